@@ -0,0 +1,68 @@
+"""Helpers for the binary (``application/octet-stream``) ciphertext routes.
+
+Binary routes take the raw serialized ciphertext or context as the request
+body and carry metadata in ``X-`` headers. Several ciphertexts in one
+response are concatenated, and ``X-Ciphertext-Lengths`` lists their sizes in
+order. There is no base64 inflation, no JSON parse and no pydantic
+validation of multi-MB strings.
+"""
+from __future__ import annotations
+
+from datetime import date
+from typing import Dict, List, Optional, Sequence
+
+from fastapi import HTTPException
+from fastapi.responses import Response
+
+OCTET_STREAM = "application/octet-stream"
+LENGTHS_HEADER = "X-Ciphertext-Lengths"
+
+
+def split_header(value: Optional[str]) -> List[str]:
+    """Comma-separated header value as a list (empty for a missing header)."""
+    if not value:
+        return []
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def parse_dates(value: Optional[str]) -> List[date]:
+    try:
+        return [date.fromisoformat(item) for item in split_header(value)]
+    except ValueError as exc:
+        raise HTTPException(status_code=422, detail=f"Invalid date in header: {exc}") from exc
+
+
+def parse_ints(value: Optional[str], name: str) -> List[int]:
+    try:
+        return [int(item) for item in split_header(value)]
+    except ValueError as exc:
+        raise HTTPException(status_code=422, detail=f"{name} must be comma-separated integers") from exc
+
+
+def require_body(body: bytes) -> bytes:
+    if not body:
+        raise HTTPException(status_code=422, detail="Request body is empty")
+    return body
+
+
+def ciphertext_response(ciphertext: bytes, headers: Optional[Dict[str, str]] = None) -> Response:
+    return Response(content=ciphertext, media_type=OCTET_STREAM, headers=headers)
+
+
+def framed_response(ciphertexts: Sequence[bytes], headers: Optional[Dict[str, str]] = None) -> Response:
+    """Concatenated ciphertexts, sizes in ``X-Ciphertext-Lengths``."""
+    headers = dict(headers or {})
+    headers[LENGTHS_HEADER] = ",".join(str(len(ciphertext)) for ciphertext in ciphertexts)
+    return Response(content=b"".join(ciphertexts), media_type=OCTET_STREAM, headers=headers)
+
+
+__all__ = [
+    "LENGTHS_HEADER",
+    "OCTET_STREAM",
+    "ciphertext_response",
+    "framed_response",
+    "parse_dates",
+    "parse_ints",
+    "require_body",
+    "split_header",
+]
@@ -1,27 +1,40 @@
 """Emotion inference and history routes."""
 from __future__ import annotations
 
+import asyncio
+import base64
+import json
+import time
 from datetime import datetime, date
+from typing import Optional
 from zoneinfo import ZoneInfo
 
-from fastapi import APIRouter, Depends, Request
+from fastapi import APIRouter, Body, Depends, Header, HTTPException, Query, Request
+from fastapi.responses import Response, StreamingResponse
 from sqlalchemy.orm import Session
 
+from app.api.binary import OCTET_STREAM, ciphertext_response, framed_response, parse_dates, require_body
 from app.core.config import settings
-from app.core.db import get_db
+from app.core.db import SessionLocal, get_db
 from app.core.security import get_current_user
 from app.models.user import User
 from app.schemas.emotion import (
+    AnalysisJobStatus,
+    EncryptedBatchImageRequest,
+    EncryptedBatchPredictionResponse,
     EncryptedDailyPrediction,
     EncryptedHistoryResponse,
+    EncryptedImageJobRequest,
     EncryptedImageRequest,
     EncryptedNDayAnalysisResponse,
     EncryptedPredictionResponse,
     EncryptedStatsRequest,
     EncryptedStatsResponse,
+    InputLayout,
 )
 from app.services.analysis_service import AnalysisService
 from app.services.emotion_service import EmotionService
+from app.services.job_service import AnalysisJobQueue, Job, QueueFull
 
 router = APIRouter(prefix="/emotion", tags=["emotion"])
 
@@ -34,6 +47,15 @@ def get_analysis_service(request: Request) -> AnalysisService:
     return request.app.state.analysis_service
 
 
+def get_job_queue(request: Request) -> AnalysisJobQueue:
+    return request.app.state.job_queue
+
+
+# Seconds between SSE status checks and between keep-alive comments
+SSE_POLL_INTERVAL = 0.5
+SSE_KEEPALIVE_INTERVAL = 15.0
+
+
 @router.post("/analyze-today", response_model=EncryptedPredictionResponse)
 def analyze_today(
     payload: EncryptedImageRequest,
@@ -43,25 +65,236 @@ def analyze_today(
 ) -> EncryptedPredictionResponse:
     tz = ZoneInfo(settings.EMOTION_DB_TIMEZONE)
     target_date = payload.date or datetime.now(tz=tz).date()
-    return emotion_service.analyze_and_store(
-        db=db,
-        user_id=current_user.user_id,
-        target_date=target_date,
-        enc_image_payload=payload.ciphertext,
-        key_id=payload.key_id,
+    try:
+        return emotion_service.analyze_and_store(
+            db=db,
+            user_id=current_user.user_id,
+            target_date=target_date,
+            enc_image_payload=payload.ciphertext,
+            key_id=payload.key_id,
+            layout=payload.layout,
+            batch_size=payload.batch_size,
+        )
+    except ValueError as exc:
+        raise HTTPException(status_code=422, detail=str(exc)) from exc
+
+
+@router.post("/analyze-today/binary", response_class=Response)
+def analyze_today_binary(
+    ciphertext: bytes = Body(..., media_type=OCTET_STREAM),
+    key_id: str = Header(..., alias="X-Key-Id"),
+    target_date: Optional[date] = Header(None, alias="X-Date"),
+    layout: InputLayout = Header("im2col", alias="X-Layout"),
+    batch_size: int = Header(1, alias="X-Batch-Size", ge=1),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+    emotion_service: EmotionService = Depends(get_emotion_service),
+) -> Response:
+    """``analyze-today`` with the raw ciphertext as body; returns the raw logits ciphertext."""
+    tz = ZoneInfo(settings.EMOTION_DB_TIMEZONE)
+    target_date = target_date or datetime.now(tz=tz).date()
+    try:
+        enc_prediction = emotion_service.analyze_and_store_raw(
+            db=db,
+            user_id=current_user.user_id,
+            target_date=target_date,
+            enc_image=require_body(ciphertext),
+            key_id=key_id,
+            layout=layout,
+            batch_size=batch_size,
+        )
+    except ValueError as exc:
+        raise HTTPException(status_code=422, detail=str(exc)) from exc
+    return ciphertext_response(enc_prediction, headers={"X-Date": target_date.isoformat()})
+
+
+def _job_status(job: Job, job_queue: AnalysisJobQueue) -> AnalysisJobStatus:
+    return AnalysisJobStatus(
+        job_id=job.job_id,
+        status=job.status,
+        priority=job.priority,
+        submitted_at=job.submitted_at,
+        started_at=job.started_at,
+        finished_at=job.finished_at,
+        queue_position=job_queue.position(job),
+        result=job.result if job.status == "succeeded" else None,
+        error=job.error,
     )
 
 
+def _get_job(job_id: str, user: User, job_queue: AnalysisJobQueue) -> Job:
+    job = job_queue.get(job_id, user.user_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@router.post("/jobs/analyze-today", response_model=AnalysisJobStatus, status_code=202)
+def submit_analyze_today(
+    payload: EncryptedImageJobRequest,
+    current_user: User = Depends(get_current_user),
+    emotion_service: EmotionService = Depends(get_emotion_service),
+    job_queue: AnalysisJobQueue = Depends(get_job_queue),
+) -> AnalysisJobStatus:
+    """Queue ``analyze-today``; poll ``/jobs/{job_id}`` or stream ``/jobs/{job_id}/events``."""
+    tz = ZoneInfo(settings.EMOTION_DB_TIMEZONE)
+    target_date = payload.date or datetime.now(tz=tz).date()
+    user_id = current_user.user_id
+
+    def run(db: Session) -> EncryptedPredictionResponse:
+        return emotion_service.analyze_and_store(
+            db=db,
+            user_id=user_id,
+            target_date=target_date,
+            enc_image_payload=payload.ciphertext,
+            key_id=payload.key_id,
+            layout=payload.layout,
+            batch_size=payload.batch_size,
+        )
+
+    try:
+        job = job_queue.submit(user_id, run, priority=payload.priority)
+    except QueueFull as exc:
+        raise HTTPException(
+            status_code=429, detail=str(exc), headers={"Retry-After": str(exc.retry_after)}
+        ) from exc
+    return _job_status(job, job_queue)
+
+
+@router.get("/jobs/{job_id}", response_model=AnalysisJobStatus)
+def job_status(
+    job_id: str,
+    current_user: User = Depends(get_current_user),
+    job_queue: AnalysisJobQueue = Depends(get_job_queue),
+) -> AnalysisJobStatus:
+    return _job_status(_get_job(job_id, current_user, job_queue), job_queue)
+
+
+@router.get("/jobs/{job_id}/events")
+def job_events(
+    job_id: str,
+    current_user: User = Depends(get_current_user),
+    job_queue: AnalysisJobQueue = Depends(get_job_queue),
+) -> StreamingResponse:
+    """Server-sent events: a ``status`` event on every change, ending with the finished job."""
+    job = _get_job(job_id, current_user, job_queue)
+
+    async def events():
+        last = None
+        last_sent = time.monotonic()
+        while True:
+            status = _job_status(job, job_queue)
+            snapshot = (status.status, status.queue_position)
+            if snapshot != last:
+                last, last_sent = snapshot, time.monotonic()
+                yield f"event: status\ndata: {status.json()}\n\n"
+                if job.finished:
+                    return
+            elif time.monotonic() - last_sent > SSE_KEEPALIVE_INTERVAL:
+                last_sent = time.monotonic()
+                yield ": keep-alive\n\n"
+            await asyncio.sleep(SSE_POLL_INTERVAL)
+
+    return StreamingResponse(
+        events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.post("/analyze-batch", response_model=EncryptedBatchPredictionResponse)
+def analyze_batch(
+    payload: EncryptedBatchImageRequest,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+    emotion_service: EmotionService = Depends(get_emotion_service),
+) -> EncryptedBatchPredictionResponse:
+    if not payload.dates or len(set(payload.dates)) != len(payload.dates):
+        raise HTTPException(status_code=422, detail="dates must be non-empty and unique")
+    try:
+        return emotion_service.analyze_batch_and_store(
+            db=db,
+            user_id=current_user.user_id,
+            target_dates=payload.dates,
+            enc_images_payload=payload.ciphertext,
+            key_id=payload.key_id,
+            layout=payload.layout,
+        )
+    except ValueError as exc:
+        raise HTTPException(status_code=422, detail=str(exc)) from exc
+
+
+@router.post("/analyze-batch/binary", response_class=Response)
+def analyze_batch_binary(
+    ciphertext: bytes = Body(..., media_type=OCTET_STREAM),
+    key_id: str = Header(..., alias="X-Key-Id"),
+    dates: str = Header(..., alias="X-Dates"),
+    layout: InputLayout = Header("im2col", alias="X-Layout"),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+    emotion_service: EmotionService = Depends(get_emotion_service),
+) -> Response:
+    """``analyze-batch`` over raw bytes; ``X-Dates`` is comma-separated, logits come back framed."""
+    target_dates = parse_dates(dates)
+    if not target_dates or len(set(target_dates)) != len(target_dates):
+        raise HTTPException(status_code=422, detail="X-Dates must be non-empty and unique")
+    try:
+        enc_predictions = emotion_service.analyze_batch_and_store_raw(
+            db=db,
+            user_id=current_user.user_id,
+            target_dates=target_dates,
+            enc_images=require_body(ciphertext),
+            key_id=key_id,
+            layout=layout,
+        )
+    except ValueError as exc:
+        raise HTTPException(status_code=422, detail=str(exc)) from exc
+    return framed_response(enc_predictions, headers={"X-Dates": ",".join(d.isoformat() for d in target_dates)})
+
+
 @router.get("/history", response_model=EncryptedNDayAnalysisResponse)
 def history(
+    key_id: Optional[str] = None,
     days: int = None,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user),
     analysis_service: AnalysisService = Depends(get_analysis_service),
 ) -> EncryptedNDayAnalysisResponse:
+    """Encrypted per-class pattern features of the window, computed server-side.
+
+    Without ``key_id`` the key the user's latest prediction was stored under is used.
+    """
+    window = days or settings.EMOTION_ANALYSIS_DAYS
+    try:
+        features = analysis_service.analyze_recent_days(db, current_user.user_id, window, key_id)
+    except ValueError as exc:
+        raise HTTPException(status_code=422, detail=str(exc)) from exc
+    if not features:
+        raise HTTPException(status_code=404, detail="No history data found")
+    return EncryptedNDayAnalysisResponse(**features)
+
+
+@router.get("/history/binary", response_class=Response)
+def history_binary(
+    key_id: Optional[str] = Header(None, alias="X-Key-Id"),
+    days: Optional[int] = Header(None, alias="X-Days", ge=1),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+    analysis_service: AnalysisService = Depends(get_analysis_service),
+) -> Response:
+    """``history`` with raw results: frequency, transition energy, then persistence (framed).
+
+    ``X-Days`` of the response is the number of stored days covered.
+    """
     window = days or settings.EMOTION_ANALYSIS_DAYS
-    ciphertext = analysis_service.analyze_recent_days(db, current_user.user_id, window)
-    return EncryptedNDayAnalysisResponse(ciphertext=ciphertext)
+    try:
+        features = analysis_service.analyze_recent_days(db, current_user.user_id, window, key_id, raw=True)
+    except ValueError as exc:
+        raise HTTPException(status_code=422, detail=str(exc)) from exc
+    if not features:
+        raise HTTPException(status_code=404, detail="No history data found")
+    return framed_response(
+        [features["frequency"], features["transition_energy"], features["persistence"]],
+        headers={"X-Days": str(features["days"])},
+    )
 
 
 @router.get("/history-raw", response_model=EncryptedHistoryResponse)
@@ -74,9 +307,59 @@ def history_raw(
 ) -> EncryptedHistoryResponse:
     window = days or settings.EMOTION_ANALYSIS_DAYS
     entries = emotion_service.get_raw_history(db, current_user.user_id, window)
-    response_entries = [EncryptedDailyPrediction(date=e.date, ciphertext=e.enc_prediction) for e in entries]
+    response_entries = [
+        EncryptedDailyPrediction(date=day, ciphertext=base64.b64encode(ciphertext).decode("utf-8"))
+        for day, ciphertext in entries
+    ]
     return EncryptedHistoryResponse(key_id=key_id or "default", days=window, entries=response_entries)
 
+
+@router.get("/history-raw/stream")
+def history_raw_stream(
+    days: int = None,
+    key_id: str = None,
+    offset: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=1),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+    emotion_service: EmotionService = Depends(get_emotion_service),
+) -> StreamingResponse:
+    """``history-raw`` as NDJSON, one page (``offset``, ``limit`` days, newest first) per request.
+
+    The first line holds the page's dates, the window's ``total`` and
+    ``next_offset`` (``null`` on the last page); then one
+    ``EncryptedDailyPrediction`` line per day, read from the database as it is
+    sent, so the first result arrives in the same time for any window.
+    """
+    window = days or settings.EMOTION_ANALYSIS_DAYS
+    user_id = current_user.user_id
+    dates = emotion_service.get_history_dates(db, user_id, window)
+    page = dates[offset : offset + limit if limit else None]
+    next_offset = offset + len(page) if offset + len(page) < len(dates) else None
+    header = {
+        "key_id": key_id or "default",
+        "days": window,
+        "total": len(dates),
+        "offset": offset,
+        "next_offset": next_offset,
+        "dates": [day.isoformat() for day in page],
+    }
+
+    def lines():
+        yield json.dumps(header) + "\n"
+        # Runs after the endpoint returns and ``get_db`` has closed ``db``, so it owns a session.
+        # Rows come from the header's dates: days written meanwhile cannot shift the page.
+        stream_db = SessionLocal()
+        try:
+            for day, ciphertext in emotion_service.iter_raw_history(stream_db, user_id, page):
+                entry = EncryptedDailyPrediction(date=day, ciphertext=base64.b64encode(ciphertext).decode("utf-8"))
+                yield entry.json() + "\n"
+        finally:
+            stream_db.close()
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson", headers={"X-Accel-Buffering": "no"})
+
+
 @router.post("/analyze-history", response_model=EncryptedStatsResponse)
 def analyze_history(
     payload: EncryptedStatsRequest,
@@ -95,4 +378,25 @@ def analyze_history(
     return EncryptedStatsResponse(
         encrypted_sum=stats["encrypted_sum"],
         encrypted_volatility=stats["encrypted_volatility"]
-    )
\ No newline at end of file
+    )
+
+
+@router.post("/analyze-history/binary", response_class=Response)
+def analyze_history_binary(
+    key_id: str = Header(..., alias="X-Key-Id"),
+    days: Optional[int] = Header(None, alias="X-Days", ge=1),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+    emotion_service: EmotionService = Depends(get_emotion_service),
+) -> Response:
+    """``analyze-history`` with raw results: the sum, then the volatility ciphertext (framed)."""
+    stats = emotion_service.get_history_statistics(
+        db=db,
+        user_id=current_user.user_id,
+        days=days or settings.EMOTION_ANALYSIS_DAYS,
+        key_id=key_id,
+        raw=True,
+    )
+    if not stats:
+        raise HTTPException(status_code=404, detail="No history data found")
+    return framed_response([stats["encrypted_sum"], stats["encrypted_volatility"]])
@@ -1,13 +1,32 @@
 """HE key registration endpoints."""
 from __future__ import annotations
 
-from fastapi import APIRouter, Depends, Request
+from typing import List, Optional
+
+from fastapi import APIRouter, Body, Depends, Header, HTTPException, Query, Request
+from fastapi.responses import Response
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
+from app.api.binary import OCTET_STREAM, parse_ints, require_body
 from app.core.db import get_db
 from app.core.security import get_current_user
+from app.fhe_core.tenseal_context import DEFAULT_PROFILE
 from app.models.user import User
-from app.schemas.emotion import HEKeyRegisterRequest
+from app.schemas.emotion import (
+    ContextCacheStats,
+    ContextPresence,
+    ContextUploadInit,
+    ContextUploadStatus,
+    HEKeyLinkRequest,
+    HEKeyRegisterRequest,
+    InputLayout,
+    MicroBatchStats,
+    ParameterProfileOut,
+    RotationStepsResponse,
+)
+from app.services.batch_scheduler import MicroBatchScheduler
+from app.services.context_upload import ContextUpload, ContextUploadManager, OffsetMismatch
 from app.services.he_service import HEEmotionEngine
 
 router = APIRouter(prefix="/he", tags=["he"])
@@ -17,6 +36,54 @@ def get_he_engine(request: Request) -> HEEmotionEngine:
     return request.app.state.he_engine
 
 
+def get_batch_scheduler(request: Request) -> MicroBatchScheduler:
+    return request.app.state.batch_scheduler
+
+
+def get_context_uploads(request: Request) -> ContextUploadManager:
+    return request.app.state.context_uploads
+
+
+@router.get("/profiles", response_model=List[ParameterProfileOut])
+def parameter_profiles(he_engine: HEEmotionEngine = Depends(get_he_engine)) -> List[ParameterProfileOut]:
+    """CKKS parameter profiles a client can create its keys with."""
+    return [ParameterProfileOut(**profile) for profile in he_engine.parameter_profiles()]
+
+
+@router.get("/context-cache", response_model=ContextCacheStats)
+def context_cache(
+    current_user: User = Depends(get_current_user),  # noqa: ARG001 - ensures auth
+    he_engine: HEEmotionEngine = Depends(get_he_engine),
+) -> ContextCacheStats:
+    """Memory use and hit/miss/eviction counters of the eval context cache."""
+    return ContextCacheStats(**he_engine.context_cache_stats())
+
+
+@router.get("/micro-batching", response_model=MicroBatchStats)
+def micro_batching(
+    current_user: User = Depends(get_current_user),  # noqa: ARG001 - ensures auth
+    batch_scheduler: MicroBatchScheduler = Depends(get_batch_scheduler),
+) -> MicroBatchStats:
+    """Requests served by the micro-batching scheduler and the batch sizes it achieved."""
+    return MicroBatchStats(**batch_scheduler.stats())
+
+
+@router.get("/rotation-steps", response_model=RotationStepsResponse)
+def rotation_steps(
+    layout: InputLayout = "im2col",
+    batch_sizes: List[int] = Query(default=[1]),
+    profile: str = DEFAULT_PROFILE,
+    current_user: User = Depends(get_current_user),  # noqa: ARG001 - ensures auth
+    he_engine: HEEmotionEngine = Depends(get_he_engine),
+) -> RotationStepsResponse:
+    """Rotation keys a client must generate for ``layout`` at ``batch_sizes``."""
+    try:
+        key_profile = he_engine.rotation_key_profile(layout, batch_sizes, profile)
+    except ValueError as exc:
+        raise HTTPException(status_code=422, detail=str(exc)) from exc
+    return RotationStepsResponse(**key_profile)
+
+
 @router.post("/register-key")
 def register_key(
     payload: HEKeyRegisterRequest,
@@ -24,5 +91,168 @@ def register_key(
     current_user: User = Depends(get_current_user),  # noqa: ARG001 - ensures auth
     he_engine: HEEmotionEngine = Depends(get_he_engine),
 ) -> dict[str, str]:
-    he_engine.register_eval_context(key_id=payload.key_id, eval_context_b64=payload.eval_context_b64)
-    return {"status": "ok", "key_id": payload.key_id}
+    try:
+        digest = he_engine.register_eval_context(
+            key_id=payload.key_id,
+            eval_context_b64=payload.eval_context_b64,
+            layout=payload.layout,
+            batch_sizes=payload.batch_sizes,
+            profile=payload.profile,
+        )
+    except ValueError as exc:
+        raise HTTPException(status_code=422, detail=str(exc)) from exc
+    return {"status": "ok", "key_id": payload.key_id, "sha256": digest}
+
+
+@router.get("/contexts/{sha256}", response_model=ContextPresence)
+def context_presence(
+    sha256: str,
+    current_user: User = Depends(get_current_user),  # noqa: ARG001 - ensures auth
+    he_engine: HEEmotionEngine = Depends(get_he_engine),
+) -> ContextPresence:
+    """Whether the server stores a context with this SHA-256; if so, register it with ``/register-key/by-hash``."""
+    return ContextPresence(sha256=sha256, present=he_engine.has_context(sha256.lower()))
+
+
+@router.post("/register-key/by-hash")
+def register_key_by_hash(
+    payload: HEKeyLinkRequest,
+    current_user: User = Depends(get_current_user),  # noqa: ARG001 - ensures auth
+    he_engine: HEEmotionEngine = Depends(get_he_engine),
+) -> dict[str, str]:
+    """Register ``key_id`` with a context the server already stores, without uploading it again."""
+    digest = payload.sha256.lower()
+    if not he_engine.has_context(digest):
+        raise HTTPException(status_code=404, detail="No eval context stored with this sha256; upload it instead")
+    try:
+        he_engine.register_existing_context(
+            payload.key_id, digest, layout=payload.layout, batch_sizes=payload.batch_sizes, profile=payload.profile
+        )
+    except ValueError as exc:
+        raise HTTPException(status_code=422, detail=str(exc)) from exc
+    return {"status": "ok", "key_id": payload.key_id, "sha256": digest}
+
+
+@router.post("/register-key/binary")
+def register_key_binary(
+    eval_context: bytes = Body(..., media_type=OCTET_STREAM),
+    key_id: str = Header(..., alias="X-Key-Id"),
+    layout: InputLayout = Header("im2col", alias="X-Layout"),
+    batch_sizes: str = Header("1", alias="X-Batch-Sizes"),
+    profile: str = Header(DEFAULT_PROFILE, alias="X-Profile"),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),  # noqa: ARG001 - ensures auth
+    he_engine: HEEmotionEngine = Depends(get_he_engine),
+) -> dict[str, str]:
+    """``register-key`` with the serialized eval context as the raw body (no base64)."""
+    try:
+        digest = he_engine.register_eval_context(
+            key_id=key_id,
+            eval_context_b64=require_body(eval_context),
+            layout=layout,
+            batch_sizes=parse_ints(batch_sizes, "X-Batch-Sizes") or [1],
+            profile=profile,
+        )
+    except ValueError as exc:
+        raise HTTPException(status_code=422, detail=str(exc)) from exc
+    return {"status": "ok", "key_id": key_id, "sha256": digest}
+
+
+def _upload_status(upload: ContextUpload, uploads: ContextUploadManager) -> ContextUploadStatus:
+    return ContextUploadStatus(
+        upload_id=upload.upload_id,
+        key_id=upload.key_id,
+        status=upload.status,
+        total_size=upload.total_size,
+        received=upload.received,
+        max_chunk_size=uploads.max_chunk_bytes,
+        error=upload.error,
+    )
+
+
+def _get_upload(upload_id: str, user: User, uploads: ContextUploadManager) -> ContextUpload:
+    upload = uploads.get(upload_id, user.user_id)
+    if upload is None:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return upload
+
+
+@router.post("/uploads", response_model=ContextUploadStatus, status_code=201)
+def create_upload(
+    payload: ContextUploadInit,
+    current_user: User = Depends(get_current_user),
+    uploads: ContextUploadManager = Depends(get_context_uploads),
+) -> ContextUploadStatus:
+    """Open a chunked eval context upload; ``PUT`` the chunks, then ``finalize``."""
+    try:
+        upload = uploads.create(
+            current_user.user_id,
+            payload.key_id,
+            payload.total_size,
+            sha256=payload.sha256,
+            layout=payload.layout,
+            batch_sizes=payload.batch_sizes,
+            profile=payload.profile,
+        )
+    except ValueError as exc:
+        raise HTTPException(status_code=422, detail=str(exc)) from exc
+    return _upload_status(upload, uploads)
+
+
+@router.get("/uploads/{upload_id}", response_model=ContextUploadStatus)
+def upload_status(
+    upload_id: str,
+    current_user: User = Depends(get_current_user),
+    uploads: ContextUploadManager = Depends(get_context_uploads),
+) -> ContextUploadStatus:
+    """Progress of an upload: where to resume, or the registration outcome."""
+    return _upload_status(_get_upload(upload_id, current_user, uploads), uploads)
+
+
+@router.put("/uploads/{upload_id}", response_model=ContextUploadStatus)
+async def upload_chunk(
+    upload_id: str,
+    request: Request,
+    offset: int = Header(..., alias="X-Upload-Offset", ge=0),
+    chunk_sha256: Optional[str] = Header(None, alias="X-Chunk-Sha256"),
+    current_user: User = Depends(get_current_user),
+    uploads: ContextUploadManager = Depends(get_context_uploads),
+) -> ContextUploadStatus:
+    """Store one chunk at ``X-Upload-Offset``; 409 with the expected offset if it is not the current end."""
+    upload = _get_upload(upload_id, current_user, uploads)
+    length = request.headers.get("content-length")
+    if length is not None and length.isdigit() and int(length) > uploads.max_chunk_bytes:
+        raise HTTPException(status_code=413, detail=f"Chunks are limited to {uploads.max_chunk_bytes} bytes")
+    data = await request.body()
+    try:
+        await run_in_threadpool(uploads.write_chunk, upload, offset, data, chunk_sha256)
+    except OffsetMismatch as exc:
+        raise HTTPException(status_code=409, detail=str(exc), headers={"X-Upload-Offset": str(exc.offset)}) from exc
+    except ValueError as exc:
+        raise HTTPException(status_code=422, detail=str(exc)) from exc
+    return _upload_status(upload, uploads)
+
+
+@router.post("/uploads/{upload_id}/finalize", response_model=ContextUploadStatus, status_code=202)
+def finalize_upload(
+    upload_id: str,
+    current_user: User = Depends(get_current_user),
+    uploads: ContextUploadManager = Depends(get_context_uploads),
+) -> ContextUploadStatus:
+    """Verify the upload and register it in the background; poll until ``registered`` or ``failed``."""
+    upload = _get_upload(upload_id, current_user, uploads)
+    try:
+        uploads.finalize(upload)
+    except ValueError as exc:
+        raise HTTPException(status_code=422, detail=str(exc)) from exc
+    return _upload_status(upload, uploads)
+
+
+@router.delete("/uploads/{upload_id}", status_code=204, response_class=Response)
+def abort_upload(
+    upload_id: str,
+    current_user: User = Depends(get_current_user),
+    uploads: ContextUploadManager = Depends(get_context_uploads),
+) -> Response:
+    uploads.abort(_get_upload(upload_id, current_user, uploads))
+    return Response(status_code=204)
@@ -1,6 +1,7 @@
 """Application settings using environment variables."""
 from __future__ import annotations
 
+import os
 from functools import lru_cache
 from pydantic import BaseSettings, Field
 
@@ -22,10 +23,58 @@ class Settings(BaseSettings):
 
     EMOTION_ANALYSIS_DAYS: int = Field(10, env="EMOTION_ANALYSIS_DAYS")
 
+    # Compiled HE plan artifact (empty = plan_artifact.PLAN_PATH)
+    HE_PLAN_PATH: str = Field("", env="HE_PLAN_PATH")
+
+    # Deserialized eval contexts kept in memory (by in-memory key size) and how to evict them (lru/lfu)
+    HE_CONTEXT_CACHE_MB: int = Field(2048, env="HE_CONTEXT_CACHE_MB")
+    HE_CONTEXT_CACHE_POLICY: str = Field("lru", env="HE_CONTEXT_CACHE_POLICY")
+    # Deserialized per-day logits kept for history statistics and pattern analysis (0 = no cache)
+    HE_VECTOR_CACHE_MB: int = Field(512, env="HE_VECTOR_CACHE_MB")
+
+    # Cores all encrypted inferences may use together (0 = every CPU) and per request. The HE_THREADS - 1
+    # shard worker processes each keep the last eval context they used loaded, outside HE_CONTEXT_CACHE_MB
+    HE_THREADS: int = Field(0, env="HE_THREADS")
+    HE_THREADS_PER_REQUEST: int = Field(4, env="HE_THREADS_PER_REQUEST")
+
+    # Dedicated HE worker processes (0 = run HE in the web process), recycled after N requests (0 = never)
+    HE_WORKERS: int = Field(0, env="HE_WORKERS")
+    HE_WORKER_MAX_REQUESTS: int = Field(0, env="HE_WORKER_MAX_REQUESTS")
+    HE_WORKER_HEALTH_INTERVAL: float = Field(30.0, env="HE_WORKER_HEALTH_INTERVAL")
+
+    # Micro-batching of single-image requests per key_id: largest merged batch and how long to wait for one
+    HE_MICRO_BATCH_MAX_SIZE: int = Field(4, env="HE_MICRO_BATCH_MAX_SIZE")
+    HE_MICRO_BATCH_WAIT_MS: float = Field(10.0, env="HE_MICRO_BATCH_WAIT_MS")
+
+    # Chunked eval context uploads: largest context and chunk, and how long an idle upload is kept
+    HE_UPLOAD_MAX_MB: int = Field(2048, env="HE_UPLOAD_MAX_MB")
+    HE_UPLOAD_CHUNK_MB: int = Field(64, env="HE_UPLOAD_CHUNK_MB")
+    HE_UPLOAD_TTL_SECONDS: int = Field(86400, env="HE_UPLOAD_TTL_SECONDS")
+
+    # Where stored prediction ciphertexts live: "blob" (LONGBLOB column) or "file" (content-addressed
+    # files under PREDICTION_STORE_DIR, empty = app/he_predictions)
+    PREDICTION_STORE: str = Field("blob", env="PREDICTION_STORE")
+    PREDICTION_STORE_DIR: str = Field("", env="PREDICTION_STORE_DIR")
+
+    # Codec of returned and stored ciphertexts: none, zlib, lzma or zstd (see app/fhe_core/codec.py)
+    HE_CIPHERTEXT_CODEC: str = Field("none", env="HE_CIPHERTEXT_CODEC")
+
+    # Background analysis jobs: worker threads, queue slots and how long finished results are kept
+    ANALYSIS_JOB_WORKERS: int = Field(2, env="ANALYSIS_JOB_WORKERS")
+    ANALYSIS_JOB_QUEUE_SIZE: int = Field(32, env="ANALYSIS_JOB_QUEUE_SIZE")
+    ANALYSIS_JOB_TTL_SECONDS: int = Field(3600, env="ANALYSIS_JOB_TTL_SECONDS")
+    # Finished jobs kept for polling per user and in total (the oldest go first)
+    ANALYSIS_JOB_MAX_FINISHED_PER_USER: int = Field(16, env="ANALYSIS_JOB_MAX_FINISHED_PER_USER")
+    ANALYSIS_JOB_MAX_FINISHED: int = Field(1024, env="ANALYSIS_JOB_MAX_FINISHED")
+
     class Config:
         env_file = ".env"
         case_sensitive = False
 
+    def he_threads(self) -> int:
+        """Resolve ``HE_THREADS`` (0 means every CPU of the machine)."""
+        return self.HE_THREADS if self.HE_THREADS > 0 else (os.cpu_count() or 1)
+
     def sqlalchemy_url(self) -> str:
         """Build a SQLAlchemy URL for MySQL using pymysql driver."""
         return (
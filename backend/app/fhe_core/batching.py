@@ -0,0 +1,236 @@
+"""Slot layout helpers for batched (multi-image) im2col inference.
+
+A single 48x48 image encoded with ``ts.im2col_encoding`` (kernel 9, stride 6)
+occupies ``128 x 49`` slots: 81 kernel positions padded to the next power of
+two, times 7x7 windows. A batch of ``B`` images concatenates the windows of
+every image inside each kernel row, so slot ``k * (B * 49) + b * 49 + w`` holds
+pixel ``k`` of window ``w`` of image ``b``. ``conv2d_im2col(kernel, B * 49)``
+then evaluates the whole batch with the same rotations as a single image.
+
+After ``pack_vectors`` the conv activations sit at ``c * (B * 49) + b * 49 + w``;
+the FC matrices are expanded so that image ``b`` only ever mixes with itself and
+its logits land at slots ``[b * num_classes, (b + 1) * num_classes)``.
+
+With N=32768 (16384 slots) two images fit in one ciphertext.
+"""
+from __future__ import annotations
+
+from typing import List, Sequence
+
+import numpy as np
+
+IMAGE_SIZE = 48
+KERNEL_SIZE = 9
+STRIDE = 6
+NUM_CLASSES = 7
+
+
+def windows_per_image(image_size: int = IMAGE_SIZE, kernel_size: int = KERNEL_SIZE, stride: int = STRIDE) -> int:
+    """Number of conv windows (output pixels) produced for one image."""
+    side = (image_size - kernel_size) // stride + 1
+    return side * side
+
+
+def kernel_rows(kernel_size: int = KERNEL_SIZE) -> int:
+    """Kernel length padded to a power of two, as TenSEAL's im2col does."""
+    length = kernel_size * kernel_size
+    return 1 << (length - 1).bit_length()
+
+
+def batch_vector_size(
+    batch_size: int,
+    image_size: int = IMAGE_SIZE,
+    kernel_size: int = KERNEL_SIZE,
+    stride: int = STRIDE,
+) -> int:
+    """Slots used by the im2col encoding of ``batch_size`` images."""
+    return kernel_rows(kernel_size) * windows_per_image(image_size, kernel_size, stride) * batch_size
+
+
+def max_batch_size(
+    slot_count: int,
+    image_size: int = IMAGE_SIZE,
+    kernel_size: int = KERNEL_SIZE,
+    stride: int = STRIDE,
+) -> int:
+    """Largest batch whose im2col encoding fits in ``slot_count`` CKKS slots."""
+    return slot_count // batch_vector_size(1, image_size, kernel_size, stride)
+
+
+def _im2col_matrix(images: Sequence[np.ndarray], kernel_size: int, stride: int) -> np.ndarray:
+    """``(kernel_size ** 2, B * windows)`` matrix with kernel positions as rows."""
+    if not images:
+        raise ValueError("At least one image is required")
+    blocks = []
+    for image in images:
+        image = np.asarray(image, dtype=np.float64)
+        if image.ndim != 2 or image.shape[0] != image.shape[1]:
+            raise ValueError(f"Expected a square 2D image, got shape {image.shape}")
+        windows = np.lib.stride_tricks.sliding_window_view(image, (kernel_size, kernel_size))[::stride, ::stride]
+        blocks.append(windows.reshape(-1, kernel_size * kernel_size).T)
+    return np.concatenate(blocks, axis=1)
+
+
+def im2col_batch(
+    images: Sequence[np.ndarray],
+    kernel_size: int = KERNEL_SIZE,
+    stride: int = STRIDE,
+) -> List[float]:
+    """Flatten square images into the batched im2col layout (plain values).
+
+    For a single image this matches ``ts.im2col_encoding`` slot for slot.
+    """
+    matrix = _im2col_matrix(images, kernel_size, stride)
+    padded = np.zeros((kernel_rows(kernel_size), matrix.shape[1]))
+    padded[: matrix.shape[0]] = matrix
+    return padded.flatten().tolist()
+
+
+# ----------------------------------------------------------------------
+# Replicated layout
+# ----------------------------------------------------------------------
+# Kernel rows are not padded (81 x B * 49 slots per copy) and the client
+# stacks ``copies`` identical copies back to back. One plaintext multiply then
+# evaluates ``copies`` output channels at once: channel ``g * copies + r`` uses
+# copy ``r`` in multiply ``g``, and after the row sum and a mask its outputs
+# are rotated to ``r * copy_size + g * (B * 49) + b * 49 + w``.
+
+
+def replicated_copy_size(
+    batch_size: int,
+    image_size: int = IMAGE_SIZE,
+    kernel_size: int = KERNEL_SIZE,
+    stride: int = STRIDE,
+) -> int:
+    """Slots used by one unpadded im2col copy of ``batch_size`` images."""
+    return kernel_size * kernel_size * windows_per_image(image_size, kernel_size, stride) * batch_size
+
+
+def replicated_copies(
+    batch_size: int,
+    slot_count: int,
+    channels: int,
+    image_size: int = IMAGE_SIZE,
+    kernel_size: int = KERNEL_SIZE,
+    stride: int = STRIDE,
+) -> int:
+    """How many copies of the batch fit in ``slot_count`` slots (at most one per channel)."""
+    return min(channels, slot_count // replicated_copy_size(batch_size, image_size, kernel_size, stride))
+
+
+def max_replicated_batch_size(
+    slot_count: int,
+    image_size: int = IMAGE_SIZE,
+    kernel_size: int = KERNEL_SIZE,
+    stride: int = STRIDE,
+) -> int:
+    """Largest batch whose unpadded im2col encoding fits in ``slot_count`` slots."""
+    return slot_count // replicated_copy_size(1, image_size, kernel_size, stride)
+
+
+def im2col_replicated(
+    images: Sequence[np.ndarray],
+    copies: int,
+    kernel_size: int = KERNEL_SIZE,
+    stride: int = STRIDE,
+) -> List[float]:
+    """Flatten images into ``copies`` back-to-back unpadded im2col copies."""
+    matrix = _im2col_matrix(images, kernel_size, stride)
+    return np.tile(matrix.flatten(), copies).tolist()
+
+
+def replicated_activation_slots(
+    channels: int,
+    copies: int,
+    batch_size: int,
+    image_size: int = IMAGE_SIZE,
+    kernel_size: int = KERNEL_SIZE,
+    stride: int = STRIDE,
+) -> np.ndarray:
+    """Slot of each conv activation, in packed ``c * (B * 49) + b * 49 + w`` order."""
+    windows = windows_per_image(image_size, kernel_size, stride) * batch_size
+    copy_size = replicated_copy_size(batch_size, image_size, kernel_size, stride)
+    channel = np.arange(channels)
+    group, copy = channel // copies, channel % copies
+    base = copy * copy_size + group * windows
+    return (base[:, None] + np.arange(windows)[None, :]).flatten()
+
+
+def expand_fc1_weight(weight_t: np.ndarray, batch_size: int, channels: int, windows: int) -> np.ndarray:
+    """Expand a transposed FC1 weight ``(channels * windows, hidden)`` for a batch.
+
+    Row ``c * (B * windows) + b * windows + w`` maps to column ``b * hidden + j``.
+    """
+    weight_t = np.asarray(weight_t, dtype=np.float64)
+    hidden = weight_t.shape[1]
+    if weight_t.shape[0] != channels * windows:
+        raise ValueError(f"FC1 weight has {weight_t.shape[0]} rows, expected {channels * windows}")
+    if batch_size == 1:
+        return weight_t
+    expanded = np.zeros((channels * batch_size * windows, batch_size * hidden))
+    blocks = weight_t.reshape(channels, windows, hidden)
+    for c in range(channels):
+        for b in range(batch_size):
+            row = c * batch_size * windows + b * windows
+            expanded[row : row + windows, b * hidden : (b + 1) * hidden] = blocks[c]
+    return expanded
+
+
+def expand_block_diagonal(weight_t: np.ndarray, batch_size: int) -> np.ndarray:
+    """Repeat a transposed weight along the diagonal, one block per image."""
+    weight_t = np.asarray(weight_t, dtype=np.float64)
+    if batch_size == 1:
+        return weight_t
+    return np.kron(np.eye(batch_size), weight_t)
+
+
+def tile_bias(bias: Sequence[float], batch_size: int) -> np.ndarray:
+    """Repeat a bias vector once per image in the batch."""
+    return np.tile(np.asarray(bias, dtype=np.float64), batch_size)
+
+
+def expand_for_image(weight_t: np.ndarray, index: int, batch_size: int) -> np.ndarray:
+    """Embed a transposed weight so it only reads the rows of image ``index``.
+
+    Multiplying the batched activations by the result yields that image's
+    outputs at slots ``[0, out)``, without spending a level on a separate split.
+    """
+    weight_t = np.asarray(weight_t, dtype=np.float64)
+    if not 0 <= index < batch_size:
+        raise ValueError(f"Image index {index} out of range for batch of {batch_size}")
+    rows = weight_t.shape[0]
+    embedded = np.zeros((batch_size * rows, weight_t.shape[1]))
+    embedded[index * rows : (index + 1) * rows] = weight_t
+    return embedded
+
+
+def split_logits(values: Sequence[float], batch_size: int, num_classes: int = NUM_CLASSES) -> np.ndarray:
+    """Slice decrypted batched logits into a ``(batch_size, num_classes)`` array."""
+    values = np.asarray(values, dtype=np.float64)
+    needed = batch_size * num_classes
+    if values.shape[0] < needed:
+        raise ValueError(f"Decrypted vector has {values.shape[0]} values, expected at least {needed}")
+    return values[:needed].reshape(batch_size, num_classes)
+
+
+__all__ = [
+    "IMAGE_SIZE",
+    "KERNEL_SIZE",
+    "STRIDE",
+    "NUM_CLASSES",
+    "windows_per_image",
+    "kernel_rows",
+    "batch_vector_size",
+    "max_batch_size",
+    "im2col_batch",
+    "replicated_copy_size",
+    "replicated_copies",
+    "max_replicated_batch_size",
+    "im2col_replicated",
+    "replicated_activation_slots",
+    "expand_fc1_weight",
+    "expand_block_diagonal",
+    "tile_bias",
+    "expand_for_image",
+    "split_logits",
+]
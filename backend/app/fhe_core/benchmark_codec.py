@@ -0,0 +1,117 @@
+"""Benchmark ciphertext/context codecs: size saved against CPU spent.
+
+Measures every codec of ``app.fhe_core.codec`` on what the service actually
+moves and stores:
+
+- ``input``: a fresh client ciphertext (all primes, full slots)
+- ``logits``: a ciphertext at the last level, like a stored prediction
+- ``context``: an eval context with relinearization and a few rotation keys
+
+For each it reports the encoded size relative to TenSEAL's serialization
+(which already has SEAL's zstd applied), and encode and decode throughput.
+Base64 (the JSON routes and the LONGTEXT column) is listed for comparison.
+
+Run with ``python -m app.fhe_core.benchmark_codec`` from ``backend/``.
+"""
+from __future__ import annotations
+
+import argparse
+import base64
+import logging
+import time
+from typing import Any, Callable, Dict, List
+
+import numpy as np
+import tenseal as ts
+
+from app.fhe_core import codec
+from app.fhe_core.seal_ops import SealEvaluator
+from app.fhe_core.tenseal_context import PROFILES, eval_context
+
+LOGGER = logging.getLogger(__name__)
+if not LOGGER.handlers:
+    logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s")
+
+
+def _time(fn: Callable[[], Any], repeats: int) -> tuple[float, Any]:
+    best = float("inf")
+    result = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000, result
+
+
+def sample_payloads(profile: str = "fast", seed: int = 0) -> Dict[str, bytes]:
+    context = PROFILES[profile].create_context(generate_galois_keys=False)
+    rng = np.random.default_rng(seed)
+    slots = PROFILES[profile].poly_modulus_degree // 2
+    enc_x = ts.ckks_vector(context, rng.normal(size=slots).tolist())
+
+    evaluator = SealEvaluator(context)
+    ct = evaluator.from_vector(ts.ckks_vector(context, rng.normal(size=7).tolist()))
+    # Drop to the last level, where predictions are stored
+    while evaluator.level_of(ct) < len(evaluator.levels) - 1:
+        ct = evaluator.rescale(evaluator.multiply_plain(ct, evaluator.encode_for_multiply([1.0], evaluator.level_of(ct))))
+    logits = evaluator.to_vector(ct, 7)
+
+    return {
+        "input": enc_x.serialize(),
+        "logits": logits.serialize(),
+        "context": eval_context(context, [1, 2, 4, 8]).serialize(),
+    }
+
+
+def benchmark_payload(name: str, data: bytes, repeats: int) -> List[Dict[str, Any]]:
+    results = []
+    mb = len(data) / 2**20
+    b64_ms, b64 = _time(lambda: base64.b64encode(data), repeats)
+    unb64_ms, _ = _time(lambda: base64.b64decode(b64), repeats)
+    results.append(
+        {"payload": name, "codec": "base64", "bytes": len(b64), "ratio": len(b64) / len(data), "encode_mb_s": mb / (b64_ms / 1000), "decode_mb_s": mb / (unb64_ms / 1000)}
+    )
+    for codec_name in codec.available_codecs():
+        encode_ms, encoded = _time(lambda: codec.encode(data, codec_name), repeats)
+        decode_ms, decoded = _time(lambda: codec.decode(encoded), repeats)
+        if decoded != data:
+            raise RuntimeError(f"{codec_name} did not round-trip the {name} payload")
+        results.append(
+            {
+                "payload": name,
+                "codec": codec_name,
+                "bytes": len(encoded),
+                "ratio": len(encoded) / len(data),
+                "encode_mb_s": mb / max(encode_ms / 1000, 1e-9),
+                "decode_mb_s": mb / max(decode_ms / 1000, 1e-9),
+            }
+        )
+    return results
+
+
+def run_benchmark(profile: str = "fast", repeats: int = 3) -> List[Dict[str, Any]]:
+    results = []
+    for name, data in sample_payloads(profile).items():
+        LOGGER.info("%s: %.2f MB serialized by TenSEAL", name, len(data) / 2**20)
+        for result in benchmark_payload(name, data, repeats):
+            LOGGER.info(
+                "  %-6s %6.3fx size | encode %8.1f MB/s | decode %8.1f MB/s",
+                result["codec"],
+                result["ratio"],
+                result["encode_mb_s"],
+                result["decode_mb_s"],
+            )
+            results.append(result)
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="fast")
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+    run_benchmark(args.profile, args.repeats)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""Benchmark baby-step/giant-step diagonal layers against TenSEAL's ``CKKSVector.mm``.
+
+Both paths see the same encrypted input (a TenSEAL ``CKKSVector``, replicated
+at its own length) and the same FHEEmotionCNN-shaped weights:
+
+- FC1: 784 -> 128 (``DiagonalPlan.packed`` with replication for FC2)
+- FC2: 128 -> 7
+
+Run with ``python -m app.fhe_core.benchmark_linear`` from ``backend/``.
+"""
+from __future__ import annotations
+
+import argparse
+import logging
+import time
+from typing import Any, Dict, List
+
+import numpy as np
+import tenseal as ts
+
+from app.fhe_core.bsgs_linear import DiagonalPlan
+from app.fhe_core.seal_ops import SealEvaluator
+from app.fhe_core.tenseal_context import create_context
+
+LOGGER = logging.getLogger(__name__)
+if not LOGGER.handlers:
+    logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s")
+
+LAYER_SHAPES = {"fc1": (128, 784), "fc2": (7, 128)}
+
+
+class CountingEvaluator(SealEvaluator):
+    """``SealEvaluator`` that counts rotations."""
+
+    def __init__(self, context: ts.Context) -> None:
+        super().__init__(context)
+        self.rotations = 0
+
+    def rotate(self, ct, steps):
+        if steps % self.slot_count:
+            self.rotations += 1
+        return super().rotate(ct, steps)
+
+
+def _time(fn, repeats: int) -> tuple[float, Any]:
+    best = float("inf")
+    result = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000, result
+
+
+def benchmark_layer(
+    context: ts.Context, evaluator: CountingEvaluator, name: str, repeats: int, seed: int = 0
+) -> Dict[str, Any]:
+    out_features, in_features = LAYER_SHAPES[name]
+    rng = np.random.default_rng(seed)
+    matrix = rng.normal(scale=0.05, size=(out_features, in_features))
+    bias = rng.normal(scale=0.1, size=out_features)
+    x = rng.normal(size=in_features)
+    expected = matrix @ x + bias
+
+    enc_x = ts.ckks_vector(context, x.tolist())
+    weight_t = matrix.T.tolist()
+    bias_list = bias.tolist()
+    mm_ms, mm_out = _time(lambda: enc_x.mm(weight_t) + bias_list, repeats)
+    mm_error = float(np.abs(np.asarray(mm_out.decrypt()) - expected).max())
+
+    plan = DiagonalPlan.packed(matrix, bias)
+    ct = evaluator.from_vector(enc_x)
+    evaluator.rotations = 0
+    bsgs_ms, bsgs_ct = _time(lambda: plan.apply(evaluator, ct), repeats)
+    rotations = evaluator.rotations // repeats
+    bsgs_out = evaluator.to_vector(bsgs_ct, out_features)
+    bsgs_error = float(np.abs(np.asarray(bsgs_out.decrypt()) - expected).max())
+
+    return {
+        "layer": name,
+        "shape": f"{out_features}x{in_features}",
+        "mm_ms": mm_ms,
+        "mm_max_error": mm_error,
+        "bsgs_ms": bsgs_ms,
+        "bsgs_rotations": rotations,
+        "bsgs_max_error": bsgs_error,
+        "baby_giant": (plan.baby, plan.giant),
+    }
+
+
+def run_benchmark(context: ts.Context | None = None, layers: List[str] | None = None, repeats: int = 3) -> List[Dict[str, Any]]:
+    context = context or create_context()
+    evaluator = CountingEvaluator(context)
+    results = []
+    for name in layers or list(LAYER_SHAPES):
+        result = benchmark_layer(context, evaluator, name, repeats)
+        LOGGER.info(
+            "%s (%s): mm %.1f ms (err %.2e) | bsgs %.1f ms (%d rotations, baby x giant = %d x %d, err %.2e) | %.2fx",
+            result["layer"],
+            result["shape"],
+            result["mm_ms"],
+            result["mm_max_error"],
+            result["bsgs_ms"],
+            result["bsgs_rotations"],
+            *result["baby_giant"],
+            result["bsgs_max_error"],
+            result["mm_ms"] / result["bsgs_ms"],
+        )
+        results.append(result)
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--layers", nargs="+", choices=sorted(LAYER_SHAPES), default=None)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+    run_benchmark(layers=args.layers, repeats=args.repeats)
+
+
+if __name__ == "__main__":
+    main()
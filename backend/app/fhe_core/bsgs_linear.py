@@ -0,0 +1,271 @@
+"""Diagonal-method linear layers with baby-step/giant-step rotations.
+
+``y = M @ x`` is evaluated as ``sum_d diag_d * rot(x, d)`` (Halevi-Shoup). With
+``d = j * baby + k`` the sum is regrouped as
+
+    sum_j rot(sum_k rot(diag_d, -j * baby) * rot(x, k), j * baby)
+
+so only ``baby - 1`` rotations of the input and ``giant - 1`` rotations of the
+partial sums are needed instead of one per diagonal. Diagonals are pre-rotated
+offline. Baby steps are taken one slot at a time and giant steps are applied
+Horner-style, so every rotation is a single key switch with TenSEAL's default
+power-of-two Galois keys.
+
+Two input layouts are supported:
+
+- ``DiagonalPlan.hybrid``: input replicated at a power-of-two period ``p``
+  over every slot (``EncodedCNN``); the output is replicated at period ``m``.
+- ``DiagonalPlan.packed``: input replicated at period ``n = in_features`` as
+  TenSEAL lays out a ``CKKSVector`` (``benchmark_linear``); the
+  output occupies slots ``[0, out)`` and can be replicated for the next layer.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+from tenseal import sealapi
+
+from app.fhe_core.seal_ops import SealEvaluator
+
+
+def next_power_of_two(value: int) -> int:
+    return 1 << (max(value, 1) - 1).bit_length()
+
+
+def baby_giant_split(count: int) -> Tuple[int, int]:
+    """Split ``count`` diagonals into ``baby`` (a power of two near ``sqrt(count)``) x ``giant`` steps."""
+    baby = 1 << ((max(count, 1) - 1).bit_length() + 1) // 2
+    return baby, -(-count // baby)
+
+
+def hybrid_diagonals(matrix: np.ndarray) -> np.ndarray:
+    """Generalized diagonals of an ``(out, in)`` matrix for the hybrid method.
+
+    The matrix is zero-padded to ``(m, p)`` with ``m``/``p`` the next powers of
+    two; diagonal ``d`` holds ``M[i mod m][(i + d) mod p]`` for ``i < p``. With
+    the input replicated at period ``p``, ``sum_d diag_d * rot(x, d)`` followed
+    by ``log2(p / m)`` rotate-and-adds leaves ``M @ x`` replicated at period ``m``.
+    """
+    matrix = np.asarray(matrix, dtype=np.float64)
+    m = next_power_of_two(matrix.shape[0])
+    p = next_power_of_two(matrix.shape[1])
+    if m > p:
+        raise ValueError(f"Hybrid method needs out <= in after padding, got {m} > {p}")
+    padded = np.zeros((m, p))
+    padded[: matrix.shape[0], : matrix.shape[1]] = matrix
+    rows = np.arange(p) % m
+    cols = (np.arange(p)[None, :] + np.arange(m)[:, None]) % p
+    return padded[rows[None, :], cols]
+
+
+def packed_diagonals(matrix: np.ndarray) -> np.ndarray:
+    """Diagonals of an ``(out, in)`` matrix for an input replicated at period ``in``.
+
+    Diagonal ``d`` holds ``M[i][(i + d) mod in]`` for ``i < out``; summing
+    ``diag_d * rot(x, d)`` leaves ``M @ x`` in slots ``[0, out)`` and zeros elsewhere.
+    """
+    matrix = np.asarray(matrix, dtype=np.float64)
+    out_features, in_features = matrix.shape
+    cols = (np.arange(out_features)[None, :] + np.arange(in_features)[:, None]) % in_features
+    return matrix[np.arange(out_features)[None, :], cols]
+
+
+@dataclass
+class DiagonalPlan:
+    """Offline arrangement of a linear layer (NumPy only, no context needed).
+
+    ``blocks[j][k]`` is diagonal ``j * baby + k`` pre-rotated right by
+    ``j * baby``; it is tiled over all slots when ``tiled`` and zero-padded
+    otherwise, and so is ``bias``. After the diagonal sum the result is folded
+    with ``fold_steps`` rotate-and-adds, the bias is added, and the result is
+    finally replicated at ``replicate_period`` (if set).
+    """
+
+    baby: int
+    giant: int
+    tiled: bool
+    blocks: Dict[int, Dict[int, np.ndarray]]
+    bias: np.ndarray
+    fold_steps: List[int] = field(default_factory=list)
+    replicate_period: Optional[int] = None
+    input_slots: int = 0  # slots of the replicated input read by the diagonal sum
+
+    @classmethod
+    def hybrid(cls, matrix: np.ndarray, bias: np.ndarray) -> "DiagonalPlan":
+        """Input replicated at period ``p``; output ``M @ x + b`` replicated at period ``m``."""
+        diagonals = hybrid_diagonals(matrix)
+        m, p = diagonals.shape
+        baby, giant = baby_giant_split(m)
+        blocks: Dict[int, Dict[int, np.ndarray]] = {}
+        for d, diagonal in enumerate(diagonals):
+            if np.any(diagonal):
+                j, k = divmod(d, baby)
+                blocks.setdefault(j, {})[k] = np.roll(diagonal, j * baby)
+        padded_bias = np.zeros(m)
+        padded_bias[: len(bias)] = bias
+        fold_steps = []
+        shift = m
+        while shift < p:
+            fold_steps.append(shift)
+            shift *= 2
+        return cls(baby, giant, True, blocks, padded_bias, fold_steps, input_slots=p)
+
+    @classmethod
+    def packed(
+        cls, matrix: np.ndarray, bias: np.ndarray, replicate: bool = False, input_period: Optional[int] = None
+    ) -> "DiagonalPlan":
+        """Input replicated at period ``input_period`` (default ``in_features``, TenSEAL's layout).
+
+        The output lands in slots ``[0, out)`` with zeros elsewhere; with
+        ``replicate`` it is then replicated at the next power of two so it can
+        feed another packed layer (built with that ``input_period``).
+        """
+        matrix = np.asarray(matrix, dtype=np.float64)
+        if input_period is not None:
+            if input_period < matrix.shape[1]:
+                raise ValueError(f"input_period {input_period} is smaller than in_features {matrix.shape[1]}")
+            matrix = np.pad(matrix, ((0, 0), (0, input_period - matrix.shape[1])))
+        diagonals = packed_diagonals(matrix)
+        in_features, out_features = diagonals.shape
+        baby, giant = baby_giant_split(in_features)
+        blocks: Dict[int, Dict[int, np.ndarray]] = {}
+        for d, diagonal in enumerate(diagonals):
+            if np.any(diagonal):
+                j, k = divmod(d, baby)
+                blocks.setdefault(j, {})[k] = np.concatenate([np.zeros(j * baby), diagonal])
+        # rot(x, k) at slot j * baby + i reads x[j * baby + k + i]
+        input_slots = (giant - 1) * baby + (baby - 1) + out_features
+        return cls(
+            baby,
+            giant,
+            False,
+            blocks,
+            np.asarray(bias, dtype=np.float64),
+            replicate_period=next_power_of_two(out_features) if replicate else None,
+            input_slots=input_slots,
+        )
+
+    def _slots(self, evaluator: SealEvaluator, pattern: np.ndarray) -> np.ndarray:
+        return evaluator.tile(pattern) if self.tiled else pattern
+
+    def rotations(self, slot_count: int) -> Set[int]:
+        """Rotation steps ``evaluate`` performs (for Galois key selection)."""
+        steps: Set[int] = set()
+        if any(k for block in self.blocks.values() for k in block):
+            steps.add(1)
+        if any(self.blocks):
+            steps.add(self.baby)
+        steps.update(self.fold_steps)
+        steps.update(self.replicate_steps(slot_count))
+        return steps
+
+    def replicate_steps(self, slot_count: int) -> List[int]:
+        if self.replicate_period is None:
+            return []
+        steps = []
+        period = self.replicate_period
+        while period < slot_count:
+            steps.append(-period)
+            period *= 2
+        return steps
+
+    def encode(self, evaluator: SealEvaluator, level: int) -> Dict[int, Dict[int, sealapi.Plaintext]]:
+        """Encode every diagonal at ``level`` with a scale that cancels on rescale."""
+        return {
+            j: {k: evaluator.encode_for_multiply(self._slots(evaluator, pattern), level) for k, pattern in block.items()}
+            for j, block in self.blocks.items()
+        }
+
+    def encode_bias(self, evaluator: SealEvaluator, level: int, scale: float) -> sealapi.Plaintext:
+        return evaluator.encode(self._slots(evaluator, self.bias), level, scale)
+
+    def apply(self, evaluator: SealEvaluator, ct: sealapi.Ciphertext) -> sealapi.Ciphertext:
+        """Encode the diagonals on the fly at ``ct``'s level, like TenSEAL's ``mm``.
+
+        Keeps memory flat for one-off evaluations; use ``EncodedDiagonalLinear``
+        to encode once and reuse.
+        """
+        level = evaluator.level_of(ct)
+        bias = self.encode_bias(evaluator, level + 1, ct.scale)
+
+        def plaintext(j: int, k: int) -> sealapi.Plaintext:
+            return evaluator.encode_for_multiply(self._slots(evaluator, self.blocks[j][k]), level)
+
+        return evaluate(evaluator, self, ct, plaintext, bias)
+
+
+def evaluate(
+    evaluator: SealEvaluator,
+    plan: DiagonalPlan,
+    ct: sealapi.Ciphertext,
+    plaintext: Callable[[int, int], sealapi.Plaintext],
+    bias: sealapi.Plaintext,
+) -> sealapi.Ciphertext:
+    """Baby-step/giant-step diagonal sum, folds, bias and replication (one level)."""
+    if plan.input_slots > evaluator.slot_count:
+        raise ValueError(f"Layer reads {plan.input_slots} input slots, only {evaluator.slot_count} available")
+    max_baby = max((k for block in plan.blocks.values() for k in block), default=0)
+    babies = [ct]
+    for _ in range(max_baby):
+        babies.append(evaluator.rotate(babies[-1], 1))
+
+    acc: Optional[sealapi.Ciphertext] = None
+    for j in range(plan.giant - 1, -1, -1):
+        if acc is not None:
+            acc = evaluator.rotate(acc, plan.baby)
+        block = plan.blocks.get(j)
+        if not block:
+            continue
+        inner: Optional[sealapi.Ciphertext] = None
+        for k in sorted(block):
+            term = evaluator.multiply_plain(babies[k], plaintext(j, k))
+            if inner is None:
+                inner = term
+            else:
+                evaluator.add_inplace(inner, term)
+        # Rescale before the giant-step rotation so it key-switches one prime fewer
+        inner = evaluator.rescale(inner)
+        if acc is None:
+            acc = inner
+        else:
+            evaluator.add_inplace(acc, inner)
+    if acc is None:
+        raise ValueError("Linear layer has no non-zero diagonals")
+
+    for step in plan.fold_steps:
+        evaluator.add_inplace(acc, evaluator.rotate(acc, step))
+    acc = evaluator.add_plain(acc, bias)
+    for step in plan.replicate_steps(evaluator.slot_count):
+        evaluator.add_inplace(acc, evaluator.rotate(acc, step))
+    return acc
+
+
+class EncodedDiagonalLinear:
+    """A ``DiagonalPlan`` with every plaintext encoded once at a fixed level.
+
+    Diagonals are encoded at ``level`` with a scale equal to the prime dropped
+    by the next rescale, so the output keeps the input ``scale`` exactly.
+    """
+
+    def __init__(self, evaluator: SealEvaluator, plan: DiagonalPlan, level: int, scale: float) -> None:
+        self.plan = plan
+        self.level = level
+        self.output_scale = scale
+        self.diagonals = plan.encode(evaluator, level)
+        self.bias = plan.encode_bias(evaluator, level + 1, scale)
+
+    def __call__(self, evaluator: SealEvaluator, ct: sealapi.Ciphertext) -> sealapi.Ciphertext:
+        return evaluate(evaluator, self.plan, ct, lambda j, k: self.diagonals[j][k], self.bias)
+
+
+__all__ = [
+    "DiagonalPlan",
+    "EncodedDiagonalLinear",
+    "baby_giant_split",
+    "evaluate",
+    "hybrid_diagonals",
+    "next_power_of_two",
+    "packed_diagonals",
+]
@@ -0,0 +1,329 @@
+"""Pre-encoded FHEEmotionCNN weights and the forward pass that consumes them.
+
+Every plaintext operand of the encrypted forward pass (conv kernels, pack mask,
+biases, FC diagonals) is encoded once per parameter set and batch size, at the
+level and scale where it is used. Requests then only pay for ciphertext ops.
+
+Two input layouts are supported (see ``fhe_core.batching``):
+
+- ``im2col``: TenSEAL's padded im2col encoding; one conv multiply per output
+  channel, then a mask-and-rotate pack into ``c * (B * 49) + b * 49 + w``.
+- ``replicated``: unpadded im2col stacked ``copies`` times; each multiply
+  evaluates ``copies`` channels and the pack step is a handful of rotations.
+
+Channel groups are independent until they are packed with a pairwise tree,
+so aligned blocks of groups (and the per-image FC2 layers) can be evaluated
+in other processes by passing an executor (see ``fhe_core.parallel``).
+
+The FC layers use the hybrid diagonal method (Juvekar et al., GAZELLE) with
+baby-step/giant-step rotations (see ``fhe_core.bsgs_linear``). FC1
+reads the conv activations wherever the conv stage left them by scattering its
+columns to those slots, so neither layout needs a separate permutation.
+
+Multiplicative depth is the same as the TenSEAL pipeline: conv, pack mask,
+square, FC1, square, FC2.
+"""
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from tenseal import sealapi
+
+from app.fhe_core import batching
+from app.fhe_core.bsgs_linear import DiagonalPlan, EncodedDiagonalLinear, next_power_of_two
+from app.fhe_core.seal_ops import SealEvaluator
+
+if TYPE_CHECKING:
+    from app.fhe_core.he_plan import CNNPlan
+
+LAYOUT_IM2COL = "im2col"
+LAYOUT_REPLICATED = "replicated"
+LAYOUTS = (LAYOUT_IM2COL, LAYOUT_REPLICATED)
+
+
+def conv_kernel_vector(kernel: np.ndarray, windows: int, rows: int) -> np.ndarray:
+    """Repeat each kernel coefficient over ``windows`` slots, one im2col row each."""
+    flat = np.asarray(kernel, dtype=np.float64).flatten()
+    vector = np.zeros(rows * windows)
+    vector[: flat.shape[0] * windows] = np.repeat(flat, windows)
+    return vector
+
+
+def scatter_columns(matrix: np.ndarray, slots: np.ndarray, period: int) -> np.ndarray:
+    """Place column ``j`` of ``matrix`` at column ``slots[j]`` of an ``(out, period)`` matrix."""
+    matrix = np.asarray(matrix, dtype=np.float64)
+    scattered = np.zeros((matrix.shape[0], period))
+    scattered[:, slots] = matrix
+    return scattered
+
+
+def rotate_sum(evaluator: SealEvaluator, ct: sealapi.Ciphertext, count: int, stride: int) -> sealapi.Ciphertext:
+    """Slot ``s`` of the result is ``sum_{k < count} ct[s + k * stride]``.
+
+    Works for any ``count`` with ``floor(log2(count)) + popcount(count) - 1``
+    rotations, so rows never have to be padded to a power of two. Every
+    rotation is by ``stride * 2**i``, which keeps the rotation key set small
+    and shared between batch sizes (see ``fhe_core.rotation_keys``).
+    """
+    # blocks[w] sums w consecutive rows; keep the ones for the set bits of count
+    blocks = {}
+    block, width = ct, 1
+    while True:
+        if count & width:
+            blocks[width] = block if width * 2 > count else evaluator.copy(block)
+        if width * 2 > count:
+            break
+        block = evaluator.copy(block) if block is ct else block
+        evaluator.add_inplace(block, evaluator.rotate(block, width * stride))
+        width *= 2
+
+    # S(w + r) = blocks[w] + rot(S(r), w * stride), smallest block first
+    acc: Optional[sealapi.Ciphertext] = None
+    for width in sorted(blocks):
+        if acc is None:
+            acc = blocks[width]
+        else:
+            acc, term = blocks[width], evaluator.rotate(acc, width * stride)
+            evaluator.add_inplace(acc, term)
+    return evaluator.copy(acc) if acc is ct else acc
+
+
+class EncodedConv:
+    """Conv1 + pack for one input layout.
+
+    Leaves the activations (bias included, not yet squared) at level 2 with
+    zeros elsewhere, replicated at ``period``; ``activation_slots[i]`` is the
+    slot of packed activation ``i`` (``c * (B * 49) + b * 49 + w`` order).
+    """
+
+    def __init__(
+        self,
+        evaluator: SealEvaluator,
+        conv_weight: np.ndarray,
+        conv_bias: np.ndarray,
+        batch_size: int,
+        input_scale: float,
+        layout: str,
+        image_size: int = batching.IMAGE_SIZE,
+        stride: int = batching.STRIDE,
+    ) -> None:
+        if layout not in LAYOUTS:
+            raise ValueError(f"Unknown input layout {layout!r}; expected one of {LAYOUTS}")
+        self.layout = layout
+        self.batch_size = batch_size
+        self.input_scale = input_scale
+        channels = conv_weight.shape[0]
+        kernel_size = conv_weight.shape[-1]
+        geometry = {"image_size": image_size, "kernel_size": kernel_size, "stride": stride}
+        self.windows = batching.windows_per_image(**geometry) * batch_size
+
+        if layout == LAYOUT_IM2COL:
+            # One channel per multiply; rows padded to a power of two like TenSEAL
+            self.row_count = batching.kernel_rows(kernel_size)
+            self.copy_size = self.row_count * self.windows
+            self.copies = 1
+            self.input_size = self.copy_size
+            kernel_groups = [[kernel[0]] for kernel in conv_weight]
+            self.activation_slots = np.arange(channels * self.windows)
+            self.group_shift = self.windows  # packed channels sit side by side
+        else:
+            # ``copies`` channels per multiply, one per unpadded copy
+            self.row_count = kernel_size * kernel_size
+            self.copy_size = batching.replicated_copy_size(batch_size, **geometry)
+            self.copies = batching.replicated_copies(batch_size, evaluator.slot_count, channels, **geometry)
+            if self.copies < 1:
+                raise ValueError(f"Batch of {batch_size} does not fit the replicated layout")
+            self.input_size = self.copies * self.copy_size
+            kernel_groups = [
+                [kernel[0] for kernel in conv_weight[start : start + self.copies]]
+                for start in range(0, channels, self.copies)
+            ]
+            self.activation_slots = batching.replicated_activation_slots(channels, self.copies, batch_size, **geometry)
+            self.group_shift = self.windows
+
+        self.kernels = []
+        for group in kernel_groups:
+            vector = np.zeros(self.input_size)
+            for copy, kernel in enumerate(group):
+                start = copy * self.copy_size
+                vector[start : start + self.copy_size] = conv_kernel_vector(kernel, self.windows, self.row_count)
+            self.kernels.append(evaluator.encode_for_multiply(vector, 0))
+
+        mask = np.zeros(self.input_size)
+        for copy in range(self.copies):
+            mask[copy * self.copy_size : copy * self.copy_size + self.windows] = 1.0
+        self.mask = evaluator.encode_for_multiply(mask, 1)
+
+        self.period = next_power_of_two(int(self.activation_slots.max()) + 1)
+        bias = np.zeros(self.period)
+        bias[self.activation_slots] = np.repeat(np.asarray(conv_bias, dtype=np.float64), self.windows)
+        self.bias = evaluator.encode(evaluator.tile(bias), 2, input_scale)
+
+    def group(self, evaluator: SealEvaluator, ct: sealapi.Ciphertext, index: int) -> sealapi.Ciphertext:
+        """Conv, row sum and mask for kernel group ``index`` (at slot offset 0)."""
+        y = evaluator.rescale(evaluator.multiply_plain(ct, self.kernels[index]))
+        y = rotate_sum(evaluator, y, self.row_count, self.windows)
+        return evaluator.rescale(evaluator.multiply_plain(y, self.mask))
+
+    def combine(
+        self, evaluator: SealEvaluator, blocks: Sequence[sealapi.Ciphertext], width: int = 1
+    ) -> sealapi.Ciphertext:
+        """Pack consecutive blocks of ``width`` groups with a pairwise tree.
+
+        Each level shifts the right block of every pair by ``width`` groups, so
+        all rotations are by ``-group_shift * 2**i`` and the result does not
+        depend on how the groups were split into blocks.
+        """
+        blocks = list(blocks)
+        while len(blocks) > 1:
+            merged = []
+            for left, right in zip(blocks[::2], blocks[1::2]):
+                right = evaluator.rotate(right, -width * self.group_shift)
+                evaluator.add_inplace(right, left)
+                merged.append(right)
+            if len(blocks) % 2:
+                merged.append(blocks[-1])
+            blocks = merged
+            width *= 2
+        return blocks[0]
+
+    def block(self, evaluator: SealEvaluator, ct: sealapi.Ciphertext, start: int, stop: int) -> sealapi.Ciphertext:
+        """Groups ``[start, stop)`` packed; ``start`` must be a multiple of the block width."""
+        return self.combine(evaluator, [self.group(evaluator, ct, g) for g in range(start, stop)])
+
+    def __call__(self, evaluator: SealEvaluator, ct: sealapi.Ciphertext, executor=None) -> sealapi.Ciphertext:
+        if executor is None:
+            packed = self.block(evaluator, ct, 0, len(self.kernels))
+        else:
+            blocks, width = executor.conv_blocks(evaluator, self, ct)
+            packed = self.combine(evaluator, blocks, width)
+
+        # Replicate at the FC1 input period so the diagonal method can rotate freely
+        period = self.period
+        while period < evaluator.slot_count:
+            evaluator.add_inplace(packed, evaluator.rotate(packed, -period))
+            period *= 2
+        return evaluator.add_plain(packed, self.bias)
+
+
+def layer_scales(evaluator: SealEvaluator, input_scale: float) -> Tuple[float, float]:
+    """Input scales of FC1 (level 3) and FC2 (level 5) for a fresh input at ``input_scale``."""
+    levels = evaluator.levels
+    # Square at level 2 -> FC1 at level 3 -> square at level 4 -> FC2 at level 5
+    fc1_scale = input_scale * input_scale / levels[2].prime
+    return fc1_scale, fc1_scale * fc1_scale / levels[4].prime
+
+
+def fc2_for_image(
+    evaluator: SealEvaluator, weights: Dict[str, np.ndarray], image: int, batch_size: int, scale: float
+) -> EncodedDiagonalLinear:
+    """FC2 reading image ``image``'s hidden units of a batch and writing single-image logits."""
+    matrix = batching.expand_for_image(weights["fc2_weight"], image, batch_size).T
+    plan = DiagonalPlan.hybrid(matrix, np.asarray(weights["fc2_bias"], dtype=np.float64))
+    return EncodedDiagonalLinear(evaluator, plan, 5, scale)
+
+
+class EncodedCNN:
+    """Pre-encoded plaintexts of a compiled ``CNNPlan`` at one batch size and layout.
+
+    Plaintexts only depend on the encryption parameters, so one instance can
+    serve every context sharing them. At N=32768 the FC1 diagonals dominate
+    (about 170 MB for a single image).
+    """
+
+    def __init__(
+        self,
+        evaluator: SealEvaluator,
+        plan: "CNNPlan",
+        batch_size: int,
+        input_scale: float,
+        layout: str = LAYOUT_IM2COL,
+    ) -> None:
+        self.plan = plan
+        self.batch_size = batch_size
+        self.input_scale = input_scale
+        self.layout = layout
+        self.num_classes = plan.num_classes
+        weights = plan.weights
+
+        # Conv1 at level 0, pack mask at level 1 (scales cancel on rescale)
+        self.conv = plan.encode_conv(evaluator, batch_size, input_scale, layout)
+        self.input_size = self.conv.input_size
+
+        fc1_scale, fc2_scale = layer_scales(evaluator, input_scale)
+        fc1_weight = batching.expand_fc1_weight(weights["fc1_weight"], batch_size, plan.channels, plan.windows)
+        fc1_matrix = scatter_columns(fc1_weight.T, self.conv.activation_slots, self.conv.period)
+        fc1_bias = batching.tile_bias(weights["fc1_bias"], batch_size)
+        self.fc1 = EncodedDiagonalLinear(evaluator, DiagonalPlan.hybrid(fc1_matrix, fc1_bias), 3, fc1_scale)
+
+        fc2_weight = batching.expand_block_diagonal(weights["fc2_weight"], batch_size)
+        fc2_bias = batching.tile_bias(weights["fc2_bias"], batch_size)
+        self.fc2 = EncodedDiagonalLinear(evaluator, DiagonalPlan.hybrid(fc2_weight.T, fc2_bias), 5, fc2_scale)
+        self.fc2_per_image: List[EncodedDiagonalLinear] = []
+        if batch_size > 1:
+            self.fc2_per_image = [fc2_for_image(evaluator, weights, b, batch_size, fc2_scale) for b in range(batch_size)]
+
+    def _check_input(self, evaluator: SealEvaluator, ct: sealapi.Ciphertext) -> None:
+        if evaluator.level_of(ct) != 0:
+            raise ValueError("Input ciphertext must be fresh (top of the modulus chain)")
+        if not np.isclose(ct.scale, self.input_scale, rtol=1e-9):
+            raise ValueError(f"Input ciphertext scale {ct.scale} does not match expected {self.input_scale}")
+
+    def forward_hidden(self, evaluator: SealEvaluator, ct: sealapi.Ciphertext, executor=None) -> sealapi.Ciphertext:
+        """Conv1 -> pack -> square -> FC1 -> square."""
+        self._check_input(evaluator, ct)
+        x = evaluator.square(self.conv(evaluator, ct, executor))
+        return evaluator.square(self.fc1(evaluator, x))
+
+    def forward(self, evaluator: SealEvaluator, ct: sealapi.Ciphertext, executor=None) -> sealapi.Ciphertext:
+        """Full forward pass; image ``b``'s logits land at slots ``[7b, 7b + 7)``."""
+        return self.fc2(evaluator, self.forward_hidden(evaluator, ct, executor))
+
+    def forward_split(
+        self, evaluator: SealEvaluator, ct: sealapi.Ciphertext, executor=None, images: Optional[int] = None
+    ) -> List[sealapi.Ciphertext]:
+        """Full forward pass returning one single-image logits ciphertext per image.
+
+        ``images`` limits the split to the first images of a partly filled batch.
+        """
+        if self.batch_size == 1:
+            return [self.forward(evaluator, ct, executor)]
+        images = self.batch_size if images is None else images
+        hidden = self.forward_hidden(evaluator, ct, executor)
+        if executor is not None:
+            return executor.fc2_per_image(evaluator, self, hidden, images)
+        return [fc2(evaluator, hidden) for fc2 in self.fc2_per_image[:images]]
+
+    def merge_inputs(self, evaluator: SealEvaluator, cts: Sequence[sealapi.Ciphertext]) -> sealapi.Ciphertext:
+        """Pack single-image inputs into one batch input.
+
+        Each input is a ``batch_size`` batch holding its image at position 0,
+        zero everywhere else up to the last slot (``CNNPlan.merge_input_vector``),
+        so input ``b`` only needs a rotation by ``b * windows`` to land at
+        position ``b``; no mask, no level. Re-laying out a ``batch_size=1``
+        input instead would move every kernel row by a different offset and
+        cost a level the chain does not have.
+        """
+        if not 1 <= len(cts) <= self.batch_size:
+            raise ValueError(f"Can merge between 1 and {self.batch_size} inputs, got {len(cts)}")
+        for ct in cts:
+            self._check_input(evaluator, ct)
+        merged = evaluator.copy(cts[0])
+        for image, ct in enumerate(cts[1:], start=1):
+            evaluator.add_inplace(merged, evaluator.rotate(ct, -image * self.plan.windows))
+        return merged
+
+
+__all__ = [
+    "LAYOUT_IM2COL",
+    "LAYOUT_REPLICATED",
+    "LAYOUTS",
+    "EncodedCNN",
+    "EncodedConv",
+    "conv_kernel_vector",
+    "fc2_for_image",
+    "layer_scales",
+    "rotate_sum",
+    "scatter_columns",
+]
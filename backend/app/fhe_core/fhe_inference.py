@@ -13,6 +13,9 @@ import torch
 import torch.nn.functional as F
 import tenseal as ts
 
+from app.fhe_core.encoded_cnn import LAYOUT_IM2COL
+from app.fhe_core.he_plan import CNNPlan, compile_module
+from app.fhe_core.seal_ops import SealEvaluator
 from app.fhe_core.tenseal_context import create_context, DEFAULT_GLOBAL_SCALE
 from app.fhe_core.fhe_cnn import FHEEmotionCNN, extract_fhe_parameters
 
@@ -169,77 +172,35 @@ class EncryptedCNNRunner:
 class PackedEncryptedCNNRunner:
     """
     TenSEAL Packed (SIMD) inference for 1-conv CNN (Balanced variant).
-    Uses im2col + matrix-vector for Conv, then FC layers.
-    16 channels * 49 = 784 slots per CKKS vector.
+    Runs the compiled HE plan (fhe_core.he_plan) of the model: the image is
+    im2col-encoded into one CKKS vector and ``EncodedCNN`` evaluates conv,
+    pack, squares and the BSGS diagonal FC layers, exactly as the service does.
     """
 
     def __init__(
         self,
         context: ts.Context,
-        params: Dict[str, List[Dict[str, torch.Tensor]]],
+        plan: CNNPlan,
         *,
         log_steps: bool = True,
     ) -> None:
         self.context = context
-        self.conv1_weight = params["conv"][0]["weight"].tolist() # (out, in, k, k)
-        self.conv1_bias = params["conv"][0]["bias"].tolist()
-        
-        # Linear weights need to be transposed for .mm() (input_size, output_size)
-        self.fc1_weight = params["linear"][0]["weight"].T.tolist()
-        self.fc1_bias = params["linear"][0]["bias"].tolist()
-        
-        self.fc2_weight = params["linear"][1]["weight"].T.tolist()
-        self.fc2_bias = params["linear"][1]["bias"].tolist()
+        self.plan = plan
+        self.evaluator = SealEvaluator(context)
+        self.encoded = plan.encode(self.evaluator, 1, context.global_scale, LAYOUT_IM2COL)
+        self.num_classes = plan.num_classes
         
         self._log_steps = log_steps
 
     def forward(self, tensor: torch.Tensor) -> ts.CKKSVector:
-        # 1. im2col encoding
-        # tensor shape: (1, 48, 48)
-        # Conv1: kernel=9, stride=6 (Balanced speed & accuracy)
-        kernel_shape = (9, 9)
-        stride = 6
-        
-        image_list = tensor.view(48, 48).tolist()
-        
+        image = tensor.reshape(self.plan.image_size, self.plan.image_size).numpy()
+
         if self._log_steps: LOGGER.info("▶ im2col Encoding")
-        enc_x, windows_nb = ts.im2col_encoding(
-            self.context, image_list, kernel_shape[0], kernel_shape[1], stride
-        )
-        
-        # 2. Conv1
-        if self._log_steps: LOGGER.info("▶ Packed Conv1")
-        enc_channels = []
-        # self.conv1_weight is list of kernels [out_channel][in_channel][k][k]
-        # Since in_channel is 1, we iterate over out_channels
-        for kernel, bias in zip(self.conv1_weight, self.conv1_bias):
-            # kernel is [1, 12, 12] list. conv2d_im2col expects [12, 12] if single channel.
-            # Since input is 1 channel, kernel[0] is the 12x12 matrix.
-            k_flat = kernel[0] 
-            y = enc_x.conv2d_im2col(k_flat, windows_nb) + bias
-            enc_channels.append(y)
-            
-        # 3. Pack (Flatten)
-        if self._log_steps: LOGGER.info("▶ Packing Channels")
-        enc_x = ts.CKKSVector.pack_vectors(enc_channels)
-        
-        # 4. Square
-        if self._log_steps: LOGGER.info("▶ Square Activation 1")
-        enc_x.square_()
-        
-        # 5. FC1
-        if self._log_steps: LOGGER.info("▶ FC1")
-        enc_x = enc_x.mm(self.fc1_weight) + self.fc1_bias
-        
-        # 6. Square
-        if self._log_steps: LOGGER.info("▶ Square Activation 2")
-        enc_x.square_()
-        
-        # 7. FC2
-        if self._log_steps: LOGGER.info("▶ FC2")
-        enc_x = enc_x.mm(self.fc2_weight) + self.fc2_bias
-        
-        return enc_x
+        enc_x = ts.ckks_vector(self.context, self.plan.input_vector([image], LAYOUT_IM2COL, self.evaluator.slot_count))
+
+        if self._log_steps: LOGGER.info("▶ Compiled plan forward (%s)", " -> ".join(self.plan.describe()["layers"]))
+        out = self.encoded.forward(self.evaluator, self.evaluator.from_vector(enc_x))
+        return self.evaluator.to_vector(out, self.num_classes)
 
 
 def load_plain_model(device: torch.device | None = None) -> Tuple[FHEEmotionCNN, NormalizationStats]:
@@ -289,7 +250,7 @@ def encrypted_inference_demo(context: ts.Context | None = None, sample_index: in
     
     if use_packed:
         LOGGER.info("Using packed TenSEAL runner for inference")
-        runner = PackedEncryptedCNNRunner(context, params, log_steps=False)
+        runner = PackedEncryptedCNNRunner(context, compile_module(model), log_steps=False)
     else:
         LOGGER.info("Using scalar TenSEAL runner for inference (fallback)")
         runner = EncryptedCNNRunner(context, params)
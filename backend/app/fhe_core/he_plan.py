@@ -0,0 +1,304 @@
+"""Compile an FHE-friendly ``nn.Module`` into a static HE execution plan.
+
+``compile_module`` walks the module's layers once and checks that they form
+the pattern the encrypted executor implements:
+
+    Conv2d(1 -> C, kernel k, stride s, no padding) -> Square -> [Flatten]
+    -> Linear -> Square -> Linear
+
+The resulting ``CNNPlan`` is NumPy only. It holds the weights in executor
+layout (``conv1_weight`` ``(C, 1, k, k)``, transposed FC weights), the input
+geometry and the slot layouts derived from it, the number of levels the
+forward pass consumes and, computed on first use, the rotation steps per input
+layout and batch size. ``CNNPlan.encode`` pre-encodes it for one context as an
+``EncodedCNN``, the single executor behind the service and the demo runner.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from typing import Any, Dict, FrozenSet, List, Sequence, Tuple
+
+import numpy as np
+
+from app.fhe_core import batching
+
+LAYER_PATTERN = ("conv", "square", "linear", "square", "linear")
+
+# Conv multiply and pack mask, then one level per remaining layer
+FORWARD_LEVELS = 2 + len(LAYER_PATTERN) - 1
+# Levels the history statistics spend on stored logits (the volatility square)
+STATISTICS_LEVELS = 1
+# One more on profiles that pack the history (the mask placing a day, see packed_history)
+PACKING_LEVELS = 1
+
+
+def statistics_levels(packed_history: bool = False) -> int:
+    """Levels stored logits need left for the history statistics."""
+    return STATISTICS_LEVELS + (PACKING_LEVELS if packed_history else 0)
+
+
+@dataclass(frozen=True, eq=False)
+class CNNPlan:
+    """Static description of the encrypted forward pass (no context needed)."""
+
+    image_size: int
+    stride: int
+    weights: Dict[str, np.ndarray]
+    _rotation_steps: Dict[Tuple[str, int, int], FrozenSet[int]] = field(default_factory=dict, repr=False)
+    _merge_steps: Dict[Tuple[str, int, int], FrozenSet[int]] = field(default_factory=dict, repr=False)
+
+    def __post_init__(self) -> None:
+        weights = {}
+        for name, value in self.weights.items():
+            array = np.asarray(value, dtype=np.float64)
+            if array.flags.writeable:
+                # Own a frozen copy; read-only arrays (e.g. a mapped artifact) are kept as they are
+                array = array.copy()
+                array.setflags(write=False)
+            weights[name] = array
+        conv = weights["conv1_weight"]
+        if conv.ndim != 4 or conv.shape[1] != 1 or conv.shape[2] != conv.shape[3]:
+            raise ValueError(f"Conv weight must be (channels, 1, k, k), got {conv.shape}")
+        if conv.shape[2] > self.image_size:
+            raise ValueError(f"Kernel {conv.shape[2]} is larger than the {self.image_size}px input")
+        if weights["fc1_weight"].shape[0] != self.channels * self.windows:
+            raise ValueError(
+                f"FC1 reads {weights['fc1_weight'].shape[0]} features, conv produces {self.channels * self.windows}"
+            )
+        if weights["fc2_weight"].shape[0] != weights["fc1_weight"].shape[1]:
+            raise ValueError(
+                f"FC2 reads {weights['fc2_weight'].shape[0]} features, FC1 produces {weights['fc1_weight'].shape[1]}"
+            )
+        object.__setattr__(self, "weights", weights)
+
+    # ------------------------------------------------------------------
+    # Geometry
+    # ------------------------------------------------------------------
+    @property
+    def kernel_size(self) -> int:
+        return self.weights["conv1_weight"].shape[-1]
+
+    @property
+    def channels(self) -> int:
+        return self.weights["conv1_weight"].shape[0]
+
+    @property
+    def windows(self) -> int:
+        """Conv output pixels per image."""
+        return batching.windows_per_image(self.image_size, self.kernel_size, self.stride)
+
+    @property
+    def hidden(self) -> int:
+        return self.weights["fc1_weight"].shape[1]
+
+    @property
+    def num_classes(self) -> int:
+        return self.weights["fc2_weight"].shape[1]
+
+    @property
+    def levels(self) -> int:
+        """Levels the forward pass consumes."""
+        return FORWARD_LEVELS
+
+    @property
+    def geometry(self) -> Dict[str, int]:
+        """Keyword arguments for the ``batching`` helpers."""
+        return {"image_size": self.image_size, "kernel_size": self.kernel_size, "stride": self.stride}
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "layers": list(LAYER_PATTERN),
+            "image_size": self.image_size,
+            "kernel_size": self.kernel_size,
+            "stride": self.stride,
+            "channels": self.channels,
+            "windows": self.windows,
+            "hidden": self.hidden,
+            "num_classes": self.num_classes,
+            "levels": self.levels,
+        }
+
+    # ------------------------------------------------------------------
+    # Slot layouts
+    # ------------------------------------------------------------------
+    def max_batch_size(self, layout: str, slot_count: int) -> int:
+        from app.fhe_core.encoded_cnn import LAYOUT_IM2COL, LAYOUTS
+
+        if layout not in LAYOUTS:
+            raise ValueError(f"Unknown input layout {layout!r}; expected one of {LAYOUTS}")
+        if layout == LAYOUT_IM2COL:
+            return batching.max_batch_size(slot_count, **self.geometry)
+        return batching.max_replicated_batch_size(slot_count, **self.geometry)
+
+    def check_batch_size(self, layout: str, batch_size: int, slot_count: int) -> None:
+        max_batch = self.max_batch_size(layout, slot_count)
+        if batch_size < 1 or batch_size > max_batch:
+            raise ValueError(f"batch_size must be between 1 and {max_batch} for this context, got {batch_size}")
+
+    def copies(self, batch_size: int, slot_count: int) -> int:
+        """Input copies of the replicated layout."""
+        return batching.replicated_copies(batch_size, slot_count, self.channels, **self.geometry)
+
+    def input_size(self, layout: str, batch_size: int, slot_count: int) -> int:
+        """Values in the encrypted input vector of a batch."""
+        from app.fhe_core.encoded_cnn import LAYOUT_IM2COL
+
+        self.check_batch_size(layout, batch_size, slot_count)
+        if layout == LAYOUT_IM2COL:
+            return batching.batch_vector_size(batch_size, **self.geometry)
+        return self.copies(batch_size, slot_count) * batching.replicated_copy_size(batch_size, **self.geometry)
+
+    def input_vector(self, images: Sequence[np.ndarray], layout: str, slot_count: int) -> List[float]:
+        """Plain input vector for ``images`` in ``layout`` (what clients encrypt)."""
+        from app.fhe_core.encoded_cnn import LAYOUT_IM2COL
+
+        self.check_batch_size(layout, len(images), slot_count)
+        if layout == LAYOUT_IM2COL:
+            return batching.im2col_batch(images, self.kernel_size, self.stride)
+        return batching.im2col_replicated(images, self.copies(len(images), slot_count), self.kernel_size, self.stride)
+
+    def merge_input_vector(self, image: np.ndarray, layout: str, batch_size: int, slot_count: int) -> List[float]:
+        """Plain input of a request the server may micro-batch (``EncodedCNN.merge_inputs``).
+
+        ``image`` sits at position 0 of a ``batch_size`` batch, and the vector
+        is zero-padded to ``slot_count``. TenSEAL replicates shorter vectors
+        over the free slots, and the merge rotation would wrap those copies
+        onto image 0.
+        """
+        blank = np.zeros_like(np.asarray(image, dtype=np.float64))
+        vector = self.input_vector([image] + [blank] * (batch_size - 1), layout, slot_count)
+        return vector + [0.0] * (slot_count - len(vector))
+
+    # ------------------------------------------------------------------
+    # Levels and keys
+    # ------------------------------------------------------------------
+    def check_levels(self, available: int) -> None:
+        if available < self.levels:
+            raise ValueError(f"Forward pass needs {self.levels} levels, the parameters provide {available}")
+
+    def output_level(self, chain_levels: int, packed_history: bool = False) -> int:
+        """Level logits are stored at in a chain of ``chain_levels`` levels.
+
+        The lowest one that still leaves ``statistics_levels`` for the
+        history statistics; every prime above it only adds size to the
+        response, the DB row and each history query.
+        """
+        return max(self.levels, chain_levels - 1 - statistics_levels(packed_history))
+
+    def rotation_steps(self, slot_count: int, layout: str, batch_size: int) -> FrozenSet[int]:
+        """Rotation steps of one forward pass (traced once per layout, batch size and slot count)."""
+        from app.fhe_core.rotation_keys import forward_rotation_steps
+
+        key = (layout, batch_size, slot_count)
+        steps = self._rotation_steps.get(key)
+        if steps is None:
+            self.check_batch_size(layout, batch_size, slot_count)
+            steps = self._rotation_steps[key] = frozenset(forward_rotation_steps(self, slot_count, layout, batch_size))
+        return steps
+
+    def merge_rotation_steps(self, slot_count: int, layout: str, batch_size: int) -> FrozenSet[int]:
+        """Rotation steps of ``EncodedCNN.merge_inputs`` packing ``batch_size`` single-image requests."""
+        from app.fhe_core.rotation_keys import merge_rotation_steps
+
+        key = (layout, batch_size, slot_count)
+        steps = self._merge_steps.get(key)
+        if steps is None:
+            self.check_batch_size(layout, batch_size, slot_count)
+            steps = self._merge_steps[key] = frozenset(merge_rotation_steps(self, slot_count, layout, batch_size))
+        return steps
+
+    # ------------------------------------------------------------------
+    # Encoding
+    # ------------------------------------------------------------------
+    def encode_conv(self, evaluator, batch_size: int, input_scale: float, layout: str):
+        from app.fhe_core.encoded_cnn import EncodedConv
+
+        return EncodedConv(
+            evaluator,
+            self.weights["conv1_weight"],
+            self.weights["conv1_bias"],
+            batch_size,
+            input_scale,
+            layout,
+            self.image_size,
+            self.stride,
+        )
+
+    def encode(self, evaluator, batch_size: int, input_scale: float, layout: str):
+        """Pre-encode the plan for ``evaluator``'s context as an ``EncodedCNN``."""
+        from app.fhe_core.encoded_cnn import EncodedCNN
+
+        return EncodedCNN(evaluator, self, batch_size, input_scale, layout)
+
+
+def _leaf_layers(module) -> List[Any]:
+    children = list(module.children())
+    if not children:
+        return [module]
+    return [leaf for child in children for leaf in _leaf_layers(child)]
+
+
+def _pair(value, name: str) -> int:
+    values = (value, value) if isinstance(value, int) else tuple(value)
+    if values[0] != values[1]:
+        raise ValueError(f"Conv {name} must be square, got {values}")
+    return values[0]
+
+
+def compile_module(module, image_size: int = batching.IMAGE_SIZE) -> CNNPlan:
+    """Lower ``module`` (e.g. ``FHEEmotionCNN``) to a ``CNNPlan`` for ``image_size`` inputs.
+
+    Layers are taken in registration order; ``Flatten``, ``Identity`` and
+    ``Dropout`` are skipped. Anything outside ``LAYER_PATTERN`` raises
+    ``ValueError``.
+    """
+    from torch import nn
+
+    from app.fhe_core.fhe_cnn import Square
+
+    layers = [layer for layer in _leaf_layers(module) if not isinstance(layer, (nn.Flatten, nn.Identity, nn.Dropout))]
+    kinds = []
+    for layer in layers:
+        if isinstance(layer, nn.Conv2d):
+            kinds.append("conv")
+        elif isinstance(layer, nn.Linear):
+            kinds.append("linear")
+        elif isinstance(layer, Square):
+            kinds.append("square")
+        else:
+            raise ValueError(f"Layer {type(layer).__name__} has no HE lowering")
+    if tuple(kinds) != LAYER_PATTERN:
+        raise ValueError(f"Unsupported layer sequence {kinds}; the HE executor runs {list(LAYER_PATTERN)}")
+
+    conv, _, fc1, _, fc2 = layers
+    if conv.in_channels != 1 or conv.groups != 1:
+        raise ValueError("Conv must read a single input channel")
+    if _pair(conv.padding, "padding") != 0 or _pair(conv.dilation, "dilation") != 1:
+        raise ValueError("Conv must use no padding and no dilation")
+    _pair(conv.kernel_size, "kernel")
+
+    def array(tensor, shape) -> np.ndarray:
+        if tensor is None:
+            return np.zeros(shape)
+        return tensor.detach().cpu().double().numpy()
+
+    weights = {
+        "conv1_weight": array(conv.weight, None),
+        "conv1_bias": array(conv.bias, conv.out_channels),
+        "fc1_weight": array(fc1.weight, None).T,
+        "fc1_bias": array(fc1.bias, fc1.out_features),
+        "fc2_weight": array(fc2.weight, None).T,
+        "fc2_bias": array(fc2.bias, fc2.out_features),
+    }
+    return CNNPlan(image_size, _pair(conv.stride, "stride"), weights)
+
+
+__all__ = [
+    "CNNPlan",
+    "FORWARD_LEVELS",
+    "LAYER_PATTERN",
+    "PACKING_LEVELS",
+    "STATISTICS_LEVELS",
+    "compile_module",
+    "statistics_levels",
+]
@@ -0,0 +1,145 @@
+"""Slot-packed history: every stored day of a user in one ciphertext.
+
+Day ``d`` occupies block ``d.toordinal() % days`` of one ciphertext, each
+block being the classes padded to a power of two (``days = slot_count //
+block``, 2048 at N=32768), so the blocks tile the slot ring and rotating by
+whole blocks wraps around it. Placing a day costs a mask multiply (one
+level, which is why only ``packed_history`` profiles allow it) and a
+rotation into its block, once, when the day is written.
+
+A window of ``n`` consecutive days then needs no per-day work:
+
+- sum: rotate the window's first block to block 0 and add up ``n`` blocks
+  by rotate-and-add over the binary digits of ``n`` (``range_sum``)
+- volatility: one rotate-subtract gives every day-to-day difference, one
+  square squares them all, and a range sum over ``n - 1`` blocks adds them
+
+Rotations only use the keys ``block * 2^k`` (``rotation_steps``); other
+offsets are composed from their binary digits. Block 0 of a result holds
+the window's statistics. The other blocks hold other windows of the same
+user, readable only with the same secret key.
+"""
+from __future__ import annotations
+
+from datetime import date
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from tenseal import sealapi
+
+from app.fhe_core.bsgs_linear import next_power_of_two
+from app.fhe_core.seal_ops import SealEvaluator
+
+
+def ring_days(slot_count: int, classes: int) -> int:
+    """Days a packed history holds before a block is reused."""
+    return slot_count // next_power_of_two(classes)
+
+
+def ring_position(day: date, days: int) -> int:
+    """Block of ``day`` in a history of ``days`` blocks."""
+    return day.toordinal() % days
+
+
+def rotation_steps(slot_count: int, classes: int) -> List[int]:
+    """Rotation steps placing days and summing windows: every power-of-two number of blocks."""
+    block = next_power_of_two(classes)
+    return [block << bit for bit in range(ring_days(slot_count, classes).bit_length() - 1)]
+
+
+class PackedHistory:
+    """Builds and queries packed histories for one context (see the module docstring)."""
+
+    def __init__(self, evaluator: SealEvaluator, classes: int) -> None:
+        self.evaluator = evaluator
+        self.classes = classes
+        self.block = next_power_of_two(classes)
+        self.days = ring_days(evaluator.slot_count, classes)
+        # level -> mask of the first block's classes
+        self._masks: Dict[int, sealapi.Plaintext] = {}
+
+    def position(self, day: date) -> int:
+        return ring_position(day, self.days)
+
+    def _mask(self, level: int) -> sealapi.Plaintext:
+        mask = self._masks.get(level)
+        if mask is None:
+            values = np.zeros(self.evaluator.slot_count)
+            values[: self.classes] = 1.0
+            mask = self._masks[level] = self.evaluator.encode_for_multiply(values, level)
+        return mask
+
+    def rotate_blocks(self, ct: sealapi.Ciphertext, blocks: int) -> sealapi.Ciphertext:
+        """Rotate left by ``blocks`` blocks (right if negative); ``ct`` itself for a whole turn."""
+        blocks %= self.days
+        bit = 0
+        while blocks:
+            if blocks & 1:
+                ct = self.evaluator.rotate(ct, self.block << bit)
+            blocks >>= 1
+            bit += 1
+        return ct
+
+    def place(self, ct: sealapi.Ciphertext, position: int) -> sealapi.Ciphertext:
+        """The first ``classes`` slots of ``ct`` at block ``position``, zero elsewhere (one level down)."""
+        evaluator = self.evaluator
+        masked = evaluator.rescale(evaluator.multiply_plain(ct, self._mask(evaluator.level_of(ct))))
+        return self.rotate_blocks(masked, -position)
+
+    def update(
+        self, packed: Optional[sealapi.Ciphertext], changes: Sequence[Tuple[int, sealapi.Ciphertext, Sequence[sealapi.Ciphertext]]]
+    ) -> sealapi.Ciphertext:
+        """``packed`` (empty if ``None``) with each ``(position, new day, old days)`` swapped in.
+
+        ``old days`` are what the block held (the overwritten prediction, or
+        the day a ring's length earlier); their difference to the new day is
+        placed in one go.
+        """
+        evaluator = self.evaluator
+        placed = []
+        for position, new, old in changes:
+            days = evaluator.match_levels([new, *old])
+            diff = days[0] if len(days) == 1 else evaluator.sub(days[0], evaluator.tree_sum(days[1:]))
+            placed.append(self.place(diff, position))
+        if packed is not None:
+            placed.append(packed)
+        if not placed:
+            raise ValueError("Nothing to pack")
+        return evaluator.tree_sum(evaluator.match_levels(placed))
+
+    def range_sum(self, ct: sealapi.Ciphertext, count: int) -> sealapi.Ciphertext:
+        """Block ``q`` of the result is the sum of blocks ``[q, q + count)`` of ``ct``.
+
+        ``power`` sums ``span`` blocks and doubles each step; every binary
+        digit of ``count`` prepends it to the total shifted by ``span``, so
+        each rotation is by a single power of two.
+        """
+        if not 1 <= count <= self.days:
+            raise ValueError(f"Can sum between 1 and {self.days} days, got {count}")
+        evaluator = self.evaluator
+        total, power, span = None, ct, 1
+        while True:
+            if count & span:
+                total = power if total is None else evaluator.add(power, self.rotate_blocks(total, span))
+            if count < span * 2:
+                return total
+            power = evaluator.add(power, self.rotate_blocks(power, span))
+            span *= 2
+
+    def window(
+        self, packed: sealapi.Ciphertext, first: int, count: int
+    ) -> Tuple[sealapi.Ciphertext, Optional[sealapi.Ciphertext]]:
+        """Sum and squared day-to-day differences of the ``count`` days from block ``first``, at block 0.
+
+        The differences are ``None`` for a single day.
+        """
+        evaluator = self.evaluator
+        aligned = self.rotate_blocks(packed, first)
+        total = self.range_sum(aligned, count)
+        if count < 2:
+            return total, None
+        diffs = evaluator.sub(self.rotate_blocks(aligned, 1), aligned)
+        return total, self.range_sum(evaluator.square(diffs), count - 1)
+
+
+__all__ = ["PackedHistory", "ring_days", "ring_position", "rotation_steps"]
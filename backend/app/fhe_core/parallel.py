@@ -0,0 +1,323 @@
+"""Intra-inference parallelism for the pre-encoded CNN forward pass.
+
+TenSEAL's SEAL bindings hold the GIL for every call, so threads cannot run
+encrypted ops side by side. Independent pieces of one forward pass are shipped
+to worker processes instead:
+
+- conv: aligned blocks of kernel groups (``EncodedConv.block``), packed back
+  with the same pairwise tree as the serial path;
+- FC2 per image (batched requests): one hidden ciphertext fans out to the
+  per-image FC2 layers;
+- history statistics: consecutive runs of days (``WindowSums``), each shard
+  deserializing its own payloads. A shard also gets the day before its run,
+  so every day-to-day difference is local to one shard.
+
+FC1 stays in the calling process: its baby steps and giant steps are chained
+rotations, and its multiply-plains are cheaper than shipping the inputs.
+
+Each worker keeps the compiled ``CNNPlan`` (set once by the pool initializer)
+and the last context it loaded from disk with its encoded layers, so a task
+only carries the ciphertext (or, for statistics, the stored payloads). That
+copy is outside the engine's context cache budget: a task for another context
+drops it before loading the new one, so each of the ``HE_THREADS - 1`` workers
+holds at most one deserialized context and its encoded layers.
+``CoreBudget`` caps the cores all concurrent requests use together: a request
+reserves up to ``HE_THREADS_PER_REQUEST`` cores, runs one share itself and
+hands the rest to the pool.
+"""
+from __future__ import annotations
+
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from tenseal import sealapi
+
+from app.fhe_core import codec
+from app.fhe_core.seal_ops import SealEvaluator
+
+if TYPE_CHECKING:
+    from app.fhe_core.he_plan import CNNPlan
+
+# Fewest days worth shipping to a worker (below it, IPC outweighs the work)
+WINDOW_DAYS_PER_SHARD = 8
+
+_worker_plan: Optional["CNNPlan"] = None
+# ((context path, mtime), state) of the one context a worker keeps loaded
+_worker_context: Optional[Tuple[Tuple[str, int], Dict[str, Any]]] = None
+
+
+class CoreBudget:
+    """Cores shared by every request of the process.
+
+    ``reserve`` grants between 1 and ``wanted`` cores, as many as are free,
+    and blocks while none are.
+    """
+
+    def __init__(self, total: int) -> None:
+        if total < 1:
+            raise ValueError(f"Core budget must be at least 1, got {total}")
+        self.total = total
+        self._free = total
+        self._condition = threading.Condition()
+
+    @contextmanager
+    def reserve(self, wanted: int) -> Iterator[int]:
+        with self._condition:
+            while self._free == 0:
+                self._condition.wait()
+            granted = max(1, min(wanted, self._free))
+            self._free -= granted
+        try:
+            yield granted
+        finally:
+            with self._condition:
+                self._free += granted
+                self._condition.notify_all()
+
+
+@dataclass
+class WindowSums:
+    """Sums over consecutive days' logits ``y_d``.
+
+    ``total`` is ``sum y_d``. Over each pair of consecutive days, ``squares``
+    is ``sum (y_d - y_{d-1})^2`` and ``products`` is ``sum y_d * y_{d-1}``
+    (``None`` without pairs, or when not asked for). Until ``finish`` they are
+    size-3 ciphertexts, so partial sums combine without relinearizing.
+    """
+
+    size: int
+    total: sealapi.Ciphertext
+    squares: Optional[sealapi.Ciphertext] = None
+    products: Optional[sealapi.Ciphertext] = None
+
+
+def deserialize_logits(evaluator: SealEvaluator, payload: bytes) -> Tuple[sealapi.Ciphertext, int]:
+    """Ciphertext and vector size of stored logits (codec-framed TenSEAL serialization)."""
+    import tenseal as ts
+
+    vector = ts.ckks_vector_from(evaluator.context, codec.decode(payload))
+    return evaluator.from_vector(vector), vector.size()
+
+
+def window_sums(evaluator: SealEvaluator, payloads: Sequence[bytes], overlap: bool = False, products: bool = False) -> WindowSums:
+    """``WindowSums`` of serialized logits (oldest first); with ``overlap`` the first day only opens a pair."""
+    days = [deserialize_logits(evaluator, payload) for payload in payloads]
+    return window_sums_of(evaluator, [ct for ct, _ in days], days[0][1], overlap, products)
+
+
+def window_sums_of(
+    evaluator: SealEvaluator, cts: Sequence[sealapi.Ciphertext], size: int, overlap: bool = False, products: bool = False
+) -> WindowSums:
+    """``window_sums`` of already deserialized days (left unmodified, see ``SealEvaluator.match_levels``)."""
+    cts = evaluator.match_levels(cts)
+    pairs = list(zip(cts[1:], cts[:-1]))
+    sums = WindowSums(size=size, total=evaluator.tree_sum(cts[1:] if overlap else cts))
+    if pairs:
+        diffs = (evaluator.sub(a, b) for a, b in pairs)
+        sums.squares = evaluator.tree_sum(evaluator.multiply_raw(diff, diff) for diff in diffs)
+        if products:
+            sums.products = evaluator.tree_sum(evaluator.multiply_raw(a, b) for a, b in pairs)
+    return sums
+
+
+def finish_window_sums(evaluator: SealEvaluator, parts: Sequence[WindowSums]) -> WindowSums:
+    """Tree-sum the ``WindowSums`` of disjoint runs of days, relinearizing and rescaling once.
+
+    Runs whose days sit at different levels are switched down to the lowest first.
+    """
+
+    def merged(name: str) -> Optional[sealapi.Ciphertext]:
+        cts = [getattr(part, name) for part in parts if getattr(part, name) is not None]
+        return evaluator.tree_sum(evaluator.match_levels(cts)) if cts else None
+
+    squares, products = merged("squares"), merged("products")
+    return WindowSums(
+        size=parts[0].size,
+        total=merged("total"),
+        squares=None if squares is None else evaluator.relinearize_rescale(squares),
+        products=None if products is None else evaluator.relinearize_rescale(products),
+    )
+
+
+# ----------------------------------------------------------------------
+# Worker side
+# ----------------------------------------------------------------------
+def _init_worker(plan: "CNNPlan") -> None:
+    global _worker_plan
+    _worker_plan = plan
+
+
+def _worker_state(context_path: str) -> Dict[str, Any]:
+    import os
+
+    import tenseal as ts
+
+    global _worker_context
+    key = (context_path, os.stat(context_path).st_mtime_ns)
+    if _worker_context is None or _worker_context[0] != key:
+        # Release the previous context first, so a worker never holds two
+        _worker_context = None
+        with open(context_path, "rb") as handle:
+            context = ts.context_from(codec.decode(handle.read()), n_threads=1)
+        _worker_context = (key, {"evaluator": SealEvaluator(context), "convs": {}, "fc2": {}})
+    return _worker_context[1]
+
+
+def _conv_block_task(
+    context_path: str, layout: str, batch_size: int, input_scale: float, ct_bytes: bytes, start: int, stop: int
+) -> bytes:
+    state = _worker_state(context_path)
+    evaluator = state["evaluator"]
+    conv = state["convs"].get((layout, batch_size, input_scale))
+    if conv is None:
+        conv = _worker_plan.encode_conv(evaluator, batch_size, input_scale, layout)
+        state["convs"][(layout, batch_size, input_scale)] = conv
+    ct = evaluator.load_ciphertext(ct_bytes)
+    return evaluator.save_ciphertext(conv.block(evaluator, ct, start, stop))
+
+
+def _fc2_task(
+    context_path: str, batch_size: int, input_scale: float, images: Sequence[int], hidden_bytes: bytes
+) -> List[bytes]:
+    from app.fhe_core.encoded_cnn import fc2_for_image, layer_scales
+
+    state = _worker_state(context_path)
+    evaluator = state["evaluator"]
+    hidden = evaluator.load_ciphertext(hidden_bytes)
+    outputs = []
+    for image in images:
+        fc2 = state["fc2"].get((batch_size, input_scale, image))
+        if fc2 is None:
+            scale = layer_scales(evaluator, input_scale)[1]
+            fc2 = fc2_for_image(evaluator, _worker_plan.weights, image, batch_size, scale)
+            state["fc2"][(batch_size, input_scale, image)] = fc2
+        outputs.append(evaluator.save_ciphertext(fc2(evaluator, hidden)))
+    return outputs
+
+
+def _window_task(
+    context_path: str, payloads: Sequence[bytes], products: bool
+) -> Tuple[int, bytes, Optional[bytes], Optional[bytes]]:
+    evaluator = _worker_state(context_path)["evaluator"]
+    sums = window_sums(evaluator, payloads, overlap=True, products=products)
+    return (
+        sums.size,
+        evaluator.save_ciphertext(sums.total),
+        *(None if ct is None else evaluator.save_ciphertext(ct) for ct in (sums.squares, sums.products)),
+    )
+
+
+# ----------------------------------------------------------------------
+# Request side
+# ----------------------------------------------------------------------
+def create_pool(workers: int, plan: "CNNPlan") -> ProcessPoolExecutor:
+    """Worker pool for ``ShardExecutor`` (spawned, so no SEAL state is forked)."""
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(plan,),
+    )
+
+
+def _shards(count: int, parts: int) -> List[range]:
+    size = -(-count // max(parts, 1))
+    return [range(start, min(start + size, count)) for start in range(0, count, size)]
+
+
+class ShardExecutor:
+    """Runs the independent pieces of one forward pass on ``cores`` cores.
+
+    The caller computes the first shard itself while ``cores - 1`` shards run
+    in ``pool``; ``context_path`` is the serialized eval context the workers
+    load (the same file the engine loaded).
+    """
+
+    def __init__(self, pool: ProcessPoolExecutor, context_path: str, cores: int) -> None:
+        self.pool = pool
+        self.context_path = context_path
+        self.cores = cores
+
+    def conv_blocks(self, evaluator: SealEvaluator, conv, ct: sealapi.Ciphertext) -> Tuple[List[sealapi.Ciphertext], int]:
+        """Packed blocks of consecutive kernel groups and the block width (a power of two)."""
+        from app.fhe_core.bsgs_linear import next_power_of_two
+
+        groups = len(conv.kernels)
+        width = next_power_of_two(-(-groups // self.cores))
+        ranges = [(start, min(start + width, groups)) for start in range(0, groups, width)]
+        ct_bytes = evaluator.save_ciphertext(ct)
+        futures = [
+            self.pool.submit(
+                _conv_block_task, self.context_path, conv.layout, conv.batch_size, conv.input_scale, ct_bytes, start, stop
+            )
+            for start, stop in ranges[1:]
+        ]
+        blocks = [conv.block(evaluator, ct, *ranges[0])]
+        blocks.extend(evaluator.load_ciphertext(future.result()) for future in futures)
+        return blocks, width
+
+    def fc2_per_image(
+        self, evaluator: SealEvaluator, encoded, hidden: sealapi.Ciphertext, images: Optional[int] = None
+    ) -> List[sealapi.Ciphertext]:
+        """``encoded.fc2_per_image`` applied to ``hidden`` for the first ``images`` images, split across cores."""
+        shards = _shards(encoded.batch_size if images is None else images, self.cores)
+        hidden_bytes = evaluator.save_ciphertext(hidden)
+        futures = [
+            self.pool.submit(_fc2_task, self.context_path, encoded.batch_size, encoded.input_scale, list(images), hidden_bytes)
+            for images in shards[1:]
+        ]
+        outputs = [encoded.fc2_per_image[image](evaluator, hidden) for image in shards[0]]
+        for future in futures:
+            outputs.extend(evaluator.load_ciphertext(data) for data in future.result())
+        return outputs
+
+    def window_sums(
+        self,
+        evaluator: SealEvaluator,
+        payloads: Sequence[bytes],
+        products: bool = False,
+        local: Optional[Callable[[range], WindowSums]] = None,
+    ) -> List[WindowSums]:
+        """``WindowSums`` of consecutive runs of ``payloads``, for ``finish_window_sums``.
+
+        Runs hold at least ``WINDOW_DAYS_PER_SHARD`` days; each one after the
+        first is sent with the day before it, so its first pair stays local.
+        ``local`` replaces ``window_sums`` for the caller's own run (the days
+        it is given); it may do more work while the workers run.
+        """
+        shards = _shards(len(payloads), min(self.cores, len(payloads) // WINDOW_DAYS_PER_SHARD))
+        futures = [
+            self.pool.submit(_window_task, self.context_path, list(payloads[days.start - 1 : days.stop]), products)
+            for days in shards[1:]
+        ]
+        if local is None:
+            parts = [window_sums(evaluator, payloads[shards[0].start : shards[0].stop], products=products)]
+        else:
+            parts = [local(shards[0])]
+        for future in futures:
+            size, total, squares, products_bytes = future.result()
+            parts.append(
+                WindowSums(
+                    size=size,
+                    total=evaluator.load_ciphertext(total),
+                    squares=None if squares is None else evaluator.load_ciphertext(squares),
+                    products=None if products_bytes is None else evaluator.load_ciphertext(products_bytes),
+                )
+            )
+        return parts
+
+
+__all__ = [
+    "CoreBudget",
+    "ShardExecutor",
+    "WindowSums",
+    "create_pool",
+    "deserialize_logits",
+    "finish_window_sums",
+    "window_sums",
+    "window_sums_of",
+]
@@ -0,0 +1,170 @@
+"""Torch-free weight artifact for the compiled HE plan.
+
+``python -m app.fhe_core.plan_artifact`` (offline; needs torch) loads the model,
+compiles it with ``he_plan.compile_module`` and writes one file:
+
+    magic      b"HEPLAN\\0\\0"
+    length     uint64 little endian, size of the manifest
+    manifest   UTF-8 JSON: format version, plan geometry, array table, digest
+    arrays     float64 little endian in C order, each 64-byte aligned
+
+The serving path only calls ``load_plan``, which maps the arrays read-only
+(NumPy only, torch is never imported) and checks them against the manifest's
+``sha256``.
+"""
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import struct
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+from app.fhe_core.he_plan import LAYER_PATTERN, CNNPlan
+
+LOGGER = logging.getLogger(__name__)
+if not LOGGER.handlers:
+    logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s")
+
+MAGIC = b"HEPLAN\0\0"
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+DTYPE = "<f8"
+
+PLAN_PATH = Path(__file__).resolve().parents[1] / "inference_model" / "he_cnn_fer2013_enhanced.heplan"
+
+
+def _align(offset: int) -> int:
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def plan_digest(plan: CNNPlan) -> str:
+    """SHA-256 over the plan geometry and weights (identifies the artifact contents)."""
+    digest = hashlib.sha256(json.dumps([plan.image_size, plan.stride]).encode("utf-8"))
+    for name in sorted(plan.weights):
+        array = np.ascontiguousarray(plan.weights[name], dtype=DTYPE)
+        digest.update(name.encode("utf-8"))
+        digest.update(json.dumps(array.shape).encode("utf-8"))
+        digest.update(array.tobytes())
+    return digest.hexdigest()
+
+
+def save_plan(plan: CNNPlan, path: Path | str = PLAN_PATH, source: Optional[str] = None) -> Dict[str, Any]:
+    """Write ``plan`` to ``path`` (atomically) and return its manifest."""
+    path = Path(path)
+    arrays = {name: np.ascontiguousarray(plan.weights[name], dtype=DTYPE) for name in sorted(plan.weights)}
+    table = {}
+    offset = 0
+    for name, array in arrays.items():
+        table[name] = {"offset": offset, "shape": list(array.shape)}
+        offset = _align(offset + array.nbytes)
+    manifest = {
+        "format_version": FORMAT_VERSION,
+        "dtype": DTYPE,
+        "layers": list(LAYER_PATTERN),
+        "image_size": plan.image_size,
+        "stride": plan.stride,
+        "arrays": table,
+        "sha256": plan_digest(plan),
+        "source": source,
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+    }
+    header = json.dumps(manifest, sort_keys=True).encode("utf-8")
+    data_start = _align(len(MAGIC) + 8 + len(header))
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as handle:
+        handle.write(MAGIC + struct.pack("<Q", len(header)) + header)
+        for name, array in arrays.items():
+            handle.seek(data_start + table[name]["offset"])
+            handle.write(array.tobytes())
+    os.replace(tmp_path, path)
+    return manifest
+
+
+def _read_header(path: Path) -> Tuple[Dict[str, Any], int]:
+    with open(path, "rb") as handle:
+        if handle.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not an HE plan artifact")
+        (length,) = struct.unpack("<Q", handle.read(8))
+        manifest = json.loads(handle.read(length).decode("utf-8"))
+    if manifest.get("format_version") != FORMAT_VERSION:
+        raise ValueError(
+            f"{path} has format version {manifest.get('format_version')}, expected {FORMAT_VERSION}; re-export it"
+        )
+    if tuple(manifest["layers"]) != LAYER_PATTERN or manifest["dtype"] != DTYPE:
+        raise ValueError(f"{path} describes layers {manifest['layers']} ({manifest['dtype']}), not supported here")
+    return manifest, _align(len(MAGIC) + 8 + length)
+
+
+def read_manifest(path: Path | str = PLAN_PATH) -> Dict[str, Any]:
+    return _read_header(Path(path))[0]
+
+
+def load_plan(path: Path | str = PLAN_PATH) -> CNNPlan:
+    """Map the artifact at ``path`` read-only and wrap it as a ``CNNPlan`` (``ValueError`` if it fails its digest)."""
+    path = Path(path)
+    if not path.exists():
+        raise FileNotFoundError(f"HE plan artifact not found at {path}; export it with python -m app.fhe_core.plan_artifact")
+    manifest, data_start = _read_header(path)
+    buffer = np.memmap(path, dtype=np.uint8, mode="r")
+    weights = {}
+    for name, entry in manifest["arrays"].items():
+        shape = tuple(entry["shape"])
+        count = int(np.prod(shape))
+        weights[name] = np.frombuffer(buffer, dtype=DTYPE, count=count, offset=data_start + entry["offset"]).reshape(shape)
+    plan = CNNPlan(manifest["image_size"], manifest["stride"], weights)
+    digest = plan_digest(plan)
+    if digest != manifest["sha256"]:
+        raise ValueError(f"{path} is corrupt: contents hash to {digest}, the manifest says {manifest['sha256']}")
+    return plan
+
+
+def export_model(model_path: Path, output: Path, image_size: int, allow_random: bool = False) -> Dict[str, Any]:
+    """Compile the trained model at ``model_path`` and write its artifact (needs torch).
+
+    A missing ``model_path`` is a ``FileNotFoundError``; with ``allow_random``
+    a randomly initialized model is exported instead (``"source": null``), for
+    development only.
+    """
+    if not model_path.exists():
+        if not allow_random:
+            raise FileNotFoundError(f"Model weights not found at {model_path} (pass --allow-random to export random weights)")
+        LOGGER.warning("Exporting a randomly initialized model: %s does not exist", model_path)
+
+    import torch
+
+    from app.fhe_core import fhe_inference
+    from app.fhe_core.he_plan import compile_module
+
+    fhe_inference.MODEL_PATH = model_path
+    model, _ = fhe_inference.load_plain_model(device=torch.device("cpu"))
+    plan = compile_module(model, image_size)
+    return save_plan(plan, output, source=model_path.name if model_path.exists() else None)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Export the compiled HE plan of the trained model")
+    parser.add_argument("--model", type=Path, default=PLAN_PATH.with_suffix(".pt"))
+    parser.add_argument("--output", type=Path, default=PLAN_PATH)
+    parser.add_argument("--image-size", type=int, default=48)
+    parser.add_argument(
+        "--allow-random", action="store_true", help="export a randomly initialized model if --model is missing (development only)"
+    )
+    args = parser.parse_args()
+    manifest = export_model(args.model, args.output, args.image_size, args.allow_random)
+    LOGGER.info("Wrote %s (sha256 %s, %d bytes)", args.output, manifest["sha256"], args.output.stat().st_size)
+
+
+__all__ = ["FORMAT_VERSION", "PLAN_PATH", "load_plan", "plan_digest", "read_manifest", "save_plan"]
+
+
+if __name__ == "__main__":
+    main()
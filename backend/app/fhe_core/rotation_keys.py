@@ -0,0 +1,230 @@
+"""Derive the rotation (Galois) keys the encrypted forward pass actually uses.
+
+``generate_galois_keys()`` creates every power-of-two rotation key, which is
+most of the ~850 MB eval context at N=32768. The forward pass only ever
+rotates by a fixed set of steps per (input layout, batch size), so clients can
+generate exactly those keys instead (``tenseal_context.eval_context``).
+
+The step set is obtained by tracing: a compiled ``CNNPlan`` is encoded and run against
+``RotationTracer``, an evaluator stand-in that records rotations and skips all
+cryptography. Micro-batching single-image requests into a batch adds one step
+per extra image (``merge_rotation_steps``). The statistics path (sums and
+squared differences) does not rotate, except on profiles with a packed history,
+which add its power-of-two block steps (``packed_history.rotation_steps``).
+
+Run ``python -m app.fhe_core.rotation_keys --layout replicated --batch-sizes 1 2 --profile fast``
+from ``backend/`` to print the steps for a profile.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Iterable, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+import tenseal as ts
+
+from app.fhe_core.seal_ops import normalize_rotation
+from app.fhe_core.tenseal_context import galois_element, poly_modulus_degree
+
+if TYPE_CHECKING:
+    from app.fhe_core.he_plan import CNNPlan
+
+# (input layout, batch size) pairs a key set has to cover
+Profile = Sequence[Tuple[str, int]]
+
+DEFAULT_PROFILE: Profile = (("im2col", 1),)
+
+
+@dataclass(frozen=True)
+class _TraceLevel:
+    prime: float = 1.0
+
+
+class _TraceCiphertext:
+    def __init__(self, scale: float) -> None:
+        self.scale = scale
+
+
+class RotationTracer:
+    """Evaluator stand-in with ``SealEvaluator``'s interface that only records rotations."""
+
+    def __init__(self, slot_count: int, levels: int = 16) -> None:
+        self.slot_count = slot_count
+        self.levels = [_TraceLevel() for _ in range(levels)]
+        self.steps: Set[int] = set()
+
+    def encode(self, values, level: int, scale: float) -> None:
+        return None
+
+    def encode_for_multiply(self, values, level: int) -> None:
+        return None
+
+    def tile(self, values) -> np.ndarray:
+        values = np.asarray(values, dtype=np.float64)
+        if self.slot_count % values.shape[0]:
+            raise ValueError(f"Period {values.shape[0]} does not divide {self.slot_count} slots")
+        return np.tile(values, self.slot_count // values.shape[0])
+
+    def level_of(self, ct: _TraceCiphertext) -> int:
+        return 0
+
+    def rotate(self, ct: _TraceCiphertext, steps: int) -> _TraceCiphertext:
+        steps = normalize_rotation(steps, self.slot_count)
+        if steps:
+            self.steps.add(steps)
+        return ct
+
+    def multiply_plain(self, ct, plain):
+        return ct
+
+    def add_plain(self, ct, plain):
+        return ct
+
+    def add_inplace(self, acc, other) -> None:
+        return None
+
+    def rescale(self, ct):
+        return ct
+
+    def square(self, ct):
+        return ct
+
+    def copy(self, ct):
+        return ct
+
+
+def forward_rotation_steps(plan: "CNNPlan", slot_count: int, layout: str, batch_size: int) -> Set[int]:
+    """Rotation steps of one ``EncodedCNN`` forward pass (including the per-image split)."""
+    tracer = RotationTracer(slot_count)
+    encoded = plan.encode(tracer, batch_size, 1.0, layout)
+    encoded.forward(tracer, _TraceCiphertext(1.0))
+    encoded.forward_split(tracer, _TraceCiphertext(1.0))
+    return tracer.steps
+
+
+def merge_rotation_steps(plan: "CNNPlan", slot_count: int, layout: str, batch_size: int) -> Set[int]:
+    """Rotation steps of ``EncodedCNN.merge_inputs`` (micro-batching single-image requests)."""
+    tracer = RotationTracer(slot_count)
+    encoded = plan.encode(tracer, batch_size, 1.0, layout)
+    encoded.merge_inputs(tracer, [_TraceCiphertext(1.0)] * batch_size)
+    return tracer.steps
+
+
+def required_rotation_steps(plan: "CNNPlan", slot_count: int, profile: Profile, merge: bool = True) -> List[int]:
+    """Sorted union of the rotation steps needed for every ``(layout, batch_size)`` in ``profile``.
+
+    ``merge`` adds the steps that let the server micro-batch single-image
+    requests into each batch size.
+    """
+    steps: Set[int] = set()
+    for layout, batch_size in profile:
+        steps |= plan.rotation_steps(slot_count, layout, batch_size)
+        if merge:
+            steps |= plan.merge_rotation_steps(slot_count, layout, batch_size)
+    return sorted(steps)
+
+
+def _naf(value: int) -> List[int]:
+    """Non-adjacent form of ``value`` (as SEAL decomposes rotations without a direct key)."""
+    terms = []
+    bit = 1
+    while value:
+        if value & 1:
+            term = 2 - (value & 3)
+            terms.append(term * bit)
+            value -= term
+        value >>= 1
+        bit <<= 1
+    return terms
+
+
+def missing_rotation_steps(context: ts.Context, steps: Iterable[int]) -> List[int]:
+    """Steps ``context`` cannot rotate by, following SEAL's ``rotate_vector`` rules.
+
+    A step is available with a key for exactly that step, or when every term
+    of its non-adjacent form has a key (the full power-of-two set covers all).
+    """
+    if not context.has_galois_keys():
+        return sorted(set(steps))
+    keys = context.data.galois_keys()
+    degree = poly_modulus_degree(context)
+    slots = degree // 2
+
+    def has(step: int) -> bool:
+        return keys.has_key(galois_element(step, degree))
+
+    missing = []
+    for step in sorted(set(steps)):
+        step = normalize_rotation(step, slots)
+        if step == 0 or has(step):
+            continue
+        terms = _naf(step)
+        if len(terms) == 1 or not all(has(normalize_rotation(term, slots)) for term in terms):
+            missing.append(step)
+    return missing
+
+
+def _shape_plan(channels: int = 16, hidden: int = 128, classes: int = 7) -> "CNNPlan":
+    # Only shapes and zero patterns matter; all-ones weights use every diagonal
+    from app.fhe_core import batching
+    from app.fhe_core.he_plan import CNNPlan
+
+    kernel = batching.KERNEL_SIZE
+    windows = batching.windows_per_image()
+    return CNNPlan(
+        batching.IMAGE_SIZE,
+        batching.STRIDE,
+        {
+            "conv1_weight": np.ones((channels, 1, kernel, kernel)),
+            "conv1_bias": np.ones(channels),
+            "fc1_weight": np.ones((channels * windows, hidden)),
+            "fc1_bias": np.ones(hidden),
+            "fc2_weight": np.ones((hidden, classes)),
+            "fc2_bias": np.ones(classes),
+        },
+    )
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    from app.fhe_core import packed_history
+    from app.fhe_core.tenseal_context import DEFAULT_PROFILE as DEFAULT_PARAMETER_PROFILE, PROFILES
+
+    parser = argparse.ArgumentParser(description="Print the rotation steps the encrypted CNN needs")
+    parser.add_argument("--layout", default="im2col", choices=["im2col", "replicated"])
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1])
+    parser.add_argument("--profile", default=DEFAULT_PARAMETER_PROFILE, choices=sorted(PROFILES))
+    args = parser.parse_args(argv)
+
+    params = PROFILES[args.profile]
+    degree = params.poly_modulus_degree
+    profile = [(args.layout, batch_size) for batch_size in args.batch_sizes]
+    plan = _shape_plan()
+    steps = required_rotation_steps(plan, degree // 2, profile)
+    if params.packed_history:
+        steps = sorted(set(steps) | set(packed_history.rotation_steps(degree // 2, plan.num_classes)))
+    print(json.dumps({
+        "profile": args.profile,
+        "poly_modulus_degree": degree,
+        "layout": args.layout,
+        "batch_sizes": args.batch_sizes,
+        "steps": steps,
+        "galois_elements": [galois_element(step, degree) for step in steps],
+    }))
+
+
+__all__ = [
+    "DEFAULT_PROFILE",
+    "Profile",
+    "RotationTracer",
+    "forward_rotation_steps",
+    "merge_rotation_steps",
+    "missing_rotation_steps",
+    "required_rotation_steps",
+]
+
+
+if __name__ == "__main__":
+    main()
+
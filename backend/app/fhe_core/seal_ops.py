@@ -0,0 +1,286 @@
+"""Thin wrapper over TenSEAL's bundled SEAL bindings for custom encrypted kernels.
+
+TenSEAL's ``CKKSVector`` ops (``mm``, ``conv2d_im2col``, ``+ list``) re-encode
+their plaintext operands on every call and offer no way to pass a pre-encoded
+plaintext. ``SealEvaluator`` works on the raw ``seal::Ciphertext`` underneath a
+``CKKSVector`` instead, so weights can be encoded once and reused.
+
+Levels are counted from the top of the modulus chain: level 0 is where fresh
+ciphertexts live and every rescale moves one level down.
+"""
+from __future__ import annotations
+
+import os
+import struct
+import tempfile
+from dataclasses import dataclass
+from typing import Iterable, List, Sequence, Tuple
+
+import numpy as np
+import tenseal as ts
+from tenseal import sealapi
+
+from app.fhe_core.tenseal_context import _varint
+
+
+@dataclass(frozen=True)
+class Level:
+    """One step of the modulus chain."""
+
+    parms_id: List[int]
+    prime: int  # modulus dropped by the next rescale
+    primes: int  # number of RNS primes at this level
+
+
+class SealEvaluator:
+    """SEAL evaluator, encoder and keys bound to one TenSEAL context."""
+
+    def __init__(self, context: ts.Context) -> None:
+        self.context = context
+        self._seal_context = context.seal_context().data
+        self.evaluator = sealapi.Evaluator(self._seal_context)
+        self.encoder = sealapi.CKKSEncoder(self._seal_context)
+        self.slot_count = self.encoder.slot_count()
+        self._galois_keys = context.data.galois_keys() if context.has_galois_keys() else None
+        self._relin_keys = context.data.relin_keys() if context.has_relin_keys() else None
+
+        self.levels: List[Level] = []
+        data = self._seal_context.first_context_data()
+        while data is not None:
+            moduli = data.parms().coeff_modulus()
+            self.levels.append(Level(parms_id=data.parms_id(), prime=moduli[-1].value(), primes=len(moduli)))
+            data = data.next_context_data()
+
+    # ------------------------------------------------------------------
+    # Encoding
+    # ------------------------------------------------------------------
+    def encode(self, values: Sequence[float] | np.ndarray, level: int, scale: float) -> sealapi.Plaintext:
+        """Encode ``values`` (at most ``slot_count``) at ``level`` with ``scale``."""
+        plain = sealapi.Plaintext()
+        values = np.asarray(values, dtype=np.float64)
+        if values.shape[0] > self.slot_count:
+            raise ValueError(f"Cannot encode {values.shape[0]} values into {self.slot_count} slots")
+        self.encoder.encode(values.tolist(), self.levels[level].parms_id, float(scale), plain)
+        return plain
+
+    def encode_for_multiply(self, values: Sequence[float] | np.ndarray, level: int) -> sealapi.Plaintext:
+        """Encode a multiplicand whose scale cancels exactly on the following rescale."""
+        return self.encode(values, level, self.levels[level].prime)
+
+    def tile(self, values: Sequence[float] | np.ndarray) -> np.ndarray:
+        """Repeat a power-of-two length vector across every slot."""
+        values = np.asarray(values, dtype=np.float64)
+        if self.slot_count % values.shape[0]:
+            raise ValueError(f"Period {values.shape[0]} does not divide {self.slot_count} slots")
+        return np.tile(values, self.slot_count // values.shape[0])
+
+    # ------------------------------------------------------------------
+    # Ciphertext ops (all return new ciphertexts)
+    # ------------------------------------------------------------------
+    def level_of(self, ct: sealapi.Ciphertext) -> int:
+        return len(self.levels) - 1 - self._seal_context.get_context_data(ct.parms_id()).chain_index()
+
+    def multiply_plain(self, ct: sealapi.Ciphertext, plain: sealapi.Plaintext) -> sealapi.Ciphertext:
+        out = sealapi.Ciphertext()
+        self.evaluator.multiply_plain(ct, plain, out)
+        return out
+
+    def add_plain(self, ct: sealapi.Ciphertext, plain: sealapi.Plaintext) -> sealapi.Ciphertext:
+        out = sealapi.Ciphertext()
+        self.evaluator.add_plain(ct, plain, out)
+        return out
+
+    def add_inplace(self, acc: sealapi.Ciphertext, other: sealapi.Ciphertext) -> None:
+        self.evaluator.add_inplace(acc, other)
+
+    def add(self, ct: sealapi.Ciphertext, other: sealapi.Ciphertext) -> sealapi.Ciphertext:
+        out = sealapi.Ciphertext()
+        self.evaluator.add(ct, other, out)
+        return out
+
+    def sub(self, ct: sealapi.Ciphertext, other: sealapi.Ciphertext) -> sealapi.Ciphertext:
+        out = sealapi.Ciphertext()
+        self.evaluator.sub(ct, other, out)
+        return out
+
+    def rescale(self, ct: sealapi.Ciphertext) -> sealapi.Ciphertext:
+        self.evaluator.rescale_to_next_inplace(ct)
+        return ct
+
+    def mod_switch_to(self, ct: sealapi.Ciphertext, level: int) -> sealapi.Ciphertext:
+        """Drop ``ct`` down to ``level`` without rescaling (in place; a no-op if it is already there or lower)."""
+        if self.level_of(ct) < level:
+            self.evaluator.mod_switch_to_inplace(ct, self.levels[level].parms_id)
+        return ct
+
+    def at_level(self, ct: sealapi.Ciphertext, level: int) -> sealapi.Ciphertext:
+        """``mod_switch_to`` into a new ciphertext; ``ct`` itself if no switch is needed."""
+        if self.level_of(ct) >= level:
+            return ct
+        out = sealapi.Ciphertext()
+        self.evaluator.mod_switch_to(ct, self.levels[level].parms_id, out)
+        return out
+
+    def match_levels(self, cts: Sequence[sealapi.Ciphertext]) -> List[sealapi.Ciphertext]:
+        """``cts`` at the lowest level among them (see ``at_level``), as SEAL's add and multiply require.
+
+        Stored logits of one window can sit at different levels (rows
+        written before the output level changed), all at the same scale.
+        """
+        level = max(self.level_of(ct) for ct in cts)
+        return [self.at_level(ct, level) for ct in cts]
+
+    def rotate(self, ct: sealapi.Ciphertext, steps: int) -> sealapi.Ciphertext:
+        """Rotate slots left by ``steps`` (right if negative)."""
+        if self._galois_keys is None:
+            raise RuntimeError("Context has no Galois keys; rotations are unavailable")
+        steps = normalize_rotation(steps, self.slot_count)
+        if steps == 0:
+            return self.copy(ct)
+        out = sealapi.Ciphertext()
+        self.evaluator.rotate_vector(ct, steps, self._galois_keys, out)
+        return out
+
+    def square(self, ct: sealapi.Ciphertext) -> sealapi.Ciphertext:
+        if self._relin_keys is None:
+            raise RuntimeError("Context has no relinearization keys")
+        out = sealapi.Ciphertext()
+        self.evaluator.square(ct, out)
+        self.evaluator.relinearize_inplace(out, self._relin_keys)
+        return self.rescale(out)
+
+    def square_sum(self, cts: Sequence[sealapi.Ciphertext]) -> sealapi.Ciphertext:
+        """``sum(ct * ct)``, relinearized and rescaled once.
+
+        Size-3 products of one level and scale add up exactly, so ``n``
+        squares cost a single key switch and rescale instead of ``n``.
+        """
+        return self.product_sum([(ct, ct) for ct in cts])
+
+    def product_sum(self, pairs: Sequence[Tuple[sealapi.Ciphertext, sealapi.Ciphertext]]) -> sealapi.Ciphertext:
+        """``sum(a * b)`` over ``pairs``, relinearized and rescaled once (see ``square_sum``).
+
+        Operands are switched to the lowest level among them first (``match_levels``).
+        """
+        if not pairs:
+            raise ValueError("Nothing to multiply")
+        level = max(self.level_of(ct) for pair in pairs for ct in pair)
+        pairs = [
+            (self.at_level(a, level),) * 2 if a is b else (self.at_level(a, level), self.at_level(b, level))
+            for a, b in pairs
+        ]
+        return self.relinearize_rescale(self.tree_sum(self.multiply_raw(a, b) for a, b in pairs))
+
+    def multiply_raw(self, ct: sealapi.Ciphertext, other: sealapi.Ciphertext) -> sealapi.Ciphertext:
+        """``ct * other`` left unrelinearized (size 3) and unrescaled, to be summed first."""
+        out = sealapi.Ciphertext()
+        if ct is other:
+            self.evaluator.square(ct, out)
+        else:
+            self.evaluator.multiply(ct, other, out)
+        return out
+
+    def relinearize_rescale(self, ct: sealapi.Ciphertext) -> sealapi.Ciphertext:
+        if self._relin_keys is None:
+            raise RuntimeError("Context has no relinearization keys")
+        self.evaluator.relinearize_inplace(ct, self._relin_keys)
+        return self.rescale(ct)
+
+    def tree_sum(self, cts: Iterable[sealapi.Ciphertext]) -> sealapi.Ciphertext:
+        """Pairwise (tree) sum of ``cts``, consumed as they come; the summands are left untouched.
+
+        Partial sums of equal size are merged like a binary counter, so at
+        most ``log2(n)`` are alive at a time. Only merging two summands
+        allocates; a partial sum is reused in place.
+        """
+        # (summands, ciphertext, whether it is a partial sum owned here)
+        stack: List[Tuple[int, sealapi.Ciphertext, bool]] = []
+
+        def merge(a: Tuple[int, sealapi.Ciphertext, bool], b: Tuple[int, sealapi.Ciphertext, bool]):
+            if not a[2]:
+                a, b = b, a
+            if a[2]:
+                self.evaluator.add_inplace(a[1], b[1])
+                return a[0] + b[0], a[1], True
+            out = sealapi.Ciphertext()
+            self.evaluator.add(a[1], b[1], out)
+            return a[0] + b[0], out, True
+
+        for ct in cts:
+            item = (1, ct, False)
+            while stack and stack[-1][0] == item[0]:
+                item = merge(stack.pop(), item)
+            stack.append(item)
+        if not stack:
+            raise ValueError("Nothing to sum")
+        total = stack.pop()
+        while stack:
+            total = merge(stack.pop(), total)
+        return total[1] if total[2] else self.copy(total[1])
+
+    def copy(self, ct: sealapi.Ciphertext) -> sealapi.Ciphertext:
+        # The bindings expose no copy constructor; a double negation is cheap and exact
+        out = sealapi.Ciphertext()
+        self.evaluator.negate(ct, out)
+        self.evaluator.negate_inplace(out)
+        return out
+
+    # ------------------------------------------------------------------
+    # CKKSVector bridge
+    # ------------------------------------------------------------------
+    @staticmethod
+    def from_vector(vector: ts.CKKSVector) -> sealapi.Ciphertext:
+        ciphertexts = vector.ciphertext()
+        if len(ciphertexts) != 1:
+            raise ValueError(f"Expected a single-ciphertext CKKSVector, got {len(ciphertexts)} chunks")
+        return ciphertexts[0]
+
+    def save_ciphertext(self, ct: sealapi.Ciphertext) -> bytes:
+        """SEAL's own serialization of ``ct`` (the bindings only save to a path)."""
+        fd, path = tempfile.mkstemp(suffix=".ct")
+        os.close(fd)
+        try:
+            ct.save(path)
+            with open(path, "rb") as handle:
+                return handle.read()
+        finally:
+            os.unlink(path)
+
+    def load_ciphertext(self, data: bytes) -> sealapi.Ciphertext:
+        """Inverse of ``save_ciphertext`` (validated against this context)."""
+        fd, path = tempfile.mkstemp(suffix=".ct")
+        try:
+            with os.fdopen(fd, "wb") as handle:
+                handle.write(data)
+            ct = sealapi.Ciphertext()
+            ct.load(self._seal_context, path)
+            return ct
+        finally:
+            os.unlink(path)
+
+    def to_vector(self, ct: sealapi.Ciphertext, size: int) -> ts.CKKSVector:
+        """Wrap ``ct`` into a ``CKKSVector`` exposing its first ``size`` slots.
+
+        The ciphertext is framed as TenSEAL's ``CKKSVectorProto``.
+        Like TenSEAL after each rescale, the scale is snapped back to the
+        context's global scale so the result mixes with TenSEAL-made vectors.
+        """
+        ct.scale = self.context.global_scale
+        ct_bytes = self.save_ciphertext(ct)
+        proto = (
+            b"\x0a" + _varint(len(_varint(size))) + _varint(size)
+            + b"\x12" + _varint(len(ct_bytes)) + ct_bytes
+            + b"\x19" + struct.pack("<d", ct.scale)
+        )
+        return ts.ckks_vector_from(self.context, proto)
+
+
+def normalize_rotation(steps: int, slot_count: int) -> int:
+    """Map a rotation to the equivalent step in ``(-slot_count / 2, slot_count / 2]``."""
+    steps %= slot_count
+    if steps > slot_count // 2:
+        steps -= slot_count
+    return steps
+
+
+__all__ = ["Level", "SealEvaluator", "normalize_rotation"]
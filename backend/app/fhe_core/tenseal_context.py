@@ -1,11 +1,15 @@
 """Utilities for building and managing TenSEAL CKKS contexts."""
 from __future__ import annotations
 
+import os
+import tempfile
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Iterable, Sequence
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
 
 import numpy as np
 import tenseal as ts
+from tenseal import sealapi
 
 
 # TenSEAL Tutorial 4 parameters
@@ -15,26 +19,241 @@ import tenseal as ts
 DEFAULT_POLY_MODULUS_DEGREE = 32768
 # [31, 26, 26, 26, 26, 26, 26, 31]
 DEFAULT_COEFF_MOD_BIT_SIZES = (60, 40, 40, 40, 40, 40, 40, 40, 60)
+PACKED_COEFF_MOD_BIT_SIZES = (60, 40, 40, 40, 40, 40, 40, 40, 40, 60)
 DEFAULT_GLOBAL_SCALE = 2**40
+# Bounds on untrusted serializations (see ParameterProfile.max_context_bytes):
+# the minimal rotation key set of the largest batch is 40 keys and TenSEAL's
+# full power-of-two set 2*log2(slots) = 28-30, both well under 64.
+MAX_GALOIS_KEYS = 64
+SERIALIZATION_OVERHEAD = 1 << 16  # protobuf and SEAL headers, parameters
+
+
+@dataclass(frozen=True)
+class ParameterProfile:
+    """A named CKKS parameter set clients can pick at key registration.
+
+    ``security_bits`` follows the HomomorphicEncryption.org standard table
+    for the total coefficient modulus. ``max_logit_error`` is the largest
+    deviation of the encrypted FHEEmotionCNN logits from a plaintext forward
+    pass (FER2013-shaped random inputs and weights, both input layouts).
+    ``fer2013_accuracy`` is the test-set accuracy of the encrypted model,
+    ``None`` until it has been measured with the trained weights.
+    ``packed_history`` profiles keep one more level for packing every
+    stored day into one ciphertext (``fhe_core.packed_history``).
+    """
+
+    name: str
+    poly_modulus_degree: int
+    coeff_mod_bit_sizes: Tuple[int, ...]
+    global_scale: float
+    security_bits: int
+    max_logit_error: float
+    fer2013_accuracy: Optional[float] = None
+    description: str = ""
+    packed_history: bool = False
+
+    @property
+    def slot_count(self) -> int:
+        return self.poly_modulus_degree // 2
+
+    @property
+    def depth(self) -> int:
+        """Rescales available (the first and last primes are not consumed)."""
+        return len(self.coeff_mod_bit_sizes) - 2
+
+    @property
+    def max_ciphertext_bytes(self) -> int:
+        """Largest serialized fresh ciphertext: two polynomials at the first data level."""
+        return 2 * self.poly_modulus_degree * (len(self.coeff_mod_bit_sizes) - 1) * 8 + SERIALIZATION_OVERHEAD
+
+    @property
+    def max_context_bytes(self) -> int:
+        """Largest serialized eval context: public, relinearization and ``MAX_GALOIS_KEYS`` rotation keys.
+
+        Every key is ``primes - 1`` pairs of polynomials over all primes (as
+        in ``context_memory_bytes``); SEAL's compression only shrinks them.
+        """
+        primes = len(self.coeff_mod_bit_sizes)
+        polynomial = self.poly_modulus_degree * primes * 8
+        keys = MAX_GALOIS_KEYS + 1
+        return keys * (primes - 1) * 2 * polynomial + 2 * polynomial + SERIALIZATION_OVERHEAD
+
+    def create_context(self, generate_galois_keys: bool = True) -> ts.Context:
+        return create_context(self.poly_modulus_degree, self.coeff_mod_bit_sizes, self.global_scale, generate_galois_keys)
+
+    def matches(self, context: ts.Context) -> bool:
+        """Whether ``context`` was created with this profile's parameters."""
+        parms = context.seal_context().data.key_context_data().parms()
+        bit_sizes = tuple(modulus.bit_count() for modulus in parms.coeff_modulus())
+        return parms.poly_modulus_degree() == self.poly_modulus_degree and bit_sizes == self.coeff_mod_bit_sizes
+
+
+# "fast" and "safe" use the depth-minimal chain: seven rescales (conv, pack mask,
+# square, FC1, square, FC2 in EncodedCNN, then the square of the history
+# statistics) as 40-bit primes between a 60-bit base and special prime.
+# "safe-packed" adds the packed history's mask level: 440 bits, within the
+# 476-bit bound for 256-bit security at N=32768. At N=16384 the 128-bit bound
+# is 438 bits, so "fast" has no room for it.
+PROFILES: Dict[str, ParameterProfile] = {
+    profile.name: profile
+    for profile in (
+        ParameterProfile(
+            name="fast",
+            poly_modulus_degree=16384,
+            coeff_mod_bit_sizes=DEFAULT_COEFF_MOD_BIT_SIZES,
+            global_scale=DEFAULT_GLOBAL_SCALE,
+            security_bits=128,
+            max_logit_error=1.5e-4,
+            description="N=16384: half the ciphertext and key size, 1.3-2x faster forward pass; batches of up to 2 images",
+        ),
+        ParameterProfile(
+            name="safe",
+            poly_modulus_degree=DEFAULT_POLY_MODULUS_DEGREE,
+            coeff_mod_bit_sizes=DEFAULT_COEFF_MOD_BIT_SIZES,
+            global_scale=DEFAULT_GLOBAL_SCALE,
+            security_bits=256,
+            max_logit_error=2e-4,
+            description="N=32768: the original parameters; batches of up to 4 images",
+        ),
+        ParameterProfile(
+            name="safe-packed",
+            poly_modulus_degree=DEFAULT_POLY_MODULUS_DEGREE,
+            coeff_mod_bit_sizes=PACKED_COEFF_MOD_BIT_SIZES,
+            global_scale=DEFAULT_GLOBAL_SCALE,
+            security_bits=256,
+            # Same forward pass as "safe"; the extra prime is only used afterwards
+            max_logit_error=2e-4,
+            description="N=32768 with one more level: history statistics from one packed ciphertext per user",
+            packed_history=True,
+        ),
+    )
+}
+DEFAULT_PROFILE = "safe"
+
+
+def get_profile(name: str) -> ParameterProfile:
+    try:
+        return PROFILES[name]
+    except KeyError:
+        raise ValueError(f"Unknown parameter profile {name!r}; expected one of {sorted(PROFILES)}") from None
+
+
+def profile_of(context: ts.Context) -> ParameterProfile:
+    """The profile ``context`` was created with (``ValueError`` for custom parameters)."""
+    for profile in PROFILES.values():
+        if profile.matches(context):
+            return profile
+    parms = context.seal_context().data.key_context_data().parms()
+    raise ValueError(
+        f"Context parameters (N={parms.poly_modulus_degree()}, "
+        f"coeff_modulus={[m.bit_count() for m in parms.coeff_modulus()]}) match no profile in {sorted(PROFILES)}"
+    )
 
 
 def create_context(
     poly_modulus_degree: int = DEFAULT_POLY_MODULUS_DEGREE,
     coeff_mod_bit_sizes: Sequence[int] = DEFAULT_COEFF_MOD_BIT_SIZES,
     global_scale: float = DEFAULT_GLOBAL_SCALE,
+    generate_galois_keys: bool = True,
 ) -> ts.Context:
-    """Instantiate a CKKS context with keys for rotations and relinearization."""
+    """Instantiate a CKKS context with keys for rotations and relinearization.
+
+    ``generate_galois_keys=False`` skips the full power-of-two rotation key
+    set (about 850 MB at N=32768); use ``eval_context`` to derive an
+    evaluation context with only the keys the server needs.
+    """
     context = ts.context(
         ts.SCHEME_TYPE.CKKS,
         poly_modulus_degree=poly_modulus_degree,
         coeff_mod_bit_sizes=list(coeff_mod_bit_sizes),
     )
     context.global_scale = global_scale
-    context.generate_galois_keys()
     context.generate_relin_keys()
+    if generate_galois_keys:
+        context.generate_galois_keys()
     return context
 
 
+def poly_modulus_degree(context: ts.Context) -> int:
+    return context.seal_context().data.first_context_data().parms().poly_modulus_degree()
+
+
+def context_memory_bytes(context: ts.Context) -> int:
+    """Memory held by the keys of a deserialized ``context``.
+
+    Every Galois and relinearization key is a key-switching key of
+    ``primes - 1`` size-2 ciphertexts at the key level (all ``primes``
+    RNS primes, special prime included), stored as 64-bit words; the public
+    key is one more size-2 ciphertext. SEAL compresses serialized keys, so
+    the serialized size undercounts this (by about a third for "fast").
+    """
+    parms = context.seal_context().data.key_context_data().parms()
+    primes = len(parms.coeff_modulus())
+    polynomial = parms.poly_modulus_degree() * primes * 8
+    keys = (context.data.galois_keys().size() if context.has_galois_keys() else 0) + (
+        context.data.relin_keys().size() if context.has_relin_keys() else 0
+    )
+    return keys * (primes - 1) * 2 * polynomial + (2 * polynomial if context.has_public_key() else 0)
+
+
+def galois_element(step: int, poly_degree: int) -> int:
+    """SEAL's Galois element for a left rotation by ``step`` slots (right if negative)."""
+    slots = poly_degree // 2
+    if step == 0 or abs(step) >= slots:
+        raise ValueError(f"Rotation step must be in (-{slots}, {slots}) and non-zero, got {step}")
+    return pow(3, step % slots, 2 * poly_degree)
+
+
+def eval_context(context: ts.Context, rotation_steps: Optional[Iterable[int]] = None) -> ts.Context:
+    """Public (no secret key) copy of ``context`` for the server.
+
+    Without ``rotation_steps`` the copy keeps ``context``'s own Galois keys.
+    With it, the copy carries rotation keys for exactly those steps (see
+    ``fhe_core.rotation_keys``). TenSEAL only generates the full power-of-two
+    set and regenerates it when loading a secret-key context, so the keys are
+    created with SEAL's ``KeyGenerator`` and spliced into the serialized
+    public context (``TenSEALPublicProto.galois_keys``).
+    """
+    if rotation_steps is None:
+        return ts.context_from(context.serialize(save_secret_key=False))
+    if not context.has_secret_key():
+        raise ValueError("Generating rotation keys requires the secret key")
+    degree = poly_modulus_degree(context)
+    elements = sorted({galois_element(step, degree) for step in rotation_steps})
+    keys = sealapi.GaloisKeys()
+    sealapi.KeyGenerator(context.seal_context().data, context.secret_key().data).create_galois_keys(elements, keys)
+    fd, path = tempfile.mkstemp(suffix=".galois")
+    os.close(fd)
+    try:
+        keys.save(path)
+        del keys
+        key_bytes = Path(path).read_bytes()
+    finally:
+        os.unlink(path)
+
+    # Keys are hundreds of MB: build the proto from small headers and join once
+    chunks: List[bytes] = []
+    for number, wire_type, value in _proto_fields(context.serialize(save_secret_key=False, save_galois_keys=False)):
+        if number != 2:
+            chunks.append(_proto_field(number, wire_type, value))
+            continue
+        # public_context: replace the (empty) galois_keys field
+        public = b"".join(_proto_field(*f) for f in _proto_fields(value) if f[0] != 5)
+        key_header = _varint(5 << 3 | 2) + _varint(len(key_bytes))
+        size = len(public) + len(key_header) + len(key_bytes)
+        chunks += [_varint(number << 3 | wire_type) + _varint(size), public, key_header, key_bytes]
+    del key_bytes
+    data = b"".join(chunks)
+    del chunks
+    return ts.context_from(data)
+
+
+def slot_count(context: ts.Context) -> int:
+    """Number of CKKS slots (poly_modulus_degree / 2) available in ``context``."""
+    parms = context.seal_context().data.first_context_data().parms()
+    return parms.poly_modulus_degree() // 2
+
+
 def encrypt_vector(context: ts.Context, values: Iterable[float] | np.ndarray) -> ts.CKKSVector:
     """Encrypt a flat vector of floats using CKKS."""
     if isinstance(values, np.ndarray):
@@ -62,8 +281,72 @@ def load_context(path: Path) -> ts.Context:
     return ts.context_from(data)
 
 
+# Minimal protobuf wire-format helpers for TenSEAL's context/vector protos
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _read_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            return value, pos
+
+
+def _proto_fields(data: bytes) -> List[Tuple[int, int, object]]:
+    """Top-level ``(field number, wire type, value)`` triples of a serialized message."""
+    fields = []
+    pos = 0
+    while pos < len(data):
+        key, pos = _read_varint(data, pos)
+        number, wire_type = key >> 3, key & 0x7
+        if wire_type == 0:
+            value, pos = _read_varint(data, pos)
+        elif wire_type == 2:
+            length, pos = _read_varint(data, pos)
+            value, pos = data[pos : pos + length], pos + length
+        elif wire_type in (1, 5):
+            size = 8 if wire_type == 1 else 4
+            value, pos = data[pos : pos + size], pos + size
+        else:
+            raise ValueError(f"Unsupported protobuf wire type {wire_type}")
+        fields.append((number, wire_type, value))
+    return fields
+
+
+def _proto_field(number: int, wire_type: int, value) -> bytes:
+    key = _varint(number << 3 | wire_type)
+    if wire_type == 0:
+        return key + _varint(value)
+    if wire_type == 2:
+        return key + _varint(len(value)) + value
+    return key + value
+
+
 __all__ = [
+    "ParameterProfile",
+    "PROFILES",
+    "DEFAULT_PROFILE",
+    "get_profile",
+    "profile_of",
     "create_context",
+    "slot_count",
+    "poly_modulus_degree",
+    "galois_element",
+    "context_memory_bytes",
+    "eval_context",
     "encrypt_vector",
     "decrypt_vector",
     "save_context",
@@ -71,4 +354,5 @@ __all__ = [
     "DEFAULT_POLY_MODULUS_DEGREE",
     "DEFAULT_COEFF_MOD_BIT_SIZES",
     "DEFAULT_GLOBAL_SCALE",
+    "PACKED_COEFF_MOD_BIT_SIZES",
 ]
@@ -7,14 +7,35 @@ from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 
 from app.api import routes_auth, routes_emotion, routes_health, routes_he
-from app.core.db import Base, engine
-from app.models import emotion_data, user  # noqa: F401 - ensure models are registered
+from app.core.config import settings
+from app.core.db import Base, SessionLocal, engine
+from app.models import emotion_aggregate, emotion_data, emotion_history, user  # noqa: F401 - ensure models are registered
 from app.repositories.emotion_data_repository import EmotionDataRepository
+from app.repositories.migrate_predictions import ensure_schema
 from app.repositories.user_repository import UserRepository
 from app.services.analysis_service import AnalysisService
 from app.services.auth_service import AuthService
+from app.services.batch_scheduler import MicroBatchScheduler
+from app.services.context_upload import ContextUploadManager
 from app.services.emotion_service import EmotionService
-from app.services.he_service import HEEmotionEngine
+from app.services.he_pool import HEWorkerPool
+from app.services.he_service import CONTEXT_DIR, HEEmotionEngine
+from app.services.job_service import AnalysisJobQueue
+
+
+def create_he_engine():
+    """In-process engine, or a key-affinity worker pool when ``HE_WORKERS`` is set."""
+    if settings.HE_WORKERS <= 0:
+        return HEEmotionEngine()
+    # Workers split the core and context cache budgets between them
+    return HEWorkerPool(
+        settings.HE_WORKERS,
+        threads_per_worker=max(1, settings.he_threads() // settings.HE_WORKERS),
+        context_cache_mb_per_worker=max(1, settings.HE_CONTEXT_CACHE_MB // settings.HE_WORKERS),
+        vector_cache_mb_per_worker=settings.HE_VECTOR_CACHE_MB // settings.HE_WORKERS,
+        max_requests=settings.HE_WORKER_MAX_REQUESTS,
+        health_interval=settings.HE_WORKER_HEALTH_INTERVAL,
+    )
 
 
 def create_app() -> FastAPI:
@@ -26,14 +47,34 @@ def create_app() -> FastAPI:
 
     # Initialize persistence and services
     Base.metadata.create_all(bind=engine)
-    he_engine = HEEmotionEngine()
+    ensure_schema(engine)
+    he_engine = create_he_engine()
     user_repo = UserRepository()
     emotion_repo = EmotionDataRepository()
 
     app.state.auth_service = AuthService(user_repo)
-    app.state.emotion_service = EmotionService(emotion_repo, he_engine)
+    batch_scheduler = MicroBatchScheduler(
+        he_engine, max_batch_size=settings.HE_MICRO_BATCH_MAX_SIZE, max_wait_ms=settings.HE_MICRO_BATCH_WAIT_MS
+    )
+    app.state.emotion_service = EmotionService(emotion_repo, he_engine, batch_scheduler)
     app.state.analysis_service = AnalysisService(emotion_repo, he_engine)
     app.state.he_engine = he_engine
+    app.state.batch_scheduler = batch_scheduler
+    app.state.context_uploads = ContextUploadManager(
+        he_engine,
+        CONTEXT_DIR,
+        max_bytes=settings.HE_UPLOAD_MAX_MB * 2**20,
+        max_chunk_bytes=settings.HE_UPLOAD_CHUNK_MB * 2**20,
+        ttl_seconds=settings.HE_UPLOAD_TTL_SECONDS,
+    )
+    app.state.job_queue = AnalysisJobQueue(
+        SessionLocal,
+        workers=settings.ANALYSIS_JOB_WORKERS,
+        max_queued=settings.ANALYSIS_JOB_QUEUE_SIZE,
+        ttl_seconds=settings.ANALYSIS_JOB_TTL_SECONDS,
+        max_finished_per_user=settings.ANALYSIS_JOB_MAX_FINISHED_PER_USER,
+        max_finished=settings.ANALYSIS_JOB_MAX_FINISHED,
+    )
 
     app.add_middleware(
         CORSMiddleware,
@@ -48,6 +89,12 @@ def create_app() -> FastAPI:
     app.include_router(routes_he.router)
     app.include_router(routes_health.router)
 
+    @app.on_event("shutdown")
+    def shutdown_he_engine() -> None:
+        app.state.job_queue.close()
+        app.state.context_uploads.close()
+        he_engine.close()
+
     @app.middleware("http")
     async def log_requests(request: Request, call_next):
         start = time.perf_counter()
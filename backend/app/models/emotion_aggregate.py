@@ -0,0 +1,29 @@
+"""SQLAlchemy model for running encrypted history aggregates."""
+from __future__ import annotations
+
+from sqlalchemy import Column, Date, ForeignKey, Integer, String, UniqueConstraint
+from sqlalchemy.dialects.mysql import LONGTEXT
+
+from app.core.db import Base
+
+
+class EmotionAggregate(Base):
+    """Encrypted prefix sums of a user's predictions up to and including ``date``.
+
+    ``enc_sum`` adds up every prediction of the chain through ``date`` and
+    ``enc_volatility`` every squared difference of consecutive ones (NULL
+    while the chain holds a single day). A chain is a run of consecutive
+    predictions under one ``key_id`` starting at ``chain_start``; prefixes
+    of different chains never mix.
+    """
+
+    __tablename__ = "emotionaggregate"
+    __table_args__ = (UniqueConstraint("user_id", "date", name="uq_emotionaggregate_user_date"),)
+
+    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+    user_id = Column(String(64), ForeignKey("user.user_id"), nullable=False, index=True)
+    date = Column(Date, nullable=False, index=True)
+    key_id = Column(String(64), nullable=False)
+    chain_start = Column(Date, nullable=False)
+    enc_sum = Column(LONGTEXT, nullable=False)
+    enc_volatility = Column(LONGTEXT, nullable=True)
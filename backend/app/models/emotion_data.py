@@ -2,16 +2,30 @@
 from __future__ import annotations
 
 from sqlalchemy import Column, Date, ForeignKey, Integer, String, UniqueConstraint
-from sqlalchemy.dialects.mysql import LONGTEXT
+from sqlalchemy.dialects.mysql import LONGBLOB, LONGTEXT
+from sqlalchemy.orm import deferred
 
 from app.core.db import Base
 
 
 class EmotionData(Base):
+    """One day's encrypted prediction.
+
+    ``enc_ref`` is the SHA-256 of the ciphertext bytes, which live in
+    ``enc_blob`` or in the file store (see ``repositories.ciphertext_store``).
+    Rows without ``enc_ref`` predate that and hold base64 text in
+    ``enc_prediction``. Both payload columns are deferred, so listing queries
+    never load them.
+    """
+
     __tablename__ = "emotiondata"
     __table_args__ = (UniqueConstraint("user_id", "date", name="uq_emotiondata_user_date"),)
 
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     user_id = Column(String(64), ForeignKey("user.user_id"), nullable=False, index=True)
     date = Column(Date, nullable=False, index=True)
-    enc_prediction = Column(LONGTEXT, nullable=False)
+    enc_ref = Column(String(64), nullable=True, index=True)
+    enc_size = Column(Integer, nullable=True)
+    enc_level = Column(Integer, nullable=True)
+    enc_blob = deferred(Column(LONGBLOB, nullable=True))
+    enc_prediction = deferred(Column(LONGTEXT, nullable=True))
@@ -0,0 +1,26 @@
+"""SQLAlchemy model for slot-packed encrypted histories."""
+from __future__ import annotations
+
+from sqlalchemy import Column, ForeignKey, Integer, String, UniqueConstraint
+from sqlalchemy.dialects.mysql import LONGBLOB, LONGTEXT
+
+from app.core.db import Base
+
+
+class EmotionHistory(Base):
+    """Every prediction of a user under ``key_id`` packed into one ciphertext.
+
+    Only kept for keys of a ``packed_history`` profile (see
+    ``fhe_core.packed_history``). ``days`` is a JSON object mapping each
+    packed date (ISO format) to the content hash of the prediction packed
+    for it, so a window whose stored hashes differ is not read from here.
+    """
+
+    __tablename__ = "emotionhistory"
+    __table_args__ = (UniqueConstraint("user_id", "key_id", name="uq_emotionhistory_user_key"),)
+
+    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+    user_id = Column(String(64), ForeignKey("user.user_id"), nullable=False, index=True)
+    key_id = Column(String(64), nullable=False)
+    enc_history = Column(LONGBLOB, nullable=False)
+    days = Column(LONGTEXT, nullable=False)
@@ -0,0 +1,100 @@
+"""Where the bytes of stored prediction ciphertexts live.
+
+``EmotionData`` rows keep the SHA-256 (``enc_ref``), byte size and CKKS
+level of their ciphertext; the bytes themselves go to one of two backends:
+
+- ``blob``: the row's deferred ``enc_blob`` LONGBLOB, loaded only by the
+  queries that ask for it;
+- ``file``: ``{directory}/{sha[:2]}/{sha}.ct``, content addressed like the
+  eval context store, so identical ciphertexts are stored once.
+
+Rows written before this layer hold base64 text in ``enc_prediction`` (no
+``enc_ref``). They stay readable, and ``migrate_predictions`` moves them to
+the configured backend.
+"""
+from __future__ import annotations
+
+import base64
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+from app.core.config import settings
+from app.models.emotion_data import EmotionData
+
+BACKENDS = ("blob", "file")
+# Default file store, next to the eval context store
+STORE_DIR = Path(__file__).resolve().parents[1] / "he_predictions"
+
+
+def _sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class CiphertextStore:
+    """Writes prediction ciphertexts to ``backend``; reads them from wherever a row points.
+
+    ``directory`` is the file store, also read when the backend is ``blob``
+    for rows written while it was ``file``.
+    """
+
+    def __init__(self, backend: str = "blob", directory: Path = STORE_DIR) -> None:
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown ciphertext store {backend!r}; expected one of {BACKENDS}")
+        self.backend = backend
+        self.directory = Path(directory)
+        if backend == "file":
+            self.directory.mkdir(parents=True, exist_ok=True)
+
+    @classmethod
+    def from_settings(cls) -> "CiphertextStore":
+        return cls(settings.PREDICTION_STORE, Path(settings.PREDICTION_STORE_DIR or STORE_DIR))
+
+    def write(self, record: EmotionData, data: bytes, level: Optional[int] = None) -> None:
+        """Point ``record`` at ``data`` (bytes as returned to the client, codec frame included)."""
+        ref = _sha256(data)
+        if self.backend == "file":
+            path = self._path(ref)
+            if not path.exists():
+                path.parent.mkdir(exist_ok=True)
+                fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".part")
+                try:
+                    with os.fdopen(fd, "wb") as handle:
+                        handle.write(data)
+                    os.replace(tmp, path)
+                except BaseException:
+                    Path(tmp).unlink(missing_ok=True)
+                    raise
+            record.enc_blob = None
+        else:
+            record.enc_blob = data
+        record.enc_prediction = None
+        record.enc_ref, record.enc_size, record.enc_level = ref, len(data), level
+
+    def read(self, record: EmotionData) -> bytes:
+        """Ciphertext bytes of ``record``, whichever backend (or legacy base64 text) holds them."""
+        if record.enc_ref is None:
+            return base64.b64decode(record.enc_prediction)
+        if record.enc_blob is not None:
+            return record.enc_blob
+        path = self._path(record.enc_ref)
+        if not path.exists():
+            raise FileNotFoundError(f"Ciphertext {record.enc_ref} of {record.date} is not in the file store")
+        return path.read_bytes()
+
+    @staticmethod
+    def content_hash(record: EmotionData) -> str:
+        """``enc_ref``, or for a legacy row the SHA-256 of its base64 text (like MySQL's ``SHA2``)."""
+        return record.enc_ref or _sha256(record.enc_prediction.encode("ascii"))
+
+    def release(self, ref: str) -> None:
+        """Delete the stored file of ``ref`` (the caller checked no row references it any more)."""
+        self._path(ref).unlink(missing_ok=True)
+
+    def _path(self, ref: str) -> Path:
+        return self.directory / ref[:2] / f"{ref}.ct"
+
+
+__all__ = ["BACKENDS", "STORE_DIR", "CiphertextStore"]
@@ -2,40 +2,231 @@
 from __future__ import annotations
 
 from datetime import date, timedelta
-from sqlalchemy.orm import Session
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
 
+from sqlalchemy import func
+from sqlalchemy.orm import Session, undefer
+
+from app.models.emotion_aggregate import EmotionAggregate
 from app.models.emotion_data import EmotionData
+from app.models.emotion_history import EmotionHistory
+from app.repositories.ciphertext_store import CiphertextStore
 import logging
 
 LOGGER = logging.getLogger(__name__)
 
 
+def window_start(days: int) -> date:
+    """First date of the ``days``-day window ending today."""
+    return date.today() - timedelta(days=max(days - 1, 0))
+
+
+def _content_hash():
+    # Legacy rows are hashed by MySQL, so checking for changed days does not transfer the ciphertexts
+    return func.coalesce(EmotionData.enc_ref, func.sha2(EmotionData.enc_prediction, 256)).label("content_hash")
+
+
+def _with_ciphertexts(query):
+    # Both payload columns are deferred; load them with the rows rather than one query per row
+    return query.options(undefer(EmotionData.enc_blob), undefer(EmotionData.enc_prediction))
+
+
 class EmotionDataRepository:
-    def upsert_enc_prediction(self, db: Session, user_id: str, date_value: date, enc_prediction: str) -> EmotionData:
+    def __init__(self, store: Optional[CiphertextStore] = None) -> None:
+        self.store = store or CiphertextStore.from_settings()
+
+    def upsert_enc_prediction(
+        self, db: Session, user_id: str, date_value: date, ciphertext: bytes, level: Optional[int] = None
+    ) -> EmotionData:
+        """Store ``ciphertext`` (bytes, at CKKS ``level``) as the prediction of ``date_value``."""
         try:
             record = (
                 db.query(EmotionData)
                 .filter(EmotionData.user_id == user_id, EmotionData.date == date_value)
                 .one_or_none()
             )
-            if record:
-                record.enc_prediction = enc_prediction
-            else:
-                record = EmotionData(user_id=user_id, date=date_value, enc_prediction=enc_prediction)
+            old_ref = record.enc_ref if record else None
+            if record is None:
+                record = EmotionData(user_id=user_id, date=date_value)
                 db.add(record)
+            self.store.write(record, ciphertext, level)
             db.commit()
             db.refresh(record)
-            return record
         except Exception as exc:  # noqa: BLE001
             db.rollback()
-            LOGGER.error("DB upsert failed for user=%s date=%s (len=%s): %s", user_id, date_value, len(enc_prediction), exc)
+            LOGGER.error("DB upsert failed for user=%s date=%s (len=%s): %s", user_id, date_value, len(ciphertext), exc)
             raise
+        if old_ref is not None and old_ref != record.enc_ref:
+            self._release(db, old_ref)
+        return record
+
+    def read_ciphertext(self, record: EmotionData) -> bytes:
+        return self.store.read(record)
 
     def get_recent_enc_predictions(self, db: Session, user_id: str, days: int) -> list[EmotionData]:
-        start_date = date.today() - timedelta(days=max(days - 1, 0))
-        return (
+        return _with_ciphertexts(
+            db.query(EmotionData)
+            .filter(EmotionData.user_id == user_id, EmotionData.date >= window_start(days))
+            .order_by(EmotionData.date.desc())
+        ).all()
+
+    def iter_enc_predictions_on(self, db: Session, user_id: str, dates: Sequence[date]) -> Iterator[EmotionData]:
+        """Predictions of those of ``dates`` that have one, newest first, streamed one row at a time.
+
+        ``yield_per`` uses a server-side cursor, so only the row being yielded
+        holds its ciphertext in memory.
+        """
+        if not dates:
+            return
+        query = db.query(EmotionData).filter(EmotionData.user_id == user_id, EmotionData.date.in_(list(dates)))
+        yield from _with_ciphertexts(query.order_by(EmotionData.date.desc())).yield_per(1)
+
+    def get_enc_prediction(self, db: Session, user_id: str, date_value: date) -> Optional[EmotionData]:
+        return _with_ciphertexts(
+            db.query(EmotionData).filter(EmotionData.user_id == user_id, EmotionData.date == date_value)
+        ).one_or_none()
+
+    def get_enc_predictions_from(self, db: Session, user_id: str, from_date: date) -> list[EmotionData]:
+        """Predictions dated ``from_date`` or later, oldest first."""
+        return _with_ciphertexts(
             db.query(EmotionData)
-            .filter(EmotionData.user_id == user_id, EmotionData.date >= start_date)
+            .filter(EmotionData.user_id == user_id, EmotionData.date >= from_date)
+            .order_by(EmotionData.date.asc())
+        ).all()
+
+    def get_recent_dates(self, db: Session, user_id: str, days: int) -> List[date]:
+        """Dates with a prediction in the ``days``-day window, newest first (no ciphertexts loaded)."""
+        rows = (
+            db.query(EmotionData.date)
+            .filter(EmotionData.user_id == user_id, EmotionData.date >= window_start(days))
             .order_by(EmotionData.date.desc())
             .all()
         )
+        return [row.date for row in rows]
+
+    def get_recent_prediction_hashes(self, db: Session, user_id: str, days: int) -> List[Tuple[date, str]]:
+        """(date, SHA-256 of the stored prediction) in the ``days``-day window, newest first."""
+        rows = (
+            db.query(EmotionData.date, _content_hash())
+            .filter(EmotionData.user_id == user_id, EmotionData.date >= window_start(days))
+            .order_by(EmotionData.date.desc())
+            .all()
+        )
+        return [(row.date, row.content_hash) for row in rows]
+
+    def get_enc_predictions_on(self, db: Session, user_id: str, dates: Sequence[date]) -> Dict[date, Tuple[bytes, str]]:
+        """date -> (ciphertext, its content hash) for those of ``dates`` that have one."""
+        if not dates:
+            return {}
+        records = _with_ciphertexts(
+            db.query(EmotionData).filter(EmotionData.user_id == user_id, EmotionData.date.in_(list(dates)))
+        ).all()
+        return {record.date: (self.store.read(record), self.store.content_hash(record)) for record in records}
+
+    def get_legacy_predictions(self, db: Session, limit: int) -> list[EmotionData]:
+        """Up to ``limit`` rows still holding base64 text (see ``migrate_predictions``)."""
+        return _with_ciphertexts(db.query(EmotionData).filter(EmotionData.enc_ref.is_(None)).limit(limit)).all()
+
+    def move_to_store(self, db: Session, records: List[EmotionData]) -> None:
+        """Rewrite legacy ``records`` into the ciphertext store (level unknown)."""
+        try:
+            for record in records:
+                self.store.write(record, self.store.read(record))
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+
+    def _release(self, db: Session, ref: str) -> None:
+        # A file may be shared by identical ciphertexts; drop it with its last row
+        if db.query(EmotionData.id).filter(EmotionData.enc_ref == ref).first() is None:
+            self.store.release(ref)
+
+    def get_previous_date(self, db: Session, user_id: str, before: date) -> Optional[date]:
+        """Latest date with a prediction before ``before``."""
+        row = (
+            db.query(EmotionData.date)
+            .filter(EmotionData.user_id == user_id, EmotionData.date < before)
+            .order_by(EmotionData.date.desc())
+            .first()
+        )
+        return row.date if row else None
+
+    # ------------------------------------------------------------------
+    # Running aggregates
+    # ------------------------------------------------------------------
+    def get_aggregate(self, db: Session, user_id: str, date_value: date) -> Optional[EmotionAggregate]:
+        return (
+            db.query(EmotionAggregate)
+            .filter(EmotionAggregate.user_id == user_id, EmotionAggregate.date == date_value)
+            .one_or_none()
+        )
+
+    def get_latest_key_id(self, db: Session, user_id: str) -> Optional[str]:
+        """key_id of the user's latest running aggregate: the key their latest prediction was made with."""
+        row = (
+            db.query(EmotionAggregate.key_id)
+            .filter(EmotionAggregate.user_id == user_id)
+            .order_by(EmotionAggregate.date.desc())
+            .first()
+        )
+        return row.key_id if row else None
+
+    def get_aggregate_keys_from(self, db: Session, user_id: str, from_date: date) -> Dict[date, str]:
+        """key_id of each aggregate dated ``from_date`` or later (no ciphertexts loaded)."""
+        rows = (
+            db.query(EmotionAggregate.date, EmotionAggregate.key_id)
+            .filter(EmotionAggregate.user_id == user_id, EmotionAggregate.date >= from_date)
+            .all()
+        )
+        return {row.date: row.key_id for row in rows}
+
+    def delete_aggregates_from(self, db: Session, user_id: str, from_date: date) -> None:
+        """Drop aggregates dated ``from_date`` or later: they include predictions about to change."""
+        try:
+            db.query(EmotionAggregate).filter(
+                EmotionAggregate.user_id == user_id, EmotionAggregate.date >= from_date
+            ).delete(synchronize_session=False)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+
+    def add_aggregates(self, db: Session, aggregates: List[EmotionAggregate]) -> None:
+        try:
+            db.add_all(aggregates)
+            db.commit()
+        except Exception as exc:  # noqa: BLE001
+            db.rollback()
+            LOGGER.error("DB insert of %d aggregates failed: %s", len(aggregates), exc)
+            raise
+
+    # ------------------------------------------------------------------
+    # Packed histories
+    # ------------------------------------------------------------------
+    def get_packed_history(self, db: Session, user_id: str, key_id: str) -> Optional[EmotionHistory]:
+        return (
+            db.query(EmotionHistory)
+            .filter(EmotionHistory.user_id == user_id, EmotionHistory.key_id == key_id)
+            .one_or_none()
+        )
+
+    def save_packed_history(self, db: Session, history: EmotionHistory) -> None:
+        """Insert or update ``history`` (a new row or one from ``get_packed_history``)."""
+        try:
+            db.add(history)
+            db.commit()
+        except Exception as exc:  # noqa: BLE001
+            db.rollback()
+            LOGGER.error("DB write of the packed history of user=%s failed: %s", history.user_id, exc)
+            raise
+
+    def delete_packed_history(self, db: Session, user_id: str, key_id: str) -> None:
+        try:
+            db.query(EmotionHistory).filter(
+                EmotionHistory.user_id == user_id, EmotionHistory.key_id == key_id
+            ).delete(synchronize_session=False)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
@@ -0,0 +1,77 @@
+"""Move stored predictions out of base64 LONGTEXT rows into the ciphertext store.
+
+Two steps, both safe to repeat and to run while the service is up:
+
+- ``ensure_schema`` adds the ciphertext store columns to an ``emotiondata``
+  table created before them (``create_all`` only creates missing tables) and
+  makes ``enc_prediction`` nullable. The app runs it at startup.
+- ``migrate`` rewrites legacy rows into the configured store
+  (``PREDICTION_STORE``) in batches. Rows not migrated yet stay readable.
+
+Run with ``python -m app.repositories.migrate_predictions`` from ``backend/``.
+"""
+from __future__ import annotations
+
+import argparse
+import logging
+
+from sqlalchemy import inspect, text
+
+from app.repositories.emotion_data_repository import EmotionDataRepository
+
+LOGGER = logging.getLogger(__name__)
+
+_COLUMNS = (
+    ("enc_ref", "VARCHAR(64) NULL"),
+    ("enc_size", "INT NULL"),
+    ("enc_level", "INT NULL"),
+    ("enc_blob", "LONGBLOB NULL"),
+)
+
+
+def ensure_schema(engine) -> None:
+    """Add the columns ``EmotionData`` gained with the ciphertext store, if missing."""
+    columns = {column["name"]: column for column in inspect(engine).get_columns("emotiondata")}
+    statements = [f"ALTER TABLE emotiondata ADD COLUMN {name} {ddl}" for name, ddl in _COLUMNS if name not in columns]
+    if "enc_ref" not in columns:
+        statements.append("CREATE INDEX ix_emotiondata_enc_ref ON emotiondata (enc_ref)")
+    if not columns["enc_prediction"]["nullable"]:
+        statements.append("ALTER TABLE emotiondata MODIFY enc_prediction LONGTEXT NULL")
+    if not statements:
+        return
+    with engine.begin() as connection:
+        for statement in statements:
+            connection.execute(text(statement))
+    LOGGER.info("🗄️  emotiondata schema updated for the ciphertext store (%d statements)", len(statements))
+
+
+def migrate(session_factory, repo: EmotionDataRepository, batch_size: int = 100) -> int:
+    """Rewrite every legacy row into ``repo``'s store, ``batch_size`` rows per transaction; returns the count."""
+    moved = 0
+    while True:
+        db = session_factory()
+        try:
+            records = repo.get_legacy_predictions(db, batch_size)
+            if not records:
+                break
+            repo.move_to_store(db, records)
+        finally:
+            db.close()
+        moved += len(records)
+        LOGGER.info("Moved %d predictions to the %s store", moved, repo.store.backend)
+    return moved
+
+
+def main() -> None:
+    from app.core.db import SessionLocal, engine
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=100)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s")
+    ensure_schema(engine)
+    migrate(SessionLocal, EmotionDataRepository(), args.batch_size)
+
+
+if __name__ == "__main__":
+    main()
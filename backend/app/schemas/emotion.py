@@ -1,17 +1,28 @@
 """Pydantic schemas for encrypted emotion inference and analysis."""
 from __future__ import annotations
 
-from datetime import date
-from typing import Any, Dict, List, Optional
+from datetime import date, datetime
+from typing import Any, Dict, List, Literal, Optional
 
 from pydantic import BaseModel, Field
 
+from app.fhe_core.tenseal_context import DEFAULT_PROFILE
+
+InputLayout = Literal["im2col", "replicated"]
+
 
 class EncryptedImageRequest(BaseModel):
     ciphertext: str = Field(..., description="Serialized encrypted image payload")
     key_id: str = Field(..., description="Logical identifier of the client key")
     metadata: Optional[Dict[str, Any]] = Field(default=None, description="Optional client-side metadata")
     date: Optional[date] = Field(default=None, description="Optional target date (YYYY-MM-DD)")
+    layout: InputLayout = Field(default="im2col", description="Slot layout of the encrypted image")
+    batch_size: int = Field(
+        default=1,
+        ge=1,
+        description="Batch layout the image is encoded in, at position 0; above 1 lets the server "
+        "micro-batch it with concurrent requests for the same key_id",
+    )
 
 
 class EncryptedPredictionResponse(BaseModel):
@@ -19,18 +30,127 @@ class EncryptedPredictionResponse(BaseModel):
     date: date
 
 
+class EncryptedImageJobRequest(EncryptedImageRequest):
+    priority: int = Field(default=5, ge=0, le=9, description="Queue priority, lower runs first")
+
+
+class AnalysisJobStatus(BaseModel):
+    job_id: str
+    status: Literal["queued", "running", "succeeded", "failed"]
+    priority: int
+    submitted_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    queue_position: Optional[int] = Field(default=None, description="Jobs ahead of this one while queued")
+    result: Optional[EncryptedPredictionResponse] = None
+    error: Optional[str] = None
+
+
+class EncryptedBatchImageRequest(BaseModel):
+    ciphertext: str = Field(..., description="Several images packed in one batched im2col ciphertext")
+    key_id: str = Field(..., description="Logical identifier of the client key")
+    dates: List[date] = Field(..., description="Target date of each packed image, in slot order")
+    layout: InputLayout = Field(default="im2col", description="Slot layout of the packed images")
+
+
+class EncryptedBatchPredictionResponse(BaseModel):
+    entries: List[EncryptedPredictionResponse] = Field(..., description="One logits ciphertext per packed image")
+
+
 class NDayAnalysisRequest(BaseModel):
     days: Optional[int] = None
 
 
 class EncryptedNDayAnalysisResponse(BaseModel):
-    ciphertext: str
+    days: int = Field(..., description="Stored days the features cover")
+    frequency: str = Field(..., description="Per-class sum of the daily logits")
+    transition_energy: str = Field(..., description="Per-class sum of squared day-to-day logit changes")
+    persistence: str = Field(..., description="Per-class sum of products of consecutive days' logits")
 
 
 # HE key registration and history (raw encrypted) --------------------------------
 class HEKeyRegisterRequest(BaseModel):
     key_id: str
     eval_context_b64: str
+    layout: InputLayout = Field(default="im2col", description="Input layout the rotation keys must cover")
+    batch_sizes: List[int] = Field(default_factory=lambda: [1], description="Batch sizes the rotation keys must cover")
+    profile: str = Field(default=DEFAULT_PROFILE, description="CKKS parameter profile the context was created with")
+
+
+class HEKeyLinkRequest(BaseModel):
+    key_id: str
+    sha256: str = Field(..., description="SHA-256 of a context the server already stores (GET /he/contexts/{sha256})")
+    layout: InputLayout = Field(default="im2col", description="Input layout the rotation keys must cover")
+    batch_sizes: List[int] = Field(default_factory=lambda: [1], description="Batch sizes the rotation keys must cover")
+    profile: str = Field(default=DEFAULT_PROFILE, description="CKKS parameter profile the context was created with")
+
+
+class ContextPresence(BaseModel):
+    sha256: str
+    present: bool
+
+
+class ContextUploadInit(BaseModel):
+    key_id: str
+    total_size: int = Field(..., gt=0, description="Size of the serialized eval context in bytes")
+    sha256: Optional[str] = Field(default=None, description="Hex SHA-256 of the whole context, checked on finalize")
+    layout: InputLayout = Field(default="im2col", description="Input layout the rotation keys must cover")
+    batch_sizes: List[int] = Field(default_factory=lambda: [1], description="Batch sizes the rotation keys must cover")
+    profile: str = Field(default=DEFAULT_PROFILE, description="CKKS parameter profile the context was created with")
+
+
+class ContextUploadStatus(BaseModel):
+    upload_id: str
+    key_id: str
+    status: Literal["uploading", "processing", "registered", "failed"]
+    total_size: int
+    received: int = Field(..., description="Bytes stored so far; the next chunk starts here")
+    max_chunk_size: int = Field(..., description="Largest chunk the server accepts in bytes")
+    error: Optional[str] = None
+
+
+class ParameterProfileOut(BaseModel):
+    name: str
+    poly_modulus_degree: int
+    coeff_mod_bit_sizes: List[int]
+    global_scale: float
+    slot_count: int
+    depth: int = Field(..., description="Rescales available to the forward pass and statistics")
+    security_bits: int
+    max_logit_error: float = Field(..., description="Largest encrypted-vs-plaintext logit deviation measured")
+    fer2013_accuracy: Optional[float] = Field(default=None, description="Encrypted model accuracy on FER2013, if measured")
+    description: str
+
+
+class RotationStepsResponse(BaseModel):
+    profile: str
+    poly_modulus_degree: int
+    layout: InputLayout
+    batch_sizes: List[int]
+    steps: List[int] = Field(..., description="Rotation steps (left if positive) the forward pass uses")
+    galois_elements: List[int] = Field(..., description="SEAL Galois elements for ``steps``")
+
+
+class ContextCacheStats(BaseModel):
+    policy: str
+    budget_bytes: int
+    used_bytes: int = Field(..., description="In-memory size of the keys of the contexts currently loaded")
+    entries: int
+    pinned: int = Field(..., description="Contexts in use by in-flight requests")
+    hits: int
+    misses: int
+    evictions: int
+    workers: int = Field(1, description="HE worker processes the counters are summed over")
+
+
+class MicroBatchStats(BaseModel):
+    max_batch_size: int
+    max_wait_ms: float
+    requests: int
+    batches: int
+    mean_batch_size: float
+    mean_wait_ms: float = Field(..., description="Average time a batch waited for more requests")
+    batch_sizes: Dict[str, int] = Field(..., description="Batches run per achieved batch size")
 
 
 class EncryptedDailyPrediction(BaseModel):
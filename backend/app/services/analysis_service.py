@@ -1,11 +1,13 @@
-"""Service skeleton for N-day encrypted analysis."""
+"""Service for N-day encrypted pattern analysis."""
 from __future__ import annotations
 
-from datetime import date
+from typing import Dict, Optional, Union
+
 from sqlalchemy.orm import Session
 
 from app.repositories.emotion_data_repository import EmotionDataRepository
 from app.services.he_service import HEEmotionEngine
+from app.services.history_window import run_on_recent_days
 
 
 class AnalysisService:
@@ -13,11 +15,26 @@ class AnalysisService:
         self.repo = repo
         self.he_engine = he_engine
 
-    def analyze_recent_days(self, db: Session, user_id: str, days: int) -> str:
-        records = self.repo.get_recent_enc_predictions(db, user_id, days)
-        enc_summaries = [record.enc_prediction for record in records]
-        if enc_summaries:
-            # TODO: implement real HE aggregation (frequency, run-length, transitions)
-            return enc_summaries[0]
-        # No data yet; return a stub summary ciphertext for the client to decrypt
-        return self.he_engine.postprocess_prediction_to_summary("", date.today())
+    def analyze_recent_days(
+        self, db: Session, user_id: str, days: int, key_id: Optional[str] = None, raw: bool = False
+    ) -> Optional[Dict[str, Union[int, str, bytes]]]:
+        """Encrypted pattern features of the last ``days`` days (``None`` without any stored day).
+
+        See ``HEEmotionEngine.run_pattern_analysis``; ``days`` in the result is
+        the number of stored days the features cover. Without ``key_id`` the
+        key recorded with the user's latest running aggregate is used
+        (``ValueError`` if there is none).
+        """
+        if key_id is None:
+            key_id = self.repo.get_latest_key_id(db, user_id)
+        if key_id is None:
+            if not self.repo.get_recent_dates(db, user_id, days):
+                return None
+            raise ValueError("key_id is required: no stored prediction records the key it was made with")
+        ran = run_on_recent_days(
+            self.repo, self.he_engine, db, user_id, days, key_id, self.he_engine.run_pattern_analysis, raw
+        )
+        if ran is None:
+            return None
+        features, count = ran
+        return dict(features, days=count)
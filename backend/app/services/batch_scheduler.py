@@ -0,0 +1,121 @@
+"""Micro-batching of concurrent single-image requests that share a key_id.
+
+A request whose image is encoded at position 0 of a batch layout (see
+``EncodedCNN.merge_inputs``) can share a forward pass with other requests for
+the same key_id, layout and batch size. The first such request opens a group
+and waits up to ``max_wait_ms`` for company. It closes the group early once
+the group is full (``min(batch_size, max_batch_size)``), then runs every
+payload of the group through ``run_encrypted_merged_inference`` and hands
+each caller its own logits ciphertext. Callers block in their own
+thread, so no extra threads are involved.
+
+``stats`` reports how many requests were served and the batch sizes achieved.
+"""
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Tuple, Union
+
+LOGGER = logging.getLogger(__name__)
+
+
+@dataclass(eq=False)
+class _Group:
+    key: Tuple[str, str, int]
+    capacity: int
+    payloads: List[Union[str, bytes]] = field(default_factory=list)
+    futures: List[Future] = field(default_factory=list)
+    full: threading.Event = field(default_factory=threading.Event)
+    opened: float = field(default_factory=time.perf_counter)
+
+
+class MicroBatchScheduler:
+    """Coalesces single-image requests of one key_id into merged forward passes."""
+
+    def __init__(self, engine, max_batch_size: int = 4, max_wait_ms: float = 10.0) -> None:
+        self.engine = engine
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self._open: Dict[Tuple[str, str, int], _Group] = {}
+        self._lock = threading.Lock()
+        self._batch_sizes: Counter = Counter()
+        self._wait_ms = 0.0
+
+    def run_encrypted_inference(
+        self, enc_image_payload: Union[str, bytes], key_id: str, batch_size: int, layout: str = "im2col"
+    ) -> Union[str, bytes]:
+        """Logits ciphertext of one image encoded at position 0 of a ``batch_size`` batch (same form as the payload)."""
+        key = (key_id, layout, batch_size)
+        capacity = min(batch_size, self.max_batch_size)
+        future: Future = Future()
+        with self._lock:
+            group = self._open.get(key)
+            leader = group is None or capacity <= 1 or self.max_wait_ms <= 0
+            if leader:
+                group = _Group(key, capacity)
+                if capacity > 1 and self.max_wait_ms > 0:
+                    self._open[key] = group
+            group.payloads.append(enc_image_payload)
+            group.futures.append(future)
+            if len(group.payloads) >= group.capacity:
+                self._close(group)
+        if leader:
+            group.full.wait(self.max_wait_ms / 1000)
+            with self._lock:
+                self._close(group)
+            self._execute(group)
+        return future.result()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            batches = sum(self._batch_sizes.values())
+            requests = sum(size * count for size, count in self._batch_sizes.items())
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait_ms,
+                "requests": requests,
+                "batches": batches,
+                "mean_batch_size": requests / batches if batches else 0.0,
+                "mean_wait_ms": self._wait_ms / batches if batches else 0.0,
+                "batch_sizes": {str(size): count for size, count in sorted(self._batch_sizes.items())},
+            }
+
+    def _close(self, group: _Group) -> None:
+        # Caller holds the lock
+        if self._open.get(group.key) is group:
+            del self._open[group.key]
+        group.full.set()
+
+    def _execute(self, group: _Group) -> None:
+        key_id, layout, batch_size = group.key
+        with self._lock:
+            self._batch_sizes[len(group.payloads)] += 1
+            self._wait_ms += (time.perf_counter() - group.opened) * 1000
+        try:
+            results = self.engine.run_encrypted_merged_inference(group.payloads, key_id, batch_size, layout)
+        except ValueError as exc:
+            if len(group.payloads) == 1:
+                group.futures[0].set_exception(exc)
+                return
+            # One bad payload must not fail the others: retry each on its own
+            LOGGER.warning("Merged batch of %d for key_id=%s rejected; running requests one by one", len(group.payloads), key_id)
+            for payload, future in zip(group.payloads, group.futures):
+                try:
+                    future.set_result(self.engine.run_encrypted_merged_inference([payload], key_id, batch_size, layout)[0])
+                except Exception as exc:  # noqa: BLE001
+                    future.set_exception(exc)
+            return
+        except Exception as exc:  # noqa: BLE001
+            for future in group.futures:
+                future.set_exception(exc)
+            return
+        for future, result in zip(group.futures, results):
+            future.set_result(result)
+
+
+__all__ = ["MicroBatchScheduler"]
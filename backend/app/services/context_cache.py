@@ -0,0 +1,174 @@
+"""Memory-budgeted cache of deserialized TenSEAL eval contexts.
+
+Each loaded context is charged by the memory of its key polynomials
+(``tenseal_context.context_memory_bytes``), which is what a deserialized
+context holds. The serialized size would undercount it: SEAL compresses the
+keys on save. When the total exceeds the byte budget, unpinned
+entries are evicted in LRU or LFU order. Requests pin the entry they work on,
+so an in-flight context is never dropped; a miss loads it back from disk
+through the engine's loader.
+
+Entries are keyed by the SHA-256 of the serialized context, so key_ids that
+registered identical contexts share one loaded instance.
+
+An entry also carries everything the engine derives from its context (SEAL
+evaluator, pre-encoded plans, verified rotation keys), so all of it is
+released together.
+"""
+from __future__ import annotations
+
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterator, Set
+
+LOGGER = logging.getLogger(__name__)
+
+POLICIES = ("lru", "lfu")
+
+
+@dataclass(eq=False)
+class ContextEntry:
+    """A loaded eval context and the state derived from it."""
+
+    digest: str
+    context: Any
+    size: int  # bytes held in memory (context_memory_bytes)
+    profile: Any
+    evaluator: Any = None
+    # (batch_size, layout) -> EncodedCNN
+    encoded: Dict[tuple, Any] = field(default_factory=dict)
+    # (layout, batch_size) pairs whose rotation keys were checked
+    verified_rotations: Set[tuple] = field(default_factory=set)
+    # (layout, batch_size) -> whether its micro-batching rotation keys are present
+    merge_keys: Dict[tuple, bool] = field(default_factory=dict)
+    # PackedHistory once built, False if the profile or keys cannot pack the history
+    packed_history: Any = None
+    hits: int = 0
+    pins: int = 0
+
+
+class ContextCache:
+    """Byte-budgeted LRU/LFU cache of ``ContextEntry`` with pinning."""
+
+    def __init__(self, budget_bytes: int, loader: Callable[[str], ContextEntry], policy: str = "lru") -> None:
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown eviction policy {policy!r}; expected one of {POLICIES}")
+        self.budget_bytes = budget_bytes
+        self.policy = policy
+        self._loader = loader
+        self._entries: "OrderedDict[str, ContextEntry]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # One load at a time per context; other contexts keep being served meanwhile
+        self._loading: Dict[str, threading.Lock] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, digest: str) -> bool:
+        return digest in self._entries
+
+    @contextmanager
+    def pinned(self, digest: str) -> Iterator[ContextEntry]:
+        """The entry for ``digest`` (loaded on a miss), protected from eviction while in use."""
+        entry = self._acquire(digest)
+        try:
+            yield entry
+        finally:
+            with self._lock:
+                entry.pins -= 1
+                self._shrink()
+
+    def put(self, entry: ContextEntry) -> None:
+        """Insert or replace ``entry`` (requests still holding the old one finish with it)."""
+        with self._lock:
+            self._remove(entry.digest)
+            self._insert(entry)
+            self._shrink()
+
+    def discard(self, digest: str) -> None:
+        with self._lock:
+            self._remove(digest)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "policy": self.policy,
+                "budget_bytes": self.budget_bytes,
+                "used_bytes": self._bytes,
+                "entries": len(self._entries),
+                "pinned": sum(1 for entry in self._entries.values() if entry.pins),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def _acquire(self, digest: str) -> ContextEntry:
+        with self._lock:
+            entry = self._hit(digest)
+            if entry is not None:
+                return entry
+            key_lock = self._loading.setdefault(digest, threading.Lock())
+        with key_lock:
+            with self._lock:
+                # Another request may have loaded it while we waited
+                entry = self._hit(digest)
+                if entry is not None:
+                    return entry
+                self.misses += 1
+            try:
+                entry = self._loader(digest)
+            finally:
+                with self._lock:
+                    self._loading.pop(digest, None)
+            with self._lock:
+                entry.hits += 1
+                entry.pins += 1
+                self._remove(digest)
+                self._insert(entry)
+                self._shrink()
+            return entry
+
+    def _hit(self, digest: str) -> ContextEntry | None:
+        entry = self._entries.get(digest)
+        if entry is None:
+            return None
+        self.hits += 1
+        entry.hits += 1
+        entry.pins += 1
+        self._entries.move_to_end(digest)
+        return entry
+
+    def _insert(self, entry: ContextEntry) -> None:
+        self._entries[entry.digest] = entry
+        self._bytes += entry.size
+
+    def _remove(self, digest: str) -> ContextEntry | None:
+        entry = self._entries.pop(digest, None)
+        if entry is not None:
+            self._bytes -= entry.size
+        return entry
+
+    def _shrink(self) -> None:
+        while self._bytes > self.budget_bytes:
+            # Oldest first, so LFU ties fall back to LRU
+            candidates = [entry for entry in self._entries.values() if not entry.pins]
+            if not candidates:
+                break
+            victim = candidates[0] if self.policy == "lru" else min(candidates, key=lambda entry: entry.hits)
+            self._remove(victim.digest)
+            self.evictions += 1
+            LOGGER.info(
+                "♻️  Evicted eval context %s (%.1f MB, %s, %.1f/%.1f MB used)",
+                victim.digest[:12],
+                victim.size / 2**20,
+                self.policy,
+                self._bytes / 2**20,
+                self.budget_bytes / 2**20,
+            )
+
+
+__all__ = ["POLICIES", "ContextCache", "ContextEntry"]
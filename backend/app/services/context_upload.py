@@ -0,0 +1,242 @@
+"""Resumable, chunked upload of eval contexts.
+
+An eval context can be hundreds of MB, so it is not sent in one request.
+``create`` opens an upload and a temp file ``he_contexts/.upload-{id}.part``.
+Each ``write_chunk`` must start at the current ``received`` offset. After an
+interrupted upload the client reads the offset back and resumes from there.
+Chunks are written straight to the temp file and fed to a running SHA-256,
+so the whole context is never held in memory.
+
+``finalize`` checks the size and the digest declared at creation. It then
+registers the context on a background thread
+(``register_eval_context_file``), which validates the file and atomically
+renames it into the content-addressed store. Clients poll the upload until
+it is ``registered`` or ``failed``.
+
+Uploads live in memory. An upload left idle for ``ttl_seconds`` is dropped
+with its temp file. Temp files that old are also removed at startup.
+"""
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from app.fhe_core.tenseal_context import DEFAULT_PROFILE
+from app.services.he_service import validate_key_id
+
+LOGGER = logging.getLogger(__name__)
+
+UPLOADING, PROCESSING, REGISTERED, FAILED = "uploading", "processing", "registered", "failed"
+
+_SHA256 = re.compile(r"[0-9a-f]{64}")
+
+
+class OffsetMismatch(Exception):
+    """A chunk did not start where the upload currently ends (``offset``)."""
+
+    def __init__(self, offset: int) -> None:
+        super().__init__(f"Upload continues at offset {offset}")
+        self.offset = offset
+
+
+@dataclass(eq=False)
+class ContextUpload:
+    upload_id: str
+    user_id: str
+    key_id: str
+    total_size: int
+    sha256: Optional[str]
+    layout: str
+    batch_sizes: List[int]
+    profile: str
+    path: Path
+    received: int = 0
+    status: str = UPLOADING
+    error: Optional[str] = None
+    updated_at: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
+    hasher: Any = field(default_factory=hashlib.sha256, repr=False)
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (REGISTERED, FAILED)
+
+
+class ContextUploadManager:
+    """Chunked eval context uploads into ``directory``, registered through ``engine``."""
+
+    def __init__(
+        self,
+        engine,
+        directory: Path,
+        max_bytes: int,
+        max_chunk_bytes: int,
+        ttl_seconds: float = 86400.0,
+    ) -> None:
+        self.engine = engine
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.max_chunk_bytes = max_chunk_bytes
+        self.ttl_seconds = ttl_seconds
+        self._uploads: Dict[str, ContextUpload] = {}
+        self._lock = threading.Lock()
+        # One registration at a time: each one deserializes a whole context
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="context-register")
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # Partial uploads of a previous run cannot resume (the running hash is gone); drop expired ones
+        cutoff = time.time() - ttl_seconds
+        for stale in self.directory.glob(".upload-*.part"):
+            if stale.stat().st_mtime < cutoff:
+                stale.unlink(missing_ok=True)
+
+    def create(
+        self,
+        user_id: str,
+        key_id: str,
+        total_size: int,
+        sha256: Optional[str] = None,
+        layout: str = "im2col",
+        batch_sizes: Optional[List[int]] = None,
+        profile: str = DEFAULT_PROFILE,
+    ) -> ContextUpload:
+        """Open an upload of ``total_size`` bytes; ``ValueError`` for an unusable key_id, size or digest."""
+        self._prune()
+        validate_key_id(key_id)
+        if not 0 < total_size <= self.max_bytes:
+            raise ValueError(f"total_size must be between 1 and {self.max_bytes} bytes")
+        if sha256 is not None:
+            sha256 = sha256.lower()
+            if not _SHA256.fullmatch(sha256):
+                raise ValueError("sha256 must be 64 hex digits")
+        upload_id = uuid.uuid4().hex
+        path = self.directory / f".upload-{upload_id}.part"
+        path.touch()
+        upload = ContextUpload(
+            upload_id=upload_id,
+            user_id=user_id,
+            key_id=key_id,
+            total_size=total_size,
+            sha256=sha256,
+            layout=layout,
+            batch_sizes=list(batch_sizes or [1]),
+            profile=profile,
+            path=path,
+        )
+        with self._lock:
+            self._uploads[upload_id] = upload
+        LOGGER.info("📦 Upload %s opened for key_id=%s (%.1f MB)", upload_id, key_id, total_size / 2**20)
+        return upload
+
+    def get(self, upload_id: str, user_id: str) -> Optional[ContextUpload]:
+        """The upload, if it exists and belongs to ``user_id``."""
+        upload = self._uploads.get(upload_id)
+        if upload is None or upload.user_id != user_id:
+            return None
+        return upload
+
+    def write_chunk(self, upload: ContextUpload, offset: int, data: bytes, sha256: Optional[str] = None) -> ContextUpload:
+        """Append ``data`` at ``offset``; ``OffsetMismatch`` unless it is the current end."""
+        with upload.lock:
+            if upload.status != UPLOADING:
+                raise ValueError(f"Upload {upload.upload_id} is {upload.status}")
+            if offset != upload.received:
+                raise OffsetMismatch(upload.received)
+            if not data or len(data) > self.max_chunk_bytes:
+                raise ValueError(f"Chunks must hold 1 to {self.max_chunk_bytes} bytes")
+            if offset + len(data) > upload.total_size:
+                raise ValueError(f"Chunk ends past total_size ({upload.total_size} bytes)")
+            if sha256 is not None and hashlib.sha256(data).hexdigest() != sha256.lower():
+                raise ValueError("Chunk checksum mismatch")
+            with open(upload.path, "r+b") as handle:
+                # Truncate the tail of a previously failed write
+                handle.seek(offset)
+                handle.write(data)
+                handle.truncate()
+            upload.hasher.update(data)
+            upload.received += len(data)
+            upload.updated_at = datetime.now(timezone.utc)
+        return upload
+
+    def finalize(self, upload: ContextUpload) -> ContextUpload:
+        """Verify the upload and register it in the background (repeat calls are no-ops)."""
+        with upload.lock:
+            if upload.status in (PROCESSING, REGISTERED):
+                return upload
+            if upload.status != UPLOADING:
+                raise ValueError(f"Upload {upload.upload_id} is {upload.status}")
+            if upload.received != upload.total_size:
+                raise ValueError(f"Upload is incomplete: {upload.received} of {upload.total_size} bytes")
+            if upload.sha256 is not None and upload.hasher.hexdigest() != upload.sha256:
+                self._fail(upload, "SHA-256 of the uploaded context does not match")
+                raise ValueError(upload.error)
+            with open(upload.path, "rb") as handle:
+                os.fsync(handle.fileno())
+            upload.status, upload.updated_at = PROCESSING, datetime.now(timezone.utc)
+        self._executor.submit(self._register, upload)
+        return upload
+
+    def abort(self, upload: ContextUpload) -> None:
+        with upload.lock:
+            if upload.status == UPLOADING:
+                self._fail(upload, "Upload aborted")
+        with self._lock:
+            self._uploads.pop(upload.upload_id, None)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _register(self, upload: ContextUpload) -> None:
+        try:
+            self.engine.register_eval_context_file(
+                upload.key_id,
+                str(upload.path),
+                layout=upload.layout,
+                batch_sizes=upload.batch_sizes,
+                profile=upload.profile,
+                digest=upload.hasher.hexdigest(),
+            )
+            status, error = REGISTERED, None
+        except ValueError as exc:
+            status, error = FAILED, str(exc)
+        except Exception as exc:  # noqa: BLE001
+            LOGGER.error("❌ Registering upload %s failed: %s", upload.upload_id, exc, exc_info=True)
+            status, error = FAILED, "Eval context registration failed"
+        finally:
+            # Renamed away on success; removes whatever a failed registration left behind
+            upload.path.unlink(missing_ok=True)
+        upload.error, upload.updated_at = error, datetime.now(timezone.utc)
+        upload.status = status
+        LOGGER.info("🏁 Upload %s for key_id=%s %s", upload.upload_id, upload.key_id, status)
+
+    def _fail(self, upload: ContextUpload, error: str) -> None:
+        # Caller holds upload.lock
+        upload.path.unlink(missing_ok=True)
+        upload.error, upload.updated_at = error, datetime.now(timezone.utc)
+        upload.status = FAILED
+
+    def _prune(self) -> None:
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            expired = [
+                upload
+                for upload in self._uploads.values()
+                if upload.status != PROCESSING and (now - upload.updated_at).total_seconds() > self.ttl_seconds
+            ]
+            for upload in expired:
+                del self._uploads[upload.upload_id]
+        for upload in expired:
+            if upload.status == UPLOADING:
+                upload.path.unlink(missing_ok=True)
+
+
+__all__ = ["ContextUpload", "ContextUploadManager", "OffsetMismatch"]
@@ -1,22 +1,47 @@
 """Domain service orchestrating encrypted single-day emotion analysis."""
 from __future__ import annotations
 
+import base64
+import json
 import logging
+import threading
 from datetime import date
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
 
 from sqlalchemy.orm import Session
 
+from app.fhe_core.packed_history import ring_position
+from app.models.emotion_aggregate import EmotionAggregate
+from app.models.emotion_history import EmotionHistory
 from app.repositories.emotion_data_repository import EmotionDataRepository
-from app.schemas.emotion import EncryptedPredictionResponse
+from app.schemas.emotion import EncryptedBatchPredictionResponse, EncryptedPredictionResponse
+from app.services.batch_scheduler import MicroBatchScheduler
 from app.services.he_service import HEEmotionEngine
+from app.services.history_window import run_on_recent_days
 
 LOGGER = logging.getLogger(__name__)
 
 
+def _stored(enc_prediction: Union[str, bytes]) -> bytes:
+    """Predictions are stored as raw bytes, however they arrived."""
+    if isinstance(enc_prediction, bytes):
+        return enc_prediction
+    return base64.b64decode(enc_prediction)
+
+
 class EmotionService:
-    def __init__(self, repo: EmotionDataRepository, he_engine: HEEmotionEngine) -> None:
+    def __init__(
+        self,
+        repo: EmotionDataRepository,
+        he_engine: HEEmotionEngine,
+        batch_scheduler: Optional[MicroBatchScheduler] = None,
+    ) -> None:
         self.repo = repo
         self.he_engine = he_engine
+        self.batch_scheduler = batch_scheduler or MicroBatchScheduler(he_engine, max_wait_ms=0)
+        # Storing predictions and rebuilding a user's running aggregates is serialized per user
+        self._user_locks: Dict[str, threading.Lock] = {}
+        self._user_locks_guard = threading.Lock()
 
     def analyze_and_store(
         self,
@@ -25,24 +50,340 @@ class EmotionService:
         target_date: date,
         enc_image_payload: str,
         key_id: str,
+        layout: str = "im2col",
+        batch_size: int = 1,
     ) -> EncryptedPredictionResponse:
+        enc_prediction = self._analyze_and_store(db, user_id, target_date, enc_image_payload, key_id, layout, batch_size)
+        return EncryptedPredictionResponse(ciphertext=enc_prediction, date=target_date)
+
+    def analyze_and_store_raw(
+        self,
+        db: Session,
+        user_id: str,
+        target_date: date,
+        enc_image: bytes,
+        key_id: str,
+        layout: str = "im2col",
+        batch_size: int = 1,
+    ) -> bytes:
+        """``analyze_and_store`` for the binary routes: raw ciphertext in, raw logits ciphertext out."""
+        return self._analyze_and_store(db, user_id, target_date, enc_image, key_id, layout, batch_size)
+
+    def _analyze_and_store(
+        self,
+        db: Session,
+        user_id: str,
+        target_date: date,
+        enc_image_payload: Union[str, bytes],
+        key_id: str,
+        layout: str,
+        batch_size: int,
+    ) -> Union[str, bytes]:
         try:
             LOGGER.info("📥 Starting analysis for user=%s, date=%s, key_id=%s", user_id, target_date, key_id)
-            enc_prediction = self.he_engine.run_encrypted_inference(enc_image_payload, key_id)
+            if batch_size > 1:
+                # Encoded at position 0 of a batch: may share a forward pass with concurrent requests
+                enc_prediction = self.batch_scheduler.run_encrypted_inference(enc_image_payload, key_id, batch_size, layout)
+            else:
+                enc_prediction = self.he_engine.run_encrypted_inference(enc_image_payload, key_id, layout=layout)
             LOGGER.info("✅ Inference complete, storing to DB")
-            self.repo.upsert_enc_prediction(db, user_id, target_date, enc_prediction)
-            return EncryptedPredictionResponse(ciphertext=enc_prediction, date=target_date)
+            self._store_predictions(db, user_id, key_id, {target_date: _stored(enc_prediction)})
+            return enc_prediction
         except Exception as e:
             LOGGER.error("❌ Error in analyze_and_store: %s", str(e), exc_info=True)
             raise
 
-    def get_raw_history(self, db: Session, user_id: str, days: int):
-        return self.repo.get_recent_enc_predictions(db, user_id, days)
+    def analyze_batch_and_store(
+        self,
+        db: Session,
+        user_id: str,
+        target_dates: List[date],
+        enc_images_payload: str,
+        key_id: str,
+        layout: str = "im2col",
+    ) -> EncryptedBatchPredictionResponse:
+        enc_predictions = self._analyze_batch_and_store(db, user_id, target_dates, enc_images_payload, key_id, layout)
+        entries = [
+            EncryptedPredictionResponse(ciphertext=enc_prediction, date=target_date)
+            for target_date, enc_prediction in zip(target_dates, enc_predictions)
+        ]
+        return EncryptedBatchPredictionResponse(entries=entries)
+
+    def analyze_batch_and_store_raw(
+        self,
+        db: Session,
+        user_id: str,
+        target_dates: List[date],
+        enc_images: bytes,
+        key_id: str,
+        layout: str = "im2col",
+    ) -> List[bytes]:
+        """``analyze_batch_and_store`` for the binary routes: one raw logits ciphertext per date."""
+        return self._analyze_batch_and_store(db, user_id, target_dates, enc_images, key_id, layout)
+
+    def _analyze_batch_and_store(
+        self,
+        db: Session,
+        user_id: str,
+        target_dates: List[date],
+        enc_images_payload: Union[str, bytes],
+        key_id: str,
+        layout: str,
+    ) -> List[Union[str, bytes]]:
+        try:
+            LOGGER.info("📥 Starting batched analysis for user=%s, %d dates, key_id=%s", user_id, len(target_dates), key_id)
+            enc_predictions = self.he_engine.run_encrypted_batch_inference(
+                enc_images_payload, key_id, len(target_dates), layout=layout
+            )
+            LOGGER.info("✅ Batched inference complete, storing to DB")
+            self._store_predictions(
+                db,
+                user_id,
+                key_id,
+                {target_date: _stored(enc_prediction) for target_date, enc_prediction in zip(target_dates, enc_predictions)},
+            )
+            return enc_predictions
+        except Exception as e:
+            LOGGER.error("❌ Error in analyze_batch_and_store: %s", str(e), exc_info=True)
+            raise
+
+    def get_raw_history(self, db: Session, user_id: str, days: int) -> List[Tuple[date, bytes]]:
+        """(date, stored ciphertext) of the last ``days`` days, newest first."""
+        return [(record.date, self.repo.read_ciphertext(record)) for record in self.repo.get_recent_enc_predictions(db, user_id, days)]
+
+    def get_history_dates(self, db: Session, user_id: str, days: int) -> List[date]:
+        """Dates with a stored prediction in the last ``days`` days, newest first."""
+        return self.repo.get_recent_dates(db, user_id, days)
+
+    def iter_raw_history(self, db: Session, user_id: str, dates: Sequence[date]) -> Iterator[Tuple[date, bytes]]:
+        """(date, raw ciphertext) of ``dates`` newest first, reading one ciphertext at a time.
+
+        Dates whose prediction was deleted since they were listed are skipped.
+        """
+        for record in self.repo.iter_enc_predictions_on(db, user_id, dates):
+            yield record.date, self.repo.read_ciphertext(record)
+
+    def get_history_statistics(
+        self, db: Session, user_id: str, days: int, key_id: str, raw: bool = False
+    ) -> Dict[str, Union[str, bytes]]:
+        dates = self.repo.get_recent_dates(db, user_id, days)
+        if not dates:
+            return None
+        stats = self._statistics_from_packed_history(db, user_id, key_id, days, raw)
+        if stats is None:
+            stats = self._statistics_from_aggregates(db, user_id, key_id, dates, raw)
+        if stats is None:
+            ran = run_on_recent_days(
+                self.repo, self.he_engine, db, user_id, days, key_id, self.he_engine.run_encrypted_statistics, raw
+            )
+            stats = ran and ran[0]
+        return stats
+
+    # ------------------------------------------------------------------
+    # Running aggregates
+    # ------------------------------------------------------------------
+    def _store_predictions(self, db: Session, user_id: str, key_id: str, predictions: Dict[date, bytes]) -> None:
+        """Upsert ``predictions`` (date -> stored ciphertext) and bring the running aggregates up to date.
+
+        Aggregates from the earliest written date on are dropped before the
+        predictions change, so a failure anywhere after that leaves missing
+        aggregates (statistics fall back to the full recomputation), never
+        stale ones. The packed history, if ``key_id`` keeps one, records the
+        prediction of each day it holds, so a failed update is detected the
+        same way.
+        """
+        from_date = min(predictions)
+        with self._user_lock(user_id):
+            aggregate_keys = self.repo.get_aggregate_keys_from(db, user_id, from_date)
+            self.repo.delete_aggregates_from(db, user_id, from_date)
+            level = self.he_engine.prediction_level(key_id)
+            try:
+                # Before the overwrite: the replaced predictions come out of the packed history
+                packing = self._packed_history_removals(db, user_id, key_id, predictions)
+            except Exception as exc:  # noqa: BLE001
+                LOGGER.warning("Packed history of user=%s not updated: %s", user_id, exc)
+                packing = None
+            hashes = {}
+            for target_date, enc_prediction in sorted(predictions.items()):
+                record = self.repo.upsert_enc_prediction(db, user_id, target_date, enc_prediction, level)
+                hashes[target_date] = record.enc_ref
+            # Replaced days would miss anyway (their content hash changed); free them now
+            self.he_engine.forget_days(user_id, list(predictions))
+            try:
+                self._rebuild_aggregates(db, user_id, key_id, from_date, predictions, aggregate_keys)
+            except Exception as exc:  # noqa: BLE001
+                LOGGER.warning("Running aggregates of user=%s not updated from %s: %s", user_id, from_date, exc)
+            if packing is not None:
+                try:
+                    self._update_packed_history(db, user_id, key_id, predictions, hashes, *packing)
+                except Exception as exc:  # noqa: BLE001
+                    LOGGER.warning("Packed history of user=%s not updated: %s", user_id, exc)
+
+    def _rebuild_aggregates(
+        self, db: Session, user_id: str, key_id: str, from_date: date, written: Iterable[date], aggregate_keys: Dict[date, str]
+    ) -> None:
+        """Recompute the aggregates of the days just written and of the later days of their chain.
+
+        Writing today's prediction only extends the chain: one day, with the
+        day before as the starting point. Overwriting or backfilling an
+        earlier day also recomputes every later day that had an aggregate
+        under ``key_id``, up to the first one that did not.
+        """
+        written = set(written)
+        run = []
+        for record in self.repo.get_enc_predictions_from(db, user_id, from_date):
+            if record.date not in written and aggregate_keys.get(record.date) != key_id:
+                break
+            run.append(record)
+        if not run:
+            return
+
+        previous, chain_start = None, run[0].date
+        previous_date = self.repo.get_previous_date(db, user_id, from_date)
+        previous_aggregate = previous_date and self.repo.get_aggregate(db, user_id, previous_date)
+        if previous_aggregate and previous_aggregate.key_id == key_id:
+            previous = {
+                "logits": self.repo.read_ciphertext(self.repo.get_enc_prediction(db, user_id, previous_date)),
+                "sum": previous_aggregate.enc_sum,
+                "volatility": previous_aggregate.enc_volatility,
+            }
+            chain_start = previous_aggregate.chain_start
+
+        aggregates = self.he_engine.extend_history_aggregates(
+            key_id, previous, [self.repo.read_ciphertext(record) for record in run]
+        )
+        self.repo.add_aggregates(
+            db,
+            [
+                EmotionAggregate(
+                    user_id=user_id,
+                    date=record.date,
+                    key_id=key_id,
+                    chain_start=chain_start,
+                    enc_sum=aggregate["sum"],
+                    enc_volatility=aggregate["volatility"],
+                )
+                for record, aggregate in zip(run, aggregates)
+            ],
+        )
+        LOGGER.info("📈 Running aggregates of user=%s updated for %d days from %s", user_id, len(run), from_date)
+
+    def _statistics_from_aggregates(
+        self, db: Session, user_id: str, key_id: str, dates: List[date], raw: bool
+    ) -> Optional[Dict[str, Union[str, bytes]]]:
+        """History statistics over ``dates`` (newest first) from at most three aggregates.
 
-    def get_history_statistics(self, db: Session, user_id: str, days: int, key_id: str) -> Dict[str, str]:
-        records = self.repo.get_recent_enc_predictions(db, user_id, days)
-        if not records:
+        ``None`` when the window is not covered by one chain under ``key_id``
+        (days stored before aggregates existed, a key change or a failed
+        update); the caller then recomputes from every prediction.
+        """
+        last = self.repo.get_aggregate(db, user_id, dates[0])
+        first = last if len(dates) == 1 else self.repo.get_aggregate(db, user_id, dates[-1])
+        if last is None or first is None or last.key_id != key_id or first.chain_start != last.chain_start:
+            LOGGER.info("No running aggregates cover the window for user=%s; recomputing from predictions", user_id)
             return None
-        enc_logits_list = [r.enc_prediction for r in records]
-        stats = self.he_engine.run_encrypted_statistics(enc_logits_list, key_id)
-        return stats
\ No newline at end of file
+        base_sum = None
+        if first.date != first.chain_start:
+            # The chain starts before the window: subtract the day before it
+            before = self.repo.get_aggregate(db, user_id, self.repo.get_previous_date(db, user_id, first.date))
+            if before is None or before.chain_start != last.chain_start:
+                return None
+            base_sum = before.enc_sum
+        if first is last:
+            # One day has no volatility (and a ciphertext minus itself is transparent)
+            return self.he_engine.run_aggregate_statistics(key_id, {"sum": last.enc_sum, "volatility": None}, base_sum, raw=raw)
+        return self.he_engine.run_aggregate_statistics(
+            key_id,
+            {"sum": last.enc_sum, "volatility": last.enc_volatility},
+            base_sum=base_sum,
+            base_volatility=first.enc_volatility,
+            raw=raw,
+        )
+
+    # ------------------------------------------------------------------
+    # Packed history
+    # ------------------------------------------------------------------
+    def _packed_history_removals(
+        self, db: Session, user_id: str, key_id: str, written: Iterable[date]
+    ) -> Optional[Tuple[int, Optional[EmotionHistory], Dict[date, str], Dict[int, List[bytes]]]]:
+        """What writing ``written`` takes out of the packed history of ``key_id``, read before the overwrite.
+
+        Returns the history's length in days, its row (``None`` for a new
+        one), the packed date -> prediction hash map and position -> the
+        predictions those blocks held; ``None`` if ``key_id`` packs no
+        history. A held day whose prediction changed since it was packed
+        cannot be taken out, so the history then starts over.
+        """
+        days = self.he_engine.history_days(key_id)
+        if not days:
+            return None
+        record = self.repo.get_packed_history(db, user_id, key_id)
+        if record is None:
+            return days, None, {}, {}
+        packed = {date.fromisoformat(day): day_hash for day, day_hash in json.loads(record.days).items()}
+        positions = {ring_position(day, days) for day in written}
+        held = [day for day in packed if ring_position(day, days) in positions]
+        stored = self.repo.get_enc_predictions_on(db, user_id, held)
+        if any(day not in stored or stored[day][1] != packed[day] for day in held):
+            LOGGER.info("Packed history of user=%s no longer matches its predictions; starting over", user_id)
+            self.repo.delete_packed_history(db, user_id, key_id)
+            return days, None, {}, {}
+        removals: Dict[int, List[bytes]] = {}
+        for day in held:
+            removals.setdefault(ring_position(day, days), []).append(stored[day][0])
+        return days, record, packed, removals
+
+    def _update_packed_history(
+        self,
+        db: Session,
+        user_id: str,
+        key_id: str,
+        predictions: Dict[date, bytes],
+        hashes: Dict[date, str],
+        days: int,
+        record: Optional[EmotionHistory],
+        packed: Dict[date, str],
+        removals: Dict[int, List[bytes]],
+    ) -> None:
+        """Write ``predictions`` (date -> stored ciphertext, ``hashes`` their ``enc_ref``) into the packed history of ``key_id``."""
+        # Of written days sharing a block (a ring's length apart) only the latest stays
+        latest = {ring_position(day, days): day for day in sorted(predictions)}
+        changes = [(day, predictions[day], removals.get(position, [])) for position, day in latest.items()]
+        enc_history = self.he_engine.update_packed_history(key_id, record and record.enc_history, changes)
+        packed = {day: day_hash for day, day_hash in packed.items() if ring_position(day, days) not in latest}
+        packed.update((day, hashes[day]) for day in latest.values())
+        if record is None:
+            record = EmotionHistory(user_id=user_id, key_id=key_id)
+        record.enc_history = enc_history
+        record.days = json.dumps({day.isoformat(): day_hash for day, day_hash in sorted(packed.items())})
+        self.repo.save_packed_history(db, record)
+        LOGGER.info("🗂️ Packed history of user=%s holds %d days", user_id, len(packed))
+
+    def _statistics_from_packed_history(
+        self, db: Session, user_id: str, key_id: str, days: int, raw: bool
+    ) -> Optional[Dict[str, Union[str, bytes]]]:
+        """History statistics of the last ``days`` days from the packed history.
+
+        ``None`` unless ``key_id`` keeps one holding exactly the stored
+        predictions of the window, on consecutive dates (the volatility
+        pairs neighbouring blocks, so a gap would pair a day with zeros).
+        """
+        history_days = self.he_engine.history_days(key_id)
+        if not history_days:
+            return None
+        day_hashes = self.repo.get_recent_prediction_hashes(db, user_id, days)
+        dates = [day for day, _ in day_hashes]
+        if len(dates) > history_days or any((newer - older).days != 1 for newer, older in zip(dates, dates[1:])):
+            return None
+        record = self.repo.get_packed_history(db, user_id, key_id)
+        if record is None:
+            return None
+        packed = json.loads(record.days)
+        if any(packed.get(day.isoformat()) != stored_hash for day, stored_hash in day_hashes):
+            LOGGER.info("Packed history of user=%s does not hold the window; trying running aggregates", user_id)
+            return None
+        return self.he_engine.run_packed_statistics(key_id, record.enc_history, dates[-1], len(dates), raw=raw)
+
+    def _user_lock(self, user_id: str) -> threading.Lock:
+        with self._user_locks_guard:
+            return self._user_locks.setdefault(user_id, threading.Lock())
\ No newline at end of file
@@ -0,0 +1,351 @@
+"""Key-affinity pool of HE worker processes, decoupled from the web workers.
+
+Each worker is a spawned process running its own ``HEEmotionEngine``. Every
+request for a key_id goes to worker ``crc32(key_id) % workers``, so that key's
+eval context is deserialized and cached in exactly one process, and HE work
+runs outside the web process's GIL. The web tier forwards the payloads it
+received (base64 strings, or raw bytes from the binary routes) over the
+worker's pipe as they are and waits for the reply.
+
+Workers are recycled after ``max_requests`` requests. This only happens
+between requests, so nothing in flight is lost. A monitor thread pings idle
+workers every ``health_interval`` seconds and restarts any that died or
+stopped answering. Requests in flight on a worker that dies fail with
+``RuntimeError``.
+
+``HEWorkerPool`` exposes the engine methods the services and routes use, so
+either one can be wired into ``create_app``.
+"""
+from __future__ import annotations
+
+import itertools
+import logging
+import multiprocessing
+import pickle
+import threading
+import time
+import zlib
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from datetime import date
+from typing import Any, Dict, List, Optional, Union
+
+from app.fhe_core.tenseal_context import DEFAULT_PROFILE
+
+LOGGER = logging.getLogger(__name__)
+
+_PING = "__ping__"
+_request_ids = itertools.count(1)
+
+
+def _portable(exc: BaseException) -> BaseException:
+    """``exc`` if it survives pickling, else a ``RuntimeError`` carrying its message."""
+    try:
+        pickle.loads(pickle.dumps(exc))
+        return exc
+    except Exception:  # noqa: BLE001
+        return RuntimeError(f"{type(exc).__name__}: {exc}")
+
+
+def _worker_main(conn, engine_kwargs: Dict[str, Any]) -> None:
+    import os
+
+    try:
+        from app.services.he_service import HEEmotionEngine
+
+        engine = HEEmotionEngine(**engine_kwargs)
+    except Exception as exc:  # noqa: BLE001
+        conn.send((0, False, _portable(exc)))
+        return
+    conn.send((0, True, os.getpid()))
+    while True:
+        try:
+            request_id, method, args, kwargs = conn.recv()
+        except EOFError:
+            break
+        if method is None:
+            break
+        try:
+            result = os.getpid() if method == _PING else getattr(engine, method)(*args, **kwargs)
+            reply = (request_id, True, result)
+        except Exception as exc:  # noqa: BLE001
+            reply = (request_id, False, _portable(exc))
+        conn.send(reply)
+    engine.close()
+
+
+class _Worker:
+    """One HE worker process, its pipe and the requests waiting on it."""
+
+    def __init__(self, index: int, engine_kwargs: Dict[str, Any], mp_context) -> None:
+        self.index = index
+        self.engine_kwargs = engine_kwargs
+        self._mp = mp_context
+        self.lock = threading.Lock()
+        self.pending: Dict[int, Future] = {}
+        self.served = 0
+        self.restarts = 0
+        self.process = None
+        self.conn = None
+
+    def alive(self) -> bool:
+        return self.process is not None and self.process.is_alive()
+
+    def start(self) -> None:
+        parent, child = self._mp.Pipe()
+        process = self._mp.Process(
+            target=_worker_main, args=(child, self.engine_kwargs), name=f"he-worker-{self.index}", daemon=True
+        )
+        process.start()
+        child.close()
+        try:
+            _, ok, payload = parent.recv()
+        except EOFError:
+            payload, ok = RuntimeError(f"HE worker {self.index} exited during startup"), False
+        if not ok:
+            process.join(timeout=5)
+            raise RuntimeError(f"HE worker {self.index} failed to start: {payload}")
+        self.process, self.conn, self.served = process, parent, 0
+        threading.Thread(target=self._receive, args=(parent,), name=f"he-worker-{self.index}-rx", daemon=True).start()
+        LOGGER.info("🧵 HE worker %d started (pid %d)", self.index, payload)
+
+    def stop(self, timeout: float = 10.0) -> None:
+        process, conn = self.process, self.conn
+        if process is None:
+            return
+        try:
+            conn.send((0, None, (), {}))
+        except (OSError, ValueError):
+            pass
+        process.join(timeout=timeout)
+        if process.is_alive():
+            process.terminate()
+            process.join(timeout=timeout)
+        conn.close()
+        self.process = self.conn = None
+
+    def restart(self, reason: str) -> None:
+        """Replace the process (caller holds ``lock``); requests still pending on it fail."""
+        LOGGER.warning("♻️  Restarting HE worker %d (%s)", self.index, reason)
+        failed, self.pending = self.pending, {}
+        for future in failed.values():
+            future.set_exception(RuntimeError(f"HE worker {self.index} was restarted ({reason})"))
+        self.stop()
+        self.restarts += 1
+        self.start()
+
+    def submit(self, method: str, args: tuple, kwargs: dict, max_requests: int = 0) -> Future:
+        with self.lock:
+            if not self.alive():
+                self.restart("not running")
+            elif max_requests and self.served >= max_requests and not self.pending:
+                self.restart(f"recycled after {self.served} requests")
+            request_id = next(_request_ids)
+            future: Future = Future()
+            self.pending[request_id] = future
+            if method != _PING:
+                self.served += 1
+            self.conn.send((request_id, method, args, kwargs))
+        return future
+
+    def _receive(self, conn) -> None:
+        while True:
+            try:
+                request_id, ok, payload = conn.recv()
+            except (EOFError, OSError):
+                break
+            with self.lock:
+                future = self.pending.pop(request_id, None)
+            if future is None:
+                continue
+            if ok:
+                future.set_result(payload)
+            else:
+                future.set_exception(payload)
+        with self.lock:
+            if self.conn is conn:
+                failed, self.pending = self.pending, {}
+                for future in failed.values():
+                    future.set_exception(RuntimeError(f"HE worker {self.index} exited"))
+
+
+class HEWorkerPool:
+    """``HEEmotionEngine`` facade that runs each key_id on its own worker process."""
+
+    def __init__(
+        self,
+        workers: int,
+        threads_per_worker: Optional[int] = None,
+        context_cache_mb_per_worker: Optional[int] = None,
+        vector_cache_mb_per_worker: Optional[int] = None,
+        max_requests: int = 0,
+        health_interval: float = 30.0,
+        request_timeout: Optional[float] = None,
+    ) -> None:
+        if workers < 1:
+            raise ValueError(f"HE worker pool needs at least one worker, got {workers}")
+        self.max_requests = max_requests
+        self.health_interval = health_interval
+        self.request_timeout = request_timeout
+        mp_context = multiprocessing.get_context("spawn")
+        engine_kwargs = {
+            "threads": threads_per_worker,
+            "context_cache_mb": context_cache_mb_per_worker,
+            "vector_cache_mb": vector_cache_mb_per_worker,
+        }
+        self._workers = [_Worker(index, engine_kwargs, mp_context) for index in range(workers)]
+        self._round_robin = itertools.count()
+        self._closed = threading.Event()
+        for worker in self._workers:
+            worker.start()
+        self._monitor = None
+        if health_interval > 0:
+            self._monitor = threading.Thread(target=self._monitor_loop, name="he-worker-monitor", daemon=True)
+            self._monitor.start()
+
+    # ------------------------------------------------------------------
+    # Routing
+    # ------------------------------------------------------------------
+    def _worker_for(self, key_id: str) -> _Worker:
+        # crc32 instead of hash(): stable across processes and restarts
+        return self._workers[zlib.crc32(key_id.encode("utf-8")) % len(self._workers)]
+
+    def _any_worker(self) -> _Worker:
+        return self._workers[next(self._round_robin) % len(self._workers)]
+
+    def _call(self, worker: _Worker, method: str, *args, **kwargs) -> Any:
+        future = worker.submit(method, args, kwargs, self.max_requests)
+        try:
+            return future.result(timeout=self.request_timeout)
+        except FutureTimeoutError as exc:
+            raise RuntimeError(f"HE worker {worker.index} did not answer {method} within {self.request_timeout}s") from exc
+
+    # ------------------------------------------------------------------
+    # Engine API
+    # ------------------------------------------------------------------
+    def register_eval_context(self, key_id: str, eval_context_b64: Union[str, bytes], **kwargs) -> str:
+        return self._call(self._worker_for(key_id), "register_eval_context", key_id, eval_context_b64, **kwargs)
+
+    def register_eval_context_file(self, key_id: str, upload_path: str, **kwargs) -> str:
+        return self._call(self._worker_for(key_id), "register_eval_context_file", key_id, upload_path, **kwargs)
+
+    def register_existing_context(self, key_id: str, digest: str, *args, **kwargs) -> str:
+        return self._call(self._worker_for(key_id), "register_existing_context", key_id, digest, *args, **kwargs)
+
+    def has_context(self, digest: str) -> bool:
+        return self._call(self._any_worker(), "has_context", digest)
+
+    def run_encrypted_inference(self, enc_image_payload: str, key_id: str, *args, **kwargs) -> str:
+        return self._call(self._worker_for(key_id), "run_encrypted_inference", enc_image_payload, key_id, *args, **kwargs)
+
+    def run_encrypted_batch_inference(self, enc_images_payload: str, key_id: str, *args, **kwargs) -> List[str]:
+        return self._call(
+            self._worker_for(key_id), "run_encrypted_batch_inference", enc_images_payload, key_id, *args, **kwargs
+        )
+
+    def run_encrypted_merged_inference(self, enc_image_payloads: List[str], key_id: str, *args, **kwargs) -> List[str]:
+        return self._call(
+            self._worker_for(key_id), "run_encrypted_merged_inference", enc_image_payloads, key_id, *args, **kwargs
+        )
+
+    def run_encrypted_statistics(self, enc_logits_list_b64: List[Optional[str]], key_id: str, *args, **kwargs) -> Dict[str, Any]:
+        return self._call(self._worker_for(key_id), "run_encrypted_statistics", enc_logits_list_b64, key_id, *args, **kwargs)
+
+    def run_pattern_analysis(self, enc_logits_list_b64: List[Optional[str]], key_id: str, *args, **kwargs) -> Dict[str, Any]:
+        return self._call(self._worker_for(key_id), "run_pattern_analysis", enc_logits_list_b64, key_id, *args, **kwargs)
+
+    def prediction_level(self, key_id: str) -> int:
+        return self._call(self._worker_for(key_id), "prediction_level", key_id)
+
+    def cached_days(self, key_id: str, user_id: str, day_hashes: List[Any]) -> List[date]:
+        return self._call(self._worker_for(key_id), "cached_days", key_id, user_id, day_hashes)
+
+    def forget_days(self, user_id: str, dates: List[date]) -> None:
+        # A user's days may be cached under any key_id, hence on any worker
+        for worker in self._workers:
+            self._call(worker, "forget_days", user_id, dates)
+
+    def extend_history_aggregates(
+        self, key_id: str, previous: Optional[Dict[str, Any]], enc_logits_list_b64: List[str]
+    ) -> List[Dict[str, Any]]:
+        return self._call(self._worker_for(key_id), "extend_history_aggregates", key_id, previous, enc_logits_list_b64)
+
+    def run_aggregate_statistics(self, key_id: str, last: Dict[str, Any], *args, **kwargs) -> Dict[str, Any]:
+        return self._call(self._worker_for(key_id), "run_aggregate_statistics", key_id, last, *args, **kwargs)
+
+    def history_days(self, key_id: str) -> int:
+        return self._call(self._worker_for(key_id), "history_days", key_id)
+
+    def update_packed_history(self, key_id: str, packed: Optional[bytes], changes: List[Any]) -> bytes:
+        return self._call(self._worker_for(key_id), "update_packed_history", key_id, packed, changes)
+
+    def run_packed_statistics(self, key_id: str, packed: bytes, *args, **kwargs) -> Dict[str, Any]:
+        return self._call(self._worker_for(key_id), "run_packed_statistics", key_id, packed, *args, **kwargs)
+
+    def rotation_steps(self, layout: str, batch_sizes: List[int], slot_count: int, merge: bool = False) -> List[int]:
+        return self._call(self._any_worker(), "rotation_steps", layout, batch_sizes, slot_count, merge)
+
+    def rotation_key_profile(self, layout: str, batch_sizes: List[int], profile: str = DEFAULT_PROFILE) -> Dict[str, Any]:
+        return self._call(self._any_worker(), "rotation_key_profile", layout, batch_sizes, profile)
+
+    @staticmethod
+    def parameter_profiles() -> List[Dict[str, Any]]:
+        from app.services.he_service import HEEmotionEngine
+
+        return HEEmotionEngine.parameter_profiles()
+
+    def context_cache_stats(self) -> Dict[str, Any]:
+        """Context cache counters summed over the workers."""
+        per_worker = [self._call(worker, "context_cache_stats") for worker in self._workers]
+        totals = {key: sum(stats[key] for stats in per_worker) for key in per_worker[0] if key != "policy"}
+        return dict(totals, policy=per_worker[0]["policy"], workers=len(per_worker))
+
+    def postprocess_prediction_to_summary(self, enc_logits_payload: str, target_date: date) -> str:
+        return self._call(self._any_worker(), "postprocess_prediction_to_summary", enc_logits_payload, target_date)
+
+    # ------------------------------------------------------------------
+    # Health
+    # ------------------------------------------------------------------
+    def health(self) -> List[Dict[str, Any]]:
+        return [
+            {
+                "index": worker.index,
+                "pid": worker.process.pid if worker.process is not None else None,
+                "alive": worker.alive(),
+                "served": worker.served,
+                "pending": len(worker.pending),
+                "restarts": worker.restarts,
+            }
+            for worker in self._workers
+        ]
+
+    def _monitor_loop(self) -> None:
+        while not self._closed.wait(self.health_interval):
+            for worker in self._workers:
+                if self._closed.is_set():
+                    return
+                if not worker.alive():
+                    with worker.lock:
+                        if not worker.alive() and not self._closed.is_set():
+                            worker.restart("process died")
+                    continue
+                if worker.pending:
+                    continue  # busy; a long HE run is not a hang
+                start = time.perf_counter()
+                try:
+                    worker.submit(_PING, (), {}).result(timeout=self.health_interval)
+                except Exception as exc:  # noqa: BLE001
+                    with worker.lock:
+                        if not self._closed.is_set():
+                            worker.restart(f"health check failed: {exc!r}")
+                    continue
+                LOGGER.debug("HE worker %d answered ping in %.1f ms", worker.index, (time.perf_counter() - start) * 1000)
+
+    def close(self) -> None:
+        self._closed.set()
+        for worker in self._workers:
+            with worker.lock:
+                worker.stop()
+
+
+__all__ = ["HEWorkerPool"]
@@ -8,31 +8,110 @@ This version enforces true end-to-end FHE:
 from __future__ import annotations
 
 import base64
+import hashlib
 import logging
+import os
+import re
 import sys
+import threading
 import time
+import weakref
 from datetime import date
 from pathlib import Path
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
 
 from app.core.config import settings
+from app.fhe_core import codec
+from app.fhe_core.tenseal_context import DEFAULT_PROFILE
+from app.services.context_cache import ContextCache, ContextEntry
+from app.services.vector_cache import VectorCache, VectorEvicted
 
 LOGGER = logging.getLogger(__name__)
 if not LOGGER.handlers:
     logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s")
 
+# Eval contexts stored by content (``objects/{sha256}.seal``), one ``{key_id}.ref``
+# per key_id naming its context's SHA-256, and in-progress uploads
+CONTEXT_DIR = Path(__file__).resolve().parents[1] / "he_contexts"
+
+# key_id becomes a file name in CONTEXT_DIR; names starting with "." are reserved
+_KEY_ID = re.compile(r"[A-Za-z0-9_-][A-Za-z0-9._-]{0,127}")
+_SHA256 = re.compile(r"[0-9a-f]{64}")
+
+
+def validate_key_id(key_id: str) -> str:
+    if not _KEY_ID.fullmatch(key_id):
+        raise ValueError("key_id may only contain letters, digits, '.', '_' and '-' (at most 128)")
+    return key_id
+
+
+def _file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as handle:
+        for block in iter(lambda: handle.read(2**20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _payload_bytes(payload: Union[str, bytes]) -> bytes:
+    """Raw bytes of a base64 string (JSON routes) or bytes (binary routes) payload."""
+    if isinstance(payload, str):
+        return base64.b64decode(payload.encode("utf-8"))
+    return payload
+
+
+def _ciphertext_bytes(payload: Union[str, bytes], max_size: Optional[int] = None) -> bytes:
+    """TenSEAL serialization inside a payload, whichever codec the client framed it with.
+
+    ``max_size`` bounds the decompressed size of untrusted payloads (``ValueError`` past it).
+    """
+    return codec.decode(_payload_bytes(payload), max_size)
+
+
+def _like(payload: Union[str, bytes], data: bytes, codec_name: str = "none") -> Union[str, bytes]:
+    """``data`` encoded with ``codec_name``, in the same form as ``payload``: base64 string or raw bytes."""
+    data = codec.encode(data, codec_name)
+    if isinstance(payload, str):
+        return base64.b64encode(data).decode("utf-8")
+    return data
+
 
 class HEEmotionEngine:
     """High-level HE emotion engine entry point."""
 
-    def __init__(self) -> None:
+    def __init__(
+        self, threads: Optional[int] = None, context_cache_mb: Optional[int] = None, vector_cache_mb: Optional[int] = None
+    ) -> None:
+        """``threads``, ``context_cache_mb`` and ``vector_cache_mb`` override the settings (a worker's share of them)."""
         self._project_root = self._bootstrap_project_root()
-        self._context_dir = self._project_root / "backend" / "app" / "he_contexts"
-        self._context_dir.mkdir(parents=True, exist_ok=True)
-        self._contexts: dict[str, Any] = {}
-
-        self._runner_weights: Optional[Dict[str, Any]] = None
-        self._torch = None
+        self._context_dir = CONTEXT_DIR
+        self._object_dir = CONTEXT_DIR / "objects"
+        self._object_dir.mkdir(parents=True, exist_ok=True)
+        # key_id -> SHA-256 of its context (the .ref files); refs change under the lock
+        self._digests: Dict[str, str] = {}
+        self._refs_lock = threading.Lock()
+        # Loaded contexts with their evaluator, encoded plans and checked rotation keys, within a byte budget
+        self._contexts = ContextCache(
+            (context_cache_mb or settings.HE_CONTEXT_CACHE_MB) * 2**20, self._load_context_from_disk, settings.HE_CONTEXT_CACHE_POLICY
+        )
+        # Deserialized per-day logits of the history windows, so refreshes skip unchanged days
+        self._vectors = VectorCache(
+            (settings.HE_VECTOR_CACHE_MB if vector_cache_mb is None else vector_cache_mb) * 2**20
+        )
+        # Encoded plaintexts only depend on the parameter set; contexts sharing it share one copy
+        self._shared_encoded_weights: "weakref.WeakValueDictionary[tuple, Any]" = weakref.WeakValueDictionary()
+
+        # Cores shared by concurrent requests; shards of one forward pass go to a worker pool
+        self._threads = threads or settings.he_threads()
+        self._threads_per_request = max(1, min(settings.HE_THREADS_PER_REQUEST, self._threads))
+        # Codec of the ciphertexts this engine returns (inputs may use any codec)
+        self._codec = codec.check_codec(settings.HE_CIPHERTEXT_CODEC)
+        self._core_budget = None
+        self._shard_pool = None
+        self._shard_pool_lock = threading.Lock()
+
+        # Compiled HE execution plan of the model (weights, slot layouts, levels, rotation steps)
+        self._plan = None
         self._ts = None
         self.class_labels = ['Angry', 'Disgust', 'Fear', 'Happy', 'Sad', 'Surprise', 'Neutral']
 
@@ -48,169 +127,887 @@ class HEEmotionEngine:
 
     def _initialize_engine(self) -> None:
         try:
-            import torch
             import tenseal as ts
-            from app.fhe_core import fhe_inference
-            from app.fhe_core.fhe_cnn import extract_fhe_parameters
+            from app.fhe_core.parallel import CoreBudget
+            from app.fhe_core.plan_artifact import PLAN_PATH, load_plan, read_manifest
 
-            self._torch = torch
             self._ts = ts
-
-            # Override model path to use local copy under backend/app/inference_model
-            local_model_path = self._project_root / "backend" / "app" / "inference_model" / "he_cnn_fer2013_enhanced.pt"
-            if local_model_path.exists():
-                fhe_inference.MODEL_PATH = local_model_path
-
-            model, _ = fhe_inference.load_plain_model(device=torch.device("cpu"))
-            params = extract_fhe_parameters(model)
-            # Precompute weights in Python lists for encrypted ops
-            self._runner_weights = {
-                "conv1_weight": params["conv"][0]["weight"].tolist(),
-                "conv1_bias": params["conv"][0]["bias"].tolist(),
-                "fc1_weight": params["linear"][0]["weight"].T.tolist(),
-                "fc1_bias": params["linear"][0]["bias"].tolist(),
-                "fc2_weight": params["linear"][1]["weight"].T.tolist(),
-                "fc2_bias": params["linear"][1]["bias"].tolist(),
-            }
-            LOGGER.info("HE engine initialized with TenSEAL and model weights")
+            self._core_budget = CoreBudget(self._threads)
+
+            # Precompiled plan exported offline (python -m app.fhe_core.plan_artifact); torch is not needed here
+            plan_path = Path(settings.HE_PLAN_PATH or PLAN_PATH)
+            self._plan = load_plan(plan_path)
+            manifest = read_manifest(plan_path)
+            LOGGER.info(
+                "HE engine initialized with TenSEAL and plan %s (sha256 %s): %s",
+                plan_path.name,
+                manifest["sha256"][:12],
+                self._plan.describe(),
+            )
         except Exception as exc:  # noqa: BLE001
             raise RuntimeError(f"Failed to initialize HE engine: {exc}") from exc
 
     # ------------------------------------------------------------------
     # Context management
     # ------------------------------------------------------------------
-    def register_eval_context(self, key_id: str, eval_context_b64: str) -> None:
-        """Register a new evaluation context (no secret key) for a client."""
+    def register_eval_context(
+        self,
+        key_id: str,
+        eval_context_b64: Union[str, bytes],
+        layout: str = "im2col",
+        batch_sizes: Optional[List[int]] = None,
+        profile: str = DEFAULT_PROFILE,
+    ) -> str:
+        """Register a new evaluation context (no secret key) for a client.
+
+        The context must use the parameters of ``profile`` (see
+        ``tenseal_context.PROFILES``) and carry relinearization keys and every
+        rotation key the forward pass uses for ``layout`` at ``batch_sizes``
+        (default ``[1]``); otherwise a ``ValueError`` is raised and nothing is
+        stored. Returns the SHA-256 the context is stored under; bytes the
+        server already has are linked to ``key_id`` without storing or
+        deserializing them again.
+        """
         start = time.perf_counter()
-        data = base64.b64decode(eval_context_b64.encode("utf-8"))
-        LOGGER.info("📥 Received eval context: %.2f KB", len(data) / 1024)
-        
-        path = self._context_dir / f"{key_id}.seal"
-        path.write_bytes(data)
-        
-        if self._ts:
-            try:
-                deserialize_start = time.perf_counter()
-                ctx = self._ts.context_from(data)
-                deserialize_time = (time.perf_counter() - deserialize_start) * 1000
-                LOGGER.info("⏱️  Context deserialization took %.1f ms", deserialize_time)
-                
-                # Safety: warn if secret key is present
-                if hasattr(ctx, "is_public") and not ctx.is_public():
-                    LOGGER.warning("Received context for %s contains a secret key; server should not have it", key_id)
-                self._contexts[key_id] = ctx
-            except Exception as exc:  # noqa: BLE001
-                LOGGER.warning("Unable to load TenSEAL context for %s: %s", key_id, exc)
-        
+        validate_key_id(key_id)
+        data = _payload_bytes(eval_context_b64)
+        digest = hashlib.sha256(data).hexdigest()
+        LOGGER.info("📥 Received eval context: %.2f KB (sha256 %s)", len(data) / 1024, digest[:12])
+        if self.has_context(digest):
+            return self.register_existing_context(key_id, digest, layout, batch_sizes, profile)
+        entry = self._validated_entry(key_id, digest, data, layout, batch_sizes, profile)
+
+        staging = self._object_dir / f".{digest}.{os.getpid()}.tmp"
+        staging.write_bytes(data)
+        with self._refs_lock:
+            self._store_object(staging, digest)
+            self._link(key_id, digest)
+        if entry is not None:
+            self._contexts.put(entry)
+
+        elapsed = (time.perf_counter() - start) * 1000
+        LOGGER.info("✅ Registered eval context %s for key_id=%s (%.1f ms total)", digest[:12], key_id, elapsed)
+        return digest
+
+    def register_eval_context_file(
+        self,
+        key_id: str,
+        upload_path: str,
+        layout: str = "im2col",
+        batch_sizes: Optional[List[int]] = None,
+        profile: str = DEFAULT_PROFILE,
+        digest: Optional[str] = None,
+    ) -> str:
+        """``register_eval_context`` for a context uploaded to a file in ``he_contexts/``.
+
+        ``digest`` is the file's SHA-256 if the caller already computed it.
+        The file is validated in place and atomically renamed into the
+        object store; it is deleted if validation fails or the server already
+        has the same bytes.
+        """
+        start = time.perf_counter()
+        source = Path(upload_path)
+        try:
+            validate_key_id(key_id)
+            digest = digest or _file_sha256(source)
+            if self.has_context(digest):
+                source.unlink(missing_ok=True)
+                return self.register_existing_context(key_id, digest, layout, batch_sizes, profile)
+            data = source.read_bytes()
+            LOGGER.info("📥 Uploaded eval context: %.2f KB (sha256 %s)", len(data) / 1024, digest[:12])
+            entry = self._validated_entry(key_id, digest, data, layout, batch_sizes, profile)
+        except BaseException:
+            source.unlink(missing_ok=True)
+            raise
+        del data
+        with self._refs_lock:
+            self._store_object(source, digest)
+            self._link(key_id, digest)
+        if entry is not None:
+            self._contexts.put(entry)
+
         elapsed = (time.perf_counter() - start) * 1000
-        LOGGER.info("✅ Registered eval context for key_id=%s at %s (%.1f ms total)", key_id, path, elapsed)
+        LOGGER.info("✅ Registered uploaded eval context %s for key_id=%s (%.1f ms total)", digest[:12], key_id, elapsed)
+        return digest
+
+    def register_existing_context(
+        self,
+        key_id: str,
+        digest: str,
+        layout: str = "im2col",
+        batch_sizes: Optional[List[int]] = None,
+        profile: str = DEFAULT_PROFILE,
+    ) -> str:
+        """Point ``key_id`` at a context the server already stores (see ``has_context``).
+
+        Runs the same checks as ``register_eval_context`` on the shared
+        loaded instance, so a repeat registration costs no upload and, while
+        the context is cached, no deserialization.
+        """
+        from app.fhe_core.he_plan import statistics_levels
+        from app.fhe_core.tenseal_context import get_profile
 
-    def _load_context_from_disk(self, key_id: str):
-        if key_id in self._contexts:
-            return self._contexts[key_id]
-        path = self._context_dir / f"{key_id}.seal"
-        if not path.exists():
+        start = time.perf_counter()
+        validate_key_id(key_id)
+        if not self.has_context(digest):
+            raise ValueError(f"No eval context stored with sha256 {digest}")
+        with self._contexts.pinned(digest) as entry:
+            expected = get_profile(profile)
+            if not expected.matches(entry.context):
+                raise ValueError(f"Eval context for key_id={key_id} does not use the {profile!r} parameter profile")
+            self._plan.check_levels(expected.depth - statistics_levels(expected.packed_history))
+            self._check_rotation_keys(key_id, entry, layout, batch_sizes or [1])
+        with self._refs_lock:
+            # It may have lost its last other key_id while we were checking
+            if not self._object_path(digest).exists():
+                raise ValueError(f"No eval context stored with sha256 {digest}")
+            self._link(key_id, digest)
+        elapsed = (time.perf_counter() - start) * 1000
+        LOGGER.info("🔗 Linked key_id=%s to stored eval context %s (%.1f ms)", key_id, digest[:12], elapsed)
+        return digest
+
+    def has_context(self, digest: str) -> bool:
+        """Whether a context with SHA-256 ``digest`` is stored (clients skip the upload then)."""
+        return bool(_SHA256.fullmatch(digest)) and self._object_path(digest).exists()
+
+    def _validated_entry(
+        self, key_id: str, digest: str, data: bytes, layout: str, batch_sizes: Optional[List[int]], profile: str
+    ) -> Optional[ContextEntry]:
+        """Deserialize ``data`` and check its profile, levels and rotation keys (``ValueError`` if unusable)."""
+        from app.fhe_core.he_plan import statistics_levels
+        from app.fhe_core.tenseal_context import context_memory_bytes, get_profile
+
+        if not self._ts:
+            return None
+        expected = get_profile(profile)
+        deserialize_start = time.perf_counter()
+        try:
+            # Bounded: a small compressed upload must not expand past any real context
+            ctx = self._ts.context_from(codec.decode(data, expected.max_context_bytes), n_threads=self._threads_per_request)
+        except Exception as exc:  # noqa: BLE001
+            raise ValueError(f"Unable to load TenSEAL context for {key_id}: {exc}") from exc
+        deserialize_time = (time.perf_counter() - deserialize_start) * 1000
+        LOGGER.info("⏱️  Context deserialization took %.1f ms", deserialize_time)
+
+        # Safety: warn if secret key is present
+        if hasattr(ctx, "is_public") and not ctx.is_public():
+            LOGGER.warning("Received context for %s contains a secret key; server should not have it", key_id)
+        if not expected.matches(ctx):
+            raise ValueError(f"Eval context for key_id={key_id} does not use the {profile!r} parameter profile")
+        # Levels are left for the squared differences of the statistics (and the packing mask)
+        self._plan.check_levels(expected.depth - statistics_levels(expected.packed_history))
+        entry = ContextEntry(digest, ctx, context_memory_bytes(ctx), expected)
+        self._check_rotation_keys(key_id, entry, layout, batch_sizes or [1])
+        return entry
+
+    def _object_path(self, digest: str) -> Path:
+        return self._object_dir / f"{digest}.seal"
+
+    def _ref_path(self, key_id: str) -> Path:
+        return self._context_dir / f"{key_id}.ref"
+
+    def _digest_for(self, key_id: str) -> str:
+        """SHA-256 of the context ``key_id`` is registered with."""
+        digest = self._digests.get(key_id)
+        if digest is not None:
+            return digest
+        validate_key_id(key_id)
+        with self._refs_lock:
+            ref = self._ref_path(key_id)
+            if ref.exists():
+                digest = ref.read_text().strip()
+            else:
+                digest = self._migrate_legacy(key_id)
+            self._digests[key_id] = digest
+        return digest
+
+    def _migrate_legacy(self, key_id: str) -> str:
+        """Move a pre-dedup ``{key_id}.seal`` into the object store (caller holds ``_refs_lock``)."""
+        legacy = self._context_dir / f"{key_id}.seal"
+        if not legacy.exists():
             raise ValueError(f"No eval context found for key_id={key_id}")
+        digest = _file_sha256(legacy)
+        self._store_object(legacy, digest)
+        self._link(key_id, digest)
+        LOGGER.info("📦 Moved eval context of key_id=%s into the object store as %s", key_id, digest[:12])
+        return digest
+
+    def _store_object(self, source: Path, digest: str) -> None:
+        """Atomically move ``source`` to the object of ``digest`` (caller holds ``_refs_lock``)."""
+        target = self._object_path(digest)
+        if target.exists():
+            source.unlink(missing_ok=True)
+        else:
+            os.replace(source, target)
+
+    def _link(self, key_id: str, digest: str) -> None:
+        """Write ``key_id``'s ref and drop the object it replaces if unused (caller holds ``_refs_lock``)."""
+        ref = self._ref_path(key_id)
+        previous = self._digests.get(key_id) or (ref.read_text().strip() if ref.exists() else None)
+        staging = ref.with_name(f".{ref.name}.{os.getpid()}.tmp")
+        staging.write_text(digest)
+        os.replace(staging, ref)
+        self._digests[key_id] = digest
+        (self._context_dir / f"{key_id}.seal").unlink(missing_ok=True)
+        if previous and previous != digest:
+            if not any(other.read_text().strip() == previous for other in self._context_dir.glob("*.ref")):
+                self._object_path(previous).unlink(missing_ok=True)
+                self._contexts.discard(previous)
+                LOGGER.info("🗑️  Removed eval context %s (no key_id uses it anymore)", previous[:12])
+
+    def _load_context_from_disk(self, digest: str) -> ContextEntry:
+        """Context cache loader: deserialize ``he_contexts/objects/{digest}.seal``."""
+        path = self._object_path(digest)
+        if not path.exists():
+            raise ValueError(f"No eval context stored with sha256 {digest}")
         data = path.read_bytes()
         if not self._ts:
             raise RuntimeError("TenSEAL not available in this environment")
-        ctx = self._ts.context_from(data)
-        self._contexts[key_id] = ctx
-        LOGGER.info("🔑 Loaded eval context for key_id=%s from %s", key_id, path)
-        return ctx
+        from app.fhe_core.tenseal_context import context_memory_bytes, profile_of
+
+        ctx = self._ts.context_from(codec.decode(data), n_threads=self._threads_per_request)
+        entry = ContextEntry(digest, ctx, context_memory_bytes(ctx), profile_of(ctx))
+        LOGGER.info(
+            "🔑 Loaded eval context %s from %s (%s profile, %.1f MB in memory)",
+            digest[:12],
+            path,
+            entry.profile.name,
+            entry.size / 2**20,
+        )
+        return entry
+
+    def context_cache_stats(self) -> Dict[str, Any]:
+        """Byte usage and hit/miss/eviction counters of the context cache."""
+        return self._contexts.stats()
+
+    @staticmethod
+    def _evaluator_for(entry: ContextEntry):
+        from app.fhe_core.seal_ops import SealEvaluator
+
+        if entry.evaluator is None:
+            entry.evaluator = SealEvaluator(entry.context)
+        return entry.evaluator
+
+    def _encoded_for(self, entry: ContextEntry, batch_size: int, input_scale: float, layout: str):
+        """Return the SEAL evaluator and pre-encoded CNN weights for a cached context.
+
+        Built on the first request for a key_id (and batch size / input
+        layout), then reused until the context is evicted. Contexts of the
+        same parameter profile share one compiled copy.
+        """
+        evaluator = self._evaluator_for(entry)
+        per_batch = entry.encoded
+        encoded = per_batch.get((batch_size, layout))
+        if encoded is None or encoded.input_scale != input_scale:
+            profile = entry.profile
+            fingerprint = (profile.name, tuple(evaluator.levels[0].parms_id), input_scale, batch_size, layout)
+            encoded = self._shared_encoded_weights.get(fingerprint)
+            if encoded is None:
+                start = time.perf_counter()
+                encoded = self._plan.encode(evaluator, batch_size, input_scale, layout)
+                self._shared_encoded_weights[fingerprint] = encoded
+                LOGGER.info(
+                    "🧮 Encoded CNN weights for context %s (profile=%s, batch_size=%d, layout=%s, %.1f ms)",
+                    entry.digest[:12],
+                    profile.name,
+                    batch_size,
+                    layout,
+                    (time.perf_counter() - start) * 1000,
+                )
+            per_batch[(batch_size, layout)] = encoded
+        return evaluator, encoded
+
+    def _shard_executor(self, digest: str, cores: int):
+        """Executor spreading one forward pass over ``cores`` cores (``None`` runs it serially)."""
+        if cores < 2:
+            return None
+        from app.fhe_core.parallel import ShardExecutor, create_pool
+
+        with self._shard_pool_lock:
+            if self._shard_pool is None:
+                # The calling thread runs one share of every request
+                self._shard_pool = create_pool(self._threads - 1, self._plan)
+        return ShardExecutor(self._shard_pool, str(self._object_path(digest)), cores)
+
+    def close(self) -> None:
+        """Shut down the shard worker pool."""
+        if self._shard_pool is not None:
+            self._shard_pool.shutdown()
+            self._shard_pool = None
 
     # ------------------------------------------------------------------
     # Inference
     # ------------------------------------------------------------------
-    def run_encrypted_inference(self, enc_image_payload: str, key_id: str) -> str:
-        """Run encrypted inference. Input/output are base64-encoded serialized CKKS vectors."""
+    def run_encrypted_inference(
+        self, enc_image_payload: Union[str, bytes], key_id: str, batch_size: int = 1, layout: str = "im2col"
+    ) -> Union[str, bytes]:
+        """Run encrypted inference on a serialized CKKS vector.
+
+        Payloads may be base64 strings (JSON routes) or raw bytes (binary
+        routes); the result comes back in the same form.
+
+        With ``batch_size > 1`` the payload holds several images in the batched
+        im2col layout (see ``fhe_core.batching``) and the logits of image ``b``
+        are returned at slots ``[7b, 7b + 7)`` of the same ciphertext.
+        ``layout="replicated"`` expects the unpadded, replicated im2col
+        encoding instead, which needs far fewer conv multiplies and rotations.
+        """
         start = time.perf_counter()
         try:
-            if not self._ts or not self._runner_weights:
+            if not self._ts or not self._plan:
                 raise RuntimeError("HE engine not fully initialized (TenSEAL/weights missing)")
 
-            LOGGER.info("🔐 Starting encrypted inference for key_id=%s", key_id)
-            ctx = self._load_context_from_disk(key_id)
-            ciphertext_bytes = base64.b64decode(enc_image_payload.encode("utf-8"))
-            LOGGER.info("📦 Decoding ciphertext: %d bytes", len(ciphertext_bytes))
-            enc_x = self._ts.ckks_vector_from(ctx, ciphertext_bytes)
-            enc_logits = self._forward_im2col(enc_x)
+            LOGGER.info("🔐 Starting encrypted inference for key_id=%s (batch_size=%d)", key_id, batch_size)
+            enc_logits = self._run_forward(key_id, [enc_image_payload], batch_size, layout)
             logits_bytes = enc_logits.serialize()
             elapsed = (time.perf_counter() - start) * 1000
             LOGGER.info("🤖 Encrypted CNN inference done for key_id=%s (%.1f ms)", key_id, elapsed)
-            return base64.b64encode(logits_bytes).decode("utf-8")
+            return _like(enc_image_payload, logits_bytes, self._codec)
         except Exception as e:
             LOGGER.error("❌ Inference failed for key_id=%s: %s", key_id, str(e), exc_info=True)
             raise
 
-    def _forward_im2col(self, enc_x):
-        """Encrypted CNN forward pass starting from im2col-encoded ciphertext."""
-        ts = self._ts
-        w = self._runner_weights
-        windows_nb = 49  # for 48x48 input, kernel 9, stride 6
+    def run_encrypted_batch_inference(
+        self, enc_images_payload: Union[str, bytes], key_id: str, batch_size: int, layout: str = "im2col"
+    ) -> List[Union[str, bytes]]:
+        """Run batched inference and split the result into one logits ciphertext per image.
 
-        # Conv1
-        enc_channels = []
-        for kernel, bias in zip(w["conv1_weight"], w["conv1_bias"]):
-            k_flat = kernel[0]  # in_channel = 1
-            y = enc_x.conv2d_im2col(k_flat, windows_nb) + bias
-            enc_channels.append(y)
+        Each returned ciphertext has the same layout as a single-image result
+        (logits at slots ``[0, 7)``), so it can be stored and aggregated as usual.
+        """
+        start = time.perf_counter()
+        try:
+            if not self._ts or not self._plan:
+                raise RuntimeError("HE engine not fully initialized (TenSEAL/weights missing)")
 
-        # Pack channels
-        enc_x = ts.CKKSVector.pack_vectors(enc_channels)
-        enc_x.square_()
+            LOGGER.info("🔐 Starting batched encrypted inference for key_id=%s (batch_size=%d)", key_id, batch_size)
+            enc_logits_list = self._run_forward(key_id, [enc_images_payload], batch_size, layout, split=True)
+            results = [_like(enc_images_payload, enc.serialize(), self._codec) for enc in enc_logits_list]
+            elapsed = (time.perf_counter() - start) * 1000
+            LOGGER.info(
+                "🤖 Batched CNN inference done for key_id=%s (%d images, %.1f ms, %.1f ms/image)",
+                key_id,
+                batch_size,
+                elapsed,
+                elapsed / batch_size,
+            )
+            return results
+        except Exception as e:
+            LOGGER.error("❌ Batched inference failed for key_id=%s: %s", key_id, str(e), exc_info=True)
+            raise
 
-        # FC1
-        enc_x = enc_x.mm(w["fc1_weight"]) + w["fc1_bias"]
-        enc_x.square_()
+    def run_encrypted_merged_inference(
+        self, enc_image_payloads: Sequence[Union[str, bytes]], key_id: str, batch_size: int, layout: str = "im2col"
+    ) -> List[Union[str, bytes]]:
+        """Run several single-image requests of one key_id as one ``batch_size`` batch.
+
+        Each payload holds its image at position 0 of the ``batch_size`` layout,
+        zero-padded to the full slot count (``CNNPlan.merge_input_vector``). The
+        payloads are packed with one rotation each, run through one forward pass
+        and split back into one logits ciphertext per payload, in order.
+        Contexts without the merge rotation keys run them one at a time instead.
+        """
+        start = time.perf_counter()
+        try:
+            if not self._ts or not self._plan:
+                raise RuntimeError("HE engine not fully initialized (TenSEAL/weights missing)")
 
-        # FC2
-        enc_x = enc_x.mm(w["fc2_weight"]) + w["fc2_bias"]
-        return enc_x
+            count = len(enc_image_payloads)
+            LOGGER.info("🔐 Starting merged encrypted inference for key_id=%s (%d/%d images)", key_id, count, batch_size)
+            enc_logits_list = self._run_forward(key_id, enc_image_payloads, batch_size, layout, merge=True)
+            results = [_like(payload, enc.serialize(), self._codec) for payload, enc in zip(enc_image_payloads, enc_logits_list)]
+            elapsed = (time.perf_counter() - start) * 1000
+            LOGGER.info(
+                "🤖 Merged CNN inference done for key_id=%s (%d images, %.1f ms, %.1f ms/image)",
+                key_id,
+                count,
+                elapsed,
+                elapsed / count,
+            )
+            return results
+        except Exception as e:
+            LOGGER.error("❌ Merged inference failed for key_id=%s: %s", key_id, str(e), exc_info=True)
+            raise
 
-    def run_encrypted_statistics(self, enc_logits_list_b64: List[str], key_id: str) -> Dict[str, str]:
+    def rotation_steps(self, layout: str, batch_sizes: List[int], slot_count: int, merge: bool = False) -> List[int]:
+        """Rotation steps the forward pass needs for ``layout`` at each batch size.
+
+        ``merge`` adds the steps for micro-batching single-image requests
+        (optional: without them such requests just run one at a time).
+        """
+        if not self._plan:
+            raise RuntimeError("HE engine not fully initialized (weights missing)")
+        steps: set = set()
+        for batch_size in batch_sizes:
+            steps |= self._plan.rotation_steps(slot_count, layout, batch_size)
+            if merge:
+                steps |= self._plan.merge_rotation_steps(slot_count, layout, batch_size)
+        return sorted(steps)
+
+    @staticmethod
+    def parameter_profiles() -> List[Dict[str, Any]]:
+        """CKKS parameter profiles clients can register keys for."""
+        from dataclasses import asdict
+
+        from app.fhe_core.tenseal_context import PROFILES
+
+        return [dict(asdict(profile), slot_count=profile.slot_count, depth=profile.depth) for profile in PROFILES.values()]
+
+    def rotation_key_profile(self, layout: str, batch_sizes: List[int], profile: str = DEFAULT_PROFILE) -> Dict[str, Any]:
+        """Rotation steps and matching Galois elements a client should generate keys for."""
+        from app.fhe_core.tenseal_context import galois_element, get_profile
+
+        params = get_profile(profile)
+        degree = params.poly_modulus_degree
+        steps = self.rotation_steps(layout, batch_sizes, params.slot_count, merge=True)
+        if params.packed_history:
+            from app.fhe_core import packed_history
+
+            steps = sorted(set(steps) | set(packed_history.rotation_steps(params.slot_count, self._plan.num_classes)))
+        return {
+            "profile": params.name,
+            "poly_modulus_degree": degree,
+            "layout": layout,
+            "batch_sizes": batch_sizes,
+            "steps": steps,
+            "galois_elements": [galois_element(step, degree) for step in steps],
+        }
+
+    def _check_rotation_keys(self, key_id: str, entry: ContextEntry, layout: str, batch_sizes: List[int]) -> None:
+        """Raise if the context lacks relinearization keys or a rotation key the forward pass uses."""
+        from app.fhe_core.rotation_keys import missing_rotation_steps
+        from app.fhe_core.tenseal_context import slot_count
+
+        ctx = entry.context
+        if not ctx.has_relin_keys():
+            raise ValueError(f"Eval context for key_id={key_id} has no relinearization keys")
+        verified = entry.verified_rotations
+        pending = [b for b in batch_sizes if (layout, b) not in verified]
+        if not pending:
+            return
+        missing = missing_rotation_steps(ctx, self.rotation_steps(layout, pending, slot_count(ctx)))
+        if missing:
+            raise ValueError(
+                f"Eval context for key_id={key_id} lacks rotation keys for steps {missing} "
+                f"(layout={layout}, batch_sizes={pending}); regenerate keys with GET /he/rotation-steps"
+            )
+        verified.update((layout, b) for b in pending)
+
+    def _has_merge_keys(self, entry: ContextEntry, layout: str, batch_size: int, slots: int) -> bool:
+        """Whether the context can pack single-image requests into a ``batch_size`` batch."""
+        from app.fhe_core.rotation_keys import missing_rotation_steps
+
+        key = (layout, batch_size)
+        available = entry.merge_keys.get(key)
+        if available is None:
+            steps = self._plan.merge_rotation_steps(slots, layout, batch_size)
+            available = entry.merge_keys[key] = not missing_rotation_steps(entry.context, steps)
+            if not available:
+                LOGGER.info("Eval context %s has no merge rotation keys; requests run one at a time", entry.digest[:12])
+        return available
+
+    def _decode_input(self, entry: ContextEntry, payload: Union[str, bytes], expected: int, batch_size: int, layout: str):
+        ciphertext_bytes = _ciphertext_bytes(payload, entry.profile.max_ciphertext_bytes)
+        LOGGER.info("📦 Decoding ciphertext: %d bytes", len(ciphertext_bytes))
+        enc_x = self._ts.ckks_vector_from(entry.context, ciphertext_bytes)
+        if enc_x.size() != expected:
+            raise ValueError(
+                f"Ciphertext holds {enc_x.size()} values, expected {expected} for batch_size={batch_size} ({layout} layout)"
+            )
+        return enc_x.ciphertext()[0]
+
+    def _run_forward(
+        self,
+        key_id: str,
+        enc_image_payloads: List[str],
+        batch_size: int,
+        layout: str,
+        split: bool = False,
+        merge: bool = False,
+    ):
+        """Decode the input ciphertexts and run the compiled plan's forward pass.
+
+        With ``merge`` every payload is a single image at position 0 of a
+        ``batch_size`` batch; they share one pass and get one output each.
+        Otherwise there is exactly one payload.
+        """
+        from app.fhe_core.tenseal_context import slot_count
+
+        with self._contexts.pinned(self._digest_for(key_id)) as entry:
+            ctx = entry.context
+            slots = slot_count(ctx)
+            expected = self._plan.input_size(layout, batch_size, slots)
+            if merge:
+                # Zero-padded to every slot, see CNNPlan.merge_input_vector
+                expected = slots
+            self._check_rotation_keys(key_id, entry, layout, [batch_size])
+            cts = [self._decode_input(entry, payload, expected, batch_size, layout) for payload in enc_image_payloads]
+
+            evaluator, encoded = self._encoded_for(entry, batch_size, cts[0].scale, layout)
+            num_classes = encoded.num_classes
+            # Serialized without the primes the statistics will not use
+            output_level = self._plan.output_level(len(evaluator.levels), entry.profile.packed_history)
+
+            def logits(out, size: int):
+                return evaluator.to_vector(evaluator.mod_switch_to(out, output_level), size)
+
+            with self._core_budget.reserve(self._threads_per_request) as cores:
+                executor = self._shard_executor(entry.digest, cores)
+                if merge:
+                    if len(cts) > 1 and self._has_merge_keys(entry, layout, batch_size, slots):
+                        merged = encoded.merge_inputs(evaluator, cts)
+                        outputs = encoded.forward_split(evaluator, merged, executor, images=len(cts))
+                    else:
+                        outputs = [encoded.forward_split(evaluator, ct, executor, images=1)[0] for ct in cts]
+                    return [logits(out, num_classes) for out in outputs]
+                (ct,) = cts
+                if split:
+                    outputs = encoded.forward_split(evaluator, ct, executor)
+                    return [logits(out, num_classes) for out in outputs]
+                return logits(encoded.forward(evaluator, ct, executor), num_classes * batch_size)
+
+    def prediction_level(self, key_id: str) -> int:
+        """CKKS level (primes dropped) of the predictions returned for ``key_id``."""
+        with self._contexts.pinned(self._digest_for(key_id)) as entry:
+            return self._plan.output_level(len(self._evaluator_for(entry).levels))
+
+    def run_encrypted_statistics(
+        self,
+        enc_logits_list_b64: Sequence[Optional[Union[str, bytes]]],
+        key_id: str,
+        raw: bool = False,
+        user_id: Optional[str] = None,
+        day_hashes: Optional[Sequence[Tuple[date, str]]] = None,
+    ) -> Dict[str, Union[str, bytes]]:
+        """Encrypted sum and volatility of stored logits (base64, or raw bytes with ``raw``).
+
+        Deserialization, the pairwise sum and the squared day-to-day
+        differences are spread over the request's cores (``_window_sums``).
+        With ``user_id`` and ``day_hashes`` (see ``cached_days``) the days go
+        through the vector cache.
+        """
         start = time.perf_counter()
         
         if not enc_logits_list_b64:
             raise ValueError("No encrypted data provided for statistics.")
 
         try:
-            ctx = self._load_context_from_disk(key_id)
-
-            encrypted_vectors = []
-            for b64_str in enc_logits_list_b64:
-                data = base64.b64decode(b64_str.encode("utf-8"))
-                vec = self._ts.ckks_vector_from(ctx, data)
-                encrypted_vectors.append(vec)
-            
-            LOGGER.info("Computing stats for %d days (key_id=%s)", len(encrypted_vectors), key_id)
-
-            enc_sum = encrypted_vectors[0].copy()
-            for i in range(1, len(encrypted_vectors)):
-                enc_sum += encrypted_vectors[i]
-
-            enc_volatility = self._ts.ckks_vector(ctx, [0.0])
-            
-            for i in range(1, len(encrypted_vectors)):
-                diff = encrypted_vectors[i] - encrypted_vectors[i-1]
-                diff_sq = diff.square() # Requires RelinKeys in context
-                enc_volatility += diff_sq
-
-            sum_b64 = base64.b64encode(enc_sum.serialize()).decode("utf-8")
-            vol_b64 = base64.b64encode(enc_volatility.serialize()).decode("utf-8")
+            with self._contexts.pinned(self._digest_for(key_id)) as entry:
+                LOGGER.info("Computing stats for %d days (key_id=%s)", len(enc_logits_list_b64), key_id)
+                evaluator = self._evaluator_for(entry)
+                sums = self._window_sums(entry, key_id, enc_logits_list_b64, user_id=user_id, day_hashes=day_hashes)
 
-            elapsed = (time.perf_counter() - start) * 1000
-            LOGGER.info("Stats calculation done (%.1f ms)", elapsed)
+                enc_sum = evaluator.to_vector(sums.total, sums.size)
+                if sums.squares is not None:
+                    enc_volatility = evaluator.to_vector(sums.squares, sums.size)
+                else:
+                    enc_volatility = self._ts.ckks_vector(entry.context, [0.0])
+
+                stats = self._final_payloads(
+                    entry, {"encrypted_sum": enc_sum, "encrypted_volatility": enc_volatility}, raw
+                )
 
-            return {
-                "encrypted_sum": sum_b64,
-                "encrypted_volatility": vol_b64
-            }
+                elapsed = (time.perf_counter() - start) * 1000
+                LOGGER.info("Stats calculation done (%.1f ms)", elapsed)
+
+                return stats
 
         except Exception as e:
             LOGGER.error("Stats calculation failed for key_id=%s: %s", key_id, str(e), exc_info=True)
             raise
 
+    def cached_days(self, key_id: str, user_id: str, day_hashes: Sequence[Tuple[date, str]]) -> List[date]:
+        """Dates of ``day_hashes`` (date, content hash) whose deserialized logits are cached.
+
+        Their payloads may be passed as ``None`` to ``run_encrypted_statistics``
+        and ``run_pattern_analysis``, which raise ``VectorEvicted`` if one was
+        evicted in between.
+        """
+        digest = self._digest_for(key_id)
+        return [day for day, content_hash in day_hashes if self._vectors.get((key_id, user_id, day), content_hash, digest)]
+
+    def forget_days(self, user_id: str, dates: Sequence[date]) -> None:
+        """Release the cached logits of ``user_id`` on ``dates`` (their predictions were overwritten)."""
+        self._vectors.discard(user_id, dates)
+
+    def _window_sums(
+        self,
+        entry: ContextEntry,
+        key_id: str,
+        payloads: Sequence[Optional[Union[str, bytes]]],
+        products: bool = False,
+        user_id: Optional[str] = None,
+        day_hashes: Optional[Sequence[Tuple[date, str]]] = None,
+    ):
+        """Finished ``WindowSums`` of consecutive days' logits, on up to ``HE_THREADS_PER_REQUEST`` cores.
+
+        With ``day_hashes``, cached days are used as they are and the others
+        are deserialized here and cached. Only a window with no cached day is
+        sharded; the caller then caches every day while the workers run.
+        """
+        from app.fhe_core.parallel import deserialize_logits, finish_window_sums, window_sums, window_sums_of
+
+        evaluator = self._evaluator_for(entry)
+        max_size = entry.profile.max_ciphertext_bytes
+        payloads = [None if payload is None else _ciphertext_bytes(payload, max_size) for payload in payloads]
+        days: List[Optional[Tuple[Any, int]]] = [None] * len(payloads)
+        if day_hashes is not None:
+            days = [self._vectors.get((key_id, user_id, day), content_hash, entry.digest) for day, content_hash in day_hashes]
+        for index, (day, payload) in enumerate(zip(days, payloads)):
+            if day is None and payload is None:
+                raise VectorEvicted(f"Logits of {day_hashes[index][0]} are no longer cached")
+
+        def load(index: int) -> Tuple[Any, int]:
+            if days[index] is None:
+                days[index] = deserialize_logits(evaluator, payloads[index])
+                if day_hashes is not None:
+                    day, content_hash = day_hashes[index]
+                    self._vectors.put((key_id, user_id, day), content_hash, entry.digest, *days[index])
+            return days[index]
+
+        def local(run: range):
+            own = [load(index) for index in run]
+            sums = window_sums_of(evaluator, [ct for ct, _ in own], own[0][1], products=products)
+            if day_hashes is not None:
+                for index in range(run.stop, len(days)):
+                    load(index)
+            return sums
+
+        with self._core_budget.reserve(self._threads_per_request) as cores:
+            executor = self._shard_executor(entry.digest, cores) if all(day is None for day in days) else None
+            if executor is not None:
+                parts = executor.window_sums(evaluator, payloads, products=products, local=local)
+            elif day_hashes is None:
+                parts = [window_sums(evaluator, payloads, products=products)]
+            else:
+                parts = [local(range(len(days)))]
+            return finish_window_sums(evaluator, parts)
+
+    def extend_history_aggregates(
+        self,
+        key_id: str,
+        previous: Optional[Dict[str, Optional[Union[str, bytes]]]],
+        enc_logits_list_b64: Sequence[Union[str, bytes]],
+    ) -> List[Dict[str, Optional[str]]]:
+        """Running sum and volatility after each of ``enc_logits_list_b64`` (consecutive days, oldest first).
+
+        ``previous`` continues a chain: the day before's ``logits`` with its
+        ``sum`` and ``volatility`` (``None`` while the chain holds one day).
+        Without it a new chain starts. Each day costs one addition and one
+        square; only ``previous`` and the new logits are deserialized.
+        """
+        start = time.perf_counter()
+        with self._contexts.pinned(self._digest_for(key_id)) as entry:
+            ctx = entry.context
+
+            def load(payload: Optional[Union[str, bytes]]):
+                return None if payload is None else self._ts.ckks_vector_from(ctx, _ciphertext_bytes(payload))
+
+            prev_logits = prev_sum = prev_volatility = None
+            if previous is not None:
+                prev_logits, prev_sum, prev_volatility = (
+                    load(previous["logits"]), load(previous["sum"]), load(previous["volatility"])
+                )
+
+            aggregates = []
+            for payload in enc_logits_list_b64:
+                logits = load(payload)
+                enc_sum = logits if prev_sum is None else prev_sum + logits
+                enc_volatility = prev_volatility
+                if prev_logits is not None:
+                    diff_sq = (logits - prev_logits).square()  # Requires RelinKeys in context
+                    enc_volatility = diff_sq if prev_volatility is None else prev_volatility + diff_sq
+                aggregates.append(
+                    {
+                        "sum": _like("", enc_sum.serialize(), self._codec),
+                        "volatility": None if enc_volatility is None else _like("", enc_volatility.serialize(), self._codec),
+                    }
+                )
+                prev_logits, prev_sum, prev_volatility = logits, enc_sum, enc_volatility
+
+        elapsed = (time.perf_counter() - start) * 1000
+        LOGGER.info("Extended history aggregates by %d days for key_id=%s (%.1f ms)", len(aggregates), key_id, elapsed)
+        return aggregates
+
+    def run_aggregate_statistics(
+        self,
+        key_id: str,
+        last: Dict[str, Optional[str]],
+        base_sum: Optional[str] = None,
+        base_volatility: Optional[str] = None,
+        raw: bool = False,
+    ) -> Dict[str, Union[str, bytes]]:
+        """``run_encrypted_statistics`` from running aggregates (see ``extend_history_aggregates``).
+
+        The window's sum is ``last["sum"] - base_sum`` (the aggregate of the
+        day before the window, if in the same chain) and its volatility
+        ``last["volatility"] - base_volatility`` (the aggregate of the
+        window's first day). CKKS arithmetic is modular, so the differences
+        are exact even if a long chain's prefixes wrap around the modulus.
+        """
+        start = time.perf_counter()
+        with self._contexts.pinned(self._digest_for(key_id)) as entry:
+            ctx = entry.context
+
+            def load(payload: Optional[str]):
+                return None if payload is None else self._ts.ckks_vector_from(ctx, _ciphertext_bytes(payload))
+
+            enc_sum = load(last["sum"])
+            if base_sum is not None:
+                enc_sum -= load(base_sum)
+            enc_volatility = load(last["volatility"])
+            if enc_volatility is None:
+                enc_volatility = self._ts.ckks_vector(ctx, [0.0])
+            elif base_volatility is not None:
+                enc_volatility -= load(base_volatility)
+            stats = self._final_payloads(entry, {"encrypted_sum": enc_sum, "encrypted_volatility": enc_volatility}, raw)
+
+        elapsed = (time.perf_counter() - start) * 1000
+        LOGGER.info("Stats from running aggregates done for key_id=%s (%.1f ms)", key_id, elapsed)
+        return stats
+
+    # ------------------------------------------------------------------
+    # Packed history (packed_history profiles)
+    # ------------------------------------------------------------------
+    def _packed_history_for(self, entry: ContextEntry):
+        """``PackedHistory`` of a cached context, ``None`` if its profile or keys do not allow one."""
+        from app.fhe_core import packed_history
+        from app.fhe_core.rotation_keys import missing_rotation_steps
+
+        if entry.packed_history is None:
+            entry.packed_history = False
+            if entry.profile.packed_history:
+                evaluator = self._evaluator_for(entry)
+                steps = packed_history.rotation_steps(evaluator.slot_count, self._plan.num_classes)
+                if missing_rotation_steps(entry.context, steps):
+                    LOGGER.info("Eval context %s has no packed history rotation keys; history is not packed", entry.digest[:12])
+                else:
+                    entry.packed_history = packed_history.PackedHistory(evaluator, self._plan.num_classes)
+        return entry.packed_history or None
+
+    def history_days(self, key_id: str) -> int:
+        """Days a packed history of ``key_id`` holds (0 if its context cannot pack one)."""
+        with self._contexts.pinned(self._digest_for(key_id)) as entry:
+            packer = self._packed_history_for(entry)
+            return packer.days if packer else 0
+
+    def update_packed_history(
+        self,
+        key_id: str,
+        packed: Optional[bytes],
+        changes: Sequence[Tuple[date, Union[str, bytes], Sequence[Union[str, bytes]]]],
+    ) -> bytes:
+        """``packed`` (a new history if ``None``) with each ``(date, new logits, old logits)`` written in.
+
+        ``old logits`` are the predictions the date's block held before (the
+        overwritten one, or the day ``history_days`` earlier). Returns the
+        raw serialized history.
+        """
+        start = time.perf_counter()
+        with self._contexts.pinned(self._digest_for(key_id)) as entry:
+            packer = self._packed_history_for(entry)
+            if packer is None:
+                raise ValueError(f"Eval context for key_id={key_id} cannot pack the history")
+            evaluator = packer.evaluator
+            max_size = entry.profile.max_ciphertext_bytes
+
+            def load(payload: Union[str, bytes]):
+                return evaluator.from_vector(self._ts.ckks_vector_from(entry.context, _ciphertext_bytes(payload, max_size)))
+
+            history = packer.update(
+                None if packed is None else load(packed),
+                [(packer.position(day), load(new), [load(payload) for payload in old]) for day, new, old in changes],
+            )
+            data = evaluator.to_vector(history, evaluator.slot_count).serialize()
+        LOGGER.info(
+            "🗂️ Packed history updated with %d day(s) for key_id=%s (%.1f ms)",
+            len(changes),
+            key_id,
+            (time.perf_counter() - start) * 1000,
+        )
+        return data
+
+    def run_packed_statistics(
+        self, key_id: str, packed: bytes, first: date, days: int, raw: bool = False
+    ) -> Dict[str, Union[str, bytes]]:
+        """``run_encrypted_statistics`` of the ``days`` consecutive days from ``first``, from a packed history."""
+        start = time.perf_counter()
+        with self._contexts.pinned(self._digest_for(key_id)) as entry:
+            packer = self._packed_history_for(entry)
+            if packer is None:
+                raise ValueError(f"Eval context for key_id={key_id} cannot pack the history")
+            evaluator = packer.evaluator
+            vector = self._ts.ckks_vector_from(entry.context, _ciphertext_bytes(packed, entry.profile.max_ciphertext_bytes))
+            total, squares = packer.window(evaluator.from_vector(vector), packer.position(first), days)
+            size = self._plan.num_classes
+            enc_volatility = self._ts.ckks_vector(entry.context, [0.0]) if squares is None else evaluator.to_vector(squares, size)
+            stats = self._final_payloads(
+                entry, {"encrypted_sum": evaluator.to_vector(total, size), "encrypted_volatility": enc_volatility}, raw
+            )
+        elapsed = (time.perf_counter() - start) * 1000
+        LOGGER.info("Stats of %d days from the packed history done for key_id=%s (%.1f ms)", days, key_id, elapsed)
+        return stats
+
+    def run_pattern_analysis(
+        self,
+        enc_logits_list_b64: Sequence[Optional[Union[str, bytes]]],
+        key_id: str,
+        raw: bool = False,
+        user_id: Optional[str] = None,
+        day_hashes: Optional[Sequence[Tuple[date, str]]] = None,
+    ) -> Dict[str, Union[str, bytes]]:
+        """Per-class pattern features of consecutive days' logits (base64, or raw bytes with ``raw``).
+
+        - ``frequency``: ``sum_d y_d``, how strongly each class showed over the window
+        - ``transition_energy``: ``sum_d (y_d - y_{d-1})^2``, how much each class moved day to day
+        - ``persistence``: ``sum_d y_d * y_{d-1}``, large when a class stays high on
+          consecutive days (a run-length proxy)
+
+        Each is summed before one relinearization and rescale and returned at
+        the last level, so a window of any length costs three downloads and
+        three decryptions. ``user_id`` and ``day_hashes`` are as in
+        ``run_encrypted_statistics``.
+        """
+        start = time.perf_counter()
+        if not enc_logits_list_b64:
+            raise ValueError("No encrypted data provided for pattern analysis.")
+
+        with self._contexts.pinned(self._digest_for(key_id)) as entry:
+            evaluator = self._evaluator_for(entry)
+            sums = self._window_sums(
+                entry, key_id, enc_logits_list_b64, products=True, user_id=user_id, day_hashes=day_hashes
+            )
+            if sums.squares is not None:
+                energy = evaluator.to_vector(sums.squares, sums.size)
+                persistence = evaluator.to_vector(sums.products, sums.size)
+            else:
+                energy = persistence = self._ts.ckks_vector(entry.context, [0.0])
+            result = self._final_payloads(
+                entry,
+                {
+                    "frequency": evaluator.to_vector(sums.total, sums.size),
+                    "transition_energy": energy,
+                    "persistence": persistence,
+                },
+                raw,
+            )
+
+        elapsed = (time.perf_counter() - start) * 1000
+        LOGGER.info("Pattern analysis of %d days done for key_id=%s (%.1f ms)", len(enc_logits_list_b64), key_id, elapsed)
+        return result
+
+    def _final_payloads(self, entry: ContextEntry, vectors: Dict[str, Any], raw: bool) -> Dict[str, Union[str, bytes]]:
+        """Serialize result ``vectors`` for the client (base64, or raw bytes with ``raw``)."""
+        # Only decrypted from here on: keep the last prime alone
+        evaluator = self._evaluator_for(entry)
+        last = len(evaluator.levels) - 1
+        form = b"" if raw else ""
+        payloads = {}
+        for name, vector in vectors.items():
+            vector = evaluator.to_vector(evaluator.mod_switch_to(evaluator.from_vector(vector), last), vector.size())
+            payloads[name] = _like(form, vector.serialize(), self._codec)
+        return payloads
+
     def postprocess_prediction_to_summary(self, enc_logits_payload: str, target_date: date) -> str:
         """Optional hook: for now return logits as-is."""
         return enc_logits_payload
@@ -0,0 +1,52 @@
+"""Runs an engine computation over a user's recent stored logits, through its vector cache.
+
+Only the content hash of each stored day is read first. The engine reports
+which of those days it still holds deserialized (``cached_days``), and only
+the other days' ciphertexts are loaded from the database. If a cached day is
+evicted before the computation runs, it is repeated with every day loaded.
+"""
+from __future__ import annotations
+
+from datetime import date
+from typing import Any, Callable, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from app.repositories.emotion_data_repository import EmotionDataRepository
+from app.services.vector_cache import VectorEvicted
+
+
+def run_on_recent_days(
+    repo: EmotionDataRepository,
+    he_engine,
+    db: Session,
+    user_id: str,
+    days: int,
+    key_id: str,
+    run: Callable[..., Any],
+    raw: bool = False,
+) -> Optional[Tuple[Any, int]]:
+    """``run`` (an engine history method) over the last ``days`` days and the number of stored days.
+
+    ``None`` without any stored day.
+    """
+    day_hashes = repo.get_recent_prediction_hashes(db, user_id, days)
+    if not day_hashes:
+        return None
+
+    def run_loading(dates: List[date]) -> Any:
+        loaded = repo.get_enc_predictions_on(db, user_id, dates)
+        # A day rewritten since its hash was read is cached under the hash of what was loaded
+        hashes = [(day, loaded[day][1] if day in loaded else content_hash) for day, content_hash in day_hashes]
+        payloads = [loaded[day][0] if day in loaded else None for day, _ in day_hashes]
+        return run(payloads, key_id, raw=raw, user_id=user_id, day_hashes=hashes)
+
+    cached = set(he_engine.cached_days(key_id, user_id, day_hashes))
+    try:
+        result = run_loading([day for day, _ in day_hashes if day not in cached])
+    except VectorEvicted:
+        result = run_loading([day for day, _ in day_hashes])
+    return result, len(day_hashes)
+
+
+__all__ = ["run_on_recent_days"]
@@ -0,0 +1,198 @@
+"""Background queue for encrypted analysis jobs.
+
+A submitted job gets an id right away and waits in a bounded priority queue
+(lower ``priority`` first, then submission order). A few worker threads run
+the jobs, each with its own DB session, so web workers never block on a
+forward pass. When the queue is full, ``submit`` raises ``QueueFull`` with a
+retry hint derived from the average job duration.
+
+Finished jobs keep their result for ``ttl_seconds`` so clients can poll or
+stream it, then they are dropped. Only the newest ``max_finished_per_user``
+finished jobs of a user and ``max_finished`` overall are kept that long. A
+job lets go of its closure (and the request payload in it) once it has run.
+"""
+from __future__ import annotations
+
+import itertools
+import logging
+import math
+import queue
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Optional
+
+from sqlalchemy.orm import Session
+
+LOGGER = logging.getLogger(__name__)
+
+QUEUED, RUNNING, SUCCEEDED, FAILED = "queued", "running", "succeeded", "failed"
+
+# Assumed job duration until one has finished (an encrypted forward pass)
+INITIAL_JOB_SECONDS = 30.0
+
+
+class QueueFull(Exception):
+    """The job queue is at capacity; retry after ``retry_after`` seconds."""
+
+    def __init__(self, retry_after: int) -> None:
+        super().__init__(f"Analysis queue is full, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+@dataclass(eq=False)
+class Job:
+    job_id: str
+    user_id: str
+    priority: int
+    # Cleared once the job has run, so a finished job does not keep the request payload alive
+    run: Optional[Callable[[Session], Any]] = field(repr=False)
+    sequence: int = 0
+    status: str = QUEUED
+    submitted_at: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    result: Any = None
+    error: Optional[str] = None
+    # "invalid" for rejected inputs (ValueError), "internal" otherwise
+    error_kind: Optional[str] = None
+    done: threading.Event = field(default_factory=threading.Event, repr=False)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (SUCCEEDED, FAILED)
+
+
+class AnalysisJobQueue:
+    """Bounded priority queue of jobs served by ``workers`` threads."""
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session],
+        workers: int = 2,
+        max_queued: int = 32,
+        ttl_seconds: float = 3600.0,
+        max_finished_per_user: int = 16,
+        max_finished: int = 1024,
+    ) -> None:
+        if workers < 1 or max_queued < 1:
+            raise ValueError("Job queue needs at least one worker and one queue slot")
+        self._session_factory = session_factory
+        self.workers = workers
+        self.max_queued = max_queued
+        self.ttl_seconds = ttl_seconds
+        self.max_finished_per_user = max_finished_per_user
+        self.max_finished = max_finished
+        self._queue: "queue.PriorityQueue[tuple]" = queue.PriorityQueue(maxsize=max_queued)
+        self._sequence = itertools.count()
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+        self._average_seconds = INITIAL_JOB_SECONDS
+        self._closed = threading.Event()
+        self._threads = [
+            threading.Thread(target=self._work, name=f"analysis-job-{index}", daemon=True) for index in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, user_id: str, run: Callable[[Session], Any], priority: int = 5) -> Job:
+        """Queue ``run(db)`` for ``user_id``; raises ``QueueFull`` when no slot is free."""
+        self._prune()
+        job = Job(job_id=uuid.uuid4().hex, user_id=user_id, priority=priority, run=run, sequence=next(self._sequence))
+        with self._lock:
+            try:
+                self._queue.put_nowait((priority, job.sequence, job))
+            except queue.Full:
+                raise QueueFull(self.retry_after()) from None
+            self._jobs[job.job_id] = job
+        LOGGER.info("🗂️  Queued job %s for user=%s (priority %d, %d queued)", job.job_id, user_id, priority, self._queue.qsize())
+        return job
+
+    def get(self, job_id: str, user_id: str) -> Optional[Job]:
+        """The job, if it exists and belongs to ``user_id``."""
+        job = self._jobs.get(job_id)
+        if job is None or job.user_id != user_id:
+            return None
+        return job
+
+    def position(self, job: Job) -> Optional[int]:
+        """Jobs that run before ``job`` (``None`` once it has started)."""
+        if job.status != QUEUED:
+            return None
+        with self._queue.mutex:
+            return sum(1 for item in self._queue.queue if item[:2] < (job.priority, job.sequence))
+
+    def retry_after(self) -> int:
+        """Seconds until a queue slot is likely to free up (the next job start)."""
+        return max(1, math.ceil(self._average_seconds / self.workers))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = {status: 0 for status in (QUEUED, RUNNING, SUCCEEDED, FAILED)}
+            for job in self._jobs.values():
+                counts[job.status] += 1
+        return dict(counts, capacity=self.max_queued, workers=self.workers, average_seconds=self._average_seconds)
+
+    def close(self) -> None:
+        """Stop the workers once they finish their current job (queued jobs are dropped)."""
+        self._closed.set()
+        for _ in self._threads:
+            try:
+                # Wakes an idle worker; busy ones see the flag after their job
+                self._queue.put_nowait((-math.inf, next(self._sequence), None))
+            except queue.Full:
+                break
+
+    def _work(self) -> None:
+        while not self._closed.is_set():
+            _, _, job = self._queue.get()
+            if job is None:
+                return
+            job.status, job.started_at = RUNNING, datetime.now(timezone.utc)
+            start = time.perf_counter()
+            db = self._session_factory()
+            status = FAILED
+            try:
+                job.result = job.run(db)
+                status = SUCCEEDED
+            except ValueError as exc:
+                job.error, job.error_kind = str(exc), "invalid"
+            except Exception as exc:  # noqa: BLE001
+                LOGGER.error("❌ Job %s failed: %s", job.job_id, exc, exc_info=True)
+                job.error, job.error_kind = "Encrypted analysis failed", "internal"
+            finally:
+                db.close()
+                job.run = None
+            elapsed = time.perf_counter() - start
+            job.finished_at = datetime.now(timezone.utc)
+            job.status = status
+            self._average_seconds = 0.8 * self._average_seconds + 0.2 * elapsed
+            job.done.set()
+            LOGGER.info("🏁 Job %s %s in %.1f s", job.job_id, job.status, elapsed)
+            self._prune()
+
+    def _prune(self) -> None:
+        """Drop finished jobs past ``ttl_seconds`` or beyond the newest ``max_finished(_per_user)``."""
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            finished = sorted(
+                (job for job in self._jobs.values() if job.finished), key=lambda job: job.finished_at, reverse=True
+            )
+            kept_per_user: Dict[str, int] = {}
+            kept = 0
+            for job in finished:
+                kept_for_user = kept_per_user.get(job.user_id, 0)
+                if (
+                    (now - job.finished_at).total_seconds() > self.ttl_seconds
+                    or kept_for_user >= self.max_finished_per_user
+                    or kept >= self.max_finished
+                ):
+                    del self._jobs[job.job_id]
+                else:
+                    kept_per_user[job.user_id] = kept_for_user + 1
+                    kept += 1
+
+
+__all__ = ["AnalysisJobQueue", "Job", "QueueFull"]
@@ -0,0 +1,90 @@
+"""Memory-budgeted cache of deserialized per-day prediction ciphertexts.
+
+History statistics and pattern analysis read the same stored predictions
+on every dashboard refresh. This cache keeps their deserialized SEAL
+ciphertexts, so a refresh only loads and deserializes the days that changed.
+
+Entries are keyed by ``(key_id, user_id, date)`` and remember the content
+hash of the stored payload and the digest of the context they were loaded
+into. A lookup only hits when both still match, so an overwritten day or a
+re-registered key_id is never served stale; ``discard`` just frees the
+memory early. Each entry is charged by its ciphertext's polynomial data, and
+the least recently used entries go when the total exceeds the byte budget.
+"""
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import date
+from typing import Any, Iterable, Optional, Tuple
+
+# (key_id, user_id, date)
+VectorKey = Tuple[str, str, date]
+
+
+class VectorEvicted(LookupError):
+    """A day expected in the cache (see ``HEEmotionEngine.cached_days``) was evicted before use."""
+
+
+def ciphertext_bytes(ct: Any) -> int:
+    """Memory held by a SEAL ciphertext's polynomials (64-bit words)."""
+    return ct.size() * ct.poly_modulus_degree() * ct.coeff_modulus_size() * 8
+
+
+@dataclass(eq=False)
+class _Vector:
+    content_hash: str
+    digest: str
+    ciphertext: Any
+    length: int
+    nbytes: int
+
+
+class VectorCache:
+    """Byte-budgeted LRU of deserialized prediction ciphertexts (a budget of 0 disables it)."""
+
+    def __init__(self, budget_bytes: int) -> None:
+        self.budget_bytes = budget_bytes
+        self._entries: "OrderedDict[VectorKey, _Vector]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: VectorKey, content_hash: str, digest: str) -> Optional[Tuple[Any, int]]:
+        """Ciphertext and vector length cached for ``key``, if it holds ``content_hash`` loaded into context ``digest``.
+
+        Cached ciphertexts are shared: callers must not modify them.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.content_hash != content_hash or entry.digest != digest:
+                return None
+            self._entries.move_to_end(key)
+            return entry.ciphertext, entry.length
+
+    def put(self, key: VectorKey, content_hash: str, digest: str, ct: Any, length: int) -> None:
+        nbytes = ciphertext_bytes(ct)
+        if nbytes > self.budget_bytes:
+            return
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = _Vector(content_hash, digest, ct, length, nbytes)
+            self._bytes += nbytes
+            while self._bytes > self.budget_bytes:
+                _, victim = self._entries.popitem(last=False)
+                self._bytes -= victim.nbytes
+
+    def discard(self, user_id: str, dates: Iterable[date]) -> None:
+        """Drop the entries of ``user_id`` on ``dates`` under every key_id."""
+        dates = set(dates)
+        with self._lock:
+            for key in [key for key in self._entries if key[1] == user_id and key[2] in dates]:
+                self._remove(key)
+
+    def _remove(self, key: VectorKey) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.nbytes
+
+
+__all__ = ["VectorCache", "VectorEvicted", "VectorKey", "ciphertext_bytes"]
@@ -0,0 +1,134 @@
+"""Shared fixtures: the Streamlit client's modules, a fast-profile context and a SQLite session."""
+import gc
+import hashlib
+import importlib.util
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.dialects.mysql import LONGBLOB, LONGTEXT
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.core.config import settings
+from app.core.db import Base
+from app.fhe_core import batching
+from app.fhe_core.he_plan import CNNPlan
+from app.fhe_core.plan_artifact import save_plan
+from app.fhe_core.rotation_keys import required_rotation_steps
+from app.fhe_core.tenseal_context import PROFILES, eval_context
+from app.models import emotion_aggregate, emotion_data, emotion_history, user  # noqa: F401 - registers the tables
+from app.services import he_service
+from app.services.he_service import HEEmotionEngine
+
+
+@compiles(LONGTEXT, "sqlite")
+def _longtext_on_sqlite(type_, compiler, **kw):
+    return "TEXT"
+
+
+@compiles(LONGBLOB, "sqlite")
+def _longblob_on_sqlite(type_, compiler, **kw):
+    return "BLOB"
+
+
+def _sha2(value, bits):
+    # MySQL's SHA2() for the repository's content hashes
+    if value is None:
+        return None
+    data = value.encode("utf-8") if isinstance(value, str) else bytes(value)
+    return hashlib.new(f"sha{bits}", data).hexdigest()
+
+
+CLIENT_DIR = Path(__file__).resolve().parents[2] / "client" / "streamlit_app"
+
+
+def load_client_module(name: str):
+    """Import ``client/streamlit_app/<name>.py``; its sibling imports resolve against that directory."""
+    if str(CLIENT_DIR) not in sys.path:
+        sys.path.append(str(CLIENT_DIR))
+    spec = importlib.util.spec_from_file_location(f"client_{name}", CLIENT_DIR / f"{name}.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def random_plan(
+    channels: int = 2,
+    hidden: int = 8,
+    image_size: int = batching.IMAGE_SIZE,
+    kernel_size: int = batching.KERNEL_SIZE,
+    stride: int = batching.STRIDE,
+    seed: int = 0,
+) -> CNNPlan:
+    """A ``CNNPlan`` with small random weights (7 classes, like FHEEmotionCNN)."""
+    rng = np.random.default_rng(seed)
+    windows = batching.windows_per_image(image_size, kernel_size, stride)
+    return CNNPlan(image_size, stride, {
+        "conv1_weight": rng.normal(size=(channels, 1, kernel_size, kernel_size)) * 0.1,
+        "conv1_bias": rng.normal(size=channels) * 0.1,
+        "fc1_weight": rng.normal(size=(channels * windows, hidden)) * 0.1,
+        "fc1_bias": rng.normal(size=hidden) * 0.1,
+        "fc2_weight": rng.normal(size=(hidden, batching.NUM_CLASSES)),
+        "fc2_bias": rng.normal(size=batching.NUM_CLASSES),
+    })
+
+
+def plain_forward(plan: CNNPlan, image: np.ndarray) -> np.ndarray:
+    """FHEEmotionCNN's forward pass (x ** 2 activations) on one image, in NumPy."""
+    weights, k = plan.weights, plan.kernel_size
+    windows = np.lib.stride_tricks.sliding_window_view(image, (k, k))[:: plan.stride, :: plan.stride]
+    conv = weights["conv1_weight"].reshape(plan.channels, -1) @ windows.reshape(-1, k * k).T
+    x = (conv + weights["conv1_bias"][:, None]).flatten() ** 2
+    x = (x @ weights["fc1_weight"] + weights["fc1_bias"]) ** 2
+    return x @ weights["fc2_weight"] + weights["fc2_bias"]
+
+
+@pytest.fixture(scope="session")
+def fast_context():
+    """Secret-key context with the "fast" profile parameters and no Galois keys."""
+    return PROFILES["fast"].create_context(generate_galois_keys=False)
+
+
+@pytest.fixture(scope="session")
+def fast_plan():
+    return random_plan()
+
+
+@pytest.fixture(scope="session")
+def fast_eval_bytes(fast_context, fast_plan):
+    """Serialized eval context of ``fast_context`` with the im2col batch-1 rotation keys."""
+    steps = required_rotation_steps(fast_plan, PROFILES["fast"].slot_count, [("im2col", 1)])
+    return eval_context(fast_context, steps).serialize()
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch, fast_plan):
+    """``HEEmotionEngine`` serving ``fast_plan`` with its contexts under ``tmp_path``."""
+    plan_path = tmp_path / "plan.heplan"
+    save_plan(fast_plan, plan_path)
+    monkeypatch.setattr(settings, "HE_PLAN_PATH", str(plan_path))
+    monkeypatch.setattr(settings, "HE_THREADS", 1)
+    monkeypatch.setattr(HEEmotionEngine, "_bootstrap_project_root", lambda self: tmp_path)
+    monkeypatch.setattr(he_service, "CONTEXT_DIR", tmp_path / "he_contexts")
+    he_engine = HEEmotionEngine()
+    yield he_engine
+    he_engine.close()
+    # The context cache's loader refers back to the engine: free its contexts now, not at the next full collection
+    del he_engine
+    gc.collect()
+
+
+@pytest.fixture
+def db():
+    """Session on an in-memory SQLite database with every table."""
+    sql_engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool, future=True)
+    event.listen(sql_engine, "connect", lambda connection, _: connection.create_function("sha2", 2, _sha2))
+    Base.metadata.create_all(sql_engine)
+    session = sessionmaker(bind=sql_engine, autoflush=False, future=True)()
+    yield session
+    session.close()
+    sql_engine.dispose()
@@ -0,0 +1,194 @@
+"""Micro-batching of single-image requests and the merged input layout."""
+import base64
+import threading
+from datetime import date, timedelta
+
+import numpy as np
+import pytest
+import tenseal as ts
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api import routes_emotion
+from app.core.db import get_db
+from app.core.security import get_current_user
+from app.fhe_core import batching
+from app.fhe_core.seal_ops import SealEvaluator
+from app.fhe_core.tenseal_context import PROFILES, eval_context
+from app.models.user import User
+from app.repositories.emotion_data_repository import EmotionDataRepository
+from app.services.batch_scheduler import MicroBatchScheduler
+from app.services.emotion_service import EmotionService
+
+
+class Engine:
+    """Records merged calls and answers each payload with its reverse."""
+
+    def __init__(self, reject=()):
+        self.calls = []
+        self.reject = set(reject)
+        self.lock = threading.Lock()
+
+    def run_encrypted_merged_inference(self, payloads, key_id, batch_size, layout):
+        with self.lock:
+            self.calls.append((list(payloads), key_id, batch_size, layout))
+        if self.reject.intersection(payloads):
+            raise ValueError("bad payload")
+        return [payload[::-1] for payload in payloads]
+
+
+def run_concurrently(scheduler, payloads, key_id="k", batch_size=4, layout="replicated"):
+    results, errors = {}, {}
+
+    def call(payload):
+        try:
+            results[payload] = scheduler.run_encrypted_inference(payload, key_id, batch_size, layout)
+        except Exception as exc:  # noqa: BLE001
+            errors[payload] = exc
+
+    threads = [threading.Thread(target=call, args=(payload,)) for payload in payloads]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    return results, errors
+
+
+def test_concurrent_requests_share_one_forward_pass():
+    engine = Engine()
+    scheduler = MicroBatchScheduler(engine, max_batch_size=4, max_wait_ms=2000)
+
+    results, errors = run_concurrently(scheduler, ["ab", "cd", "ef", "gh"])
+
+    assert not errors
+    assert results == {"ab": "ba", "cd": "dc", "ef": "fe", "gh": "hg"}
+    assert len(engine.calls) == 1  # the full group closes before the wait ends
+    payloads, key_id, batch_size, layout = engine.calls[0]
+    assert sorted(payloads) == ["ab", "cd", "ef", "gh"]
+    assert (key_id, batch_size, layout) == ("k", 4, "replicated")
+    stats = scheduler.stats()
+    assert (stats["requests"], stats["batches"], stats["mean_batch_size"]) == (4, 1, 4.0)
+    assert stats["batch_sizes"] == {"4": 1}
+
+
+def test_groups_are_split_by_key_and_capacity():
+    engine = Engine()
+    scheduler = MicroBatchScheduler(engine, max_batch_size=2, max_wait_ms=2000)
+
+    results, errors = run_concurrently(scheduler, ["a1", "a2", "a3", "a4"])
+    other, _ = run_concurrently(scheduler, ["b1"], key_id="other", batch_size=2)
+
+    assert not errors and len(results) == 4 and other == {"b1": "1b"}
+    assert sorted(len(call[0]) for call in engine.calls) == [1, 2, 2]
+    assert all(call[1] == "k" for call in engine.calls if len(call[0]) == 2)
+
+
+def test_rejected_group_falls_back_to_single_requests():
+    engine = Engine(reject=["bad"])
+    scheduler = MicroBatchScheduler(engine, max_batch_size=3, max_wait_ms=2000)
+
+    results, errors = run_concurrently(scheduler, ["ok", "bad", "fine"], batch_size=3)
+
+    assert results == {"ok": "ko", "fine": "enif"}
+    assert isinstance(errors["bad"], ValueError)
+    assert [len(call[0]) for call in engine.calls] == [3, 1, 1, 1]
+
+
+def test_single_requests_do_not_wait():
+    engine = Engine()
+    for scheduler, batch_size in ((MicroBatchScheduler(engine, max_wait_ms=0), 4), (MicroBatchScheduler(engine), 1)):
+        assert scheduler.run_encrypted_inference("xy", "k", batch_size) == "yx"
+        assert scheduler.stats()["mean_wait_ms"] < 1000
+
+    with pytest.raises(ValueError):
+        MicroBatchScheduler(Engine(reject=["bad"])).run_encrypted_inference("bad", "k", 1)
+
+
+class RouteEngine(Engine):
+    """``Engine`` answering base64 payloads, with what storing a prediction needs."""
+
+    def run_encrypted_merged_inference(self, payloads, key_id, batch_size, layout):
+        with self.lock:
+            self.calls.append((list(payloads), key_id, batch_size, layout))
+        return [base64.b64encode(base64.b64decode(payload)[::-1]).decode() for payload in payloads]
+
+    def run_encrypted_inference(self, payload, key_id, layout="im2col"):
+        raise AssertionError("batch_size > 1 goes through the scheduler")
+
+    def prediction_level(self, key_id):
+        return None
+
+    def history_days(self, key_id):
+        return 0
+
+    def extend_history_aggregates(self, key_id, previous, logits):
+        return [{"sum": "", "volatility": None} for _ in logits]
+
+    def forget_days(self, user_id, days):
+        pass
+
+
+def test_analyze_today_requests_share_one_forward_pass(db):
+    engine = RouteEngine()
+    app = FastAPI()
+    app.include_router(routes_emotion.router)
+    app.state.emotion_service = EmotionService(
+        EmotionDataRepository(), engine, MicroBatchScheduler(engine, max_batch_size=2, max_wait_ms=2000)
+    )
+    app.dependency_overrides[get_current_user] = lambda: User(user_id="alice")
+    app.dependency_overrides[get_db] = lambda: db
+    client = TestClient(app)
+    days = [date.today() - timedelta(days=offset) for offset in (1, 0)]
+    images = {day: base64.b64encode(f"image-{day}".encode()).decode() for day in days}
+    bodies = {}
+
+    def post(day):
+        body = {"ciphertext": images[day], "key_id": "key-1", "date": day.isoformat(), "batch_size": 2}
+        bodies[day] = client.post("/emotion/analyze-today", json={**body, "layout": "replicated"}).json()
+
+    threads = [threading.Thread(target=post, args=(day,)) for day in days]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+
+    assert len(engine.calls) == 1
+    payloads, key_id, batch_size, layout = engine.calls[0]
+    assert sorted(payloads) == sorted(images.values())
+    assert (key_id, batch_size, layout) == ("key-1", 2, "replicated")
+    repo = EmotionDataRepository()
+    for day in days:
+        logits = f"image-{day}".encode()[::-1]
+        assert bodies[day] == {"ciphertext": base64.b64encode(logits).decode(), "date": day.isoformat()}
+        assert repo.read_ciphertext(repo.get_enc_prediction(db, "alice", day)) == logits
+
+
+def test_merge_input_vector_pads_to_the_slot_count(fast_plan):
+    image = np.random.default_rng(0).uniform(size=(batching.IMAGE_SIZE, batching.IMAGE_SIZE))
+
+    vector = fast_plan.merge_input_vector(image, "replicated", 2, 8192)
+
+    assert len(vector) == 8192
+    single = fast_plan.input_vector([image, np.zeros_like(image)], "replicated", 8192)
+    assert vector[: len(single)] == single
+    assert not any(vector[len(single):])
+
+
+def test_merged_inputs_equal_the_batch_input(fast_context, fast_plan):
+    slots = PROFILES["fast"].slot_count
+    evaluator = SealEvaluator(eval_context(fast_context, fast_plan.merge_rotation_steps(slots, "replicated", 2)))
+    encoded = fast_plan.encode(evaluator, 2, evaluator.context.global_scale, "replicated")
+    rng = np.random.default_rng(1)
+    images = [rng.uniform(size=(batching.IMAGE_SIZE, batching.IMAGE_SIZE)) for _ in range(2)]
+    inputs = [
+        SealEvaluator.from_vector(ts.ckks_vector(evaluator.context, fast_plan.merge_input_vector(image, "replicated", 2, slots)))
+        for image in images
+    ]
+
+    merged = encoded.merge_inputs(evaluator, inputs)
+
+    expected = fast_plan.input_vector(images, "replicated", slots)
+    out = ts.ckks_vector_from(fast_context, evaluator.to_vector(merged, len(expected)).serialize()).decrypt()
+    np.testing.assert_allclose(out, expected, atol=1e-3)
+    with pytest.raises(ValueError, match="between 1 and 2"):
+        encoded.merge_inputs(evaluator, inputs * 2)
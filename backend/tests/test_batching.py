@@ -0,0 +1,137 @@
+"""Batched im2col layout, the expanded FC weights and the client's mirror of it."""
+import numpy as np
+import pytest
+import tenseal as ts
+
+from app.fhe_core import batching
+
+from conftest import load_client_module
+
+
+@pytest.fixture(scope="module")
+def client_batching():
+    return load_client_module("batching")
+
+
+@pytest.fixture(scope="module")
+def context():
+    ctx = ts.context(ts.SCHEME_TYPE.CKKS, poly_modulus_degree=16384, coeff_mod_bit_sizes=[60, 40, 60])
+    ctx.global_scale = 2**40
+    return ctx
+
+
+def images(count, seed=0):
+    return list(np.random.default_rng(seed).uniform(0, 1, size=(count, batching.IMAGE_SIZE, batching.IMAGE_SIZE)))
+
+
+def test_single_image_matches_tenseal_im2col(context):
+    (image,) = images(1)
+    enc, windows = ts.im2col_encoding(context, image.tolist(), batching.KERNEL_SIZE, batching.KERNEL_SIZE, batching.STRIDE)
+
+    assert windows == batching.windows_per_image()
+    np.testing.assert_allclose(enc.decrypt(), batching.im2col_batch([image]), atol=1e-4)
+
+
+def test_batch_slot_layout():
+    batch = images(3)
+    values = np.asarray(batching.im2col_batch(batch))
+    windows = batching.windows_per_image()
+    side = (batching.IMAGE_SIZE - batching.KERNEL_SIZE) // batching.STRIDE + 1
+
+    assert values.shape == (batching.batch_vector_size(3),)
+    for b, image in enumerate(batch):
+        for w in (0, 10, windows - 1):
+            row, col = divmod(w, side)
+            patch = image[row * batching.STRIDE :, col * batching.STRIDE :][: batching.KERNEL_SIZE, : batching.KERNEL_SIZE]
+            for k in (0, 40, batching.KERNEL_SIZE**2 - 1):
+                assert values[k * 3 * windows + b * windows + w] == patch.flat[k]
+    # Kernel rows past 81 are padding
+    assert not values[batching.KERNEL_SIZE**2 * 3 * windows :].any()
+
+
+def test_max_batch_size():
+    assert batching.max_batch_size(8192) == 1
+    assert batching.max_batch_size(16384) == 2
+
+
+def test_expanded_weights_keep_images_apart():
+    rng = np.random.default_rng(1)
+    channels, windows, hidden, classes, batch = 3, 5, 4, batching.NUM_CLASSES, 2
+    fc1 = rng.normal(size=(channels * windows, hidden))
+    fc2 = rng.normal(size=(hidden, classes))
+    bias = rng.normal(size=classes)
+    # Per-image activations in (channel, window) order, then packed as c * (B * windows) + b * windows + w
+    activations = rng.normal(size=(batch, channels, windows))
+    packed = activations.transpose(1, 0, 2).reshape(-1)
+
+    hidden_out = packed @ batching.expand_fc1_weight(fc1, batch, channels, windows)
+    logits = hidden_out @ batching.expand_block_diagonal(fc2, batch) + batching.tile_bias(bias, batch)
+
+    expected = np.stack([activations[b].reshape(-1) @ fc1 @ fc2 + bias for b in range(batch)])
+    np.testing.assert_allclose(batching.split_logits(logits, batch), expected)
+
+
+def test_split_logits_needs_every_image():
+    with pytest.raises(ValueError):
+        batching.split_logits(np.zeros(10), 2)
+
+
+def test_client_mirrors_server_layout(client_batching, context):
+    batch = images(2, seed=2)
+
+    assert client_batching.im2col_batch(batch) == batching.im2col_batch(batch)
+
+
+def test_expand_for_image_reads_one_image():
+    rng = np.random.default_rng(3)
+    hidden, classes, batch = 4, batching.NUM_CLASSES, 3
+    fc2 = rng.normal(size=(hidden, classes))
+    activations = rng.normal(size=(batch, hidden))
+
+    for index in range(batch):
+        logits = activations.reshape(-1) @ batching.expand_for_image(fc2, index, batch)
+        np.testing.assert_allclose(logits, activations[index] @ fc2)
+    with pytest.raises(ValueError):
+        batching.expand_for_image(fc2, batch, batch)
+
+
+def test_replicated_layout_stacks_unpadded_copies():
+    batch = images(2, seed=4)
+    copy_size = batching.replicated_copy_size(2)
+    slots = batching.im2col_replicated(batch, 3)
+
+    assert copy_size == batching.KERNEL_SIZE**2 * batching.windows_per_image() * 2
+    assert len(slots) == 3 * copy_size
+    first = np.asarray(slots[:copy_size]).reshape(batching.KERNEL_SIZE**2, -1)
+    padded = np.asarray(batching.im2col_batch(batch)).reshape(batching.kernel_rows(), -1)
+    np.testing.assert_array_equal(first, padded[: batching.KERNEL_SIZE**2])
+    assert slots[copy_size:2 * copy_size] == slots[:copy_size] == slots[2 * copy_size :]
+
+
+def test_replicated_copies_fit_the_slots():
+    assert batching.replicated_copies(1, 16384, 16) == 4
+    assert batching.replicated_copies(1, 8192, 16) == 2
+    assert batching.replicated_copies(1, 16384, 3) == 3  # never more copies than channels
+    assert batching.replicated_copies(3, 8192, 16) == 0
+    assert batching.max_replicated_batch_size(16384) == 4
+
+
+def test_replicated_activation_slots():
+    windows = batching.windows_per_image()
+    copy_size = batching.replicated_copy_size(1)
+    slots = batching.replicated_activation_slots(4, 2, 1).reshape(4, windows)
+
+    # channel g * copies + r sits in copy r, group g
+    np.testing.assert_array_equal(slots[0], np.arange(windows))
+    np.testing.assert_array_equal(slots[1], copy_size + np.arange(windows))
+    np.testing.assert_array_equal(slots[2], windows + np.arange(windows))
+    np.testing.assert_array_equal(slots[3], copy_size + windows + np.arange(windows))
+
+
+def test_client_mirrors_replicated_layout(client_batching, context):
+    batch = images(1, seed=5)
+    copies = batching.replicated_copies(1, 8192, client_batching.CONV_CHANNELS)
+
+    assert client_batching.replicated_copies(context, 1) == copies
+    assert client_batching.im2col_replicated(context, batch) == batching.im2col_replicated(batch, copies)
+    assert client_batching.max_batch_size(context) == batching.max_replicated_batch_size(8192)
@@ -0,0 +1,82 @@
+"""Binary (application/octet-stream) ciphertext routes and their framing."""
+from datetime import date
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api import routes_emotion
+from app.api.binary import LENGTHS_HEADER, OCTET_STREAM
+from app.core.security import get_current_user
+from app.models.user import User
+
+from conftest import load_client_module
+
+
+class EmotionService:
+    """Answers every ciphertext with its reverse and records the calls."""
+
+    def __init__(self):
+        self.calls = []
+
+    def analyze_and_store_raw(self, db, user_id, target_date, enc_image, key_id, layout, batch_size):
+        self.calls.append((user_id, target_date, key_id, layout, batch_size))
+        if enc_image == b"bad":
+            raise ValueError("bad ciphertext")
+        return enc_image[::-1]
+
+    def analyze_batch_and_store_raw(self, db, user_id, target_dates, enc_images, key_id, layout):
+        self.calls.append((user_id, target_dates, key_id, layout))
+        return [enc_images[:2] * (i + 1) for i in range(len(target_dates))]
+
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+    app.include_router(routes_emotion.router)
+    app.state.emotion_service = EmotionService()
+    app.dependency_overrides[get_current_user] = lambda: User(user_id="alice")
+    app.dependency_overrides[routes_emotion.get_db] = lambda: None
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+def post(client, path, body, **headers):
+    return client.post(f"/emotion/{path}/binary", content=body, headers={"Content-Type": OCTET_STREAM, **headers})
+
+
+def test_analyze_today_takes_and_returns_raw_bytes(client):
+    response = post(client, "analyze-today", b"\x00\x01\xff", **{"X-Key-Id": "k", "X-Date": "2026-01-02", "X-Batch-Size": "2"})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == OCTET_STREAM
+    assert response.content == b"\xff\x01\x00"
+    assert response.headers["X-Date"] == "2026-01-02"
+    assert client.app.state.emotion_service.calls == [("alice", date(2026, 1, 2), "k", "im2col", 2)]
+
+
+def test_analyze_today_rejects_bad_input(client):
+    assert post(client, "analyze-today", b"", **{"X-Key-Id": "k"}).status_code == 422
+    assert post(client, "analyze-today", b"bad", **{"X-Key-Id": "k"}).status_code == 422
+    assert post(client, "analyze-today", b"ct", **{"X-Key-Id": "k", "X-Layout": "diagonal"}).status_code == 422
+    assert post(client, "analyze-today", b"ct").status_code == 422
+
+
+def test_analyze_batch_frames_one_ciphertext_per_date(client):
+    response = post(client, "analyze-batch", b"abcdef", **{"X-Key-Id": "k", "X-Dates": "2026-01-02, 2026-01-03"})
+
+    assert response.status_code == 200
+    assert response.headers[LENGTHS_HEADER] == "2,4"
+    assert response.content == b"ababab"
+    assert response.headers["X-Dates"] == "2026-01-02,2026-01-03"
+
+    for dates in ("2026-01-02,2026-01-02", "2026-13-01", ""):
+        assert post(client, "analyze-batch", b"abc", **{"X-Key-Id": "k", "X-Dates": dates}).status_code == 422
+
+
+def test_client_splits_framed_responses(client):
+    pytest.importorskip("requests")
+    api_client = load_client_module("api_client")
+    response = post(client, "analyze-batch", b"xyz", **{"X-Key-Id": "k", "X-Dates": "2026-01-02,2026-01-03,2026-01-04"})
+
+    assert api_client._split_framed(response) == [b"xy", b"xyxy", b"xyxyxy"]
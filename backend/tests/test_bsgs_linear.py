@@ -0,0 +1,114 @@
+"""Baby-step/giant-step diagonal plans against plain matrix products."""
+import numpy as np
+import pytest
+import tenseal as ts
+
+from app.fhe_core.bsgs_linear import DiagonalPlan, EncodedDiagonalLinear, baby_giant_split, hybrid_diagonals
+from app.fhe_core.seal_ops import SealEvaluator
+
+
+@pytest.fixture(scope="module")
+def evaluator():
+    ctx = ts.context(ts.SCHEME_TYPE.CKKS, poly_modulus_degree=8192, coeff_mod_bit_sizes=[60, 40, 40, 60])
+    ctx.global_scale = 2**40
+    ctx.generate_galois_keys()
+    return SealEvaluator(ctx)
+
+
+def replay(plan, slots):
+    """Plaintext replay of ``bsgs_linear.evaluate`` (``np.roll(x, -s)`` is a left rotation)."""
+    length = len(slots)
+    acc = None
+    for j in range(plan.giant - 1, -1, -1):
+        if acc is not None:
+            acc = np.roll(acc, -plan.baby)
+        for k, pattern in plan.blocks.get(j, {}).items():
+            diagonal = np.tile(pattern, length // len(pattern)) if plan.tiled else np.resize(np.pad(pattern, (0, length)), length)
+            term = diagonal * np.roll(slots, -k)
+            acc = term if acc is None else acc + term
+    for step in plan.fold_steps:
+        acc = acc + np.roll(acc, -step)
+    bias = np.tile(plan.bias, length // len(plan.bias)) if plan.tiled else np.pad(plan.bias, (0, length - len(plan.bias)))
+    return acc + bias
+
+
+def encrypt(evaluator, slots):
+    return SealEvaluator.from_vector(ts.ckks_vector(evaluator.context, list(slots)))
+
+
+def test_baby_giant_split_covers_every_diagonal():
+    for count in (1, 7, 8, 128, 784, 1024):
+        baby, giant = baby_giant_split(count)
+        assert baby & (baby - 1) == 0
+        assert baby * giant >= count > baby * (giant - 1)
+    assert baby_giant_split(128) == (16, 8)
+
+
+def test_hybrid_diagonals_reject_wide_outputs():
+    with pytest.raises(ValueError):
+        hybrid_diagonals(np.ones((9, 4)))
+
+
+def test_hybrid_plan_replays_to_matmul():
+    rng = np.random.default_rng(0)
+    matrix, bias, x = rng.normal(size=(7, 12)), rng.normal(size=7), rng.normal(size=12)
+    plan = DiagonalPlan.hybrid(matrix, bias)
+
+    out = replay(plan, np.tile(np.pad(x, (0, 4)), 4))
+    np.testing.assert_allclose(out[:7], matrix @ x + bias)
+    np.testing.assert_allclose(out[8:15], out[:7])  # replicated at period 8
+    assert plan.rotations(64) == {1, plan.baby, 8}
+
+
+def test_packed_plan_replays_to_matmul():
+    rng = np.random.default_rng(1)
+    matrix, bias, x = rng.normal(size=(5, 12)), rng.normal(size=5), rng.normal(size=12)
+    plan = DiagonalPlan.packed(matrix, bias)
+
+    out = replay(plan, np.resize(x, 64))
+    np.testing.assert_allclose(out[:5], matrix @ x + bias)
+    np.testing.assert_allclose(out[5:], 0, atol=1e-12)
+    assert plan.input_slots <= 64
+
+
+def test_packed_plan_rejects_short_input_period():
+    with pytest.raises(ValueError):
+        DiagonalPlan.packed(np.ones((2, 8)), np.zeros(2), input_period=4)
+
+
+def test_encrypted_hybrid_matches_matmul(evaluator):
+    rng = np.random.default_rng(2)
+    matrix, bias, x = rng.normal(size=(16, 64)) * 0.1, rng.normal(size=16), rng.uniform(-1, 1, size=64)
+    plan = DiagonalPlan.hybrid(matrix, bias)
+    expected = matrix @ x + bias
+    scale = evaluator.context.global_scale
+
+    on_the_fly = plan.apply(evaluator, encrypt(evaluator, evaluator.tile(x)))
+    encoded = EncodedDiagonalLinear(evaluator, plan, 0, scale)
+    pre_encoded = encoded(evaluator, encrypt(evaluator, evaluator.tile(x)))
+
+    for ct in (on_the_fly, pre_encoded):
+        assert evaluator.level_of(ct) == 1
+        out = np.asarray(evaluator.to_vector(ct, 32).decrypt())
+        np.testing.assert_allclose(out[:16], expected, atol=1e-3)
+        np.testing.assert_allclose(out[16:], expected, atol=1e-3)
+
+
+def test_encrypted_packed_layers_chain(evaluator):
+    rng = np.random.default_rng(3)
+    fc1, b1 = rng.normal(size=(10, 49)) * 0.1, rng.normal(size=10)
+    fc2, b2 = rng.normal(size=(3, 10)), rng.normal(size=3)
+    x = rng.uniform(-1, 1, size=49)
+    plan1 = DiagonalPlan.packed(fc1, b1, replicate=True)
+    plan2 = DiagonalPlan.packed(fc2, b2, input_period=plan1.replicate_period)
+
+    hidden = plan1.apply(evaluator, encrypt(evaluator, np.resize(x, evaluator.slot_count)))
+    out = evaluator.to_vector(plan2.apply(evaluator, hidden), 3).decrypt()
+    np.testing.assert_allclose(out, fc2 @ (fc1 @ x + b1) + b2, atol=1e-3)
+
+
+def test_plan_must_fit_the_slots(evaluator):
+    plan = DiagonalPlan.packed(np.ones((2, 2 * evaluator.slot_count)), np.zeros(2))
+
+    with pytest.raises(ValueError):
+        plan.apply(evaluator, encrypt(evaluator, [1.0]))
@@ -0,0 +1,92 @@
+"""Prediction ciphertexts in the blob column or the file store, and moving legacy rows there."""
+import base64
+import hashlib
+from datetime import date, timedelta
+
+import pytest
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.orm import sessionmaker
+
+from app.models.emotion_data import EmotionData
+from app.repositories.ciphertext_store import CiphertextStore
+from app.repositories.emotion_data_repository import EmotionDataRepository
+from app.repositories.migrate_predictions import ensure_schema, migrate
+
+DAY = date(2026, 1, 1)
+DATA = b"\x00HE\x00" + bytes(range(256)) * 4
+
+
+@pytest.fixture(params=["blob", "file"])
+def repo(request, tmp_path):
+    return EmotionDataRepository(CiphertextStore(request.param, tmp_path / "store"))
+
+
+def test_round_trip_through_either_backend(repo, db):
+    record = repo.upsert_enc_prediction(db, "alice", DAY, DATA, level=6)
+
+    assert (record.enc_ref, record.enc_size, record.enc_level) == (hashlib.sha256(DATA).hexdigest(), len(DATA), 6)
+    assert record.enc_prediction is None
+    assert (record.enc_blob is None) == (repo.store.backend == "file")
+    assert repo.read_ciphertext(repo.get_enc_prediction(db, "alice", DAY)) == DATA
+    assert repo.get_enc_predictions_on(db, "alice", [DAY]) == {DAY: (DATA, record.enc_ref)}
+    assert repo.get_recent_prediction_hashes(db, "alice", 10**5) == [(DAY, record.enc_ref)]
+
+
+def test_listings_do_not_load_ciphertexts(repo, db):
+    repo.upsert_enc_prediction(db, "alice", DAY, DATA)
+    db.expunge_all()
+
+    (record,) = db.query(EmotionData).all()
+    assert {"enc_blob", "enc_prediction"} <= inspect(record).unloaded
+
+
+def test_a_shared_file_goes_with_its_last_row(tmp_path, db):
+    repo = EmotionDataRepository(CiphertextStore("file", tmp_path))
+    ref = hashlib.sha256(DATA).hexdigest()
+    path = tmp_path / ref[:2] / f"{ref}.ct"
+    repo.upsert_enc_prediction(db, "alice", DAY, DATA)
+    repo.upsert_enc_prediction(db, "alice", DAY + timedelta(days=1), DATA)
+
+    repo.upsert_enc_prediction(db, "alice", DAY, b"other")
+    assert path.exists()
+    repo.upsert_enc_prediction(db, "alice", DAY + timedelta(days=1), b"other")
+    assert not path.exists()
+
+
+def test_unknown_backend_is_rejected(tmp_path):
+    with pytest.raises(ValueError, match="Unknown ciphertext store"):
+        CiphertextStore("s3", tmp_path)
+
+
+def test_legacy_rows_are_read_and_moved(repo, db):
+    legacy = base64.b64encode(DATA).decode("ascii")
+    for offset in range(3):
+        db.add(EmotionData(user_id="alice", date=DAY + timedelta(days=offset), enc_prediction=legacy))
+    db.commit()
+    dates = [DAY + timedelta(days=offset) for offset in range(3)]
+
+    # Hashed like MySQL's SHA2 over the base64 text until moved
+    before = repo.get_enc_predictions_on(db, "alice", dates)
+    assert before[DAY] == (DATA, hashlib.sha256(legacy.encode("ascii")).hexdigest())
+
+    assert migrate(sessionmaker(bind=db.get_bind(), future=True), repo, batch_size=2) == 3
+    db.expire_all()
+    after = repo.get_enc_predictions_on(db, "alice", dates)
+    assert set(after) == set(dates)
+    assert all(value == (DATA, hashlib.sha256(DATA).hexdigest()) for value in after.values())
+    assert repo.get_legacy_predictions(db, 10) == []
+
+
+def test_ensure_schema_adds_the_store_columns_once():
+    engine = create_engine("sqlite://", future=True)
+    with engine.begin() as connection:
+        connection.execute(
+            text("CREATE TABLE emotiondata (id INTEGER PRIMARY KEY, user_id VARCHAR(64), date DATE, enc_prediction TEXT)")
+        )
+
+    ensure_schema(engine)
+    ensure_schema(engine)
+
+    columns = {column["name"] for column in inspect(engine).get_columns("emotiondata")}
+    assert {"enc_ref", "enc_size", "enc_level", "enc_blob"} <= columns
+    assert "ix_emotiondata_enc_ref" in {index["name"] for index in inspect(engine).get_indexes("emotiondata")}
@@ -0,0 +1,115 @@
+"""Framed ciphertext codecs and the bounds on untrusted payloads."""
+import zlib
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api import routes_emotion, routes_he
+from app.api.binary import OCTET_STREAM
+from app.core.db import get_db
+from app.core.security import get_current_user
+from app.fhe_core import codec, tenseal_context
+from app.fhe_core.tenseal_context import PROFILES
+from app.models.user import User
+from app.repositories.emotion_data_repository import EmotionDataRepository
+from app.services.emotion_service import EmotionService
+
+from conftest import load_client_module
+
+DATA = bytes(range(256)) * 64
+
+
+@pytest.mark.parametrize("name", codec.available_codecs())
+def test_round_trip(name):
+    encoded = codec.encode(DATA, name)
+
+    assert codec.decode(encoded) == DATA
+    assert codec.decode(encoded, max_size=len(DATA)) == DATA
+    assert codec.codec_of(encoded) == name
+    assert (encoded == DATA) == (name == "none")
+
+
+def test_client_codec_reads_server_frames():
+    client_codec = load_client_module("codec")
+
+    for name in codec.available_codecs():
+        assert client_codec.decode(codec.encode(DATA, name)) == DATA
+        assert codec.decode(client_codec.encode(DATA, name)) == DATA
+
+
+@pytest.mark.parametrize("name", [name for name in codec.available_codecs() if name != "none"])
+def test_bombs_stop_at_max_size(name):
+    bomb = codec.encode(bytes(64 * 2**20), name)
+    assert len(bomb) < 2**20
+
+    with pytest.raises(ValueError, match="more than 4096 bytes"):
+        codec.decode(bomb, max_size=4096)
+
+
+def test_unframed_payloads_are_bounded_too():
+    with pytest.raises(ValueError, match="larger than"):
+        codec.decode(DATA, max_size=len(DATA) - 1)
+
+
+def test_corrupt_frames_raise_value_error():
+    framed = codec.encode(DATA, "zlib")
+
+    with pytest.raises(ValueError, match="Truncated"):
+        codec.decode(framed[:-10])
+    with pytest.raises(ValueError, match="Corrupt"):
+        codec.decode(codec.MAGIC + b"\x01" + b"not zlib")
+    with pytest.raises(ValueError, match="unknown or unavailable codec id 9"):
+        codec.decode(codec.MAGIC + b"\x09" + zlib.compress(DATA))
+    with pytest.raises(ValueError, match="unknown"):
+        codec.decode(codec.MAGIC)
+    with pytest.raises(ValueError, match="Unknown or unavailable codec"):
+        codec.encode(DATA, "brotli")
+
+
+def test_profile_bounds_cover_real_serializations(fast_context, fast_eval_bytes):
+    profile = PROFILES["fast"]
+    vector = tenseal_context.encrypt_vector(fast_context, [1.0] * profile.slot_count)
+
+    assert len(vector.serialize()) <= profile.max_ciphertext_bytes
+    assert len(fast_eval_bytes) <= profile.max_context_bytes
+
+
+@pytest.fixture
+def client(engine, fast_eval_bytes):
+    engine.register_eval_context("key-1", fast_eval_bytes, profile="fast")
+    app = FastAPI()
+    app.include_router(routes_emotion.router)
+    app.include_router(routes_he.router)
+    app.state.he_engine = engine
+    app.state.emotion_service = EmotionService(EmotionDataRepository(), engine)
+    app.dependency_overrides[get_current_user] = lambda: User(user_id="alice")
+    app.dependency_overrides[get_db] = lambda: None
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+def post(client, path, body, **headers):
+    return client.post(path, content=body, headers={"Content-Type": OCTET_STREAM, **headers})
+
+
+def test_oversized_ciphertexts_are_rejected_with_422(client):
+    limit = PROFILES["fast"].max_ciphertext_bytes
+
+    for body in (codec.encode(bytes(4 * limit), "zlib"), b"\x0a" * (limit + 1)):
+        response = post(client, "/emotion/analyze-today/binary", body, **{"X-Key-Id": "key-1"})
+        assert response.status_code == 422
+        assert f"{limit} bytes" in response.json()["detail"]
+
+
+def test_context_bombs_are_rejected_with_422(client, monkeypatch):
+    # A bound of no rotation keys keeps the bomb small
+    monkeypatch.setattr(tenseal_context, "MAX_GALOIS_KEYS", 0)
+    limit = PROFILES["fast"].max_context_bytes
+    bomb = codec.encode(bytes(limit + 2**20), "zlib")
+
+    response = post(client, "/he/register-key/binary", bomb, **{"X-Key-Id": "key-2", "X-Profile": "fast"})
+
+    assert response.status_code == 422
+    assert "more than" in response.json()["detail"]
+    assert not (client.app.state.he_engine._context_dir / "key-2.ref").exists()
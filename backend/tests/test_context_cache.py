@@ -0,0 +1,115 @@
+"""Byte-budgeted context cache: eviction order, pinning and key-size accounting."""
+import base64
+
+import pytest
+
+from app.fhe_core.tenseal_context import context_memory_bytes, create_context
+from app.services.context_cache import ContextCache, ContextEntry
+
+
+class Loader:
+    """Builds entries of a fixed size and records which key_ids were loaded."""
+
+    def __init__(self, size=10):
+        self.size = size
+        self.loaded = []
+
+    def __call__(self, key_id):
+        self.loaded.append(key_id)
+        return ContextEntry(key_id, object(), self.size, None)
+
+
+def use(cache, key_id):
+    with cache.pinned(key_id) as entry:
+        return entry
+
+
+def test_miss_loads_and_hit_reuses():
+    loader = Loader()
+    cache = ContextCache(100, loader)
+
+    first = use(cache, "a")
+    assert use(cache, "a") is first
+    assert loader.loaded == ["a"]
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["used_bytes"], stats["entries"]) == (1, 1, 10, 1)
+
+
+def test_lru_evicts_the_least_recently_used():
+    loader = Loader()
+    cache = ContextCache(20, loader, "lru")
+    use(cache, "a")
+    use(cache, "b")
+    use(cache, "a")
+    use(cache, "c")
+
+    assert "a" in cache and "c" in cache and "b" not in cache
+    assert cache.stats()["evictions"] == 1
+
+
+def test_lfu_evicts_the_least_frequently_used():
+    loader = Loader()
+    cache = ContextCache(20, loader, "lfu")
+    for key_id in ("a", "a", "a", "b", "b"):
+        use(cache, key_id)
+    use(cache, "a")  # b is now least recently used but used twice
+    use(cache, "c")
+    use(cache, "c")
+    use(cache, "c")
+    use(cache, "d")
+
+    assert "a" in cache and "b" not in cache
+
+
+def test_pinned_entries_are_never_evicted():
+    cache = ContextCache(10, Loader())
+
+    with cache.pinned("a") as entry:
+        use(cache, "b")  # over budget, but "a" is in use
+        assert "a" in cache
+        assert cache.stats()["pinned"] == 1
+    assert entry.pins == 0
+    # Unpinning shrinks back to the budget
+    assert cache.stats()["used_bytes"] <= 10
+
+
+def test_put_replaces_and_discard_releases():
+    cache = ContextCache(100, Loader())
+    use(cache, "a")
+    cache.put(ContextEntry("a", object(), 30, None))
+
+    assert cache.stats()["used_bytes"] == 30
+    cache.discard("a")
+    assert cache.stats()["used_bytes"] == 0 and "a" not in cache
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        ContextCache(10, Loader(), "fifo")
+
+
+def test_context_memory_bytes_counts_every_key():
+    context = create_context(8192, (60, 40, 60), generate_galois_keys=False)
+    polynomial = 8192 * 3 * 8
+
+    # One relinearization key of (primes - 1) size-2 ciphertexts, plus the public key
+    assert context_memory_bytes(context) == 2 * 2 * polynomial + 2 * polynomial
+    context.generate_galois_keys()
+    keys = 1 + context.data.galois_keys().size()
+    assert context_memory_bytes(context) == keys * 2 * 2 * polynomial + 2 * polynomial
+
+
+def test_registered_context_is_charged_by_memory(engine, fast_eval_bytes):
+    digest = engine.register_eval_context("key-1", base64.b64encode(fast_eval_bytes).decode("ascii"), profile="fast")
+
+    stats = engine.context_cache_stats()
+    assert stats["entries"] == 1
+    assert stats["used_bytes"] > len(fast_eval_bytes)  # SEAL compresses keys on save
+    with engine._contexts.pinned(digest) as entry:
+        assert stats["used_bytes"] == context_memory_bytes(entry.context)
+
+
+def test_registration_rejects_another_profile(engine, fast_eval_bytes):
+    with pytest.raises(ValueError, match="'safe' parameter profile"):
+        engine.register_eval_context("key-1", base64.b64encode(fast_eval_bytes).decode("ascii"), profile="safe")
+    assert engine.context_cache_stats()["entries"] == 0
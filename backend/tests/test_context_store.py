@@ -0,0 +1,81 @@
+"""Content-addressed eval context storage shared between key_ids."""
+import hashlib
+
+import pytest
+
+from app.fhe_core.rotation_keys import required_rotation_steps
+from app.fhe_core.tenseal_context import PROFILES, eval_context
+
+
+@pytest.fixture(scope="module")
+def other_eval_bytes(fast_context, fast_plan):
+    """Another eval context of ``fast_context``: the same checks pass, fresh keys make other bytes."""
+    steps = required_rotation_steps(fast_plan, PROFILES["fast"].slot_count, [("im2col", 1)])
+    return eval_context(fast_context, steps).serialize()
+
+
+def refs(engine):
+    return {path.stem: path.read_text() for path in engine._context_dir.glob("*.ref")}
+
+
+def objects(engine):
+    return {path.stem for path in engine._object_dir.glob("*.seal")}
+
+
+def test_identical_contexts_are_stored_and_loaded_once(engine, fast_eval_bytes):
+    digest = hashlib.sha256(fast_eval_bytes).hexdigest()
+    assert not engine.has_context(digest)
+
+    assert engine.register_eval_context("key-1", fast_eval_bytes, profile="fast") == digest
+    misses = engine.context_cache_stats()["misses"]
+    assert engine.register_eval_context("key-2", fast_eval_bytes, profile="fast") == digest
+
+    assert engine.has_context(digest)
+    assert refs(engine) == {"key-1": digest, "key-2": digest}
+    assert objects(engine) == {digest}
+    stats = engine.context_cache_stats()
+    assert stats["entries"] == 1 and stats["misses"] == misses  # linked without deserializing again
+
+
+def test_unused_objects_are_removed(engine, fast_eval_bytes, other_eval_bytes):
+    first = engine.register_eval_context("key-1", fast_eval_bytes, profile="fast")
+    engine.register_eval_context("key-2", fast_eval_bytes, profile="fast")
+
+    second = engine.register_eval_context("key-1", other_eval_bytes, profile="fast")
+    assert objects(engine) == {first, second}  # key-2 still uses the first one
+
+    engine.register_eval_context("key-2", other_eval_bytes, profile="fast")
+    assert objects(engine) == {second}
+    assert refs(engine) == {"key-1": second, "key-2": second}
+    assert engine.context_cache_stats()["entries"] == 1
+
+
+def test_link_by_hash_runs_the_usual_checks(engine, fast_eval_bytes):
+    digest = engine.register_eval_context("key-1", fast_eval_bytes, profile="fast")
+
+    assert engine.register_existing_context("key-2", digest, profile="fast") == digest
+    with pytest.raises(ValueError, match="'safe' parameter profile"):
+        engine.register_existing_context("key-3", digest, profile="safe")
+    with pytest.raises(ValueError, match="rotation"):
+        engine.register_existing_context("key-3", digest, layout="replicated", batch_sizes=[2], profile="fast")
+    with pytest.raises(ValueError, match="No eval context stored"):
+        engine.register_existing_context("key-3", "0" * 64, profile="fast")
+    with pytest.raises(ValueError, match="key_id"):
+        engine.register_existing_context("../key-3", digest, profile="fast")
+    assert not engine.has_context("not-a-digest")
+    assert set(refs(engine)) == {"key-1", "key-2"}
+
+
+def test_legacy_contexts_move_into_the_store(engine, fast_eval_bytes):
+    legacy = engine._context_dir / "old-key.seal"
+    legacy.write_bytes(fast_eval_bytes)
+
+    digest = engine._digest_for("old-key")
+
+    assert digest == hashlib.sha256(fast_eval_bytes).hexdigest()
+    assert not legacy.exists()
+    assert refs(engine) == {"old-key": digest} and objects(engine) == {digest}
+    with engine._contexts.pinned(digest) as entry:
+        assert entry.digest == digest
+    with pytest.raises(ValueError, match="No eval context found"):
+        engine._digest_for("missing")
@@ -0,0 +1,195 @@
+"""Resumable chunked eval context uploads."""
+import hashlib
+import time
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api import routes_he
+from app.core.security import get_current_user
+from app.models.user import User
+from app.services.context_upload import FAILED, PROCESSING, REGISTERED, ContextUploadManager, OffsetMismatch
+
+DATA = bytes(range(256)) * 4
+
+
+class Engine:
+    """Records registrations and keeps the uploaded file's bytes."""
+
+    def __init__(self, error=None):
+        self.error = error
+        self.registered = []
+
+    def register_eval_context_file(self, key_id, upload_path, layout, batch_sizes, profile, digest):
+        if self.error is not None:
+            raise self.error
+        with open(upload_path, "rb") as handle:
+            data = handle.read()
+        assert hashlib.sha256(data).hexdigest() == digest
+        self.registered.append((key_id, data, layout, batch_sizes, profile))
+
+
+def wait_until_finished(upload, timeout=60.0):
+    deadline = time.monotonic() + timeout
+    while not upload.finished:
+        assert time.monotonic() < deadline, "registration did not finish"
+        time.sleep(0.01)
+    return upload
+
+
+@pytest.fixture
+def uploads(tmp_path):
+    managers = []
+
+    def make(engine=None, **kwargs):
+        kwargs.setdefault("max_bytes", len(DATA))
+        kwargs.setdefault("max_chunk_bytes", 300)
+        manager = ContextUploadManager(engine or Engine(), tmp_path / "he_contexts", **kwargs)
+        managers.append(manager)
+        return manager
+
+    yield make
+    for manager in managers:
+        manager.close()
+
+
+def upload_all(manager, upload, data, chunk=300):
+    for offset in range(0, len(data), chunk):
+        manager.write_chunk(upload, offset, data[offset : offset + chunk])
+
+
+def test_create_validates_key_size_and_digest(uploads):
+    manager = uploads()
+
+    for key_id in (".hidden", "../escape", "a" * 129, ""):
+        with pytest.raises(ValueError, match="key_id"):
+            manager.create("u", key_id, 10)
+    for size in (0, len(DATA) + 1):
+        with pytest.raises(ValueError, match="total_size"):
+            manager.create("u", "key", size)
+    with pytest.raises(ValueError, match="64 hex"):
+        manager.create("u", "key", 10, sha256="abc")
+
+    upload = manager.create("u", "key.v2", 10, sha256="A" * 64)
+    assert upload.sha256 == "a" * 64 and upload.path.exists()
+    assert manager.get(upload.upload_id, "u") is upload
+    assert manager.get(upload.upload_id, "other") is None
+
+
+def test_chunks_must_continue_at_the_current_offset(uploads):
+    manager = uploads()
+    upload = manager.create("u", "key", len(DATA))
+
+    manager.write_chunk(upload, 0, DATA[:300])
+    with pytest.raises(OffsetMismatch) as excinfo:
+        manager.write_chunk(upload, 600, DATA[600:900])
+    assert excinfo.value.offset == 300
+    with pytest.raises(OffsetMismatch):
+        manager.write_chunk(upload, 0, DATA[:300])
+    with pytest.raises(ValueError, match="1 to 300"):
+        manager.write_chunk(upload, 300, DATA[300:700])
+    with pytest.raises(ValueError, match="checksum"):
+        manager.write_chunk(upload, 300, DATA[300:600], sha256="0" * 64)
+
+    # Resume from the offset the failed chunks reported
+    manager.write_chunk(upload, 300, DATA[300:600], sha256=hashlib.sha256(DATA[300:600]).hexdigest())
+    assert upload.received == 600
+    assert upload.path.read_bytes() == DATA[:600]
+
+
+def test_chunks_cannot_pass_the_total_size(uploads):
+    manager = uploads()
+    upload = manager.create("u", "key", 100)
+
+    with pytest.raises(ValueError, match="past total_size"):
+        manager.write_chunk(upload, 0, DATA[:101])
+    with pytest.raises(ValueError, match="incomplete"):
+        manager.finalize(upload)
+
+
+def test_finalize_registers_the_verified_file(uploads):
+    engine = Engine()
+    manager = uploads(engine)
+    upload = manager.create("u", "key", len(DATA), sha256=hashlib.sha256(DATA).hexdigest(), batch_sizes=[1, 2])
+    upload_all(manager, upload, DATA)
+
+    assert manager.finalize(upload).status in (PROCESSING, REGISTERED)
+    assert wait_until_finished(upload).status == REGISTERED
+    assert engine.registered == [("key", DATA, "im2col", [1, 2], "safe")]
+    assert manager.finalize(upload) is upload  # repeat calls are no-ops
+    assert not upload.path.exists()
+
+
+def test_digest_mismatch_fails_the_upload(uploads):
+    manager = uploads()
+    upload = manager.create("u", "key", 100, sha256=hashlib.sha256(b"other").hexdigest())
+    manager.write_chunk(upload, 0, DATA[:100])
+
+    with pytest.raises(ValueError, match="SHA-256"):
+        manager.finalize(upload)
+    assert upload.status == FAILED and not upload.path.exists()
+    with pytest.raises(ValueError, match="failed"):
+        manager.write_chunk(upload, 100, b"x")
+
+
+def test_rejected_context_fails_with_the_engine_error(uploads):
+    manager = uploads(Engine(ValueError("missing rotation keys")))
+    upload = manager.create("u", "key", 100)
+    manager.write_chunk(upload, 0, DATA[:100])
+
+    manager.finalize(upload)
+    assert wait_until_finished(upload).status == FAILED
+    assert upload.error == "missing rotation keys"
+    assert not upload.path.exists()
+
+
+def test_expired_uploads_are_dropped(uploads):
+    manager = uploads(ttl_seconds=0)
+    upload = manager.create("u", "key", 100)
+    time.sleep(0.01)
+
+    manager.create("u", "key", 100)
+    assert manager.get(upload.upload_id, "u") is None
+    assert not upload.path.exists()
+
+
+def test_uploaded_context_is_registered_by_the_engine(engine, fast_eval_bytes):
+    manager = ContextUploadManager(engine, engine._context_dir, max_bytes=len(fast_eval_bytes), max_chunk_bytes=2**20)
+    try:
+        upload = manager.create("u", "key-1", len(fast_eval_bytes), hashlib.sha256(fast_eval_bytes).hexdigest(), profile="fast")
+        upload_all(manager, upload, fast_eval_bytes, chunk=2**20)
+        manager.finalize(upload)
+
+        assert wait_until_finished(upload).status == REGISTERED, upload.error
+        digest = hashlib.sha256(fast_eval_bytes).hexdigest()
+        assert (engine._object_dir / f"{digest}.seal").read_bytes() == fast_eval_bytes
+        assert (engine._context_dir / "key-1.ref").read_text() == digest
+        assert engine.context_cache_stats()["entries"] == 1
+    finally:
+        manager.close()
+
+
+def test_upload_routes_report_the_resume_offset(uploads):
+    app = FastAPI()
+    app.include_router(routes_he.router)
+    app.state.context_uploads = uploads()
+    app.dependency_overrides[get_current_user] = lambda: User(user_id="alice")
+    client = TestClient(app)
+
+    created = client.post("/he/uploads", json={"key_id": "key", "total_size": 600})
+    assert created.status_code == 201
+    upload_id = created.json()["upload_id"]
+    assert created.json()["max_chunk_size"] == 300
+
+    def put(offset, data):
+        return client.put(f"/he/uploads/{upload_id}", content=data, headers={"X-Upload-Offset": str(offset)})
+
+    assert put(0, DATA[:300]).json()["received"] == 300
+    conflict = put(0, DATA[:300])
+    assert conflict.status_code == 409 and conflict.headers["X-Upload-Offset"] == "300"
+    assert put(300, DATA[300:700]).status_code == 413
+    assert client.post(f"/he/uploads/{upload_id}/finalize").status_code == 422
+    assert client.get("/he/uploads/unknown").status_code == 404
+    assert client.delete(f"/he/uploads/{upload_id}").status_code == 204
+    assert client.get(f"/he/uploads/{upload_id}").status_code == 404
@@ -0,0 +1,235 @@
+"""Storing predictions and the running aggregates behind the history statistics."""
+import base64
+import json
+from datetime import date, timedelta
+
+import numpy as np
+import pytest
+import tenseal as ts
+
+from app.fhe_core.packed_history import ring_position
+from app.models.emotion_aggregate import EmotionAggregate
+from app.models.emotion_history import EmotionHistory
+from app.repositories.emotion_data_repository import EmotionDataRepository
+from app.services.emotion_service import EmotionService
+
+
+def encode(values):
+    return json.dumps([float(v) for v in values])
+
+
+def decode(payload):
+    return None if payload is None else np.array(json.loads(payload))
+
+
+class Engine:
+    """Plaintext stand-in for HEEmotionEngine: a "ciphertext" is a JSON list of logits."""
+
+    def __init__(self, history_days=0):
+        self.recomputed = 0
+        self.fail_aggregates = False
+        self.days = history_days
+        self.fail_packing = False
+        self.packed_windows = 0
+        self.forgotten = []
+
+    def run_encrypted_inference(self, payload, key_id, batch_size=1, layout="im2col"):
+        return payload
+
+    def extend_history_aggregates(self, key_id, previous, payloads):
+        if self.fail_aggregates:
+            raise RuntimeError("engine unavailable")
+        prev_logits = prev_sum = prev_volatility = None
+        if previous is not None:
+            prev_logits, prev_sum, prev_volatility = (decode(previous[name]) for name in ("logits", "sum", "volatility"))
+        aggregates = []
+        for payload in payloads:
+            logits = decode(payload)
+            prev_sum = logits if prev_sum is None else prev_sum + logits
+            if prev_logits is not None:
+                square = (logits - prev_logits) ** 2
+                prev_volatility = square if prev_volatility is None else prev_volatility + square
+            aggregates.append({"sum": encode(prev_sum), "volatility": None if prev_volatility is None else encode(prev_volatility)})
+            prev_logits = logits
+        return aggregates
+
+    def run_aggregate_statistics(self, key_id, last, base_sum=None, base_volatility=None, raw=False):
+        total = decode(last["sum"]) - (0 if base_sum is None else decode(base_sum))
+        volatility = decode(last["volatility"])
+        volatility = np.zeros(1) if volatility is None else volatility - (0 if base_volatility is None else decode(base_volatility))
+        return {"encrypted_sum": encode(total), "encrypted_volatility": encode(volatility)}
+
+    def prediction_level(self, key_id):
+        return None
+
+    def history_days(self, key_id):
+        return self.days
+
+    def update_packed_history(self, key_id, packed, changes):
+        if self.fail_packing:
+            raise RuntimeError("engine unavailable")
+        blocks = np.zeros((self.days, 7)) if packed is None else np.array(json.loads(packed))
+        for day, new, old in changes:
+            blocks[ring_position(day, self.days)] += decode(new) - sum((decode(payload) for payload in old), np.zeros(7))
+        return json.dumps(blocks.tolist()).encode()
+
+    def run_packed_statistics(self, key_id, packed, first, days, raw=False):
+        self.packed_windows += 1
+        blocks = np.array(json.loads(packed))
+        window = blocks[[(ring_position(first, self.days) + i) % self.days for i in range(days)]]
+        return {"encrypted_sum": encode(window.sum(axis=0)), "encrypted_volatility": encode((np.diff(window, axis=0) ** 2).sum(axis=0))}
+
+    def cached_days(self, key_id, user_id, day_hashes):
+        return []
+
+    def forget_days(self, user_id, dates):
+        self.forgotten.extend(dates)
+
+    def run_encrypted_statistics(self, payloads, key_id, raw=False, user_id=None, day_hashes=None):
+        self.recomputed += 1
+        days = np.array([decode(payload) for payload in payloads])
+        return {"encrypted_sum": encode(days.sum(axis=0)), "encrypted_volatility": encode((np.diff(days, axis=0) ** 2).sum(axis=0))}
+
+
+@pytest.fixture
+def service():
+    return EmotionService(EmotionDataRepository(), Engine())
+
+
+def day(offset):
+    return date.today() - timedelta(days=offset)
+
+
+def logits_of(offset, version=0):
+    return np.arange(7) * (offset + 1) + version
+
+
+def store(service, db, offset, key_id="k", version=0):
+    # Binary-route payload: stored as it arrived
+    service.analyze_and_store(db, "alice", day(offset), encode(logits_of(offset, version)).encode(), key_id)
+
+
+def expected(days):
+    days = np.array(days)
+    return days.sum(axis=0), (np.diff(days, axis=0) ** 2).sum(axis=0)
+
+
+def statistics(service, db, days, key_id="k"):
+    stats = service.get_history_statistics(db, "alice", days, key_id)
+    return decode(stats["encrypted_sum"]), decode(stats["encrypted_volatility"])
+
+
+def test_statistics_come_from_the_aggregates(service, db):
+    for offset in (5, 4, 3, 2, 1, 0):
+        store(service, db, offset)
+
+    for days in (1, 2, 4, 6):
+        total, volatility = statistics(service, db, days)
+        want_total, want_volatility = expected([logits_of(offset) for offset in reversed(range(days))])
+        np.testing.assert_allclose(total, want_total)
+        np.testing.assert_allclose(volatility, want_volatility if days > 1 else 0)
+    assert service.he_engine.recomputed == 0
+    assert db.query(EmotionAggregate).count() == 6
+
+
+def test_overwriting_a_day_recomputes_the_rest_of_the_chain(service, db):
+    for offset in (3, 2, 1, 0):
+        store(service, db, offset)
+
+    store(service, db, 2, version=10)
+
+    total, volatility = statistics(service, db, 4)
+    want = expected([logits_of(3), logits_of(2, 10), logits_of(1), logits_of(0)])
+    np.testing.assert_allclose(total, want[0])
+    np.testing.assert_allclose(volatility, want[1])
+    assert service.he_engine.recomputed == 0
+    # Stored days leave the engine's vector cache
+    assert service.he_engine.forgotten == [day(3), day(2), day(1), day(0), day(2)]
+
+
+def test_key_changes_fall_back_to_recomputation(service, db):
+    for offset in (2, 1):
+        store(service, db, offset)
+    store(service, db, 0, key_id="new-key")
+
+    total, volatility = statistics(service, db, 3, key_id="new-key")
+    want = expected([logits_of(offset) for offset in (2, 1, 0)])
+    np.testing.assert_allclose(total, want[0])
+    np.testing.assert_allclose(volatility, want[1])
+    assert service.he_engine.recomputed == 1
+    # A window inside the old chain still uses its aggregates
+    statistics(service, db, 1, key_id="new-key")
+    assert service.he_engine.recomputed == 1
+
+
+def test_failed_aggregate_updates_leave_no_stale_rows(service, db):
+    for offset in (2, 1, 0):
+        store(service, db, offset)
+    service.he_engine.fail_aggregates = True
+
+    store(service, db, 1, version=5)
+
+    assert {row.date for row in db.query(EmotionAggregate)} == {day(2)}
+    total, _ = statistics(service, db, 3)
+    np.testing.assert_allclose(total, logits_of(2) + logits_of(1, 5) + logits_of(0))
+    assert service.he_engine.recomputed == 1
+
+
+def test_statistics_come_from_the_packed_history(db):
+    service = EmotionService(EmotionDataRepository(), Engine(history_days=4))
+    for offset in (5, 4, 3, 2, 1, 0):
+        store(service, db, offset)
+    # Overwriting a day swaps its block; day 4 went out of the ring when day 0 took its block
+    store(service, db, 2, version=10)
+    days = [logits_of(3), logits_of(2, 10), logits_of(1), logits_of(0)]
+
+    for count in (1, 3, 4):
+        total, volatility = statistics(service, db, count)
+        want_total, want_volatility = expected(days[-count:])
+        np.testing.assert_allclose(total, want_total)
+        np.testing.assert_allclose(volatility, want_volatility)
+    assert service.he_engine.packed_windows == 3
+    assert len(json.loads(db.query(EmotionHistory).one().days)) == 4
+
+    # Longer than the ring: the running aggregates take over
+    total, _ = statistics(service, db, 6)
+    np.testing.assert_allclose(total, expected([logits_of(5), logits_of(4)] + days)[0])
+    assert service.he_engine.packed_windows == 3 and service.he_engine.recomputed == 0
+
+
+def test_packed_history_is_not_used_across_gaps_or_changed_days(db):
+    service = EmotionService(EmotionDataRepository(), Engine(history_days=8))
+    for offset in (4, 2, 1, 0):
+        store(service, db, offset)
+
+    statistics(service, db, 5)
+    assert service.he_engine.packed_windows == 0
+    statistics(service, db, 3)
+    assert service.he_engine.packed_windows == 1
+
+    # A failed update leaves the history holding the old prediction, which no longer matches
+    service.he_engine.fail_packing = True
+    store(service, db, 1, version=3)
+    total, _ = statistics(service, db, 3)
+    np.testing.assert_allclose(total, logits_of(2) + logits_of(1, 3) + logits_of(0))
+    assert service.he_engine.packed_windows == 1
+
+
+def test_engine_aggregates_match_the_plain_window(engine, fast_context, fast_eval_bytes):
+    engine.register_eval_context("key-1", fast_eval_bytes, profile="fast")
+    rng = np.random.default_rng(0)
+    days = rng.normal(size=(3, 7))
+    payloads = [ts.ckks_vector(fast_context, values).serialize() for values in days]
+
+    first = engine.extend_history_aggregates("key-1", None, payloads[:2])
+    (third,) = engine.extend_history_aggregates("key-1", {"logits": payloads[1], **first[1]}, payloads[2:])
+    # Window of the last two days: subtract the sum before it and the volatility up to its first day
+    stats = engine.run_aggregate_statistics("key-1", third, base_sum=first[0]["sum"], base_volatility=first[1]["volatility"])
+
+    def decrypt(payload):
+        return np.array(ts.ckks_vector_from(fast_context, base64.b64decode(payload)).decrypt())
+
+    assert first[0]["volatility"] is None
+    np.testing.assert_allclose(decrypt(third["sum"]), days.sum(axis=0), atol=1e-3)
+    np.testing.assert_allclose(decrypt(stats["encrypted_sum"]), days[1:].sum(axis=0), atol=1e-3)
+    np.testing.assert_allclose(decrypt(stats["encrypted_volatility"]), (days[2] - days[1]) ** 2, atol=1e-3)
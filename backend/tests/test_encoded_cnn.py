@@ -0,0 +1,56 @@
+"""Pre-encoded conv plaintexts and the SEAL evaluator that consumes them."""
+import numpy as np
+import pytest
+import tenseal as ts
+
+from app.fhe_core import batching
+from app.fhe_core.encoded_cnn import LAYOUTS, EncodedConv, conv_kernel_vector
+from app.fhe_core.seal_ops import SealEvaluator
+
+
+def test_conv_kernel_vector_repeats_each_coefficient():
+    kernel = np.arange(4.0).reshape(2, 2)
+    np.testing.assert_array_equal(conv_kernel_vector(kernel, 3, 5), [0, 0, 0, 1, 1, 1, 2, 2, 2, 3, 3, 3, 0, 0, 0])
+
+
+def test_rotate_needs_galois_keys():
+    ctx = ts.context(ts.SCHEME_TYPE.CKKS, poly_modulus_degree=8192, coeff_mod_bit_sizes=[60, 40, 60])
+    ctx.global_scale = 2**40
+    evaluator = SealEvaluator(ctx)
+    ct = SealEvaluator.from_vector(ts.ckks_vector(ctx, [1.0, 2.0]))
+
+    with pytest.raises(RuntimeError):
+        evaluator.rotate(ct, 1)
+
+
+@pytest.fixture(scope="module")
+def conv_evaluator():
+    # Conv at level 0, mask at level 1, bias at level 2
+    ctx = ts.context(ts.SCHEME_TYPE.CKKS, poly_modulus_degree=16384, coeff_mod_bit_sizes=[60, 40, 40, 40, 60])
+    ctx.global_scale = 2**40
+    ctx.generate_galois_keys()
+    return SealEvaluator(ctx)
+
+
+@pytest.mark.parametrize("layout", LAYOUTS)
+def test_encoded_conv_matches_plain_conv(conv_evaluator, layout):
+    rng = np.random.default_rng(2)
+    channels = 4
+    weight = rng.normal(size=(channels, 1, batching.KERNEL_SIZE, batching.KERNEL_SIZE)) * 0.1
+    bias = rng.normal(size=channels)
+    image = rng.uniform(0, 1, size=(batching.IMAGE_SIZE, batching.IMAGE_SIZE))
+    conv = EncodedConv(conv_evaluator, weight, bias, 1, conv_evaluator.context.global_scale, layout)
+
+    if conv.copies == 1:
+        values = batching.im2col_batch([image])
+    else:
+        values = batching.im2col_replicated([image], conv.copies)
+    assert len(values) == conv.input_size
+    enc = ts.ckks_vector(conv_evaluator.context, values)
+    out = np.asarray(conv_evaluator.to_vector(conv(conv_evaluator, SealEvaluator.from_vector(enc)), conv.period).decrypt())
+
+    windows = np.lib.stride_tricks.sliding_window_view(image, (batching.KERNEL_SIZE,) * 2)[:: batching.STRIDE, :: batching.STRIDE]
+    expected = weight.reshape(channels, -1) @ windows.reshape(-1, batching.KERNEL_SIZE**2).T + bias[:, None]
+    np.testing.assert_allclose(out[conv.activation_slots], expected.flatten(), atol=1e-3)
+    rest = np.delete(out, conv.activation_slots)
+    np.testing.assert_allclose(rest, 0, atol=1e-3)
@@ -0,0 +1,96 @@
+"""CNNPlan geometry, validation and the module compiler."""
+import numpy as np
+import pytest
+
+from app.fhe_core import batching
+from app.fhe_core.he_plan import FORWARD_LEVELS, PACKING_LEVELS, STATISTICS_LEVELS, CNNPlan, compile_module
+
+from conftest import random_plan
+
+
+def test_geometry_is_read_from_the_weights():
+    plan = random_plan(channels=3, hidden=5, image_size=20, kernel_size=5, stride=3)
+
+    assert (plan.kernel_size, plan.channels, plan.windows, plan.hidden, plan.num_classes) == (5, 3, 36, 5, 7)
+    assert plan.describe()["layers"] == ["conv", "square", "linear", "square", "linear"]
+    assert plan.levels == FORWARD_LEVELS == 6
+
+
+def test_plan_rejects_inconsistent_weights():
+    weights = dict(random_plan().weights)
+    with pytest.raises(ValueError, match="FC1 reads"):
+        CNNPlan(batching.IMAGE_SIZE, batching.STRIDE, dict(weights, fc1_weight=np.ones((10, 8))))
+    with pytest.raises(ValueError, match="FC2 reads"):
+        CNNPlan(batching.IMAGE_SIZE, batching.STRIDE, dict(weights, fc2_weight=np.ones((9, 7))))
+    with pytest.raises(ValueError, match="larger than"):
+        CNNPlan(8, batching.STRIDE, weights)
+
+
+def test_weights_are_read_only():
+    plan = random_plan()
+
+    with pytest.raises(ValueError):
+        plan.weights["fc1_bias"][0] = 1.0
+
+
+def test_input_vector_follows_the_layout():
+    plan = random_plan()
+    image = np.random.default_rng(0).uniform(size=(batching.IMAGE_SIZE, batching.IMAGE_SIZE))
+
+    assert plan.input_vector([image], "im2col", 8192) == batching.im2col_batch([image])
+    copies = plan.copies(1, 8192)
+    assert copies == 2  # bounded by the two channels, not by the slots
+    assert plan.input_vector([image], "replicated", 8192) == batching.im2col_replicated([image], copies)
+    assert plan.input_size("replicated", 1, 8192) == copies * batching.replicated_copy_size(1)
+
+
+def test_batch_limits():
+    plan = random_plan()
+
+    assert plan.max_batch_size("im2col", 16384) == 2
+    assert plan.max_batch_size("replicated", 16384) == 4
+    plan.check_batch_size("replicated", 4, 16384)
+    for batch_size in (0, 5):
+        with pytest.raises(ValueError):
+            plan.check_batch_size("replicated", batch_size, 16384)
+    with pytest.raises(ValueError, match="Unknown input layout"):
+        plan.max_batch_size("diagonal", 16384)
+
+
+def test_check_levels():
+    plan = random_plan()
+    plan.check_levels(7)
+    with pytest.raises(ValueError):
+        plan.check_levels(5)
+
+
+def test_output_level_leaves_room_for_the_statistics():
+    plan = random_plan()
+
+    # The statistics square needs STATISTICS_LEVELS below the output, above the last level
+    assert plan.output_level(10) == 10 - 1 - STATISTICS_LEVELS == 8
+    # Never above the level the forward pass ends at
+    assert plan.output_level(7) == plan.levels
+    # A packed history also keeps the mask's level
+    assert plan.output_level(10, packed_history=True) == 10 - 1 - STATISTICS_LEVELS - PACKING_LEVELS == 7
+
+
+def test_rotation_steps_are_traced_once():
+    plan = random_plan()
+
+    steps = plan.rotation_steps(8192, "im2col", 1)
+    assert steps and plan.rotation_steps(8192, "im2col", 1) is steps
+    assert plan.rotation_steps(8192, "replicated", 1) is not steps
+
+
+def test_compile_module_lowers_the_emotion_cnn():
+    torch = pytest.importorskip("torch")
+    from app.fhe_core.fhe_cnn import FHEEmotionCNN
+
+    module = FHEEmotionCNN()
+    plan = compile_module(module)
+
+    assert (plan.kernel_size, plan.stride, plan.windows) == (batching.KERNEL_SIZE, batching.STRIDE, 49)
+    np.testing.assert_array_equal(plan.weights["fc1_weight"], module.fc1.weight.detach().double().numpy().T)
+    with pytest.raises(ValueError, match="Unsupported layer sequence"):
+        compile_module(torch.nn.Sequential(torch.nn.Linear(4, 4)))
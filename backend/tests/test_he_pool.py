@@ -0,0 +1,86 @@
+"""Key-affinity HE worker pool: routing, error forwarding, restarts and recycling."""
+import zlib
+
+import pytest
+
+from app.fhe_core.plan_artifact import save_plan
+from app.services.he_pool import HEWorkerPool
+
+
+@pytest.fixture
+def plan_env(tmp_path, monkeypatch, fast_plan):
+    # Spawned workers read their settings from the environment
+    plan_path = tmp_path / "plan.heplan"
+    save_plan(fast_plan, plan_path)
+    monkeypatch.setenv("HE_PLAN_PATH", str(plan_path))
+    monkeypatch.setenv("HE_THREADS", "1")
+
+
+@pytest.fixture
+def make_pool(plan_env):
+    pools = []
+
+    def make(workers=2, **kwargs):
+        pool = HEWorkerPool(workers, threads_per_worker=1, context_cache_mb_per_worker=64, health_interval=0, **kwargs)
+        pools.append(pool)
+        return pool
+
+    yield make
+    for pool in pools:
+        pool.close()
+
+
+def test_key_ids_stick_to_one_worker(make_pool):
+    pool = make_pool()
+
+    for key_id in ("alice", "bob", "carol"):
+        assert pool._worker_for(key_id).index == zlib.crc32(key_id.encode("utf-8")) % 2
+        assert pool._worker_for(key_id) is pool._worker_for(key_id)
+
+
+def test_calls_run_in_the_workers(make_pool):
+    pool = make_pool()
+
+    profile = pool.rotation_key_profile("im2col", [1], "fast")
+    assert profile["profile"] == "fast" and profile["steps"]
+    stats = pool.context_cache_stats()
+    assert stats["workers"] == 2
+    assert stats["budget_bytes"] == 2 * 64 * 2**20
+    assert stats["entries"] == 0
+
+
+def test_engine_errors_keep_their_type(make_pool):
+    pool = make_pool(1)
+
+    with pytest.raises(ValueError, match="Unknown parameter profile"):
+        pool.rotation_key_profile("im2col", [1], "turbo")
+    assert pool.health()[0]["alive"]
+
+
+def test_dead_worker_is_restarted_on_the_next_request(make_pool):
+    pool = make_pool(1)
+    worker = pool._workers[0]
+    first_pid = worker.process.pid
+    worker.process.kill()
+    worker.process.join(5)
+
+    assert pool.context_cache_stats()["workers"] == 1
+    assert worker.restarts == 1 and worker.process.pid != first_pid
+
+
+def test_workers_are_recycled_after_max_requests(make_pool):
+    pool = make_pool(1, max_requests=2)
+    worker = pool._workers[0]
+
+    pool.context_cache_stats()
+    pool.context_cache_stats()
+    assert worker.restarts == 0
+    pool.context_cache_stats()
+    assert worker.restarts == 1 and worker.served == 1
+
+
+def test_startup_failure_is_reported(plan_env, monkeypatch, tmp_path):
+    monkeypatch.setenv("HE_PLAN_PATH", str(tmp_path / "missing.heplan"))
+
+    with pytest.raises(RuntimeError, match="failed to start"):
+        HEWorkerPool(1, health_interval=0)
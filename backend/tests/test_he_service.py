@@ -0,0 +1,54 @@
+"""Encrypted inference and history statistics through HEEmotionEngine."""
+import numpy as np
+import pytest
+import tenseal as ts
+
+from app.fhe_core import batching
+from app.fhe_core.seal_ops import SealEvaluator
+from app.fhe_core.tenseal_context import PROFILES
+
+from conftest import plain_forward
+
+
+@pytest.fixture
+def served(engine, fast_eval_bytes):
+    engine.register_eval_context("key-1", fast_eval_bytes, profile="fast")
+    return engine
+
+
+def images(count, seed=0):
+    rng = np.random.default_rng(seed)
+    return [rng.uniform(size=(batching.IMAGE_SIZE, batching.IMAGE_SIZE)) for _ in range(count)]
+
+
+def encrypt_image(context, plan, image):
+    return ts.ckks_vector(context, plan.input_vector([image], "im2col", PROFILES["fast"].slot_count)).serialize()
+
+
+def level(context, data):
+    return SealEvaluator(context).level_of(SealEvaluator.from_vector(ts.ckks_vector_from(context, data)))
+
+
+def test_inference_returns_logits_at_the_output_level(served, fast_context, fast_plan):
+    (image,) = images(1)
+
+    logits = served.run_encrypted_inference(encrypt_image(fast_context, fast_plan, image), "key-1")
+
+    vector = ts.ckks_vector_from(fast_context, logits)
+    np.testing.assert_allclose(vector.decrypt(), plain_forward(fast_plan, image), atol=1e-2)
+    chain = len(SealEvaluator(fast_context).levels)
+    assert level(fast_context, logits) == fast_plan.output_level(chain) == chain - 2
+    with pytest.raises(ValueError, match="expected"):
+        served.run_encrypted_inference(ts.ckks_vector(fast_context, [1.0]).serialize(), "key-1")
+
+
+def test_statistics_are_sent_at_the_last_level(served, fast_context, fast_plan):
+    (image,) = images(1, seed=1)
+    logits = served.run_encrypted_inference(encrypt_image(fast_context, fast_plan, image), "key-1")
+
+    stats = served.run_encrypted_statistics([logits], "key-1", raw=True)
+
+    enc_sum = ts.ckks_vector_from(fast_context, stats["encrypted_sum"])
+    np.testing.assert_allclose(enc_sum.decrypt(), plain_forward(fast_plan, image), atol=1e-2)
+    last = len(SealEvaluator(fast_context).levels) - 1
+    assert level(fast_context, stats["encrypted_sum"]) == level(fast_context, stats["encrypted_volatility"]) == last
@@ -0,0 +1,85 @@
+"""History sums over stored logits written at different output levels."""
+import numpy as np
+import pytest
+import tenseal as ts
+
+from app.fhe_core.parallel import finish_window_sums, window_sums
+from app.fhe_core.seal_ops import SealEvaluator
+
+CLASSES = 7
+# Rows written before the statistics level moved sit one level below new ones
+LEGACY_LEVEL, OUTPUT_LEVEL = 5, 6
+
+
+@pytest.fixture(scope="module")
+def evaluator(fast_context):
+    return SealEvaluator(fast_context)
+
+
+def stored_logits(evaluator, values, level):
+    ct = SealEvaluator.from_vector(ts.ckks_vector(evaluator.context, list(values)))
+    evaluator.mod_switch_to(ct, level)
+    return evaluator.to_vector(ct, CLASSES).serialize()
+
+
+def decrypt(evaluator, ct):
+    return np.array(evaluator.to_vector(ct, CLASSES).decrypt())
+
+
+def test_square_sum_of_matched_levels(evaluator):
+    rng = np.random.default_rng(0)
+    days = rng.uniform(-3, 3, size=(3, CLASSES))
+    stored = [
+        evaluator.from_vector(ts.ckks_vector_from(evaluator.context, stored_logits(evaluator, day, level)))
+        for day, level in zip(days, [LEGACY_LEVEL, OUTPUT_LEVEL, LEGACY_LEVEL])
+    ]
+
+    cts = evaluator.match_levels(stored)
+    squares = evaluator.square_sum([evaluator.sub(cts[i], cts[i - 1]) for i in range(1, len(cts))])
+
+    assert [evaluator.level_of(ct) for ct in stored] == [LEGACY_LEVEL, OUTPUT_LEVEL, LEGACY_LEVEL]
+    assert {evaluator.level_of(ct) for ct in cts} == {OUTPUT_LEVEL}
+    np.testing.assert_allclose(decrypt(evaluator, squares), ((days[1:] - days[:-1]) ** 2).sum(axis=0), atol=1e-2)
+
+
+def test_product_sum_mixes_levels(evaluator):
+    rng = np.random.default_rng(2)
+    days = rng.uniform(-3, 3, size=(3, CLASSES))
+    legacy, current, other = (
+        evaluator.from_vector(ts.ckks_vector_from(evaluator.context, stored_logits(evaluator, day, level)))
+        for day, level in zip(days, [LEGACY_LEVEL, OUTPUT_LEVEL, OUTPUT_LEVEL])
+    )
+
+    squares = evaluator.square_sum([legacy, current])
+    products = evaluator.product_sum([(legacy, current), (current, other)])
+
+    np.testing.assert_allclose(decrypt(evaluator, squares), (days[:2] ** 2).sum(axis=0), atol=1e-2)
+    np.testing.assert_allclose(decrypt(evaluator, products), days[0] * days[1] + days[1] * days[2], atol=1e-2)
+
+
+def test_window_sums_mix_levels(evaluator):
+    rng = np.random.default_rng(3)
+    days = rng.uniform(-3, 3, size=(4, CLASSES))
+    levels = [LEGACY_LEVEL, OUTPUT_LEVEL, LEGACY_LEVEL, OUTPUT_LEVEL]
+    payloads = [stored_logits(evaluator, day, level) for day, level in zip(days, levels)]
+
+    sums = finish_window_sums(evaluator, [window_sums(evaluator, payloads, products=True)])
+
+    diffs = days[1:] - days[:-1]
+    np.testing.assert_allclose(decrypt(evaluator, sums.total), days.sum(axis=0), atol=1e-3)
+    np.testing.assert_allclose(decrypt(evaluator, sums.squares), (diffs**2).sum(axis=0), atol=1e-2)
+    np.testing.assert_allclose(decrypt(evaluator, sums.products), (days[1:] * days[:-1]).sum(axis=0), atol=1e-2)
+
+
+def test_shard_parts_at_different_levels(evaluator):
+    rng = np.random.default_rng(4)
+    days = rng.uniform(-3, 3, size=(4, CLASSES))
+    legacy = [stored_logits(evaluator, day, LEGACY_LEVEL) for day in days[:2]]
+    current = [stored_logits(evaluator, day, OUTPUT_LEVEL) for day in days[1:]]
+    # How ShardExecutor splits a window: later runs repeat the previous run's last day
+    parts = [window_sums(evaluator, legacy), window_sums(evaluator, current, overlap=True)]
+
+    sums = finish_window_sums(evaluator, parts)
+
+    np.testing.assert_allclose(decrypt(evaluator, sums.total), days.sum(axis=0), atol=1e-3)
+    np.testing.assert_allclose(decrypt(evaluator, sums.squares), ((days[1:] - days[:-1]) ** 2).sum(axis=0), atol=1e-2)
@@ -0,0 +1,86 @@
+"""Paginated NDJSON raw history, read to the end page by page."""
+import base64
+import json
+from datetime import date, timedelta
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import sessionmaker
+
+from app.api import routes_emotion
+from app.core.db import get_db
+from app.core.security import get_current_user
+from app.models.user import User
+from app.repositories.emotion_data_repository import EmotionDataRepository
+from app.services.emotion_service import EmotionService
+
+from conftest import load_client_module
+
+STORED_DAYS = 5
+
+
+@pytest.fixture
+def stored(db):
+    """Newest first: (date, ciphertext) of the days stored for alice."""
+    repo = EmotionDataRepository()
+    days = [(date.today() - timedelta(days=offset), f"day-{offset}".encode() * 100) for offset in range(STORED_DAYS)]
+    for day, ciphertext in days:
+        repo.upsert_enc_prediction(db, "alice", day, ciphertext)
+    return days
+
+
+@pytest.fixture
+def client(db, monkeypatch):
+    # The stream reads from its own session, opened once the endpoint has returned
+    monkeypatch.setattr(routes_emotion, "SessionLocal", sessionmaker(bind=db.get_bind(), future=True))
+    app = FastAPI()
+    app.include_router(routes_emotion.router)
+    app.state.emotion_service = EmotionService(EmotionDataRepository(), he_engine=None)
+    app.dependency_overrides[get_current_user] = lambda: User(user_id="alice")
+    app.dependency_overrides[get_db] = lambda: db
+    return TestClient(app)
+
+
+def read_page(client, offset, limit):
+    response = client.get("/emotion/history-raw/stream", params={"days": 30, "offset": offset, "limit": limit})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    header, *entries = [json.loads(line) for line in response.text.splitlines() if line]
+    return header, entries
+
+
+def test_pages_cover_the_window_once(client, stored):
+    offset, pages, received = 0, 0, []
+    while offset is not None:
+        header, entries = read_page(client, offset, 2)
+        assert header["total"] == STORED_DAYS
+        assert [entry["date"] for entry in entries] == header["dates"]
+        received += entries
+        offset, pages = header["next_offset"], pages + 1
+
+    assert pages == 3
+    assert [(date.fromisoformat(entry["date"]), base64.b64decode(entry["ciphertext"])) for entry in received] == stored
+
+
+def test_a_page_past_the_end_is_empty(client, stored):
+    header, entries = read_page(client, STORED_DAYS, 2)
+
+    assert (header["dates"], header["next_offset"], entries) == ([], None, [])
+
+
+def test_client_walks_every_page(client, stored, monkeypatch):
+    pytest.importorskip("requests")
+    api_client = load_client_module("api_client")
+    api = api_client.APIClient("http://testserver")
+
+    def get_ndjson(path, params=None):
+        response = client.get(path, params=params)
+        return (json.loads(line) for line in response.text.splitlines() if line)
+
+    monkeypatch.setattr(api, "_get_ndjson", get_ndjson)
+    lines = list(api.history_raw(30, "key-1", page_size=2))
+
+    headers = [line for line in lines if "next_offset" in line]
+    assert [header["next_offset"] for header in headers] == [2, 4, None]
+    assert [line["date"] for line in lines if "ciphertext" in line] == [day.isoformat() for day, _ in stored]
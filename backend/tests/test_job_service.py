@@ -0,0 +1,158 @@
+"""Analysis job queue: priority order, failures, and the 429 Retry-After of a full queue."""
+import threading
+import time
+from datetime import date
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api import routes_emotion
+from app.core.security import get_current_user
+from app.models.user import User
+from app.schemas.emotion import EncryptedPredictionResponse
+from app.services.job_service import FAILED, INITIAL_JOB_SECONDS, SUCCEEDED, AnalysisJobQueue, QueueFull
+
+
+class Session:
+    def close(self):
+        pass
+
+
+def wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "condition not reached"
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def job_queue():
+    queues = []
+
+    def make(**kwargs):
+        queues.append(AnalysisJobQueue(Session, **kwargs))
+        return queues[-1]
+
+    yield make
+    for created in queues:
+        created.close()
+
+
+def test_lower_priority_values_run_first(job_queue):
+    jobs = job_queue(workers=1, max_queued=4)
+    gate, order = threading.Event(), []
+    blocker = jobs.submit("u", lambda db: gate.wait(5))
+    wait_for(lambda: blocker.status == "running")
+
+    low = jobs.submit("u", lambda db: order.append("low"), priority=9)
+    high = jobs.submit("u", lambda db: order.append("high"), priority=1)
+    assert (jobs.position(high), jobs.position(low)) == (0, 1)
+    gate.set()
+    assert low.done.wait(5) and high.done.wait(5)
+    assert order == ["high", "low"]
+
+
+def test_failures_are_classified(job_queue):
+    jobs = job_queue(workers=1)
+
+    def invalid(db):
+        raise ValueError("bad ciphertext")
+
+    def broken(db):
+        raise RuntimeError("boom")
+
+    rejected, crashed = jobs.submit("u", invalid), jobs.submit("u", broken)
+    assert rejected.done.wait(5) and crashed.done.wait(5)
+    assert (rejected.status, rejected.error_kind, rejected.error) == (FAILED, "invalid", "bad ciphertext")
+    assert (crashed.status, crashed.error_kind, crashed.error) == (FAILED, "internal", "Encrypted analysis failed")
+
+
+def test_full_queue_raises_with_a_retry_hint(job_queue):
+    jobs = job_queue(workers=2, max_queued=1)
+    gate = threading.Event()
+    for _ in range(2):
+        job = jobs.submit("u", lambda db: gate.wait(5))
+        wait_for(lambda: job.status == "running")
+    jobs.submit("u", lambda db: None)
+
+    with pytest.raises(QueueFull) as excinfo:
+        jobs.submit("u", lambda db: None)
+    assert excinfo.value.retry_after == INITIAL_JOB_SECONDS / 2
+    gate.set()
+
+
+def test_jobs_belong_to_their_user(job_queue):
+    jobs = job_queue()
+    job = jobs.submit("alice", lambda db: 1)
+
+    assert jobs.get(job.job_id, "alice") is job
+    assert jobs.get(job.job_id, "bob") is None
+
+
+def test_finished_jobs_let_go_of_their_closure(job_queue):
+    jobs = job_queue(workers=1)
+    job = jobs.submit("alice", lambda db: 1)
+
+    assert job.done.wait(5)
+    wait_for(lambda: job.run is None)
+    assert (job.status, job.result) == (SUCCEEDED, 1)
+
+
+def test_only_the_newest_finished_jobs_are_kept(job_queue):
+    jobs = job_queue(workers=1, max_finished_per_user=2, max_finished=3)
+    alice = [jobs.submit("alice", lambda db: None) for _ in range(4)]
+    bob = [jobs.submit("bob", lambda db: None) for _ in range(2)]
+
+    wait_for(lambda: all(job.finished for job in alice + bob))
+    wait_for(lambda: len(jobs._jobs) == 3)
+    assert [jobs.get(job.job_id, "alice") is job for job in alice] == [False, False, False, True]
+    assert all(jobs.get(job.job_id, "bob") is job for job in bob)
+
+
+class EmotionService:
+    """Stands in for the HE analysis: blocks until released, then returns a fixed result."""
+
+    def __init__(self):
+        self.release = threading.Event()
+
+    def analyze_and_store(self, db, user_id, target_date, enc_image_payload, key_id, layout, batch_size=1):
+        self.release.wait(5)
+        return EncryptedPredictionResponse(ciphertext=enc_image_payload[::-1], date=target_date)
+
+
+@pytest.fixture
+def client(job_queue):
+    app = FastAPI()
+    app.include_router(routes_emotion.router)
+    app.state.job_queue = job_queue(workers=1, max_queued=1)
+    app.state.emotion_service = EmotionService()
+    app.dependency_overrides[get_current_user] = lambda: User(user_id="alice")
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+def submit(client, **extra):
+    return client.post("/emotion/jobs/analyze-today", json=dict(ciphertext="abc", key_id="k", date="2026-01-02", **extra))
+
+
+def test_job_routes_run_and_report(client):
+    response = submit(client)
+    assert response.status_code == 202
+    job_id = response.json()["job_id"]
+
+    client.app.state.emotion_service.release.set()
+    wait_for(lambda: client.get(f"/emotion/jobs/{job_id}").json()["status"] == SUCCEEDED)
+    assert client.get(f"/emotion/jobs/{job_id}").json()["result"] == {"ciphertext": "cba", "date": str(date(2026, 1, 2))}
+    assert client.get("/emotion/jobs/unknown").status_code == 404
+
+
+def test_full_queue_answers_429_with_retry_after(client):
+    first = submit(client).json()["job_id"]
+    wait_for(lambda: client.get(f"/emotion/jobs/{first}").json()["status"] == "running")
+    assert submit(client).status_code == 202
+
+    response = submit(client)
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == str(int(INITIAL_JOB_SECONDS))
+    client.app.state.emotion_service.release.set()
@@ -0,0 +1,77 @@
+"""Windows of a slot-packed history against the plain daily logits."""
+from datetime import date, timedelta
+
+import numpy as np
+import pytest
+import tenseal as ts
+
+from app.fhe_core.packed_history import PackedHistory, rotation_steps
+from app.fhe_core.seal_ops import SealEvaluator
+from app.fhe_core.tenseal_context import PROFILES, eval_context
+
+CLASSES = 7
+# The fast chain has no packing level; days one level up leave the same room
+STORED_LEVEL = 5
+START = date(2026, 1, 1)
+
+
+@pytest.fixture(scope="module")
+def keys(fast_context):
+    steps = rotation_steps(PROFILES["fast"].slot_count, CLASSES)
+    return fast_context, SealEvaluator(eval_context(fast_context, steps))
+
+
+def stored_logits(evaluator, values, level=STORED_LEVEL):
+    # Slots past the classes hold garbage, as a forward pass leaves them
+    noise = np.random.default_rng(len(values)).uniform(-3, 3, size=20)
+    ct = SealEvaluator.from_vector(ts.ckks_vector(evaluator.context, list(values) + list(noise)))
+    evaluator.mod_switch_to(ct, level)
+    return evaluator.from_vector(evaluator.to_vector(ct, CLASSES))
+
+
+def decrypt(secret, evaluator, ct):
+    return np.array(ts.ckks_vector_from(secret, evaluator.to_vector(ct, CLASSES).serialize()).decrypt())
+
+
+def test_window_statistics(keys):
+    secret, evaluator = keys
+    packer = PackedHistory(evaluator, CLASSES)
+    days = np.random.default_rng(0).uniform(-3, 3, size=(12, CLASSES))
+    cts = [stored_logits(evaluator, day) for day in days]
+    packed = packer.update(None, [(packer.position(START + timedelta(i)), ct, []) for i, ct in enumerate(cts)])
+    # Overwriting a day swaps its block
+    days[3] = np.random.default_rng(1).uniform(-3, 3, size=CLASSES)
+    packed = packer.update(packed, [(packer.position(START + timedelta(3)), stored_logits(evaluator, days[3]), [cts[3]])])
+
+    for first, count in [(0, 12), (2, 5), (7, 1)]:
+        total, squares = packer.window(packed, packer.position(START + timedelta(first)), count)
+        window = days[first : first + count]
+        np.testing.assert_allclose(decrypt(secret, evaluator, total), window.sum(axis=0), atol=1e-3)
+        if count == 1:
+            assert squares is None
+        else:
+            expected = ((window[1:] - window[:-1]) ** 2).sum(axis=0)
+            np.testing.assert_allclose(decrypt(secret, evaluator, squares), expected, atol=1e-2)
+
+
+def test_window_wraps_around_the_ring(keys):
+    secret, evaluator = keys
+    packer = PackedHistory(evaluator, CLASSES)
+    # Three days ending on the ring's last block and starting over at block 0
+    first = date.fromordinal((START.toordinal() // packer.days + 1) * packer.days - 2)
+    days = np.random.default_rng(2).uniform(-3, 3, size=(3, CLASSES))
+    packed = packer.update(
+        None, [(packer.position(first + timedelta(i)), stored_logits(evaluator, day), []) for i, day in enumerate(days)]
+    )
+
+    total, squares = packer.window(packed, packer.position(first), 3)
+
+    np.testing.assert_allclose(decrypt(secret, evaluator, total), days.sum(axis=0), atol=1e-3)
+    np.testing.assert_allclose(decrypt(secret, evaluator, squares), ((days[1:] - days[:-1]) ** 2).sum(axis=0), atol=1e-2)
+
+
+def test_range_sum_bounds(keys):
+    _, evaluator = keys
+    packer = PackedHistory(evaluator, CLASSES)
+    with pytest.raises(ValueError):
+        packer.range_sum(stored_logits(evaluator, np.zeros(CLASSES)), packer.days + 1)
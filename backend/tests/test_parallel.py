@@ -0,0 +1,161 @@
+"""Core budget and the sharded conv stage against the serial forward pass."""
+import threading
+
+import numpy as np
+import pytest
+import tenseal as ts
+
+from app.fhe_core import batching, parallel
+from app.fhe_core.parallel import (
+    WINDOW_DAYS_PER_SHARD,
+    CoreBudget,
+    ShardExecutor,
+    _shards,
+    _worker_state,
+    create_pool,
+    finish_window_sums,
+    window_sums,
+)
+from app.fhe_core.rotation_keys import required_rotation_steps
+from app.fhe_core.seal_ops import SealEvaluator
+from app.fhe_core.tenseal_context import create_context, eval_context
+
+from conftest import random_plan
+
+CHANNELS = 4
+
+
+@pytest.fixture(scope="module")
+def plan():
+    return random_plan(channels=CHANNELS)
+
+
+@pytest.fixture(scope="module")
+def setup(plan, tmp_path_factory):
+    """Secret context, a file with its step-limited eval context, and that eval context's evaluator."""
+    context = create_context(16384, (60, 40, 40, 40, 60), generate_galois_keys=False)
+    steps = required_rotation_steps(plan, 8192, [("im2col", 1)])
+    evaluation = eval_context(context, steps)
+    path = tmp_path_factory.mktemp("contexts") / "key.seal"
+    path.write_bytes(evaluation.serialize())
+    return context, path, SealEvaluator(evaluation)
+
+
+@pytest.fixture(scope="module")
+def conv(plan, setup):
+    _, _, evaluator = setup
+    return plan.encode_conv(evaluator, 1, 2**40, "im2col")
+
+
+def encrypted_image(context):
+    image = np.random.default_rng(1).uniform(0, 1, size=(batching.IMAGE_SIZE, batching.IMAGE_SIZE))
+    return SealEvaluator.from_vector(ts.ckks_vector(context, batching.im2col_batch([image])))
+
+
+def decrypt(context, ct, size):
+    return np.asarray(SealEvaluator(context).to_vector(ct, size).decrypt())
+
+
+def test_core_budget_grants_what_is_free():
+    budget = CoreBudget(3)
+
+    with budget.reserve(2) as first:
+        with budget.reserve(4) as second:
+            assert (first, second) == (2, 1)
+    with budget.reserve(8) as granted:
+        assert granted == 3
+    with pytest.raises(ValueError):
+        CoreBudget(0)
+
+
+def test_core_budget_blocks_until_released():
+    budget = CoreBudget(1)
+    granted = []
+
+    with budget.reserve(1):
+        waiter = threading.Thread(target=lambda: granted.append(budget.reserve(1).__enter__()))
+        waiter.start()
+        waiter.join(0.2)
+        assert waiter.is_alive() and not granted
+    waiter.join(5)
+    assert granted == [1]
+
+
+def test_shards_cover_every_index():
+    assert _shards(4, 3) == [range(0, 2), range(2, 4)]
+    assert _shards(3, 8) == [range(0, 1), range(1, 2), range(2, 3)]
+
+
+def test_ciphertext_round_trip(setup):
+    context, _, evaluator = setup
+    ct = SealEvaluator.from_vector(ts.ckks_vector(context, [1.0, -2.0, 3.5]))
+
+    loaded = evaluator.load_ciphertext(evaluator.save_ciphertext(ct))
+    np.testing.assert_allclose(decrypt(context, loaded, 3), [1.0, -2.0, 3.5], atol=1e-4)
+
+
+def test_blocked_conv_packs_like_the_serial_path(setup, conv):
+    context, _, evaluator = setup
+    ct = encrypted_image(context)
+
+    serial = decrypt(context, conv.block(evaluator, ct, 0, CHANNELS), conv.period)
+    blocks = [conv.block(evaluator, ct, 0, 2), conv.block(evaluator, ct, 2, 4)]
+    blocked = decrypt(context, conv.combine(evaluator, blocks, 2), conv.period)
+    np.testing.assert_allclose(blocked, serial, atol=1e-4)
+
+
+def test_shard_executor_matches_serial_conv(plan, setup, conv):
+    context, path, evaluator = setup
+    ct = encrypted_image(context)
+    pool = create_pool(1, plan)
+    try:
+        sharded = conv(evaluator, ct, ShardExecutor(pool, str(path), cores=2))
+    finally:
+        pool.shutdown()
+
+    serial = decrypt(context, conv(evaluator, ct), conv.period)
+    np.testing.assert_allclose(decrypt(context, sharded, conv.period), serial, atol=1e-4)
+
+
+def test_tree_sum_adds_every_summand(setup):
+    context, _, evaluator = setup
+    values = np.arange(1.0, 12.0)
+    cts = [SealEvaluator.from_vector(ts.ckks_vector(context, [value] * 3)) for value in values]
+
+    np.testing.assert_allclose(decrypt(context, evaluator.tree_sum(cts), 3), [values.sum()] * 3, atol=1e-3)
+    with pytest.raises(ValueError):
+        evaluator.tree_sum([])
+
+
+def test_sharded_window_sums_match_one_run(plan, setup):
+    context, path, evaluator = setup
+    days = np.random.default_rng(2).uniform(-3, 3, size=(2 * WINDOW_DAYS_PER_SHARD + 1, 7))
+    payloads = [ts.ckks_vector(context, list(day)).serialize() for day in days]
+    pool = create_pool(1, plan)
+    try:
+        parts = ShardExecutor(pool, str(path), cores=2).window_sums(evaluator, payloads, products=True)
+    finally:
+        pool.shutdown()
+
+    assert len(parts) == 2
+    sharded = finish_window_sums(evaluator, parts)
+    serial = finish_window_sums(evaluator, [window_sums(evaluator, payloads, products=True)])
+    for name in ("total", "squares", "products"):
+        np.testing.assert_allclose(
+            decrypt(context, getattr(sharded, name), 7), decrypt(context, getattr(serial, name), 7), atol=1e-2
+        )
+
+
+def test_a_worker_keeps_only_its_last_context(setup, tmp_path, monkeypatch):
+    _, path, _ = setup
+    other = tmp_path / "other.seal"
+    other.write_bytes(path.read_bytes())
+    monkeypatch.setattr(parallel, "_worker_context", None)
+
+    first = _worker_state(str(path))
+    assert _worker_state(str(path)) is first
+    second = _worker_state(str(other))
+
+    assert second is not first
+    assert parallel._worker_context[0][0] == str(other)
+    assert _worker_state(str(path)) is not first
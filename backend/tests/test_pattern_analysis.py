@@ -0,0 +1,126 @@
+"""Encrypted N-day pattern features behind /emotion/history."""
+import base64
+from datetime import date, timedelta
+
+import numpy as np
+import pytest
+import tenseal as ts
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api import routes_emotion
+from app.api.binary import LENGTHS_HEADER
+from app.core.db import get_db
+from app.core.security import get_current_user
+from app.fhe_core.seal_ops import SealEvaluator
+from app.models.emotion_aggregate import EmotionAggregate
+from app.models.user import User
+from app.repositories.emotion_data_repository import EmotionDataRepository
+from app.services.analysis_service import AnalysisService
+
+CLASSES = 7
+
+
+@pytest.fixture
+def served(engine, fast_eval_bytes):
+    engine.register_eval_context("key-1", fast_eval_bytes, profile="fast")
+    return engine
+
+
+def stored(context, values, level):
+    evaluator = SealEvaluator(context)
+    ct = evaluator.mod_switch_to(SealEvaluator.from_vector(ts.ckks_vector(context, list(values))), level)
+    return base64.b64encode(evaluator.to_vector(ct, CLASSES).serialize()).decode()
+
+
+def decrypt(context, payload):
+    data = payload if isinstance(payload, bytes) else base64.b64decode(payload)
+    return np.array(ts.ckks_vector_from(context, data).decrypt())
+
+
+def expected(days):
+    return {
+        "frequency": days.sum(axis=0),
+        "transition_energy": ((days[1:] - days[:-1]) ** 2).sum(axis=0),
+        "persistence": (days[1:] * days[:-1]).sum(axis=0),
+    }
+
+
+def test_features_match_the_plain_window(served, fast_context):
+    days = np.random.default_rng(0).uniform(-3, 3, size=(4, CLASSES))
+    # Rows stored before the output level moved sit one level lower
+    payloads = [stored(fast_context, day, level) for day, level in zip(days, [5, 6, 6, 5])]
+
+    features = served.run_pattern_analysis(payloads, "key-1")
+
+    for name, want in expected(days).items():
+        np.testing.assert_allclose(decrypt(fast_context, features[name]), want, atol=1e-2)
+    last = len(SealEvaluator(fast_context).levels) - 1
+    level = SealEvaluator(fast_context).level_of(
+        SealEvaluator.from_vector(ts.ckks_vector_from(fast_context, base64.b64decode(features["persistence"])))
+    )
+    assert level == last
+
+
+def test_a_single_day_has_no_transitions(served, fast_context):
+    (day,) = np.random.default_rng(1).uniform(-3, 3, size=(1, CLASSES))
+
+    features = served.run_pattern_analysis([stored(fast_context, day, 6)], "key-1", raw=True)
+
+    np.testing.assert_allclose(decrypt(fast_context, features["frequency"]), day, atol=1e-3)
+    np.testing.assert_allclose(decrypt(fast_context, features["transition_energy"])[:1], [0.0], atol=1e-3)
+    with pytest.raises(ValueError, match="No encrypted data"):
+        served.run_pattern_analysis([], "key-1")
+
+
+@pytest.fixture
+def client(served, db):
+    app = FastAPI()
+    app.include_router(routes_emotion.router)
+    app.state.analysis_service = AnalysisService(EmotionDataRepository(), served)
+    app.dependency_overrides[get_current_user] = lambda: User(user_id="alice")
+    app.dependency_overrides[get_db] = lambda: db
+    return TestClient(app)
+
+
+def test_history_routes_return_the_features(client, db, fast_context):
+    days = np.random.default_rng(2).uniform(-3, 3, size=(3, CLASSES))
+    repo = EmotionDataRepository()
+    for offset, values in zip((2, 1, 0), days):
+        repo.upsert_enc_prediction(
+            db, "alice", date.today() - timedelta(days=offset), base64.b64decode(stored(fast_context, values, 6))
+        )
+
+    body = client.get("/emotion/history", params={"key_id": "key-1", "days": 3}).json()
+    assert body["days"] == 3
+    np.testing.assert_allclose(decrypt(fast_context, body["frequency"]), days.sum(axis=0), atol=1e-2)
+
+    response = client.get("/emotion/history/binary", headers={"X-Key-Id": "key-1", "X-Days": "2"})
+    assert response.headers["X-Days"] == "2"
+    lengths = [int(size) for size in response.headers[LENGTHS_HEADER].split(",")]
+    persistence = response.content[sum(lengths[:2]) :]
+    np.testing.assert_allclose(decrypt(fast_context, persistence), days[1] * days[2], atol=1e-2)
+
+
+def test_history_without_stored_days_is_404(client):
+    assert client.get("/emotion/history", params={"key_id": "key-1"}).status_code == 404
+
+
+def test_history_without_key_id_uses_the_latest_stored_key(client, db, fast_context):
+    days = np.random.default_rng(3).uniform(-3, 3, size=(2, CLASSES))
+    repo = EmotionDataRepository()
+    for offset, values in zip((1, 0), days):
+        repo.upsert_enc_prediction(
+            db, "alice", date.today() - timedelta(days=offset), base64.b64decode(stored(fast_context, values, 6))
+        )
+    # Older clients omit key_id; without a recorded key it cannot be guessed
+    response = client.get("/emotion/history", params={"days": 2})
+    assert response.status_code == 422 and "key_id" in response.json()["detail"]
+
+    for offset, key_id in ((1, "old-key"), (0, "key-1")):
+        day = date.today() - timedelta(days=offset)
+        db.add(EmotionAggregate(user_id="alice", date=day, key_id=key_id, chain_start=day, enc_sum=""))
+    db.commit()
+    body = client.get("/emotion/history", params={"days": 2}).json()
+    np.testing.assert_allclose(decrypt(fast_context, body["frequency"]), days.sum(axis=0), atol=1e-2)
+    assert client.get("/emotion/history/binary", headers={"X-Days": "2"}).status_code == 200
@@ -0,0 +1,104 @@
+"""The .heplan artifact: round trip, memory mapping and header checks."""
+import json
+import struct
+import subprocess
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from app.fhe_core.plan_artifact import (
+    ALIGNMENT,
+    FORMAT_VERSION,
+    MAGIC,
+    export_model,
+    load_plan,
+    plan_digest,
+    read_manifest,
+    save_plan,
+)
+
+from conftest import random_plan
+
+
+@pytest.fixture
+def artifact(tmp_path):
+    plan = random_plan(channels=3, image_size=20, kernel_size=5, stride=3)
+    path = tmp_path / "model.heplan"
+    return plan, path, save_plan(plan, path, source="model.pt")
+
+
+def test_round_trip_keeps_geometry_and_weights(artifact):
+    plan, path, manifest = artifact
+    loaded = load_plan(path)
+
+    assert (loaded.image_size, loaded.stride, loaded.kernel_size, loaded.channels) == (20, 3, 5, 3)
+    for name, array in plan.weights.items():
+        np.testing.assert_array_equal(loaded.weights[name], array)
+    assert plan_digest(loaded) == manifest["sha256"] == read_manifest(path)["sha256"]
+    assert manifest["source"] == "model.pt"
+
+
+def test_arrays_are_mapped_read_only_and_aligned(artifact):
+    _, path, manifest = artifact
+    loaded = load_plan(path)
+
+    assert all(entry["offset"] % ALIGNMENT == 0 for entry in manifest["arrays"].values())
+    for array in loaded.weights.values():
+        assert not array.flags.writeable
+        while not isinstance(array, np.memmap):  # no copy was made
+            array = array.base
+            assert array is not None
+
+
+def test_digest_depends_on_weights_and_geometry():
+    plan = random_plan()
+
+    assert plan_digest(plan) == plan_digest(random_plan())
+    assert plan_digest(plan) != plan_digest(random_plan(seed=1))
+    assert plan_digest(plan) != plan_digest(random_plan(image_size=42))
+
+
+def test_rejects_foreign_and_stale_files(artifact, tmp_path):
+    _, path, _ = artifact
+    foreign = tmp_path / "foreign.heplan"
+    foreign.write_bytes(b"not a plan")
+    with pytest.raises(ValueError, match="not an HE plan"):
+        load_plan(foreign)
+
+    data = path.read_bytes()
+    (length,) = struct.unpack("<Q", data[len(MAGIC) : len(MAGIC) + 8])
+    manifest = json.loads(data[len(MAGIC) + 8 : len(MAGIC) + 8 + length])
+    manifest["format_version"] = FORMAT_VERSION + 1
+    header = json.dumps(manifest).encode("utf-8").ljust(length)
+    stale = tmp_path / "stale.heplan"
+    stale.write_bytes(data[: len(MAGIC) + 8] + header + data[len(MAGIC) + 8 + length :])
+    with pytest.raises(ValueError, match="re-export"):
+        load_plan(stale)
+
+    with pytest.raises(FileNotFoundError):
+        load_plan(tmp_path / "missing.heplan")
+
+
+def test_rejects_weights_that_fail_the_digest(artifact, tmp_path):
+    _, path, _ = artifact
+    data = bytearray(path.read_bytes())
+    # Flip a bit of the last weight: the header stays valid
+    data[-1] ^= 1
+    corrupt = tmp_path / "corrupt.heplan"
+    corrupt.write_bytes(bytes(data))
+
+    with pytest.raises(ValueError, match="corrupt"):
+        load_plan(corrupt)
+
+
+def test_export_needs_the_trained_weights(tmp_path):
+    with pytest.raises(FileNotFoundError, match="--allow-random"):
+        export_model(tmp_path / "missing.pt", tmp_path / "model.heplan", 48)
+    assert not (tmp_path / "model.heplan").exists()
+
+
+def test_serving_path_does_not_import_torch():
+    code = "import sys, app.services.he_service, app.fhe_core.plan_artifact; assert 'torch' not in sys.modules"
+    subprocess.run([sys.executable, "-c", code], cwd=Path(__file__).resolve().parents[1], check=True)
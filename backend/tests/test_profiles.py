@@ -0,0 +1,94 @@
+"""Named CKKS parameter profiles and the client's mirror of them."""
+import inspect
+
+import pytest
+
+from app.api import routes_he
+from app.fhe_core.tenseal_context import DEFAULT_PROFILE, PROFILES, create_context, get_profile, profile_of
+from app.schemas.emotion import ContextUploadInit, HEKeyLinkRequest, HEKeyRegisterRequest
+from app.services.context_upload import ContextUploadManager
+from app.services.he_pool import HEWorkerPool
+from app.services.he_service import HEEmotionEngine
+
+from conftest import load_client_module
+
+
+def test_profiles_leave_room_for_every_rescale():
+    for profile in PROFILES.values():
+        # conv, pack mask, square, FC1, square, FC2 and the statistics square
+        assert profile.depth >= 7
+        assert profile.slot_count == profile.poly_modulus_degree // 2
+    assert DEFAULT_PROFILE in PROFILES
+
+
+def test_packed_history_profile_adds_the_mask_level():
+    safe, packed = PROFILES["safe"], PROFILES["safe-packed"]
+
+    assert packed.packed_history and not safe.packed_history
+    assert packed.poly_modulus_degree == safe.poly_modulus_degree
+    assert packed.depth == safe.depth + 1
+    # Within the 256-bit security bound at N=32768
+    assert sum(packed.coeff_mod_bit_sizes) <= 476
+
+
+def test_get_profile_rejects_unknown_names():
+    assert get_profile("fast") is PROFILES["fast"]
+    with pytest.raises(ValueError, match="fast"):
+        get_profile("turbo")
+
+
+def test_profile_of_maps_a_context_back(fast_context):
+    assert profile_of(fast_context) is PROFILES["fast"]
+    assert PROFILES["fast"].matches(fast_context)
+    assert not PROFILES["safe"].matches(fast_context)
+
+
+def test_profile_of_rejects_custom_parameters():
+    context = create_context(8192, (60, 40, 60), generate_galois_keys=False)
+
+    with pytest.raises(ValueError, match="match no profile"):
+        profile_of(context)
+
+
+def test_client_mirrors_server_profiles():
+    fhe_keys = load_client_module("fhe_keys")
+
+    assert set(fhe_keys.PROFILES) == set(PROFILES)
+    for name, params in fhe_keys.PROFILES.items():
+        profile = PROFILES[name]
+        assert params["poly_modulus_degree"] == profile.poly_modulus_degree
+        assert tuple(params["coeff_mod_bit_sizes"]) == profile.coeff_mod_bit_sizes
+        assert params["global_scale"] == profile.global_scale
+    assert fhe_keys.LEGACY_PROFILE in PROFILES
+
+
+def default_of(function, name="profile"):
+    default = inspect.signature(function).parameters[name].default
+    return getattr(default, "default", default)
+
+
+def test_server_defaults_to_the_default_profile():
+    assert HEKeyRegisterRequest(key_id="k", eval_context_b64="").profile == DEFAULT_PROFILE
+    assert HEKeyLinkRequest(key_id="k", sha256="0" * 64).profile == DEFAULT_PROFILE
+    assert ContextUploadInit(key_id="k", total_size=1).profile == DEFAULT_PROFILE
+    functions = [
+        routes_he.rotation_steps,
+        routes_he.register_key_binary,
+        ContextUploadManager.create,
+        HEEmotionEngine.register_eval_context,
+        HEEmotionEngine.register_eval_context_file,
+        HEEmotionEngine.register_existing_context,
+        HEEmotionEngine.rotation_key_profile,
+        HEWorkerPool.rotation_key_profile,
+    ]
+    assert {default_of(function) for function in functions} == {DEFAULT_PROFILE}
+
+
+def test_client_defaults_to_the_server_profile(monkeypatch):
+    monkeypatch.delenv("FHE_PARAM_PROFILE", raising=False)
+
+    assert load_client_module("config").PARAM_PROFILE == DEFAULT_PROFILE
+    pytest.importorskip("requests")
+    api = load_client_module("api_client").APIClient
+    functions = [api.rotation_steps, api.register_he_key, api.register_he_key_binary, api.upload_eval_context]
+    assert {default_of(function) for function in functions} == {DEFAULT_PROFILE}
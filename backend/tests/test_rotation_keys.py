@@ -0,0 +1,64 @@
+"""Traced rotation steps, step-limited eval contexts and the register-key check."""
+import numpy as np
+import pytest
+import tenseal as ts
+
+from app.fhe_core import batching
+from app.fhe_core.rotation_keys import _naf, missing_rotation_steps, required_rotation_steps
+from app.fhe_core.seal_ops import SealEvaluator
+from app.fhe_core.tenseal_context import create_context, eval_context, galois_element
+
+from conftest import plain_forward, random_plan
+
+SMALL = dict(poly_modulus_degree=8192, coeff_mod_bit_sizes=(60, 40, 60))
+
+
+def test_galois_element_rejects_out_of_range_steps():
+    assert galois_element(1, 8192) == 3
+    assert galois_element(-1, 8192) == pow(3, 4095, 16384)
+    for step in (0, 4096, -4096):
+        with pytest.raises(ValueError):
+            galois_element(step, 8192)
+
+
+@pytest.mark.parametrize("value", [1, 3, 7, 12, 49, 255, 784, 4095])
+def test_naf_is_a_non_adjacent_decomposition(value):
+    terms = _naf(value)
+
+    assert sum(terms) == value
+    exponents = sorted(abs(term).bit_length() for term in terms)
+    assert all(b - a >= 2 for a, b in zip(exponents, exponents[1:]))
+
+
+def test_missing_steps_follow_keys_and_naf():
+    context = create_context(**SMALL, generate_galois_keys=False)
+    evaluation = eval_context(context, [1, 4, 5, -8])
+
+    assert not evaluation.has_secret_key()
+    assert missing_rotation_steps(context, [1, 2]) == [1, 2]  # no Galois keys at all
+    assert missing_rotation_steps(evaluation, [1, 4, 5, -8]) == []
+    # 3 = 4 - 1 needs a -1 key; 12 = 16 - 4 needs 16; 2 has no key and no decomposition
+    assert missing_rotation_steps(evaluation, [2, 3, 12]) == [2, 3, 12]
+    assert missing_rotation_steps(eval_context(create_context(**SMALL)), [2, 3, 12, 777]) == []
+
+
+def test_eval_context_needs_the_secret_key():
+    public = eval_context(create_context(**SMALL, generate_galois_keys=False))
+
+    with pytest.raises(ValueError):
+        eval_context(public, [1])
+
+
+def test_traced_steps_cover_a_real_forward_pass():
+    # conv, mask, square, FC1, square, FC2: six levels
+    context = create_context(poly_modulus_degree=16384, coeff_mod_bit_sizes=(60,) + (40,) * 6 + (60,), generate_galois_keys=False)
+    plan = random_plan()
+    steps = required_rotation_steps(plan, 8192, [("im2col", 1)])
+    evaluator = SealEvaluator(eval_context(context, steps))
+    encoded = plan.encode(evaluator, 1, context.global_scale, "im2col")
+    image = np.random.default_rng(1).uniform(0, 1, size=(batching.IMAGE_SIZE, batching.IMAGE_SIZE))
+
+    enc = ts.ckks_vector(context, batching.im2col_batch([image]))
+    logits = encoded.forward(evaluator, SealEvaluator.from_vector(enc))
+    out = SealEvaluator(context).to_vector(logits, batching.NUM_CLASSES).decrypt()
+    np.testing.assert_allclose(out, plain_forward(plan, image), rtol=1e-2, atol=1e-2)
@@ -0,0 +1,131 @@
+"""Per-day vector cache and the history window read through it."""
+import base64
+from datetime import date, timedelta
+
+import numpy as np
+import pytest
+import tenseal as ts
+
+from app.repositories.emotion_data_repository import EmotionDataRepository
+from app.services.history_window import run_on_recent_days
+from app.services.vector_cache import VectorCache, VectorEvicted
+
+CLASSES = 7
+DAY = date(2026, 1, 1)
+
+
+class FakeCiphertext:
+    def __init__(self, words: int) -> None:
+        self.words = words
+
+    def size(self):
+        return 2
+
+    def poly_modulus_degree(self):
+        return self.words
+
+    def coeff_modulus_size(self):
+        return 1
+
+
+def test_hits_only_with_the_same_hash_and_context():
+    cache = VectorCache(1024)
+    ct = FakeCiphertext(8)
+    cache.put(("key-1", "alice", DAY), "h1", "d1", ct, CLASSES)
+
+    assert cache.get(("key-1", "alice", DAY), "h1", "d1") == (ct, CLASSES)
+    assert cache.get(("key-1", "alice", DAY), "h2", "d1") is None
+    assert cache.get(("key-1", "alice", DAY), "h1", "d2") is None
+    assert cache.get(("key-2", "alice", DAY), "h1", "d1") is None
+
+
+def test_least_recently_used_days_go_over_budget():
+    # Each entry holds 2 * 16 * 1 * 8 = 256 bytes
+    cache = VectorCache(600)
+    days = [DAY + timedelta(days=offset) for offset in range(3)]
+    cache.put(("key-1", "alice", days[0]), "h", "d", FakeCiphertext(16), CLASSES)
+    cache.put(("key-1", "alice", days[1]), "h", "d", FakeCiphertext(16), CLASSES)
+    cache.get(("key-1", "alice", days[0]), "h", "d")
+    cache.put(("key-1", "alice", days[2]), "h", "d", FakeCiphertext(16), CLASSES)
+
+    assert cache.get(("key-1", "alice", days[1]), "h", "d") is None
+    assert cache.get(("key-1", "alice", days[0]), "h", "d") is not None
+    # Larger than the whole budget: not cached at all
+    cache.put(("key-1", "bob", DAY), "h", "d", FakeCiphertext(64), CLASSES)
+    assert cache.get(("key-1", "bob", DAY), "h", "d") is None
+    assert cache.get(("key-1", "alice", days[2]), "h", "d") is not None
+
+
+def test_discard_drops_a_users_days_under_every_key():
+    cache = VectorCache(4096)
+    for key_id in ("key-1", "key-2"):
+        cache.put((key_id, "alice", DAY), "h", "d", FakeCiphertext(8), CLASSES)
+    cache.put(("key-1", "bob", DAY), "h", "d", FakeCiphertext(8), CLASSES)
+
+    cache.discard("alice", [DAY])
+
+    assert cache.get(("key-1", "alice", DAY), "h", "d") is None
+    assert cache.get(("key-2", "alice", DAY), "h", "d") is None
+    assert cache.get(("key-1", "bob", DAY), "h", "d") is not None
+
+
+class CountingRepository(EmotionDataRepository):
+    def __init__(self) -> None:
+        super().__init__()
+        self.loaded = []
+
+    def get_enc_predictions_on(self, db, user_id, dates):
+        self.loaded.append(sorted(dates))
+        return super().get_enc_predictions_on(db, user_id, dates)
+
+
+@pytest.fixture
+def served(engine, fast_eval_bytes):
+    engine.register_eval_context("key-1", fast_eval_bytes, profile="fast")
+    return engine
+
+
+def stored(context, values):
+    return ts.ckks_vector(context, list(values)).serialize()
+
+
+def frequency(context, features):
+    return np.array(ts.ckks_vector_from(context, base64.b64decode(features["frequency"])).decrypt())
+
+
+def test_a_warm_window_loads_only_changed_days(served, db, fast_context):
+    repo = CountingRepository()
+    days = np.random.default_rng(0).uniform(-3, 3, size=(3, CLASSES))
+    dates = [date.today() - timedelta(days=offset) for offset in (2, 1, 0)]
+    for day, values in zip(dates, days):
+        repo.upsert_enc_prediction(db, "alice", day, stored(fast_context, values))
+
+    def analyze():
+        features, count = run_on_recent_days(repo, served, db, "alice", 3, "key-1", served.run_pattern_analysis)
+        assert count == 3
+        return frequency(fast_context, features)
+
+    np.testing.assert_allclose(analyze(), days.sum(axis=0), atol=1e-2)
+    np.testing.assert_allclose(analyze(), days.sum(axis=0), atol=1e-2)
+    days[1] += 1.0
+    repo.upsert_enc_prediction(db, "alice", dates[1], stored(fast_context, days[1]))
+    np.testing.assert_allclose(analyze(), days.sum(axis=0), atol=1e-2)
+
+    assert repo.loaded == [dates, [], [dates[1]]]
+
+
+def test_an_evicted_day_is_reloaded(served, db, fast_context, monkeypatch):
+    repo = CountingRepository()
+    values = np.random.default_rng(1).uniform(-3, 3, size=CLASSES)
+    repo.upsert_enc_prediction(db, "alice", date.today(), stored(fast_context, values))
+    # The engine claims the day is cached, but it is gone when the window runs
+    monkeypatch.setattr(served, "cached_days", lambda key_id, user_id, day_hashes: [day for day, _ in day_hashes])
+
+    with pytest.raises(VectorEvicted):
+        served.run_pattern_analysis(
+            [None], "key-1", user_id="alice", day_hashes=repo.get_recent_prediction_hashes(db, "alice", 1)
+        )
+    features, _ = run_on_recent_days(repo, served, db, "alice", 1, "key-1", served.run_pattern_analysis)
+
+    np.testing.assert_allclose(frequency(fast_context, features), values, atol=1e-3)
+    assert repo.loaded == [[], [date.today()]]
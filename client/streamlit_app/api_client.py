@@ -1,11 +1,15 @@
 """HTTP client for FastAPI backend."""
 from __future__ import annotations
 
-from typing import Any, Dict, Optional
+import hashlib
+import json
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional
 
 import requests
 
-from config import BACKEND_BASE_URL
+from config import BACKEND_BASE_URL, HISTORY_PAGE_SIZE, PARAM_PROFILE
 
 
 class APIClient:
@@ -25,23 +29,264 @@ class APIClient:
         return res
 
     # -------------------- HE key registration --------------------
-    def register_he_key(self, key_id: str, eval_context_b64: str) -> Dict[str, Any]:
-        payload = {"key_id": key_id, "eval_context_b64": eval_context_b64}
+    def parameter_profiles(self) -> List[Dict[str, Any]]:
+        return self._get("/he/profiles")
+
+    def rotation_steps(self, layout: str, batch_sizes: List[int], profile: str = PARAM_PROFILE) -> Dict[str, Any]:
+        params = {"layout": layout, "batch_sizes": batch_sizes, "profile": profile}
+        return self._get("/he/rotation-steps", params=params)
+
+    def register_he_key(
+        self,
+        key_id: str,
+        eval_context_b64: str,
+        layout: str = "im2col",
+        batch_sizes: List[int] | None = None,
+        profile: str = PARAM_PROFILE,
+    ) -> Dict[str, Any]:
+        payload = {
+            "key_id": key_id,
+            "eval_context_b64": eval_context_b64,
+            "layout": layout,
+            "batch_sizes": batch_sizes or [1],
+            "profile": profile,
+        }
         return self._post("/he/register-key", json=payload)
 
+    def register_he_key_binary(
+        self,
+        key_id: str,
+        eval_context: bytes,
+        layout: str = "im2col",
+        batch_sizes: List[int] | None = None,
+        profile: str = PARAM_PROFILE,
+    ) -> Dict[str, Any]:
+        headers = {
+            "X-Key-Id": key_id,
+            "X-Layout": layout,
+            "X-Batch-Sizes": ",".join(str(b) for b in batch_sizes or [1]),
+            "X-Profile": profile,
+        }
+        return self._post_bytes("/he/register-key/binary", eval_context, headers, timeout=600).json()
+
+    def context_present(self, sha256: str) -> bool:
+        """Whether the server already stores the eval context with this SHA-256."""
+        return bool(self._get(f"/he/contexts/{sha256}").get("present"))
+
+    def upload_eval_context(
+        self,
+        key_id: str,
+        path: Path,
+        layout: str = "im2col",
+        batch_sizes: List[int] | None = None,
+        profile: str = PARAM_PROFILE,
+        chunk_size: int = 16 * 2**20,
+        progress: Callable[[int, int], None] | None = None,
+        sha256: str | None = None,
+        retries: int = 5,
+        poll_interval: float = 2.0,
+        timeout: float = 1800.0,
+    ) -> Dict[str, Any]:
+        """Register the eval context in ``path`` through the resumable chunked upload.
+
+        If the server already stores a context with the file's SHA-256,
+        ``key_id`` is linked to it and nothing is uploaded. Otherwise chunks
+        are read from disk one at a time. After a failed chunk the client asks
+        the server where the upload stands and resumes there, up to
+        ``retries`` times in a row. ``progress(sent, total)`` is called after
+        every chunk. ``sha256`` skips hashing the file when the caller knows
+        its digest. Returns the final upload status (``status`` is
+        ``"registered"``) once the server has registered the context.
+        """
+        path = Path(path)
+        total = path.stat().st_size
+        if sha256 is None:
+            digest = hashlib.sha256()
+            with path.open("rb") as handle:
+                for block in iter(lambda: handle.read(2**20), b""):
+                    digest.update(block)
+            sha256 = digest.hexdigest()
+        payload = {
+            "key_id": key_id,
+            "sha256": sha256,
+            "layout": layout,
+            "batch_sizes": batch_sizes or [1],
+            "profile": profile,
+        }
+        if self.context_present(payload["sha256"]):
+            linked = self._post("/he/register-key/by-hash", json=payload)
+            if progress:
+                progress(total, total)
+            return dict(linked, status="registered")
+        upload = self._post("/he/uploads", json=dict(payload, total_size=total))
+        upload_id = upload["upload_id"]
+        chunk_size = min(chunk_size, upload["max_chunk_size"])
+        offset, failures = 0, 0
+        with path.open("rb") as handle:
+            while offset < total:
+                handle.seek(offset)
+                chunk = handle.read(chunk_size)
+                headers = {"X-Upload-Offset": str(offset), "X-Chunk-Sha256": hashlib.sha256(chunk).hexdigest()}
+                try:
+                    res = self._send_bytes("PUT", f"/he/uploads/{upload_id}", chunk, headers)
+                    offset, failures = res.json()["received"], 0
+                except requests.RequestException:
+                    failures += 1
+                    if failures > retries:
+                        raise
+                    time.sleep(min(2**failures, 30))
+                    offset = self._get(f"/he/uploads/{upload_id}")["received"]
+                if progress:
+                    progress(offset, total)
+        upload = self._post(f"/he/uploads/{upload_id}/finalize")
+        deadline = time.monotonic() + timeout
+        while upload["status"] == "processing":
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Upload {upload_id} was not registered within {timeout}s")
+            time.sleep(poll_interval)
+            upload = self._get(f"/he/uploads/{upload_id}")
+        if upload["status"] != "registered":
+            raise RuntimeError(f"Eval context registration failed: {upload.get('error')}")
+        return upload
+
     # -------------------- Emotion --------------------
-    def analyze_today(self, ciphertext_b64: str, key_id: str, target_date: str | None = None) -> Dict[str, Any]:
-        payload = {"ciphertext": ciphertext_b64, "key_id": key_id, "date": target_date}
+    def analyze_today(
+        self,
+        ciphertext_b64: str,
+        key_id: str,
+        target_date: str | None = None,
+        layout: str = "im2col",
+        batch_size: int = 1,
+    ) -> Dict[str, Any]:
+        """``batch_size > 1``: the ciphertext is a ``batching.mergeable_replicated`` encoding."""
+        payload = {
+            "ciphertext": ciphertext_b64,
+            "key_id": key_id,
+            "date": target_date,
+            "layout": layout,
+            "batch_size": batch_size,
+        }
         return self._post("/emotion/analyze-today", json=payload)
 
-    def history_raw(self, days: int, key_id: str) -> Dict[str, Any]:
-        params = {"days": days, "key_id": key_id}
-        return self._get("/emotion/history-raw", params=params)
+    def analyze_today_binary(
+        self,
+        ciphertext: bytes,
+        key_id: str,
+        target_date: str | None = None,
+        layout: str = "im2col",
+        batch_size: int = 1,
+    ) -> Dict[str, Any]:
+        """``analyze_today`` with raw serialized ciphertexts; returns ``{"date", "ciphertext": bytes}``."""
+        headers = {"X-Key-Id": key_id, "X-Layout": layout, "X-Batch-Size": str(batch_size)}
+        if target_date:
+            headers["X-Date"] = target_date
+        res = self._post_bytes("/emotion/analyze-today/binary", ciphertext, headers)
+        return {"date": res.headers.get("X-Date"), "ciphertext": res.content}
+
+    def submit_analyze_today(
+        self,
+        ciphertext_b64: str,
+        key_id: str,
+        target_date: str | None = None,
+        layout: str = "im2col",
+        priority: int = 5,
+        batch_size: int = 1,
+    ) -> Dict[str, Any]:
+        payload = {
+            "ciphertext": ciphertext_b64,
+            "key_id": key_id,
+            "date": target_date,
+            "layout": layout,
+            "priority": priority,
+            "batch_size": batch_size,
+        }
+        return self._post("/emotion/jobs/analyze-today", json=payload, timeout=60)
+
+    def job_status(self, job_id: str) -> Dict[str, Any]:
+        return self._get(f"/emotion/jobs/{job_id}")
+
+    def analyze_today_job(
+        self,
+        ciphertext_b64: str,
+        key_id: str,
+        target_date: str | None = None,
+        layout: str = "im2col",
+        poll_interval: float = 2.0,
+        timeout: float = 900.0,
+    ) -> Dict[str, Any]:
+        """``analyze_today`` through the job queue: submit, then poll until the job finishes."""
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                job = self.submit_analyze_today(ciphertext_b64, key_id, target_date, layout)
+                break
+            except requests.HTTPError as exc:
+                if exc.response is None or exc.response.status_code != 429 or time.monotonic() > deadline:
+                    raise
+                time.sleep(float(exc.response.headers.get("Retry-After", poll_interval)))
+        while job["status"] not in ("succeeded", "failed"):
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Job {job['job_id']} did not finish within {timeout}s")
+            time.sleep(poll_interval)
+            job = self.job_status(job["job_id"])
+        if job["status"] == "failed":
+            raise RuntimeError(f"Job {job['job_id']} failed: {job.get('error')}")
+        return job["result"]
+
+    def analyze_batch(
+        self, ciphertext_b64: str, key_id: str, target_dates: List[str], layout: str = "im2col"
+    ) -> Dict[str, Any]:
+        payload = {"ciphertext": ciphertext_b64, "key_id": key_id, "dates": target_dates, "layout": layout}
+        return self._post("/emotion/analyze-batch", json=payload)
+
+    def analyze_batch_binary(
+        self, ciphertext: bytes, key_id: str, target_dates: List[str], layout: str = "im2col"
+    ) -> Dict[str, Any]:
+        """``analyze_batch`` with raw serialized ciphertexts; entries carry ``bytes`` ciphertexts."""
+        headers = {"X-Key-Id": key_id, "X-Dates": ",".join(target_dates), "X-Layout": layout}
+        res = self._post_bytes("/emotion/analyze-batch/binary", ciphertext, headers)
+        dates = res.headers.get("X-Dates", "").split(",")
+        return {"entries": [{"date": d, "ciphertext": ct} for d, ct in zip(dates, _split_framed(res))]}
+
+    def history_raw(self, days: int, key_id: str, page_size: int = HISTORY_PAGE_SIZE) -> Iterator[Dict[str, Any]]:
+        """Stored ciphertexts of the window, newest first, as they arrive from ``/emotion/history-raw/stream``.
+
+        Each page starts with its header (``dates``, ``total``, ``next_offset``),
+        followed by one ``{"date", "ciphertext"}`` entry per day.
+        """
+        offset: Optional[int] = 0
+        while offset is not None:
+            params = {"days": days, "key_id": key_id, "offset": offset, "limit": page_size}
+            lines = self._get_ndjson("/emotion/history-raw/stream", params=params)
+            header = next(lines)
+            yield header
+            yield from lines
+            offset = header["next_offset"]
+
+    def history_analysis(self, days: int, key_id: str) -> Dict[str, Any]:
+        """Encrypted per-class frequency, transition energy and persistence of the window."""
+        return self._get("/emotion/history", params={"days": days, "key_id": key_id})
+
+    def history_analysis_binary(self, days: int, key_id: str) -> Dict[str, Any]:
+        """``history_analysis`` with raw ciphertexts."""
+        res = self._send_bytes("GET", "/emotion/history/binary", b"", {"X-Key-Id": key_id, "X-Days": str(days)})
+        frequency, transition_energy, persistence = _split_framed(res)
+        return {
+            "days": int(res.headers.get("X-Days", days)),
+            "frequency": frequency,
+            "transition_energy": transition_energy,
+            "persistence": persistence,
+        }
 
     def analyze_history_fhe(self, days: int, key_id: str) -> Dict[str, str]:
         payload = {"days": days, "key_id": key_id}
         return self._post("/emotion/analyze-history", json=payload)
 
+    def analyze_history_fhe_binary(self, days: int, key_id: str) -> Dict[str, bytes]:
+        res = self._post_bytes("/emotion/analyze-history/binary", b"", {"X-Key-Id": key_id, "X-Days": str(days)})
+        enc_sum, enc_vol = _split_framed(res)
+        return {"encrypted_sum": enc_sum, "encrypted_volatility": enc_vol}
+
     # -------------------- Internal helpers --------------------
     def _headers(self) -> Dict[str, str]:
         headers = {"Content-Type": "application/json"}
@@ -58,6 +303,25 @@ class APIClient:
             raise requests.HTTPError(detail, response=res) from exc
         return res.json() if res.text else {}
 
+    def _post_bytes(
+        self, path: str, data: bytes, headers: Dict[str, str], timeout: int = 300
+    ) -> requests.Response:
+        return self._send_bytes("POST", path, data, headers, timeout)
+
+    def _send_bytes(
+        self, method: str, path: str, data: bytes, headers: Dict[str, str], timeout: int = 300
+    ) -> requests.Response:
+        """Send a raw ``application/octet-stream`` body; metadata travels in ``headers``."""
+        all_headers = dict(self._headers(), **headers)
+        all_headers["Content-Type"] = "application/octet-stream"
+        res = requests.request(method, f"{self.base_url}{path}", data=data, headers=all_headers, timeout=timeout)
+        try:
+            res.raise_for_status()
+        except requests.HTTPError as exc:
+            detail = f"{method} {path} -> {res.status_code} {res.reason}; body={res.text[:500]}"
+            raise requests.HTTPError(detail, response=res) from exc
+        return res
+
     def _get(self, path: str, params: Dict[str, Any] | None = None) -> Dict[str, Any]:
         res = requests.get(f"{self.base_url}{path}", params=params or {}, headers=self._headers(), timeout=30)
         try:
@@ -67,6 +331,30 @@ class APIClient:
             raise requests.HTTPError(detail, response=res) from exc
         return res.json() if res.text else {}
 
+    def _get_ndjson(self, path: str, params: Dict[str, Any] | None = None) -> Iterator[Dict[str, Any]]:
+        """GET a newline-delimited JSON response, parsing each line as it arrives."""
+        res = requests.get(
+            f"{self.base_url}{path}", params=params or {}, headers=self._headers(), timeout=30, stream=True
+        )
+        try:
+            res.raise_for_status()
+        except requests.HTTPError as exc:
+            detail = f"GET {path} -> {res.status_code} {res.reason}; body={res.text}"
+            raise requests.HTTPError(detail, response=res) from exc
+        with res:
+            for line in res.iter_lines():
+                if line:
+                    yield json.loads(line)
+
+
+def _split_framed(res: requests.Response) -> List[bytes]:
+    """Split a binary response into its ciphertexts using ``X-Ciphertext-Lengths``."""
+    parts, offset = [], 0
+    for length in (int(n) for n in res.headers.get("X-Ciphertext-Lengths", "").split(",") if n):
+        parts.append(res.content[offset : offset + length])
+        offset += length
+    return parts
+
 
 def get_client(base_url: str | None = None) -> APIClient:
     return APIClient(base_url=base_url or BACKEND_BASE_URL)
@@ -2,7 +2,7 @@
 from __future__ import annotations
 
 import base64
-from typing import List
+from typing import List, Union
 
 import numpy as np
 import streamlit as st
@@ -12,8 +12,20 @@ import datetime
 
 from diagnostics import MentalHealthDiagnostics
 
+import codec
 from api_client import get_client
-from fhe_keys import ensure_client_context
+from batching import LAYOUT, im2col_replicated, key_batch_sizes
+from config import CIPHERTEXT_CODEC
+from fhe_keys import (
+    LEGACY_PROFILE,
+    PARAM_PROFILE,
+    ensure_client_context,
+    eval_context_sha256,
+    keypair_exists,
+    load_key_meta,
+    max_ciphertext_bytes,
+    slot_count,
+)
 from preprocessing import preprocess_image_to_fer2013_format
 from state import init_session_state, set_auth, set_key_info
 
@@ -30,15 +42,29 @@ def softmax(x: np.ndarray) -> np.ndarray:
 
 
 def encrypt_image(ctx: ts.Context, vector: np.ndarray) -> str:
-    """Encrypt preprocessed 48x48 image using im2col encoding."""
-    image_list = vector.reshape(48, 48).tolist()
-    enc_x, _ = ts.im2col_encoding(ctx, image_list, KERNEL_SIZE, KERNEL_SIZE, STRIDE)
-    return base64.b64encode(enc_x.serialize()).decode("utf-8")
+    """Encrypt preprocessed 48x48 image using the replicated im2col encoding."""
+    return encrypt_images(ctx, [vector])
 
 
-def decrypt_logits(ctx: ts.Context, logits_b64: str) -> np.ndarray:
-    logits_bytes = base64.b64decode(logits_b64.encode("utf-8"))
-    enc_logits = ts.ckks_vector_from(ctx, logits_bytes)
+def encrypt_images(ctx: ts.Context, vectors: List[np.ndarray]) -> str:
+    """Encrypt several preprocessed 48x48 images into one replicated im2col ciphertext."""
+    return base64.b64encode(encrypt_images_raw(ctx, vectors)).decode("utf-8")
+
+
+def encrypt_images_raw(ctx: ts.Context, vectors: List[np.ndarray]) -> bytes:
+    """``encrypt_images`` without base64, for the binary endpoints."""
+    return codec.encode(ts.ckks_vector(ctx, im2col_replicated(ctx, vectors)).serialize(), CIPHERTEXT_CODEC)
+
+
+def load_vector(ctx: ts.Context, data: bytes) -> ts.CKKSVector:
+    """A server ciphertext, decompressed no further than any ciphertext of ``ctx`` can be."""
+    return ts.ckks_vector_from(ctx, codec.decode(data, max_ciphertext_bytes(ctx)))
+
+
+def decrypt_logits(ctx: ts.Context, logits: Union[str, bytes]) -> np.ndarray:
+    """Decrypt a logits ciphertext, base64 (JSON routes) or raw bytes (binary routes)."""
+    logits_bytes = base64.b64decode(logits.encode("utf-8")) if isinstance(logits, str) else logits
+    enc_logits = load_vector(ctx, logits_bytes)
     logits = np.array(enc_logits.decrypt())
     # FC2 outputs 7 classes
     return logits[: len(EMOTION_LABELS)]
@@ -85,10 +111,35 @@ def render_key_setup(client):
 
     client.token = st.session_state.jwt_token
     if st.button("Ensure local keypair & register eval context"):
-        ctx, key_id, eval_b64 = ensure_client_context()
-        if eval_b64:
+        batch_sizes = key_batch_sizes(slot_count(PARAM_PROFILE))
+        rotation_steps = None
+        if not keypair_exists():
+            # Only generate the rotation keys the server's forward pass uses
+            try:
+                rotation_steps = client.rotation_steps(LAYOUT, batch_sizes, PARAM_PROFILE)["steps"]
+            except Exception as e:
+                st.error(f"❌ Could not fetch rotation steps: {str(e)}")
+                return
+        ctx, key_id, eval_path = ensure_client_context(rotation_steps, LAYOUT, batch_sizes, PARAM_PROFILE)
+        meta = load_key_meta()
+        if eval_path.exists():
+            bar = st.progress(0.0, text="Uploading eval context...")
+
+            def on_progress(sent: int, total: int) -> None:
+                bar.progress(sent / total, text=f"Uploading eval context: {sent / 2**20:.0f} / {total / 2**20:.0f} MB")
+
             try:
-                client.register_he_key(key_id, eval_b64)
+                result = client.upload_eval_context(
+                    key_id,
+                    eval_path,
+                    layout=meta.get("layout", LAYOUT),
+                    batch_sizes=meta.get("batch_sizes", batch_sizes),
+                    profile=meta.get("profile", LEGACY_PROFILE),
+                    progress=on_progress,
+                    sha256=eval_context_sha256(),
+                )
+                # Linked without an upload when the server already had these bytes
+                bar.progress(1.0, text="Eval context uploaded" if "upload_id" in result else "Server already has this eval context")
                 st.success(f"✅ Registered eval context for key_id={key_id}")
             except Exception as e:
                 st.error(f"❌ Registration failed: {str(e)}")
@@ -120,7 +171,10 @@ def render_today(client):
 
         if st.button("Encrypt and analyze today"):
             ciphertext_b64 = encrypt_image(st.session_state.ts_context, prep.vector)
-            resp = client.analyze_today(ciphertext_b64, st.session_state.key_id, target_date.isoformat())
+            with st.spinner("Waiting for the encrypted analysis job..."):
+                resp = client.analyze_today_job(
+                    ciphertext_b64, st.session_state.key_id, target_date.isoformat(), layout=LAYOUT
+                )
             logits = decrypt_logits(st.session_state.ts_context, resp["ciphertext"])
             probs = softmax(logits)
             label_idx = int(np.argmax(probs))
@@ -131,6 +185,49 @@ def render_today(client):
             st.bar_chart(chart_data, x="label", y="prob")
 
 
+def render_backfill(client):
+    st.header("Backfill (batched E2E FHE)")
+    if not st.session_state.jwt_token:
+        st.info("Login first.")
+        return
+    if not st.session_state.ts_context or not st.session_state.key_id:
+        st.info("Register/load your keys first.")
+        return
+
+    client.token = st.session_state.jwt_token
+    ctx = st.session_state.ts_context
+    # Rotation keys only cover these batch sizes; uploads are split into them, largest first.
+    # Older keypairs carry every power-of-two key and no batch_sizes entry.
+    meta = load_key_meta()
+    batch_sizes = meta.get("batch_sizes") or key_batch_sizes(slot_count(meta.get("profile", LEGACY_PROFILE)))
+    st.caption(f"Up to {max(batch_sizes)} images are packed into one ciphertext per request.")
+    uploads = st.file_uploader("Upload face images", type=["jpg", "jpeg", "png"], accept_multiple_files=True)
+    if not uploads:
+        return
+
+    start_date = st.date_input("Date of the first image", value=datetime.date.today() - datetime.timedelta(days=len(uploads) - 1))
+    dates = [start_date + datetime.timedelta(days=i) for i in range(len(uploads))]
+    vectors = [preprocess_image_to_fer2013_format(f.read()).vector for f in uploads]
+
+    if st.button("Encrypt and analyze all"):
+        rows: List[dict] = []
+        offset = 0
+        while offset < len(vectors):
+            size = max(b for b in batch_sizes if b <= len(vectors) - offset)
+            chunk_vectors = vectors[offset : offset + size]
+            chunk_dates = [d.isoformat() for d in dates[offset : offset + size]]
+            offset += size
+            with st.spinner(f"Analyzing {chunk_dates[0]} .. {chunk_dates[-1]}"):
+                resp = client.analyze_batch_binary(
+                    encrypt_images_raw(ctx, chunk_vectors), st.session_state.key_id, chunk_dates, layout=LAYOUT
+                )
+            for entry in resp.get("entries", []):
+                probs = softmax(decrypt_logits(ctx, entry["ciphertext"]))
+                label_idx = int(np.argmax(probs))
+                rows.append({"date": entry["date"], "label": EMOTION_LABELS[label_idx], "max_prob": float(probs[label_idx])})
+        st.table(rows)
+
+
 def render_history(client):
     st.header("N-day history (client-side decrypt)")
     if not st.session_state.jwt_token:
@@ -143,15 +240,16 @@ def render_history(client):
     client.token = st.session_state.jwt_token
     days = st.slider("Days", min_value=1, max_value=30, value=7)
     if st.button("Fetch history"):
-        resp = client.history_raw(days, st.session_state.key_id)
-        entries = resp.get("entries", [])
-        if not entries:
-            st.info("No history yet.")
-            return
-
+        # Pages arrive as a header (dates of the page) followed by one ciphertext per day;
+        # each day is decrypted and shown as soon as it arrives
+        progress, table_slot, chart_slot = st.empty(), st.empty(), st.empty()
         rows: List[dict] = []
         freq = {label: 0 for label in EMOTION_LABELS}
-        for item in entries:
+        total = 0
+        for item in client.history_raw(days, st.session_state.key_id):
+            if "ciphertext" not in item:
+                total = item["total"]
+                continue
             logits = decrypt_logits(st.session_state.ts_context, item["ciphertext"])
             probs = softmax(logits)
             label_idx = int(np.argmax(probs))
@@ -159,18 +257,44 @@ def render_history(client):
             freq[label] += 1
             rows.append({"date": item["date"], "label": label, "max_prob": float(probs[label_idx])})
 
-        st.table(rows)
-        freq_rows = [{"label": k, "count": v} for k, v in freq.items() if v > 0]
-        if freq_rows:
-            st.bar_chart(freq_rows, x="label", y="count")
+            progress.caption(f"{len(rows)}/{total} day(s) decrypted")
+            table_slot.table(rows)
+            chart_slot.bar_chart([{"label": k, "count": v} for k, v in freq.items() if v > 0], x="label", y="count")
+        if not rows:
+            st.info("No history yet.")
+    if st.button("Server-side pattern analysis"):
+        ctx = st.session_state.ts_context
+        try:
+            resp = client.history_analysis_binary(days, st.session_state.key_id)
+        except Exception as e:
+            st.error(f"Server Error: {e}")
+            return
+        covered = max(resp["days"], 1)
+        features = {
+            name: np.array(ts.ckks_vector_from(ctx, codec.decode(resp[name])).decrypt())[: len(EMOTION_LABELS)]
+            for name in ("frequency", "transition_energy", "persistence")
+        }
+        transitions = max(covered - 1, 1)
+        st.caption(f"{resp['days']} stored day(s) in the window; one download, three decryptions")
+        st.table(
+            [
+                {
+                    "label": label,
+                    "mean_logit": float(features["frequency"][i] / covered),
+                    "transition_energy": float(features["transition_energy"][i] / transitions),
+                    "persistence": float(features["persistence"][i] / transitions),
+                }
+                for i, label in enumerate(EMOTION_LABELS)
+            ]
+        )
     if st.button("Run Server-Side FHE Analysis"):
         ctx = st.session_state.ts_context
         with st.spinner("Requesting Homomorphic Aggregation to Server..."):
             try:
-                resp = client.analyze_history_fhe(days, st.session_state.key_id)
-                
-                enc_sum_b64 = resp["encrypted_sum"]
-                enc_vol_b64 = resp["encrypted_volatility"]
+                resp = client.analyze_history_fhe_binary(days, st.session_state.key_id)
+
+                enc_sum_bytes = resp["encrypted_sum"]
+                enc_vol_bytes = resp["encrypted_volatility"]
                 
                 st.success("Received encrypted statistics from server!")
                 
@@ -181,9 +305,9 @@ def render_history(client):
 
         with st.spinner("Decrypting & Diagnosing..."):
             try:
-                # Base64 -> CKKSVector -> Decrypt
-                enc_sum = ts.ckks_vector_from(ctx, base64.b64decode(enc_sum_b64))
-                enc_vol = ts.ckks_vector_from(ctx, base64.b64decode(enc_vol_b64))
+                # Raw bytes -> CKKSVector -> Decrypt
+                enc_sum = load_vector(ctx, enc_sum_bytes)
+                enc_vol = load_vector(ctx, enc_vol_bytes)
                 
                 plain_sum = np.array(enc_sum.decrypt())[:7]
                 plain_vol = np.array(enc_vol.decrypt())[:7]
@@ -198,8 +322,8 @@ def main():
     st.set_page_config(page_title="FHE Emotion (Streamlit)", layout="wide")
     init_session_state()
     client = get_client()
-    # Auto-load key if present on disk
-    if st.session_state.key_id is None:
+    # Auto-load key if present on disk (new keys are generated from Key setup after login)
+    if st.session_state.key_id is None and keypair_exists():
         try:
             ctx, key_id, _ = ensure_client_context()
             set_key_info(key_id, ctx)
@@ -208,7 +332,7 @@ def main():
     if st.session_state.jwt_token:
         client.token = st.session_state.jwt_token
 
-    page = st.sidebar.radio("Navigation", ["Auth", "Key setup", "Today", "History"])
+    page = st.sidebar.radio("Navigation", ["Auth", "Key setup", "Today", "Backfill", "History"])
 
     if page == "Auth":
         render_auth(client)
@@ -216,6 +340,8 @@ def main():
         render_key_setup(client)
     elif page == "Today":
         render_today(client)
+    elif page == "Backfill":
+        render_backfill(client)
     elif page == "History":
         render_history(client)
 
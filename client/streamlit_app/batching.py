@@ -0,0 +1,96 @@
+"""Client-side im2col layouts (mirror backend app/fhe_core/batching.py).
+
+Slot ``k * (B * 49) + b * 49 + w`` holds pixel ``k`` of window ``w`` of image ``b``.
+The replicated layout drops the row padding and stacks as many copies of that
+matrix as fit, which lets the server evaluate several conv channels per multiply.
+The server splits a batched result into one single-image logits ciphertext per date.
+"""
+from __future__ import annotations
+
+from typing import List, Sequence
+
+import numpy as np
+import tenseal as ts
+
+IMAGE_SIZE = 48
+KERNEL_SIZE = 9
+STRIDE = 6
+CONV_CHANNELS = 16
+LAYOUT = "replicated"
+
+
+def _windows_per_image() -> int:
+    side = (IMAGE_SIZE - KERNEL_SIZE) // STRIDE + 1
+    return side * side
+
+
+def _kernel_rows() -> int:
+    length = KERNEL_SIZE * KERNEL_SIZE
+    return 1 << (length - 1).bit_length()
+
+
+def _slot_count(ctx: ts.Context) -> int:
+    return ctx.seal_context().data.first_context_data().parms().poly_modulus_degree() // 2
+
+
+def _copy_size(batch_size: int) -> int:
+    return KERNEL_SIZE * KERNEL_SIZE * _windows_per_image() * batch_size
+
+
+def max_batch_size(ctx: ts.Context) -> int:
+    """Largest number of images that fit in one replicated ciphertext for ``ctx``."""
+    return _slot_count(ctx) // _copy_size(1)
+
+
+def key_batch_sizes(slot_count: int) -> List[int]:
+    """Batch sizes rotation keys are generated for: powers of two up to the batch limit.
+
+    Other sizes would need extra keys, so uploads are chunked into these sizes.
+    """
+    limit = slot_count // _copy_size(1)
+    sizes = [1]
+    while sizes[-1] * 2 <= limit:
+        sizes.append(sizes[-1] * 2)
+    return sizes
+
+
+def replicated_copies(ctx: ts.Context, batch_size: int) -> int:
+    """Number of stacked copies the server expects for ``batch_size`` images."""
+    return min(CONV_CHANNELS, _slot_count(ctx) // _copy_size(batch_size))
+
+
+def _im2col_matrix(images: Sequence[np.ndarray]) -> np.ndarray:
+    if not images:
+        raise ValueError("At least one image is required")
+    blocks = []
+    for image in images:
+        image = np.asarray(image, dtype=np.float64).reshape(IMAGE_SIZE, IMAGE_SIZE)
+        windows = np.lib.stride_tricks.sliding_window_view(image, (KERNEL_SIZE, KERNEL_SIZE))[::STRIDE, ::STRIDE]
+        blocks.append(windows.reshape(-1, KERNEL_SIZE * KERNEL_SIZE).T)
+    return np.concatenate(blocks, axis=1)
+
+
+def im2col_batch(images: Sequence[np.ndarray]) -> List[float]:
+    """Flatten 48x48 images into the batched (padded) im2col layout."""
+    matrix = _im2col_matrix(images)
+    padded = np.zeros((_kernel_rows(), matrix.shape[1]))
+    padded[: matrix.shape[0]] = matrix
+    return padded.flatten().tolist()
+
+
+def im2col_replicated(ctx: ts.Context, images: Sequence[np.ndarray]) -> List[float]:
+    """Flatten 48x48 images into the replicated im2col layout for ``ctx``."""
+    matrix = _im2col_matrix(images)
+    return np.tile(matrix.flatten(), replicated_copies(ctx, len(images))).tolist()
+
+
+def mergeable_replicated(ctx: ts.Context, image: np.ndarray, batch_size: int) -> List[float]:
+    """One image at position 0 of a ``batch_size`` replicated batch, zero-padded to every slot.
+
+    The server may merge such requests for the same key_id into one forward pass.
+    Padding matters: TenSEAL would otherwise replicate the vector over the free
+    slots, and the server's merge rotation would wrap those copies onto image 0.
+    """
+    blank = np.zeros_like(np.asarray(image, dtype=np.float64))
+    vector = im2col_replicated(ctx, [image] + [blank] * (batch_size - 1))
+    return vector + [0.0] * (_slot_count(ctx) - len(vector))
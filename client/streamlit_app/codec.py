@@ -0,0 +1,116 @@
+"""Framed, optionally compressed ciphertext serialization (client side).
+
+Mirrors ``backend/app/fhe_core/codec.py``: a compressed payload is
+``MAGIC + codec id + body``, and unframed bytes are plain TenSEAL
+serializations. Ciphertexts are encrypted with ``CIPHERTEXT_CODEC``;
+responses are decoded whatever codec the server used.
+"""
+from __future__ import annotations
+
+import lzma
+import zlib
+from typing import Callable, Dict, List, Optional, Tuple
+
+MAGIC = b"\x00HE"
+
+try:  # optional dependency
+    import zstandard
+except ImportError:  # pragma: no cover - depends on the environment
+    zstandard = None
+
+
+def _too_large(max_size: int) -> ValueError:
+    return ValueError(f"Payload decompresses to more than {max_size} bytes")
+
+
+def _zlib_decompress(body: bytes, max_size: Optional[int]) -> bytes:
+    decompressor = zlib.decompressobj()
+    try:
+        data = decompressor.decompress(body, 0 if max_size is None else max_size + 1)
+    except zlib.error as exc:
+        raise ValueError(f"Corrupt zlib payload: {exc}") from exc
+    if max_size is not None and len(data) > max_size:
+        raise _too_large(max_size)
+    if not decompressor.eof:
+        raise ValueError("Truncated zlib payload")
+    return data
+
+
+def _lzma_decompress(body: bytes, max_size: Optional[int]) -> bytes:
+    decompressor = lzma.LZMADecompressor()
+    try:
+        data = decompressor.decompress(body, -1 if max_size is None else max_size + 1)
+    except lzma.LZMAError as exc:
+        raise ValueError(f"Corrupt lzma payload: {exc}") from exc
+    if max_size is not None and len(data) > max_size:
+        raise _too_large(max_size)
+    if not decompressor.eof:
+        raise ValueError("Truncated lzma payload")
+    return data
+
+
+def _zstd_decompress(body: bytes, max_size: Optional[int]) -> bytes:
+    try:
+        # decompress() allocates the size the frame header declares
+        if max_size is not None and zstandard.frame_content_size(body) > max_size:
+            raise _too_large(max_size)
+        return zstandard.ZstdDecompressor().decompress(body, max_output_size=max_size or 0)
+    except zstandard.ZstdError as exc:
+        raise ValueError(f"Corrupt or oversized zstd payload: {exc}") from exc
+
+
+# name -> (frame id, compress, decompress(body, max_size))
+_CODECS: Dict[str, Tuple[int, Callable[[bytes], bytes], Callable[[bytes, Optional[int]], bytes]]] = {
+    "zlib": (1, lambda data: zlib.compress(data, 1), _zlib_decompress),
+    "lzma": (2, lambda data: lzma.compress(data, preset=0), _lzma_decompress),
+}
+if zstandard is not None:
+    _CODECS["zstd"] = (3, lambda data: zstandard.ZstdCompressor(level=3).compress(data), _zstd_decompress)
+_BY_ID = {codec_id: (name, decompress) for name, (codec_id, _, decompress) in _CODECS.items()}
+
+
+def available_codecs() -> List[str]:
+    return ["none", *_CODECS]
+
+
+def check_codec(name: str) -> str:
+    if name != "none" and name not in _CODECS:
+        raise ValueError(f"Unknown or unavailable codec {name!r}; expected one of {available_codecs()}")
+    return name
+
+
+def encode(data: bytes, codec: str = "none") -> bytes:
+    """``data`` compressed with ``codec`` and framed (``"none"`` returns it as is)."""
+    if check_codec(codec) == "none":
+        return data
+    codec_id, compress, _ = _CODECS[codec]
+    return MAGIC + bytes([codec_id]) + compress(data)
+
+
+def decode(data: bytes, max_size: Optional[int] = None) -> bytes:
+    """Inverse of ``encode`` for any codec; unframed bytes pass through.
+
+    With ``max_size`` a body that would decompress to more bytes raises
+    ``ValueError`` before more than ``max_size + 1`` bytes are produced, so
+    untrusted payloads cannot expand without bound.
+    """
+    if not data.startswith(MAGIC):
+        if max_size is not None and len(data) > max_size:
+            raise ValueError(f"Payload is larger than {max_size} bytes")
+        return data
+    codec_id = data[len(MAGIC)] if len(data) > len(MAGIC) else -1
+    if codec_id not in _BY_ID:
+        raise ValueError(f"Payload uses unknown or unavailable codec id {codec_id}")
+    _, decompress = _BY_ID[codec_id]
+    return decompress(data[len(MAGIC) + 1 :], max_size)
+
+
+def codec_of(data: bytes) -> str:
+    """Name of the codec ``data`` was encoded with."""
+    if not data.startswith(MAGIC) or len(data) <= len(MAGIC):
+        return "none"
+    entry = _BY_ID.get(data[len(MAGIC)])
+    return entry[0] if entry else f"unknown({data[len(MAGIC)]})"
+
+
+__all__ = ["MAGIC", "available_codecs", "check_codec", "codec_of", "decode", "encode"]
@@ -5,3 +5,10 @@ import os
 
 BACKEND_BASE_URL = os.getenv("BACKEND_BASE_URL", "http://localhost:8000")
 KEY_DIR = os.getenv("FHE_KEY_DIR", "keys")
+# CKKS parameter profile for new keys ("fast": N=16384, "safe": N=32768, "safe-packed": "safe" plus a packed history level);
+# see fhe_keys.PROFILES. The default is the server's (tenseal_context.DEFAULT_PROFILE)
+PARAM_PROFILE = os.getenv("FHE_PARAM_PROFILE", "safe")
+# Codec of uploaded ciphertexts: none, zlib, lzma or zstd (see codec.py); SEAL already compresses them
+CIPHERTEXT_CODEC = os.getenv("FHE_CIPHERTEXT_CODEC", "none")
+# Days per /emotion/history-raw/stream page; each page is one request, its ciphertexts streamed one at a time
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "7"))
@@ -3,25 +3,35 @@ from __future__ import annotations
 
 import base64
 import json
+import os
+import tempfile
 import uuid
 from hashlib import sha256
 from pathlib import Path
-from typing import Tuple
+from typing import Iterable, List, Optional, Sequence, Tuple
 
 import tenseal as ts
+from tenseal import sealapi
 
-from config import KEY_DIR
+from config import KEY_DIR, PARAM_PROFILE
 
 KEY_DIR_PATH = Path(KEY_DIR)
 KEYPAIR_PATH = KEY_DIR_PATH / "fhe-emotion-keypair.seal"
 EVAL_STATE_PATH = KEY_DIR_PATH / "fhe-eval-context.seal"
 META_PATH = KEY_DIR_PATH / "key_meta.json"
 
-# Match backend defaults (see he/tenseal_context.py)
-DEFAULT_POLY_MODULUS_DEGREE = 32768
-DEFAULT_COEFF_MOD_BIT_SIZES = (60, 40, 40, 40, 40, 40, 40, 40, 60)
-DEFAULT_GLOBAL_SCALE = 2**40
-
+# Match backend profiles (see app/fhe_core/tenseal_context.py, GET /he/profiles)
+PROFILES = {
+    "fast": {"poly_modulus_degree": 16384, "coeff_mod_bit_sizes": (60, 40, 40, 40, 40, 40, 40, 40, 60), "global_scale": 2**40},
+    "safe": {"poly_modulus_degree": 32768, "coeff_mod_bit_sizes": (60, 40, 40, 40, 40, 40, 40, 40, 60), "global_scale": 2**40},
+    "safe-packed": {
+        "poly_modulus_degree": 32768,
+        "coeff_mod_bit_sizes": (60, 40, 40, 40, 40, 40, 40, 40, 40, 60),
+        "global_scale": 2**40,
+    },
+}
+# Keypairs created before profiles existed use the "safe" parameters
+LEGACY_PROFILE = "safe"
 
 
 def _ensure_dir() -> None:
@@ -41,55 +51,195 @@ def _compute_key_id(eval_bytes: bytes) -> str:
     return sha256(eval_bytes).hexdigest()[:16]
 
 
-def generate_and_store_keys() -> Tuple[ts.Context, str, str]:
-    """Generate CKKS context, save client+eval contexts, and return eval b64 for registration."""
+def galois_element(step: int, poly_degree: int) -> int:
+    """SEAL's Galois element for a left rotation by ``step`` slots (right if negative)."""
+    return pow(3, step % (poly_degree // 2), 2 * poly_degree)
+
+
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if not value:
+            out.append(byte)
+            return bytes(out)
+        out.append(byte | 0x80)
+
+
+def _read_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            return value, pos
+
+
+def _proto_fields(data: bytes) -> List[Tuple[int, int, object]]:
+    fields = []
+    pos = 0
+    while pos < len(data):
+        key, pos = _read_varint(data, pos)
+        number, wire_type = key >> 3, key & 0x7
+        if wire_type == 0:
+            value, pos = _read_varint(data, pos)
+        elif wire_type == 2:
+            length, pos = _read_varint(data, pos)
+            value, pos = data[pos : pos + length], pos + length
+        elif wire_type in (1, 5):
+            size = 8 if wire_type == 1 else 4
+            value, pos = data[pos : pos + size], pos + size
+        else:
+            raise ValueError(f"Unsupported protobuf wire type {wire_type}")
+        fields.append((number, wire_type, value))
+    return fields
+
+
+def _proto_field(number: int, wire_type: int, value) -> bytes:
+    key = _varint(number << 3 | wire_type)
+    if wire_type == 0:
+        return key + _varint(value)
+    if wire_type == 2:
+        return key + _varint(len(value)) + value
+    return key + value
+
+
+def _eval_context_bytes(context: ts.Context, steps: Iterable[int]) -> bytes:
+    """Serialized public context with Galois keys for exactly ``steps`` (mirrors backend ``eval_context``).
+
+    TenSEAL regenerates the full key set when loading a secret-key context, so
+    selected keys can only travel in the evaluation context.
+    """
+    degree = context.seal_context().data.first_context_data().parms().poly_modulus_degree()
+    elements = sorted({galois_element(step, degree) for step in steps})
+    keys = sealapi.GaloisKeys()
+    sealapi.KeyGenerator(context.seal_context().data, context.secret_key().data).create_galois_keys(elements, keys)
+    fd, path = tempfile.mkstemp(suffix=".galois")
+    os.close(fd)
+    try:
+        keys.save(path)
+        del keys
+        key_bytes = Path(path).read_bytes()
+    finally:
+        os.unlink(path)
+
+    chunks: List[bytes] = []
+    for number, wire_type, value in _proto_fields(context.serialize(save_secret_key=False, save_galois_keys=False)):
+        if number != 2:
+            chunks.append(_proto_field(number, wire_type, value))
+            continue
+        # public_context.galois_keys
+        public = b"".join(_proto_field(*f) for f in _proto_fields(value) if f[0] != 5)
+        key_header = _varint(5 << 3 | 2) + _varint(len(key_bytes))
+        size = len(public) + len(key_header) + len(key_bytes)
+        chunks += [_varint(number << 3 | wire_type) + _varint(size), public, key_header, key_bytes]
+    return b"".join(chunks)
+
+
+def slot_count(profile: str = PARAM_PROFILE) -> int:
+    return PROFILES[profile]["poly_modulus_degree"] // 2
+
+
+def max_ciphertext_bytes(context: ts.Context) -> int:
+    """Largest serialized ciphertext for ``context``: two polynomials over every data prime, plus headers."""
+    parms = context.seal_context().data.first_context_data().parms()
+    return 2 * parms.poly_modulus_degree() * len(parms.coeff_modulus()) * 8 + (1 << 16)
+
+
+def generate_and_store_keys(
+    rotation_steps: Optional[Sequence[int]] = None,
+    layout: Optional[str] = None,
+    batch_sizes: Optional[Sequence[int]] = None,
+    profile: str = PARAM_PROFILE,
+) -> Tuple[ts.Context, str, Path]:
+    """Generate CKKS context, save client+eval contexts, and return the eval context file to register.
+
+    ``profile`` names the CKKS parameters (``PROFILES``). With
+    ``rotation_steps`` (from ``GET /he/rotation-steps``) the eval context
+    only carries those Galois keys, and the client context none (the client
+    never rotates), instead of the full power-of-two set in both.
+    """
     _ensure_dir()
+    params = PROFILES[profile]
     context = ts.context(
         ts.SCHEME_TYPE.CKKS,
-        poly_modulus_degree=DEFAULT_POLY_MODULUS_DEGREE,
-        coeff_mod_bit_sizes=list(DEFAULT_COEFF_MOD_BIT_SIZES),
+        poly_modulus_degree=params["poly_modulus_degree"],
+        coeff_mod_bit_sizes=list(params["coeff_mod_bit_sizes"]),
     )
-    context.global_scale = DEFAULT_GLOBAL_SCALE
-    context.generate_galois_keys()
+    context.global_scale = params["global_scale"]
     context.generate_relin_keys()
-
+    if rotation_steps is None:
+        context.generate_galois_keys()
+        eval_bytes = context.serialize(save_secret_key=False, save_public_key=True, save_galois_keys=True, save_relin_keys=True)
+    else:
+        eval_bytes = _eval_context_bytes(context, rotation_steps)
     client_bytes = context.serialize(save_secret_key=True, save_public_key=True, save_galois_keys=True, save_relin_keys=True)
-    eval_bytes = context.serialize(save_secret_key=False, save_public_key=True, save_galois_keys=True, save_relin_keys=True)
 
     key_id = str(uuid.uuid4())
     KEYPAIR_PATH.write_bytes(client_bytes)
     EVAL_STATE_PATH.write_bytes(eval_bytes)
-    META_PATH.write_text(json.dumps({"key_id": key_id}))
+    meta = {"key_id": key_id, "profile": profile}
+    if rotation_steps is not None:
+        meta.update(layout=layout, batch_sizes=list(batch_sizes or [1]), rotation_steps=list(rotation_steps))
+    META_PATH.write_text(json.dumps(meta))
+    return context, key_id, EVAL_STATE_PATH
 
-    eval_context_b64 = base64.b64encode(eval_bytes).decode("utf-8")
-    return context, key_id, eval_context_b64
 
+def load_key_meta() -> dict:
+    return json.loads(META_PATH.read_text()) if META_PATH.exists() else {}
 
-def ensure_client_context() -> Tuple[ts.Context, str, str | None]:
-    """Load existing context or generate a new one.
 
-    Returns (context, key_id, eval_context_b64_if_new)
-    eval_context_b64 is returned even for existing keys to allow re-registration.
+def ensure_client_context(
+    rotation_steps: Optional[Sequence[int]] = None,
+    layout: Optional[str] = None,
+    batch_sizes: Optional[Sequence[int]] = None,
+    profile: str = PARAM_PROFILE,
+) -> Tuple[ts.Context, str, Path]:
+    """Load existing context or generate a new one (see ``generate_and_store_keys``).
+
+    Returns (context, key_id, eval_context_path)
+    The eval context file is returned even for existing keys to allow re-registration;
+    it is uploaded from disk in chunks (``APIClient.upload_eval_context``).
     """
     if keypair_exists():
         ctx = load_client_context()
-        eval_bytes = EVAL_STATE_PATH.read_bytes() if EVAL_STATE_PATH.exists() else b""
-        meta = json.loads(META_PATH.read_text()) if META_PATH.exists() else {}
-        key_id = meta.get("key_id") or _compute_key_id(eval_bytes)
+        has_eval = EVAL_STATE_PATH.exists() and EVAL_STATE_PATH.stat().st_size > 0
+        meta = load_key_meta()
+        key_id = meta.get("key_id") or _compute_key_id(EVAL_STATE_PATH.read_bytes() if has_eval else b"")
         # Always return eval context to allow re-registration
-        if not eval_bytes:
-            eval_bytes = ctx.serialize(save_secret_key=False, save_public_key=True, save_galois_keys=True, save_relin_keys=True)
+        if not has_eval:
+            if "rotation_steps" in meta:
+                eval_bytes = _eval_context_bytes(ctx, meta["rotation_steps"])
+            else:
+                eval_bytes = ctx.serialize(save_secret_key=False, save_public_key=True, save_galois_keys=True, save_relin_keys=True)
             EVAL_STATE_PATH.write_bytes(eval_bytes)
-        eval_context_b64 = base64.b64encode(eval_bytes).decode("utf-8")
-        return ctx, key_id, eval_context_b64
+        return ctx, key_id, EVAL_STATE_PATH
 
     # No existing keypair: generate
-    return generate_and_store_keys()
+    return generate_and_store_keys(rotation_steps, layout, batch_sizes, profile)
+
+
+def eval_context_sha256() -> str:
+    """SHA-256 of the eval context file, cached in the key meta until the file changes."""
+    stat = EVAL_STATE_PATH.stat()
+    meta = load_key_meta()
+    cached = meta.get("eval_sha256")
+    if cached and cached.get("size") == stat.st_size and cached.get("mtime_ns") == stat.st_mtime_ns:
+        return cached["digest"]
+    digest = sha256()
+    with EVAL_STATE_PATH.open("rb") as handle:
+        for block in iter(lambda: handle.read(2**20), b""):
+            digest.update(block)
+    meta["eval_sha256"] = {"digest": digest.hexdigest(), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    META_PATH.write_text(json.dumps(meta))
+    return meta["eval_sha256"]["digest"]
 
 
 def get_eval_context_b64() -> str:
     """Return base64 of evaluation context (no secret key)."""
-    if EVAL_STATE_PATH.exists():
-        return base64.b64encode(EVAL_STATE_PATH.read_bytes()).decode("utf-8")
-    _, _, eval_b64 = generate_and_store_keys()
-    return eval_b64
+    if not EVAL_STATE_PATH.exists():
+        generate_and_store_keys()
+    return base64.b64encode(EVAL_STATE_PATH.read_bytes()).decode("utf-8")